@@ -18,24 +18,153 @@ raw events.
 # You should have received a copy of the GNU Lesser General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import concurrent.futures
+import contextlib
 import ctypes
-import glob
+import errno
 import os
-import re
 import stat
 import tempfile
+import threading
 
 import evemu.base
+import evemu.exception
 
 __all__ = ["Device",
+           "DeviceInfo",
+           "Filter",
+           "FlightRecorder",
            "InputEvent",
+           "NodeWatch",
+           "Player",
+           "Recording",
+           "fan_out",
            "event_get_value",
            "event_get_name",
            "input_prop_get_value",
-           "input_prop_get_name"]
+           "input_prop_get_name",
+           "add_checkpoints",
+           "create_devices",
+           "list_devices",
+           "play_many",
+           "record_many",
+           "wait_for_devnodes"]
 
 _libevdev = evemu.base.LibEvdev()
 
+_EV_MAX = 0x1f
+
+# trace records kept in memory by play() and record(), 32 bytes each
+_TRACE_RECORDS = 1024 * 1024
+
+class DeviceInfo(object):
+    """
+    The description of an input device of the system, see list_devices().
+
+    devnode -- the /dev/input/eventN node
+    name -- the name of the device
+    id_bustype, id_vendor, id_product, id_version -- the device ids
+    capabilities -- a dict mapping each supported event type to a
+    frozenset of the supported event codes
+    """
+
+    def __init__(self, devnode, name, ids, capabilities):
+        self.devnode = devnode
+        self.name = name
+        (self.id_bustype, self.id_vendor,
+         self.id_product, self.id_version) = ids
+        self.capabilities = capabilities
+
+    def has_event(self, event_type, event_code):
+        """
+        Return True if the device supports the given event type/code
+        pair, or False otherwise.
+
+        event_type and event_code may be ints or string-like ("EV_REL",
+        "REL_X").
+        """
+        if not isinstance(event_type, int):
+            event_type = event_get_value(event_type)
+        if not isinstance(event_code, int):
+            event_code = event_get_value(event_type, event_code)
+        return event_code in self.capabilities.get(event_type, ())
+
+    def __repr__(self):
+        return "<DeviceInfo %s: %s>" % (self.devnode, self.name)
+
+class _DeviceCache(object):
+    """
+    The devices of the system, kept current by libevemu with inotify. The
+    first call scans all event nodes in parallel, further calls only
+    rescan the nodes that changed in the meantime.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._list = None
+        self._devices = []
+
+    def __del__(self):
+        if self._list is not None:
+            evemu.base.LibEvemu().evemu_device_list_delete(self._list)
+
+    def devices(self):
+        libevemu = evemu.base.LibEvemu()
+        with self._lock:
+            if self._list is None:
+                self._list = libevemu.evemu_device_list_new(None)
+                self._devices = self._describe(libevemu)
+            elif libevemu.evemu_device_list_update(self._list) > 0:
+                self._devices = self._describe(libevemu)
+            return list(self._devices)
+
+    def _describe(self, libevemu):
+        devices = []
+        count = libevemu.evemu_device_list_get_count(self._list)
+        for i in range(count):
+            devnode = libevemu.evemu_device_list_get_devnode(self._list, i)
+            dev = libevemu.evemu_device_list_get_device(self._list, i)
+            ids = (libevemu.evemu_get_id_bustype(dev),
+                   libevemu.evemu_get_id_vendor(dev),
+                   libevemu.evemu_get_id_product(dev),
+                   libevemu.evemu_get_id_version(dev))
+            capabilities = _capabilities(libevemu, dev)
+            name = libevemu.evemu_get_name(dev).decode("iso8859-1")
+            devices.append(DeviceInfo(devnode.decode("iso8859-1"), name, ids,
+                                      capabilities))
+        return devices
+
+def _capabilities(libevemu, dev):
+    """
+    Returns a dict mapping each event type of the struct evemu_device at
+    address dev to a frozenset of its event codes.
+    """
+    accelerator = evemu.base.accelerator
+    if accelerator is not None:
+        return accelerator.capabilities(dev)
+
+    capabilities = {}
+    for t in range(_EV_MAX + 1):
+        if not libevemu.evemu_has_bit(dev, t):
+            continue
+        codes = range(_libevdev.libevdev_event_type_get_max(t) + 1)
+        capabilities[t] = frozenset(
+                c for c in codes if libevemu.evemu_has_event(dev, t, c))
+    return capabilities
+
+_device_cache = _DeviceCache()
+
+def list_devices():
+    """
+    Returns a DeviceInfo for each input device of the system that can be
+    opened, sorted by event node number.
+
+    The devices are cached and the cache is kept current with inotify, so
+    repeated calls are cheap and only devices that were added or changed
+    since the last call are opened again.
+    """
+    return _device_cache.devices()
+
 def event_get_value(event_type, event_code = None):
     """
     Return the integer-value for the given event type and/or code string
@@ -165,6 +294,11 @@ class InputEvent(object):
         return True
 
     def __str__(self):
+        accelerator = evemu.base.accelerator
+        if accelerator is not None:
+            return accelerator.format_event(self.sec, self.usec, self.type,
+                                            self.code, self.value)
+
         f = tempfile.TemporaryFile()
         libc = evemu.base.LibC()
         fp = libc.fdopen(f.fileno(), b"w+")
@@ -180,15 +314,357 @@ class InputEvent(object):
         libevemu.evemu_write_event(fp, ctypes.byref(event))
         libc.fflush(fp)
         f.seek(0)
-        return f.readline().rstrip()
+        return f.readline().rstrip().decode("iso8859-1")
+
+class Filter(object):
+    """
+    Encapsulates an event filter. The filter rules are compiled by libevemu,
+    see evemu_filter_add() for the rule syntax, e.g.
+
+        Filter("drop=EV_MSC", "time=1.5-3", "remap=BTN_LEFT=BTN_RIGHT")
+
+    A Filter can be passed to Device.play(), Device.record() and
+    Device.events(), or applied to any sequence of InputEvents with
+    filter(). A filter keeps state across events, so it should only be
+    used for one event stream at a time.
+    """
+
+    def __init__(self, *rules):
+        self._libevemu = evemu.base.LibEvemu()
+        self._filter = self._libevemu.evemu_filter_new()
+        for rule in rules:
+            self.add(rule)
+
+    def __del__(self):
+        if hasattr(self, "_filter"):
+            self._libevemu.evemu_filter_delete(self._filter)
+
+    def add(self, rule):
+        """
+        Adds the given rule or comma-separated list of rules to the filter.
+        """
+        self._libevemu.evemu_filter_add(self._filter,
+                                        str(rule).encode("iso8859-1"))
+
+    def enable_reduction(self, device):
+        """
+        Drop events that the kernel would discard when written to the
+        given Device, e.g. key events that do not change the key state or
+        absolute events within the axis fuzz. See
+        evemu_filter_enable_reduction() for details.
+        """
+        self._libevemu.evemu_filter_enable_reduction(self._filter,
+                                                     device._evemu_device)
+
+    @property
+    def reduced(self):
+        """
+        The number of events dropped because the kernel would have
+        discarded them, i.e. the number of writes saved.
+
+        :return: integer
+        """
+        return self._libevemu.evemu_filter_get_reduced_count(self._filter)
+
+    def filter(self, events):
+        """
+        Generator yielding the InputEvents from events that pass the
+        filter, with any remap rules applied.
+        """
+        event = evemu.base.InputEvent()
+        for e in events:
+            event.sec = e.sec
+            event.usec = e.usec
+            event.type = e.type
+            event.code = e.code
+            event.value = e.value
+            if self._libevemu.evemu_filter_event(self._filter,
+                                                 ctypes.byref(event)):
+                yield InputEvent(event.sec, event.usec, event.type,
+                                 event.code, event.value)
+
+class Recording(object):
+    """
+    An event recording read into memory once, so it can be played to many
+    devices without parsing it again. See Player.
+    """
+
+    def __init__(self, events_file, filter=None):
+        """
+        Reads all events from events_file, a file name or a real file with
+        fileno(). If filter is not None, only events passing the Filter are
+        kept.
+        """
+        self._libc = evemu.base.LibC()
+        self._libevemu = evemu.base.LibEvemu()
+
+        if isinstance(events_file, str):
+            with open(events_file) as f:
+                self._read(f, filter)
+        elif hasattr(events_file, "fileno"):
+            self._read(events_file, filter)
+        else:
+            raise TypeError("expected file or file name")
+
+    def _read(self, events_file, filter):
+        fs = self._libc.fdopen(os.dup(events_file.fileno()), b"r")
+        try:
+            self._recording = self._libevemu.evemu_recording_new(
+                    fs, filter._filter if filter is not None else None)
+        finally:
+            self._libc.fclose(fs)
+
+    def __del__(self):
+        if hasattr(self, "_recording"):
+            self._libevemu.evemu_recording_delete(self._recording)
+
+    @property
+    def frames(self):
+        """
+        The number of frames in the recording.
+        """
+        return self._libevemu.evemu_recording_get_frame_count(self._recording)
+
+    @property
+    def duration(self):
+        """
+        The time between the first and the last event in microseconds.
+        """
+        return self._libevemu.evemu_recording_get_duration(self._recording)
+
+class Player(object):
+    """
+    Replays Recordings to several Devices on one timeline, e.g. a keyboard
+    and a touchpad recorded at the same time:
+
+        player = Player()
+        player.add(keyboard, Recording("keyboard.events"))
+        player.add(touchpad, Recording("touchpad.events"))
+        player.run()
+
+    Each frame is written to its device when it is due, frames of all
+    devices are dispatched in the order of their timestamps from a single
+    scheduler.
+    """
+
+    def __init__(self):
+        self._libevemu = evemu.base.LibEvemu()
+        self._player = self._libevemu.evemu_player_new()
+        # the player only borrows devices and recordings
+        self._streams = []
+
+    def __del__(self):
+        if hasattr(self, "_player"):
+            self._libevemu.evemu_player_delete(self._player)
+
+    def add(self, device, recording, offset=0):
+        """
+        Adds a device to the player. recording is played to the device,
+        starting offset milliseconds after the start of run(). A Recording
+        may be added for several devices.
+        """
+        self._libevemu.evemu_player_add(self._player, recording._recording,
+                                        device._file.fileno(),
+                                        int(offset * 1000))
+        self._streams.append((device, recording))
+
+    def run(self):
+        """
+        Replays all recordings in realtime and returns once all of them
+        have been played. run() may be called again to replay them again.
+        """
+        self._libevemu.evemu_player_run(self._player)
+
+    @property
+    def devices(self):
+        """
+        The devices added to this player, in the order they were added.
+        """
+        return [device for (device, _) in self._streams]
+
+class FlightRecorder(object):
+    """
+    Keeps the most recent events of a Device in memory and only writes
+    them out on request, e.g. to capture what led up to a bug on a test rig
+    that runs for days:
+
+        recorder = FlightRecorder(device, seconds=30, triggers=["KEY_F12=1"],
+                                  on_trigger=lambda r: r.dump("bug.events"))
+        recorder.start()
+        ...
+        recorder.dump("now.events")
+        recorder.stop()
+
+    Events are read by a background thread into a fixed-size ring buffer in
+    libevemu, nothing is parsed or formatted until a dump.
+    """
+
+    def __init__(self, device, seconds=60, size=16 * 1024 * 1024,
+                 triggers=(), on_trigger=None):
+        """
+        args:
+        device -- the Device to record
+        seconds -- the time window to keep, 0 to keep as many events as
+        fit into size
+        size -- the memory used for events, in bytes
+        triggers -- event patterns like "EV_KEY:KEY_F12=1" or "SW_LID",
+        see evemu_ring_add_trigger()
+        on_trigger -- called with the recorder from the recording thread
+        once a frame matching a trigger is complete
+        """
+        self._libevemu = evemu.base.LibEvemu()
+        self._libc = evemu.base.LibC()
+        self._device = device
+        self._on_trigger = on_trigger
+        self._ring = self._libevemu.evemu_ring_new(size, int(seconds * 1e6))
+        for trigger in triggers:
+            self._libevemu.evemu_ring_add_trigger(self._ring,
+                                                  trigger.encode("ascii"))
+        self._context = self._libevemu.evemu_context_new()
+        self._thread = None
+        self._done = threading.Event()
+        self._requests = []
+        self._requests_lock = threading.Lock()
+        # the exception that stopped the recording thread, if any
+        self.error = None
+
+    def __del__(self):
+        if getattr(self, "_thread", None) is not None:
+            self.stop()
+        if hasattr(self, "_context"):
+            self._libevemu.evemu_context_delete(self._context)
+        if hasattr(self, "_ring"):
+            self._libevemu.evemu_ring_delete(self._ring)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def __len__(self):
+        return self._libevemu.evemu_ring_get_event_count(self._ring)
+
+    def start(self):
+        """
+        Starts recording in a background thread.
+        """
+        if self._thread is not None:
+            raise RuntimeError("recorder already started")
+        self._done.clear()
+        self._fd = os.open(self._device.devnode, os.O_RDONLY | os.O_NONBLOCK)
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops recording. The events in memory are kept, dump() may still
+        be called.
+        """
+        if self._thread is None:
+            return
+        self._done.set()
+        self._thread.join()
+        self._thread = None
+        os.close(self._fd)
+
+    def clear(self):
+        """
+        Discards all events in memory.
+        """
+        self._call(lambda: self._libevemu.evemu_ring_clear(self._ring))
+
+    def dump(self, events_file, filter=None):
+        """
+        Writes the device description and the complete frames in memory to
+        events_file, a file name or a real file with fileno(). The result
+        can be replayed with Device.play(). Returns the number of events
+        written.
+
+        If filter is not None, only events passing the Filter are written.
+        """
+        if isinstance(events_file, str):
+            with open(events_file, "w") as f:
+                return self.dump(f, filter)
+        if not hasattr(events_file, "fileno"):
+            raise TypeError("expected file or file name")
+
+        events_file.flush()
+        return self._call(lambda: self._dump(events_file, filter))
+
+    def _dump(self, events_file, filter):
+        fs = self._libc.fdopen(os.dup(events_file.fileno()), b"w")
+        try:
+            self._libevemu.evemu_write(self._device._evemu_device, fs)
+            self._libevemu.evemu_context_set_filter(
+                    self._context,
+                    filter._filter if filter is not None else None)
+            return self._libevemu.evemu_context_write_ring(self._context,
+                                                           self._ring, fs)
+        finally:
+            self._libevemu.evemu_context_set_filter(self._context, None)
+            self._libc.fclose(fs)
+
+    def _call(self, func):
+        # the ring is only touched by the recording thread while it runs,
+        # other threads hand their requests over to it
+        thread = self._thread
+        if thread is None or thread is threading.current_thread():
+            return func()
+
+        request = {"func": func, "done": threading.Event()}
+        with self._requests_lock:
+            self._requests.append(request)
+        while not request["done"].wait(0.1):
+            if not thread.is_alive():
+                with self._requests_lock:
+                    if request in self._requests:
+                        self._requests.remove(request)
+                        return func()
+        if "error" in request:
+            raise request["error"]
+        return request.get("result")
+
+    def _run_requests(self):
+        with self._requests_lock:
+            requests, self._requests = self._requests, []
+        for request in requests:
+            try:
+                request["result"] = request["func"]()
+            except Exception as e:
+                request["error"] = e
+            request["done"].set()
+
+    def _run(self):
+        try:
+            while not self._done.is_set():
+                ret = self._libevemu.evemu_context_record_ring(
+                        self._context, self._ring, self._fd, 100)
+                if ret < 0 and ret != -errno.EINTR:
+                    raise OSError(-ret, os.strerror(-ret))
+                if ret == 1 and self._on_trigger is not None:
+                    self._on_trigger(self)
+                self._run_requests()
+        except Exception as e:
+            # the recorder stops, but the events so far can be dumped
+            self.error = e
+        finally:
+            self._run_requests()
 
 class Device(object):
     """
     Encapsulates a raw kernel input event device, either an existing one as
     reported by the kernel or a pseudodevice as created through a .prop file.
+
+    Each Device has its own libevemu context, so different Devices can
+    play and record concurrently from different threads; libevemu releases
+    the GIL while it blocks. A single Device must only be used by one
+    thread at a time. See play_many() and record_many().
     """
 
-    def __init__(self, f, create=True):
+    def __init__(self, f, create=True, timeout=5.0):
         """
         Initialize an evemu Device.
 
@@ -198,6 +674,9 @@ class Device(object):
         to create a pseudo-device node.
         create -- If f points to an evemu prop file, 'create' specifies if a
         uinput device should be created
+        timeout -- how long to wait for the node of a created device to
+        become usable, in seconds. See create_devices() to create several
+        devices at once.
         """
 
         if type(f) == str:
@@ -212,37 +691,61 @@ class Device(object):
         self._libevemu = evemu.base.LibEvemu()
 
         self._evemu_device = self._libevemu.evemu_new(b"")
+        self._context = self._libevemu.evemu_context_new()
 
         if self._is_propfile:
             fs = self._libc.fdopen(self._file.fileno(), b"r")
             self._libevemu.evemu_read(self._evemu_device, fs)
             if create:
-                self._file = self._create_devnode()
+                devnode = self.create_uinput()
+                wait_for_devnodes([devnode], timeout)
+                self.open_devnode(devnode)
         else:
             self._libevemu.evemu_extract(self._evemu_device,
                                          self._file.fileno())
 
     def __del__(self):
+        if hasattr(self, "_context"):
+            self._libevemu.evemu_context_delete(self._context)
         if hasattr(self, "_is_propfile") and self._is_propfile:
             self._file.close()
             self._libevemu.evemu_destroy(self._evemu_device)
 
-    def _create_devnode(self):
+    def create_uinput(self):
+        """
+        Creates the uinput device of a Device made from a prop file with
+        create=False and returns the path of its node, without waiting for
+        the node. Once wait_for_devnodes() or evemu.aio.wait_for_devnodes()
+        returns, pass the path to open_devnode().
+        """
+        if not self._is_propfile:
+            raise TypeError("expected a prop file")
         self._libevemu.evemu_create_managed(self._evemu_device)
-        return open(self._find_newest_devnode(self.name), 'r+b', buffering=0)
+        devnode = self._libevemu.evemu_get_devnode(self._evemu_device)
+        if devnode is not None:
+            devnode = devnode.decode("iso8859-1")
+        else:
+            # libevdev could not find the node, look for it ourselves
+            devnode = self._find_newest_devnode(self.name)
+        if devnode is None:
+            raise evemu.exception.ExecutionError(
+                    "cannot determine the device node of %s" % self.name)
+        return devnode
+
+    def open_devnode(self, devnode):
+        """
+        Opens the node returned by create_uinput(). The Device then plays
+        to and records from that node.
+        """
+        self._file = open(devnode, 'r+b', buffering=0)
 
     def _find_newest_devnode(self, target_name):
         newest_node = (None, float(0))
-        for sysname in glob.glob("/sys/class/input/event*/device/name"):
-            with open(sysname) as f:
-                name = f.read().rstrip()
-                if name == target_name:
-                    ev = re.search("(event\d+)", sysname)
-                    if ev:
-                       devname = os.path.join("/dev/input", ev.group(1))
-                       ctime = os.stat(devname).st_ctime
-                       if ctime > newest_node[1]:
-                           newest_node = (devname, ctime)
+        for info in list_devices():
+            if info.name == target_name:
+                ctime = os.stat(info.devnode).st_ctime
+                if ctime > newest_node[1]:
+                    newest_node = (info.devnode, ctime)
         return newest_node[0]
 
     def _check_is_propfile(self, f):
@@ -281,20 +784,49 @@ class Device(object):
         self._libevemu.evemu_write(self._evemu_device, fs)
         self._libc.fflush(fs)
 
-    def events(self, events_file=None):
+    def events(self, events_file=None, filter=None, follow=False,
+               timeout=None):
         """
-        Reads the events from the given file and returns them as a list of
-        dicts.
+        Generator yielding the events read from the given file as
+        InputEvents.
 
         If not None, events_file must be a real file with fileno(), not
         file-like. If None, the file used for creating this device is used.
+
+        If filter is not None, only events passing the Filter are returned.
+
+        If follow is True, the events of a recording that is still being
+        written are returned as they are appended, see evemu_tail_new().
+        events_file may then also be the path of the recording or the
+        output file of evemu-record, in which case the segments written
+        with --autorestart or --rotate-* are followed one after another.
+        A file is followed from its current offset. Without a timeout the
+        events never end, otherwise they end once no event was appended
+        for timeout seconds.
         """
+        if filter is not None:
+            for e in filter.filter(self.events(events_file, follow=follow,
+                                               timeout=timeout)):
+                yield e
+            return
+
+        if follow:
+            for e in self._follow(events_file, timeout):
+                yield e
+            return
+
         if events_file:
             if not hasattr(events_file, "fileno"):
                 raise TypeError("expected file")
         else:
             events_file = self._file
 
+        accelerator = evemu.base.accelerator
+        if accelerator is not None:
+            for e in accelerator.EventReader(events_file.fileno(), InputEvent):
+                yield e
+            return
+
         fs = self._libc.fdopen(events_file.fileno(), b"r")
         event = evemu.base.InputEvent()
         while self._libevemu.evemu_read_event(fs, ctypes.byref(event)) > 0:
@@ -302,7 +834,35 @@ class Device(object):
 
         self._libc.rewind(fs)
 
-    def play(self, events_file):
+    def _follow(self, events_file, timeout):
+        if events_file is None:
+            events_file = self._file
+        if hasattr(events_file, "fileno"):
+            path = getattr(events_file, "name", "")
+            fd = events_file.fileno()
+        else:
+            path = events_file
+            fd = -1
+        if not isinstance(path, str):
+            path = ""
+
+        ms = -1 if timeout is None else int(timeout * 1000)
+        tail = self._libevemu.evemu_tail_new(path.encode("iso8859-1"), fd)
+        try:
+            event = evemu.base.InputEvent()
+            while True:
+                ret = self._libevemu.evemu_tail_read_event(
+                        tail, ctypes.byref(event), ms)
+                if ret < 0:
+                    raise OSError(-ret, "could not follow %s" % path)
+                if ret == 0:
+                    return
+                yield InputEvent(event.sec, event.usec, event.type,
+                                 event.code, event.value)
+        finally:
+            self._libevemu.evemu_tail_delete(tail)
+
+    def play(self, events_file, filter=None, start=None, trace=None):
         """
         Replays an event sequence, as provided by the events_file,
         through the input device. The event sequence must be in
@@ -312,14 +872,37 @@ class Device(object):
         succeed (usually root).
 
         events_file must be a real file with fileno(), not file-like.
+
+        If filter is not None, only events passing the Filter are
+        replayed. Filtering is done by libevemu, without per-event calls
+        into Python.
+
+        If start is not None, the replay starts start seconds into the
+        recording: one frame restores the device state at that time,
+        then the events from the first frame at or after start are
+        replayed. The state is read from the checkpoints in the
+        recording, see record() and add_checkpoints().
+
+        If trace is not None, a timeline of the replay is written to the
+        file trace in the Chrome trace event format once the replay is
+        done, see evemu_context_enable_trace().
         """
         if not hasattr(events_file, "fileno"):
             raise TypeError("expected file")
 
         fs = self._libc.fdopen(events_file.fileno(), b"r")
-        self._libevemu.evemu_play(fs, self._file.fileno())
-
-    def record(self, events_file, timeout=10000):
+        self._set_filter(filter)
+        with self._tracing(trace):
+            if start is None:
+                self._libevemu.evemu_context_play(self._context, fs,
+                                                  self._file.fileno())
+            else:
+                self._libevemu.evemu_context_play_from(
+                        self._context, fs, self._file.fileno(),
+                        int(start * 1000000))
+
+    def record(self, events_file, timeout=10000, filter=None,
+               checkpoint=None, trace=None):
         """
         Captures events from the input device and prints them to the
         events_file. The events can be parsed by the play method,
@@ -330,14 +913,148 @@ class Device(object):
         succeed (usually root).
 
         events_file must be a real file with fileno(), not file-like.
+
+        If filter is not None, only events passing the Filter are
+        recorded.
+
+        If checkpoint is not None, a checkpoint of the device state is
+        written at the start and then at least every checkpoint seconds,
+        so play() can start in the middle of the recording.
+
+        If trace is not None, a timeline of the recording is written to
+        the file trace in the Chrome trace event format once the
+        recording is done.
         """
         if not hasattr(events_file, "fileno"):
             raise TypeError("expected file")
 
         fs = self._libc.fdopen(events_file.fileno(), b"w")
-        self._libevemu.evemu_record(fs, self._file.fileno(), timeout)
+        self._set_filter(filter)
+        self._set_checkpoints(checkpoint)
+        with self._tracing(trace):
+            self._libevemu.evemu_context_record(self._context, fs,
+                                                self._file.fileno(), timeout)
         self._libc.fflush(fs)
 
+    @contextlib.contextmanager
+    def _tracing(self, trace_file):
+        # the trace is written even if the replay or recording fails
+        if trace_file is None:
+            yield
+            return
+
+        if not hasattr(trace_file, "fileno"):
+            raise TypeError("expected file")
+
+        self._libevemu.evemu_context_enable_trace(self._context,
+                                                  _TRACE_RECORDS)
+        try:
+            yield
+        finally:
+            trace_file.flush()
+            fs = self._libc.fdopen(os.dup(trace_file.fileno()), b"w")
+            try:
+                self._libevemu.evemu_context_write_trace(self._context, fs)
+            finally:
+                self._libc.fclose(fs)
+                self._libevemu.evemu_context_enable_trace(self._context, 0)
+
+    def _set_checkpoints(self, interval):
+        if interval is None:
+            self._libevemu.evemu_context_enable_checkpoints(self._context,
+                                                            None, 0)
+            return
+
+        if interval <= 0:
+            raise ValueError("checkpoint interval must be positive")
+
+        # the state is taken from the device as it is now
+        device = self._libevemu.evemu_new(b"")
+        try:
+            self._libevemu.evemu_extract(device, self._file.fileno())
+            self._libevemu.evemu_context_enable_checkpoints(
+                    self._context, device, int(interval * 1000000))
+        finally:
+            self._libevemu.evemu_delete(device)
+
+    def _set_filter(self, filter):
+        # the context only borrows the filter, keep it alive until the
+        # next call replaces it
+        self._filter = filter
+        self._libevemu.evemu_context_set_filter(
+                self._context, filter._filter if filter is not None else None)
+
+    def enable_stats(self):
+        """
+        Starts collecting statistics about play() and record(), see stats.
+        If statistics are already enabled, they are reset.
+        """
+        self._libevemu.evemu_context_enable_stats(self._context)
+
+    @property
+    def stats(self):
+        """
+        The statistics collected since enable_stats() as dict, or None if
+        statistics are not enabled. Keys are the fields of struct
+        evemu_stats, e.g. "events_read", "short_writes" or "sleep_ns".
+        "sleep_overshoot" is a list of counts, index 0 counts overshoots
+        below 1us, index n overshoots of [2^(n-1), 2^n) us.
+
+        :return: dict or None
+        """
+        stats = evemu.base.Stats()
+        if self._libevemu.evemu_context_get_stats(self._context,
+                                                  ctypes.byref(stats)) != 0:
+            return None
+
+        result = {}
+        for (name, _) in stats._fields_:
+            value = getattr(stats, name)
+            if name == "sleep_overshoot":
+                value = list(value)
+            result[name] = value
+        return result
+
+    def enable_latency(self, stall=0.02, annotate=False):
+        """
+        Starts measuring the delivery latency of the frames read by
+        record(), see latency. Frames delivered stall seconds or more late
+        count as stalls. If annotate is True, the latency of each frame is
+        written to the recording as "# L:" comment. If latency profiling
+        is already enabled, the latencies are reset.
+        """
+        self._libevemu.evemu_context_enable_latency(self._context,
+                                                    int(stall * 1000000),
+                                                    1 if annotate else 0)
+
+    @property
+    def latency(self):
+        """
+        The delivery latencies measured since enable_latency() as dict, or
+        None if latency profiling is not enabled. Keys are the fields of
+        struct evemu_latency, e.g. "frames", "max_us" or "stalls".
+        "histogram" is a list of counts, index 0 counts latencies below
+        1us, index n latencies of [2^(n-1), 2^n) us. "stall" is a list of
+        (time, latency_us) tuples of the most recent stalls, oldest first.
+
+        :return: dict or None
+        """
+        latency = evemu.base.Latency()
+        if self._libevemu.evemu_context_get_latency(
+                self._context, ctypes.byref(latency)) != 0:
+            return None
+
+        result = {}
+        for (name, _) in latency._fields_:
+            value = getattr(latency, name)
+            if name == "histogram":
+                value = list(value)
+            elif name == "stall":
+                n = min(latency.stalls, evemu.base.EVEMU_LATENCY_STALLS)
+                value = [(s.time, s.latency_us) for s in value[:n]]
+            result[name] = value
+        return result
+
     @property
     def version(self):
         """
@@ -473,3 +1190,161 @@ class Device(object):
                                                 event_code)
         return bool(result)
 
+def _run_many(func, jobs, max_workers):
+    """
+    Calls func(*job) for each job in a pool of threads and returns the
+    results in the order of jobs. All jobs run to completion, then the
+    first exception raised by any of them is re-raised.
+    """
+    jobs = list(jobs)
+    if not jobs:
+        return []
+
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers or len(jobs)) as executor:
+        futures = [executor.submit(func, *job) for job in jobs]
+
+    return [f.result() for f in futures]
+
+def play_many(jobs, max_workers=None):
+    """
+    Replays several event sequences concurrently, each on its own thread.
+
+    jobs is a sequence of (device, events_file) or (device, events_file,
+    filter) tuples, see Device.play(). Each Device must appear only once.
+    By default, one thread is used per job, max_workers limits the number
+    of threads.
+    """
+    return _run_many(lambda d, *args: d.play(*args), jobs, max_workers)
+
+def record_many(jobs, timeout=10000, max_workers=None):
+    """
+    Records several devices concurrently, each on its own thread.
+
+    jobs is a sequence of (device, events_file) or (device, events_file,
+    filter) tuples, see Device.record(). Each Device must appear only
+    once. By default, one thread is used per job, max_workers limits the
+    number of threads. Note that a recording occupies its thread until the
+    device has been idle for timeout milliseconds.
+    """
+    def record(device, events_file, filter=None):
+        device.record(events_file, timeout, filter)
+
+    return _run_many(record, jobs, max_workers)
+
+class NodeWatch(object):
+    """
+    Waits for device nodes to become usable, see evemu_node_watch_new().
+    wait_for_devnodes() blocks on a NodeWatch, an event loop can watch
+    fileno() and call dispatch() when it is readable instead.
+    """
+
+    def __init__(self, devnodes, writable=True):
+        self._libevemu = evemu.base.LibEvemu()
+        self._watch = self._libevemu.evemu_node_watch_new()
+        flags = os.O_RDWR if writable else os.O_RDONLY
+        for devnode in devnodes:
+            self._libevemu.evemu_node_watch_add(self._watch,
+                                                devnode.encode("iso8859-1"),
+                                                flags)
+
+    def __del__(self):
+        if hasattr(self, "_watch"):
+            self._libevemu.evemu_node_watch_delete(self._watch)
+
+    def fileno(self):
+        """
+        The inotify descriptor, readable when a node may have changed.
+        """
+        return self._libevemu.evemu_node_watch_get_fd(self._watch)
+
+    def dispatch(self):
+        """
+        Returns the number of nodes that cannot be opened yet.
+        """
+        return self._libevemu.evemu_node_watch_dispatch(self._watch)
+
+    def wait(self, timeout):
+        """
+        Waits until all nodes can be opened. Raises
+        evemu.exception.DevnodeTimeoutError if they cannot after timeout
+        seconds. A timeout of None waits forever.
+        """
+        ms = -1 if timeout is None else int(timeout * 1000)
+        ret = self._libevemu.evemu_node_watch_wait(self._watch, ms)
+        if ret == -errno.ETIMEDOUT:
+            raise evemu.exception.DevnodeTimeoutError(
+                    "device nodes not ready after %ss" % timeout)
+        elif ret < 0:
+            raise OSError(-ret, os.strerror(-ret))
+
+def wait_for_devnodes(devnodes, timeout=5.0, writable=True):
+    """
+    Waits until all devnodes exist and can be opened, for reading and
+    writing if writable is True. udev creates the nodes of new devices and
+    sets their permissions asynchronously, this waits for it with inotify
+    instead of polling.
+
+    Raises evemu.exception.DevnodeTimeoutError if the nodes are not ready
+    after timeout seconds. A timeout of None waits forever.
+    """
+    NodeWatch(devnodes, writable).wait(timeout)
+
+def create_devices(prop_files, timeout=5.0):
+    """
+    Creates a Device for each of the prop_files, see Device(). All uinput
+    devices are created first, then their nodes are awaited together, so
+    creating many devices takes about as long as creating one. Returns the
+    list of Devices.
+
+    See evemu.aio for the asyncio version.
+    """
+    devices = [Device(f, create=False) for f in prop_files]
+    devnodes = [d.create_uinput() for d in devices]
+    wait_for_devnodes(devnodes, timeout)
+    for (device, devnode) in zip(devices, devnodes):
+        device.open_devnode(devnode)
+    return devices
+
+def fan_out(prop_file, events_file, count, offsets=None, stagger=0):
+    """
+    Creates count Devices from prop_file and returns a Player that replays
+    events_file to all of them. The recording is parsed only once.
+
+    offsets is an optional sequence of start offsets in milliseconds, the
+    n-th offset applies to the n-th device. In addition, the n-th device
+    starts n * stagger milliseconds after the first one.
+    """
+    if count <= 0:
+        raise ValueError("count must be positive")
+
+    offsets = list(offsets or [])
+    recording = Recording(events_file)
+    player = Player()
+    for (i, device) in enumerate(create_devices([prop_file] * count)):
+        offset = i * stagger + (offsets[i] if i < len(offsets) else 0)
+        player.add(device, recording, offset)
+    return player
+
+def add_checkpoints(events_file, output_file, interval=10.0):
+    """
+    Copies the recording in events_file to output_file and adds a
+    checkpoint of the device state at its start and then at least every
+    interval seconds. Existing checkpoints are replaced. A recording with
+    checkpoints can be replayed from any point in time, see Device.play().
+
+    Both files must be real files with fileno(), not file-like, and
+    events_file must be seekable.
+    """
+    if not hasattr(events_file, "fileno") or \
+       not hasattr(output_file, "fileno"):
+        raise TypeError("expected file")
+    if interval <= 0:
+        raise ValueError("interval must be positive")
+
+    libc = evemu.base.LibC()
+    libevemu = evemu.base.LibEvemu()
+    fin = libc.fdopen(events_file.fileno(), b"r")
+    fout = libc.fdopen(output_file.fileno(), b"w")
+    libevemu.evemu_add_checkpoints(fin, fout, int(interval * 1000000))
+    libc.fflush(fout)
@@ -0,0 +1,360 @@
+/*****************************************************************************
+ *
+ * evemu - Kernel device emulation
+ *
+ * Copyright (C) 2014 Red Hat, Inc.
+ *
+ * This library is free software: you can redistribute it and/or modify it
+ * under the terms of the GNU Lesser General Public License version 3
+ * as published by the Free Software Foundation.
+ *
+ * This library is distributed in the hope that it will be useful, but
+ * WITHOUT ANY WARRANTY; without even the implied warranties of
+ * MERCHANTABILITY, SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR
+ * PURPOSE.  See the GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU Lesser General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses/>.
+ *
+ ****************************************************************************/
+
+/*
+ * Optional compiled fast paths for the evemu Python bindings. Every call
+ * through ctypes pays for argument conversion and an errcheck callback,
+ * the per-event paths here do the same work with one call per batch.
+ * evemu.base imports this module if it is available and falls back to
+ * ctypes otherwise; both behave the same.
+ */
+
+#define PY_SSIZE_T_CLEAN
+#define _GNU_SOURCE
+#include <Python.h>
+#include <errno.h>
+#include <stdio.h>
+#include <string.h>
+#include <unistd.h>
+#include <linux/input.h>
+#include <libevdev/libevdev.h>
+
+#include "evemu.h"
+
+/* events read per call into libevemu with the GIL released */
+#define READ_BATCH 64
+
+typedef struct {
+	PyObject_HEAD
+	FILE *fp;
+	PyObject *factory;
+	struct input_event events[READ_BATCH];
+	int count;
+	int next;
+	int done;
+} EventReader;
+
+static int
+EventReader_init(EventReader *self, PyObject *args, PyObject *kwds)
+{
+	static char *kwlist[] = { "fd", "factory", NULL };
+	PyObject *factory;
+	int fd;
+
+	if (!PyArg_ParseTupleAndKeywords(args, kwds, "iO", kwlist,
+					 &fd, &factory))
+		return -1;
+
+	if (self->fp) {
+		PyErr_SetString(PyExc_RuntimeError,
+				"EventReader is already initialized");
+		return -1;
+	}
+
+	/* a private FILE on a dup, so closing it leaves fd alone; both share
+	 * the file offset */
+	fd = dup(fd);
+	if (fd < 0) {
+		PyErr_SetFromErrno(PyExc_OSError);
+		return -1;
+	}
+	self->fp = fdopen(fd, "r");
+	if (!self->fp) {
+		PyErr_SetFromErrno(PyExc_OSError);
+		close(fd);
+		return -1;
+	}
+
+	Py_INCREF(factory);
+	self->factory = factory;
+
+	return 0;
+}
+
+static void
+EventReader_dealloc(EventReader *self)
+{
+	if (self->fp)
+		fclose(self->fp);
+	Py_XDECREF(self->factory);
+	Py_TYPE(self)->tp_free((PyObject *)self);
+}
+
+static int
+EventReader_fill(EventReader *self)
+{
+	FILE *fp = self->fp;
+	int n = 0, rc = 1;
+
+	Py_BEGIN_ALLOW_THREADS
+	while (n < READ_BATCH) {
+		rc = evemu_read_event(fp, &self->events[n]);
+		if (rc <= 0)
+			break;
+		n++;
+	}
+	/* like the ctypes path, the file is rewound once all events are
+	 * read, an invalid event ends the events as well */
+	if (rc <= 0)
+		rewind(fp);
+	Py_END_ALLOW_THREADS
+
+	self->count = n;
+	self->next = 0;
+	self->done = rc <= 0;
+
+	return n;
+}
+
+static PyObject *
+EventReader_next(EventReader *self)
+{
+	struct input_event *ev;
+
+	if (!self->fp) {
+		PyErr_SetString(PyExc_RuntimeError,
+				"EventReader is not initialized");
+		return NULL;
+	}
+
+	if (self->next == self->count) {
+		if (self->done || EventReader_fill(self) == 0)
+			return NULL;
+	}
+
+	ev = &self->events[self->next++];
+	return PyObject_CallFunction(self->factory, "llHHi",
+				     (long)ev->time.tv_sec,
+				     (long)ev->time.tv_usec,
+				     ev->type, ev->code, ev->value);
+}
+
+static PyTypeObject EventReaderType = {
+	PyVarObject_HEAD_INIT(NULL, 0)
+	.tp_name = "evemu._speedups.EventReader",
+	.tp_basicsize = sizeof(EventReader),
+	.tp_flags = Py_TPFLAGS_DEFAULT,
+	.tp_doc = "EventReader(fd, factory)\n\n"
+		  "Iterates over the events of the evemu events file fd,\n"
+		  "returning factory(sec, usec, type, code, value) for each\n"
+		  "event. The file is rewound after the last event.",
+	.tp_new = PyType_GenericNew,
+	.tp_init = (initproc)EventReader_init,
+	.tp_dealloc = (destructor)EventReader_dealloc,
+	.tp_iter = PyObject_SelfIter,
+	.tp_iternext = (iternextfunc)EventReader_next,
+};
+
+static PyObject *
+format_event(PyObject *self, PyObject *args)
+{
+	struct input_event ev;
+	PyObject *line;
+	long sec, usec;
+	char *buf = NULL;
+	size_t sz = 0, len;
+	FILE *fp;
+	int rc;
+
+	(void)self;
+
+	memset(&ev, 0, sizeof(ev));
+	if (!PyArg_ParseTuple(args, "llHHi", &sec, &usec,
+			      &ev.type, &ev.code, &ev.value))
+		return NULL;
+	ev.time.tv_sec = sec;
+	ev.time.tv_usec = usec;
+
+	fp = open_memstream(&buf, &sz);
+	if (!fp)
+		return PyErr_SetFromErrno(PyExc_OSError);
+	rc = evemu_write_event(fp, &ev);
+	fclose(fp);
+	if (rc <= 0) {
+		free(buf);
+		return PyErr_Format(PyExc_OSError,
+				    "evemu_write_event failed (%d)", rc);
+	}
+
+	/* the first line without trailing whitespace, like the ctypes path */
+	len = strcspn(buf, "\n");
+	while (len > 0 && Py_ISSPACE(buf[len - 1]))
+		len--;
+
+	line = PyUnicode_DecodeLatin1(buf, len, NULL);
+	free(buf);
+
+	return line;
+}
+
+static PyObject *
+write_events(PyObject *self, PyObject *args)
+{
+	struct input_event *events;
+	PyObject *seq, *fast;
+	Py_ssize_t i, n;
+	ssize_t written;
+	int fd;
+
+	(void)self;
+
+	if (!PyArg_ParseTuple(args, "iO", &fd, &seq))
+		return NULL;
+
+	fast = PySequence_Fast(seq, "expected a sequence of events");
+	if (!fast)
+		return NULL;
+
+	n = PySequence_Fast_GET_SIZE(fast);
+	events = PyMem_Calloc(n ? n : 1, sizeof(*events));
+	if (!events) {
+		Py_DECREF(fast);
+		return PyErr_NoMemory();
+	}
+
+	for (i = 0; i < n; i++) {
+		PyObject *item = PySequence_Fast_GET_ITEM(fast, i);
+
+		if (!PyArg_ParseTuple(item, "HHi;expected (type, code, value)",
+				      &events[i].type, &events[i].code,
+				      &events[i].value)) {
+			PyMem_Free(events);
+			Py_DECREF(fast);
+			return NULL;
+		}
+	}
+	Py_DECREF(fast);
+
+	Py_BEGIN_ALLOW_THREADS
+	do {
+		written = write(fd, events, n * sizeof(*events));
+	} while (written < 0 && errno == EINTR);
+	Py_END_ALLOW_THREADS
+
+	PyMem_Free(events);
+	if (written < 0)
+		return PyErr_SetFromErrno(PyExc_OSError);
+
+	return PyLong_FromSsize_t(written);
+}
+
+static PyObject *
+capabilities(PyObject *self, PyObject *args)
+{
+	const struct evemu_device *dev;
+	PyObject *caps, *codes = NULL, *set = NULL, *key = NULL;
+	unsigned long long address;
+	int type, code, max;
+
+	(void)self;
+
+	if (!PyArg_ParseTuple(args, "K", &address))
+		return NULL;
+	dev = (const struct evemu_device *)(uintptr_t)address;
+
+	caps = PyDict_New();
+	if (!caps)
+		return NULL;
+
+	for (type = 0; type <= EV_MAX; type++) {
+		if (!evemu_has_bit(dev, type))
+			continue;
+
+		codes = PyList_New(0);
+		if (!codes)
+			goto error;
+		max = libevdev_event_type_get_max(type);
+		for (code = 0; code <= max; code++) {
+			PyObject *c;
+
+			if (!evemu_has_event(dev, type, code))
+				continue;
+			c = PyLong_FromLong(code);
+			if (!c || PyList_Append(codes, c) < 0) {
+				Py_XDECREF(c);
+				goto error;
+			}
+			Py_DECREF(c);
+		}
+
+		set = PyFrozenSet_New(codes);
+		key = PyLong_FromLong(type);
+		if (!set || !key || PyDict_SetItem(caps, key, set) < 0)
+			goto error;
+		Py_CLEAR(codes);
+		Py_CLEAR(set);
+		Py_CLEAR(key);
+	}
+
+	return caps;
+
+error:
+	Py_XDECREF(codes);
+	Py_XDECREF(set);
+	Py_XDECREF(key);
+	Py_DECREF(caps);
+	return NULL;
+}
+
+static PyMethodDef speedups_methods[] = {
+	{ "format_event", format_event, METH_VARARGS,
+	  "format_event(sec, usec, type, code, value) -> str\n\n"
+	  "Returns the event as written to an evemu events file." },
+	{ "write_events", write_events, METH_VARARGS,
+	  "write_events(fd, events) -> int\n\n"
+	  "Writes the (type, code, value) events to fd as struct\n"
+	  "input_event with one write and returns the bytes written." },
+	{ "capabilities", capabilities, METH_VARARGS,
+	  "capabilities(device) -> dict\n\n"
+	  "Returns a dict mapping each event type of the struct\n"
+	  "evemu_device at the given address to a frozenset of its codes." },
+	{ NULL, NULL, 0, NULL }
+};
+
+static struct PyModuleDef speedups_module = {
+	PyModuleDef_HEAD_INIT,
+	.m_name = "evemu._speedups",
+	.m_doc = "Compiled fast paths for the evemu bindings.",
+	.m_size = -1,
+	.m_methods = speedups_methods,
+};
+
+PyMODINIT_FUNC
+PyInit__speedups(void)
+{
+	PyObject *m;
+
+	if (PyType_Ready(&EventReaderType) < 0)
+		return NULL;
+
+	m = PyModule_Create(&speedups_module);
+	if (!m)
+		return NULL;
+
+	Py_INCREF(&EventReaderType);
+	if (PyModule_AddObject(m, "EventReader",
+			       (PyObject *)&EventReaderType) < 0) {
+		Py_DECREF(&EventReaderType);
+		Py_DECREF(m);
+		return NULL;
+	}
+
+	return m;
+}
@@ -0,0 +1,72 @@
+"""
+The aio module provides asyncio versions of the evemu functions that wait
+for devices, so test fixtures can create devices without blocking their
+event loop:
+
+    keyboard, touchpad = await evemu.aio.create_devices(["kbd.prop",
+                                                         "tp.prop"])
+
+This module requires Python 3.7 or later.
+"""
+
+import asyncio
+
+import evemu
+import evemu.exception
+
+__all__ = ["create_device",
+           "create_devices",
+           "wait_for_devnodes"]
+
+
+async def wait_for_devnodes(devnodes, timeout=5.0, writable=True):
+    """
+    Waits until all devnodes exist and can be opened, see
+    evemu.wait_for_devnodes(). The inotify descriptor is added to the
+    running event loop, nothing blocks while waiting.
+
+    Raises evemu.exception.DevnodeTimeoutError if the nodes are not ready
+    after timeout seconds. A timeout of None waits forever.
+    """
+    watch = evemu.NodeWatch(devnodes, writable)
+    loop = asyncio.get_running_loop()
+    ready = loop.create_future()
+
+    def check():
+        if not ready.done() and watch.dispatch() == 0:
+            ready.set_result(None)
+
+    check()
+    if ready.done():
+        return
+
+    loop.add_reader(watch.fileno(), check)
+    try:
+        await asyncio.wait_for(ready, timeout)
+    except asyncio.TimeoutError:
+        raise evemu.exception.DevnodeTimeoutError(
+                "device nodes not ready after %ss" % timeout)
+    finally:
+        loop.remove_reader(watch.fileno())
+
+
+async def create_devices(prop_files, timeout=5.0):
+    """
+    Creates a Device for each of the prop_files and waits for all of their
+    nodes together, see evemu.create_devices(). Returns the list of
+    Devices.
+    """
+    devices = [evemu.Device(f, create=False) for f in prop_files]
+    devnodes = [d.create_uinput() for d in devices]
+    await wait_for_devnodes(devnodes, timeout)
+    for (device, devnode) in zip(devices, devnodes):
+        device.open_devnode(devnode)
+    return devices
+
+
+async def create_device(prop_file, timeout=5.0):
+    """
+    Creates a Device from prop_file and waits for its node, see
+    create_devices().
+    """
+    return (await create_devices([prop_file], timeout))[0]
@@ -4,9 +4,10 @@ The base module provides classes wrapping shared libraries.
 import ctypes
 import ctypes.util
 import os
+import threading
 
 # Import types directly, so they don't have to be prefixed with "ctypes.".
-from ctypes import c_char_p, c_int, c_uint, c_void_p, c_long, c_int32, c_uint16
+from ctypes import c_char_p, c_int, c_uint, c_void_p, c_long, c_ulong, c_ulonglong, c_size_t, c_int32, c_uint16
 
 import evemu.exception
 
@@ -83,6 +84,9 @@ class LibraryWrapper(object):
         # represents the shared library.
         # Initialized once, shared between all instances of this class.
 
+    _load_lock = threading.Lock()
+        # Serializes the initialization of _loaded_lib between threads.
+
     def __init__(self):
         super(LibraryWrapper, self).__init__()
         self._load()
@@ -110,13 +114,30 @@ class LibraryWrapper(object):
             # Already initialized, just return it.
             return cls._loaded_lib
 
+        with cls._load_lock:
+            if cls._loaded_lib is None:
+                cls._setup()
+
+        return cls._loaded_lib
+
+    @classmethod
+    def _setup(cls):
+        """
+        Loads the shared library and sets up the API calls. _loaded_lib is
+        only set once all API calls are available, so other threads never
+        see a half-initialized library.
+
+        All API calls are made through ctypes.CDLL, which releases the GIL
+        for the duration of the call. Blocking calls like evemu_play() or
+        evemu_record() thus do not block other Python threads.
+        """
         # Get an instance of the wrapped shared library.
-        cls._loaded_lib = cls._cdll()
+        lib = cls._cdll()
 
         # Iterate the API call prototypes.
         for (name, attrs) in cls._api_prototypes.items():
             # Get the API call.
-            api_call = getattr(cls._loaded_lib, name)
+            api_call = getattr(lib, name)
             # Add argument and return types.
             api_call.argtypes = attrs["argtypes"]
             api_call.restype = attrs["restype"]
@@ -126,7 +147,7 @@ class LibraryWrapper(object):
             # Add the API call as attribute to the class.
             setattr(cls, name, api_call)
 
-        return cls._loaded_lib
+        cls._loaded_lib = lib
 
     @staticmethod
     # @abc.abstractmethod - Would be nice here, but it can't be mixed with
@@ -156,10 +177,19 @@ class LibC(LibraryWrapper):
             "restype": c_int,
             "errcheck": expect_eq_zero
             },
+        "fclose": {
+            "argtypes": (c_void_p,),
+            "restype": c_int,
+            "errcheck": expect_eq_zero
+            },
         "rewind": {
             "argtypes": (c_void_p,),
             "restype": None,
             },
+        "free": {
+            "argtypes": (c_void_p,),
+            "restype": None,
+            },
         }
 
 class LibEvdev(LibraryWrapper):
@@ -187,6 +217,11 @@ class LibEvdev(LibraryWrapper):
             "argtypes": (c_uint, c_uint,),
             "restype": c_char_p
             },
+        #int libevdev_event_type_get_max(unsigned int type);
+        "libevdev_event_type_get_max": {
+            "argtypes": (c_uint,),
+            "restype": c_int
+            },
         #int libevdev_event_code_from_name(unsigned int type, const char *name);
         "libevdev_event_code_from_name": {
             "argtypes": (c_uint, c_char_p,),
@@ -433,6 +468,382 @@ class LibEvemu(LibraryWrapper):
             "restype": c_int,
             "errcheck": expect_eq_zero
             },
+        #struct evemu_filter *evemu_filter_new(void);
+        "evemu_filter_new": {
+            "argtypes": (),
+            "restype": c_void_p,
+            "errcheck": expect_not_none
+            },
+        #void evemu_filter_delete(struct evemu_filter *filter);
+        "evemu_filter_delete": {
+            "argtypes": (c_void_p,),
+            "restype": None
+            },
+        #int evemu_filter_add(struct evemu_filter *filter, const char *spec);
+        "evemu_filter_add": {
+            "argtypes": (c_void_p, c_char_p),
+            "restype": c_int,
+            "errcheck": expect_eq_zero
+            },
+        #int evemu_filter_event(struct evemu_filter *filter,
+        #                       struct input_event *ev);
+        "evemu_filter_event": {
+            "argtypes": (c_void_p, c_void_p),
+            "restype": c_int
+            },
+        #int evemu_filter_enable_reduction(struct evemu_filter *filter,
+        #                                  const struct evemu_device *dev);
+        "evemu_filter_enable_reduction": {
+            "argtypes": (c_void_p, c_void_p),
+            "restype": c_int,
+            "errcheck": expect_eq_zero
+            },
+        #unsigned long evemu_filter_get_reduced_count(
+        #                                const struct evemu_filter *filter);
+        "evemu_filter_get_reduced_count": {
+            "argtypes": (c_void_p,),
+            "restype": c_ulong
+            },
+        #int evemu_record_filtered(FILE *fp, int fd, int ms,
+        #                          struct evemu_filter *filter);
+        "evemu_record_filtered": {
+            "argtypes": (c_void_p, c_int, c_int, c_void_p),
+            "restype": c_int,
+            "errcheck": expect_eq_zero
+            },
+        #int evemu_play_filtered(FILE *fp, int fd,
+        #                        struct evemu_filter *filter);
+        "evemu_play_filtered": {
+            "argtypes": (c_void_p, c_int, c_void_p),
+            "restype": c_int,
+            "errcheck": expect_eq_zero
+            },
+        #struct evemu_context *evemu_context_new(void);
+        "evemu_context_new": {
+            "argtypes": (),
+            "restype": c_void_p,
+            "errcheck": expect_not_none
+            },
+        #void evemu_context_delete(struct evemu_context *ctx);
+        "evemu_context_delete": {
+            "argtypes": (c_void_p,),
+            "restype": None
+            },
+        #void evemu_context_set_filter(struct evemu_context *ctx,
+        #                              struct evemu_filter *filter);
+        "evemu_context_set_filter": {
+            "argtypes": (c_void_p, c_void_p),
+            "restype": None
+            },
+        #int evemu_context_enable_stats(struct evemu_context *ctx);
+        "evemu_context_enable_stats": {
+            "argtypes": (c_void_p,),
+            "restype": c_int,
+            "errcheck": expect_eq_zero
+            },
+        #int evemu_context_get_stats(const struct evemu_context *ctx,
+        #                            struct evemu_stats *stats);
+        "evemu_context_get_stats": {
+            "argtypes": (c_void_p, c_void_p),
+            "restype": c_int
+            },
+        #int evemu_context_enable_trace(struct evemu_context *ctx,
+        #                               size_t max_records);
+        "evemu_context_enable_trace": {
+            "argtypes": (c_void_p, c_size_t),
+            "restype": c_int,
+            "errcheck": expect_eq_zero
+            },
+        #int evemu_context_write_trace(const struct evemu_context *ctx,
+        #                              FILE *fp);
+        "evemu_context_write_trace": {
+            "argtypes": (c_void_p, c_void_p),
+            "restype": c_int,
+            "errcheck": expect_eq_zero
+            },
+        #int evemu_context_enable_latency(struct evemu_context *ctx,
+        #                                 long stall_us, int annotate);
+        "evemu_context_enable_latency": {
+            "argtypes": (c_void_p, c_long, c_int),
+            "restype": c_int,
+            "errcheck": expect_eq_zero
+            },
+        #int evemu_context_get_latency(const struct evemu_context *ctx,
+        #                              struct evemu_latency *latency);
+        "evemu_context_get_latency": {
+            "argtypes": (c_void_p, c_void_p),
+            "restype": c_int
+            },
+        #int evemu_context_play(struct evemu_context *ctx, FILE *fp, int fd);
+        "evemu_context_play": {
+            "argtypes": (c_void_p, c_void_p, c_int),
+            "restype": c_int,
+            "errcheck": expect_eq_zero
+            },
+        #int evemu_context_play_from(struct evemu_context *ctx, FILE *fp, int fd,
+        #                            long time);
+        "evemu_context_play_from": {
+            "argtypes": (c_void_p, c_void_p, c_int, c_long),
+            "restype": c_int,
+            "errcheck": expect_eq_zero
+            },
+        #int evemu_context_record(struct evemu_context *ctx, FILE *fp, int fd,
+        #                         int ms);
+        "evemu_context_record": {
+            "argtypes": (c_void_p, c_void_p, c_int, c_int),
+            "restype": c_int,
+            "errcheck": expect_eq_zero
+            },
+        #int evemu_context_enable_checkpoints(struct evemu_context *ctx,
+        #                                     const struct evemu_device *dev,
+        #                                     long interval);
+        "evemu_context_enable_checkpoints": {
+            "argtypes": (c_void_p, c_void_p, c_long),
+            "restype": c_int,
+            "errcheck": expect_eq_zero
+            },
+        #int evemu_add_checkpoints(FILE *in, FILE *out, long interval);
+        "evemu_add_checkpoints": {
+            "argtypes": (c_void_p, c_void_p, c_long),
+            "restype": c_int,
+            "errcheck": expect_eq_zero
+            },
+        #int evemu_seek(const struct evemu_device *dev, FILE *fp, long time,
+        #               struct input_event **frame);
+        "evemu_seek": {
+            "argtypes": (c_void_p, c_void_p, c_long, c_void_p),
+            "restype": c_int,
+            "errcheck": expect_ge_zero
+            },
+        #struct evemu_recording *evemu_recording_new(FILE *fp,
+        #                                            struct evemu_filter *filter);
+        "evemu_recording_new": {
+            "argtypes": (c_void_p, c_void_p),
+            "restype": c_void_p,
+            "errcheck": expect_not_none
+            },
+        #void evemu_recording_delete(struct evemu_recording *rec);
+        "evemu_recording_delete": {
+            "argtypes": (c_void_p,),
+            "restype": None
+            },
+        #size_t evemu_recording_get_frame_count(const struct evemu_recording *rec);
+        "evemu_recording_get_frame_count": {
+            "argtypes": (c_void_p,),
+            "restype": c_size_t
+            },
+        #long evemu_recording_get_duration(const struct evemu_recording *rec);
+        "evemu_recording_get_duration": {
+            "argtypes": (c_void_p,),
+            "restype": c_long
+            },
+        #struct evemu_player *evemu_player_new(void);
+        "evemu_player_new": {
+            "argtypes": (),
+            "restype": c_void_p,
+            "errcheck": expect_not_none
+            },
+        #void evemu_player_delete(struct evemu_player *player);
+        "evemu_player_delete": {
+            "argtypes": (c_void_p,),
+            "restype": None
+            },
+        #int evemu_player_add(struct evemu_player *player,
+        #                     const struct evemu_recording *rec, int fd,
+        #                     long offset);
+        "evemu_player_add": {
+            "argtypes": (c_void_p, c_void_p, c_int, c_long),
+            "restype": c_int,
+            "errcheck": expect_eq_zero
+            },
+        #int evemu_player_run(struct evemu_player *player);
+        "evemu_player_run": {
+            "argtypes": (c_void_p,),
+            "restype": c_int,
+            "errcheck": expect_eq_zero
+            },
+        #struct evemu_ring *evemu_ring_new(size_t size, long duration);
+        "evemu_ring_new": {
+            "argtypes": (c_size_t, c_long),
+            "restype": c_void_p,
+            "errcheck": expect_not_none
+            },
+        #void evemu_ring_delete(struct evemu_ring *ring);
+        "evemu_ring_delete": {
+            "argtypes": (c_void_p,),
+            "restype": None
+            },
+        #int evemu_ring_add_trigger(struct evemu_ring *ring, const char *spec);
+        "evemu_ring_add_trigger": {
+            "argtypes": (c_void_p, c_char_p),
+            "restype": c_int,
+            "errcheck": expect_eq_zero
+            },
+        #size_t evemu_ring_get_event_count(const struct evemu_ring *ring);
+        "evemu_ring_get_event_count": {
+            "argtypes": (c_void_p,),
+            "restype": c_size_t
+            },
+        #void evemu_ring_clear(struct evemu_ring *ring);
+        "evemu_ring_clear": {
+            "argtypes": (c_void_p,),
+            "restype": None
+            },
+        #int evemu_context_record_ring(struct evemu_context *ctx,
+        #                              struct evemu_ring *ring, int fd, int ms);
+        "evemu_context_record_ring": {
+            "argtypes": (c_void_p, c_void_p, c_int, c_int),
+            "restype": c_int
+            },
+        #int evemu_context_write_ring(struct evemu_context *ctx,
+        #                             const struct evemu_ring *ring, FILE *fp);
+        "evemu_context_write_ring": {
+            "argtypes": (c_void_p, c_void_p, c_void_p),
+            "restype": c_int,
+            "errcheck": expect_ge_zero
+            },
+        #struct evemu_shm *evemu_shm_new(const char *name, size_t size);
+        "evemu_shm_new": {
+            "argtypes": (c_char_p, c_size_t),
+            "restype": c_void_p,
+            "errcheck": expect_not_none
+            },
+        #struct evemu_shm *evemu_shm_open(const char *name);
+        "evemu_shm_open": {
+            "argtypes": (c_char_p,),
+            "restype": c_void_p,
+            "errcheck": expect_not_none
+            },
+        #void evemu_shm_delete(struct evemu_shm *shm);
+        "evemu_shm_delete": {
+            "argtypes": (c_void_p,),
+            "restype": None
+            },
+        #size_t evemu_shm_get_capacity(const struct evemu_shm *shm);
+        "evemu_shm_get_capacity": {
+            "argtypes": (c_void_p,),
+            "restype": c_size_t
+            },
+        #int evemu_shm_publish(struct evemu_shm *shm,
+        #                      const struct input_event *ev, size_t n);
+        "evemu_shm_publish": {
+            "argtypes": (c_void_p, c_void_p, c_size_t),
+            "restype": c_int,
+            "errcheck": expect_ge_zero
+            },
+        #int evemu_shm_read(struct evemu_shm *shm,
+        #                   const struct input_event **events, int ms);
+        "evemu_shm_read": {
+            "argtypes": (c_void_p, c_void_p, c_int),
+            "restype": c_int
+            },
+        #int evemu_shm_valid(const struct evemu_shm *shm);
+        "evemu_shm_valid": {
+            "argtypes": (c_void_p,),
+            "restype": c_int
+            },
+        #unsigned long evemu_shm_get_lost(const struct evemu_shm *shm);
+        "evemu_shm_get_lost": {
+            "argtypes": (c_void_p,),
+            "restype": c_ulong
+            },
+        #int evemu_context_record_shm(struct evemu_context *ctx,
+        #                             struct evemu_shm *shm, int fd, int ms);
+        "evemu_context_record_shm": {
+            "argtypes": (c_void_p, c_void_p, c_int, c_int),
+            "restype": c_int
+            },
+        #struct evemu_tail *evemu_tail_new(const char *path, int fd);
+        "evemu_tail_new": {
+            "argtypes": (c_char_p, c_int),
+            "restype": c_void_p,
+            "errcheck": expect_not_none
+            },
+        #void evemu_tail_delete(struct evemu_tail *tail);
+        "evemu_tail_delete": {
+            "argtypes": (c_void_p,),
+            "restype": None
+            },
+        #int evemu_tail_read_event(struct evemu_tail *tail,
+        #                          struct input_event *ev, int ms);
+        "evemu_tail_read_event": {
+            "argtypes": (c_void_p, c_void_p, c_int),
+            "restype": c_int
+            },
+        #const char *evemu_tail_get_filename(const struct evemu_tail *tail);
+        "evemu_tail_get_filename": {
+            "argtypes": (c_void_p,),
+            "restype": c_char_p
+            },
+        #struct evemu_device_list *evemu_device_list_new(const char *path);
+        "evemu_device_list_new": {
+            "argtypes": (c_char_p,),
+            "restype": c_void_p,
+            "errcheck": expect_not_none
+            },
+        #void evemu_device_list_delete(struct evemu_device_list *list);
+        "evemu_device_list_delete": {
+            "argtypes": (c_void_p,),
+            "restype": None
+            },
+        #int evemu_device_list_update(struct evemu_device_list *list);
+        "evemu_device_list_update": {
+            "argtypes": (c_void_p,),
+            "restype": c_int,
+            "errcheck": expect_ge_zero
+            },
+        #size_t evemu_device_list_get_count(const struct evemu_device_list *list);
+        "evemu_device_list_get_count": {
+            "argtypes": (c_void_p,),
+            "restype": c_size_t
+            },
+        #const char *evemu_device_list_get_devnode(const struct evemu_device_list *list,
+        #                                          size_t index);
+        "evemu_device_list_get_devnode": {
+            "argtypes": (c_void_p, c_size_t),
+            "restype": c_char_p
+            },
+        #const struct evemu_device *
+        #evemu_device_list_get_device(const struct evemu_device_list *list,
+        #                             size_t index);
+        "evemu_device_list_get_device": {
+            "argtypes": (c_void_p, c_size_t),
+            "restype": c_void_p
+            },
+        #struct evemu_node_watch *evemu_node_watch_new(void);
+        "evemu_node_watch_new": {
+            "argtypes": (),
+            "restype": c_void_p,
+            "errcheck": expect_not_none
+            },
+        #void evemu_node_watch_delete(struct evemu_node_watch *watch);
+        "evemu_node_watch_delete": {
+            "argtypes": (c_void_p,),
+            "restype": None
+            },
+        #int evemu_node_watch_add(struct evemu_node_watch *watch,
+        #                         const char *devnode, int flags);
+        "evemu_node_watch_add": {
+            "argtypes": (c_void_p, c_char_p, c_int),
+            "restype": c_int,
+            "errcheck": expect_eq_zero
+            },
+        #int evemu_node_watch_get_fd(const struct evemu_node_watch *watch);
+        "evemu_node_watch_get_fd": {
+            "argtypes": (c_void_p,),
+            "restype": c_int
+            },
+        #int evemu_node_watch_dispatch(struct evemu_node_watch *watch);
+        "evemu_node_watch_dispatch": {
+            "argtypes": (c_void_p,),
+            "restype": c_int,
+            "errcheck": expect_ge_zero
+            },
+        #int evemu_node_watch_wait(struct evemu_node_watch *watch, int ms);
+        "evemu_node_watch_wait": {
+            "argtypes": (c_void_p, c_int),
+            "restype": c_int
+            },
         #int evemu_create(struct evemu_device *dev, int fd);
         "evemu_create": {
             "argtypes": (c_void_p, c_int),
@@ -445,6 +856,11 @@ class LibEvemu(LibraryWrapper):
             "restype": c_int,
             "errcheck": expect_eq_zero
             },
+        #const char *evemu_get_devnode(struct evemu_device *dev);
+        "evemu_get_devnode": {
+            "argtypes": (c_void_p,),
+            "restype": c_char_p
+            },
         #void evemu_destroy(struct evemu_device *dev);
         "evemu_destroy": {
             "argtypes": (c_void_p,),
@@ -458,3 +874,56 @@ class InputEvent(ctypes.Structure):
 		("type", c_uint16),
 		("code", c_uint16),
 		("value", c_int32)]
+
+EVEMU_STATS_OVERSHOOT_BUCKETS = 16
+
+class Stats(ctypes.Structure):
+    _fields_ = [("events_read", c_ulong),
+                ("events_written", c_ulong),
+                ("parse_failures", c_ulong),
+                ("read_calls", c_ulong),
+                ("write_calls", c_ulong),
+                ("write_errors", c_ulong),
+                ("short_writes", c_ulong),
+                ("syn_dropped", c_ulong),
+                ("sleeps", c_ulong),
+                ("sleep_overshoot", c_ulong * EVEMU_STATS_OVERSHOOT_BUCKETS),
+                ("max_overshoot_us", c_ulong),
+                ("parse_ns", c_ulonglong),
+                ("sleep_ns", c_ulonglong),
+                ("write_ns", c_ulonglong)]
+
+EVEMU_LATENCY_BUCKETS = 20
+EVEMU_LATENCY_STALLS = 16
+
+class LatencyStall(ctypes.Structure):
+    _fields_ = [("time", c_long),
+                ("latency_us", c_ulong)]
+
+class Latency(ctypes.Structure):
+    _fields_ = [("frames", c_ulong),
+                ("histogram", c_ulong * EVEMU_LATENCY_BUCKETS),
+                ("max_us", c_ulong),
+                ("total_us", c_ulonglong),
+                ("skewed", c_ulong),
+                ("stalls", c_ulong),
+                ("stall", LatencyStall * EVEMU_LATENCY_STALLS)]
+
+
+def _load_accelerator():
+    """
+    Returns the compiled evemu._speedups module or None if it is not
+    built or disabled with EVEMU_NO_ACCELERATOR in the environment.
+    """
+    if os.environ.get("EVEMU_NO_ACCELERATOR"):
+        return None
+    try:
+        import evemu._speedups
+    except ImportError:
+        return None
+    return evemu._speedups
+
+# The compiled fast paths for reading, formatting and writing events and
+# for device capabilities, or None. Callers fall back to the ctypes API
+# calls above if this is None; both behave the same.
+accelerator = _load_accelerator()
@@ -0,0 +1,181 @@
+"""
+The client module talks to evemu-daemon, which keeps virtual devices alive
+across processes:
+
+    client = Client()
+    device = client.create("touchpad.prop")
+    device.send([("EV_KEY", "BTN_LEFT", 1), ("EV_SYN", "SYN_REPORT", 0)])
+    device.play("tap.events")
+
+Devices created through a Client belong to the daemon and outlive the
+connection; they are only destroyed by destroy() or when the daemon exits.
+See evemu-daemon(1) for the protocol.
+"""
+
+import os
+import socket
+
+import evemu
+import evemu.exception
+
+__all__ = ["RemoteDevice",
+           "Client",
+           "default_socket"]
+
+
+def default_socket():
+    """
+    The socket evemu-daemon listens on by default.
+    """
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return os.path.join(runtime_dir, "evemu.socket")
+    return "/run/evemu.socket"
+
+
+class RemoteDevice(object):
+    """
+    A device held by evemu-daemon.
+
+    id -- the daemon's id of the device
+    devnode -- the device node
+    name -- the device name, if known
+    """
+
+    def __init__(self, client, id, devnode, name=None):
+        self._client = client
+        self.id = id
+        self.devnode = devnode
+        self.name = name
+
+    def send(self, events):
+        """
+        See Client.send().
+        """
+        return self._client.send(self, events)
+
+    def play(self, events_file):
+        """
+        See Client.play().
+        """
+        self._client.play(self, events_file)
+
+    def destroy(self):
+        """
+        See Client.destroy().
+        """
+        self._client.destroy(self)
+
+    def __repr__(self):
+        return "RemoteDevice(%d, %r)" % (self.id, self.devnode)
+
+
+def _lines(f):
+    if isinstance(f, str):
+        with open(f) as fp:
+            return fp.read().splitlines()
+    return f.read().splitlines()
+
+
+def _format_event(e):
+    if isinstance(e, evemu.InputEvent):
+        return "%d %d %d" % (e.type, e.code, e.value)
+    if isinstance(e, str):
+        return e.strip()
+    return " ".join(str(x) for x in e)
+
+
+class Client(object):
+    """
+    A connection to evemu-daemon. A Client may be used from one thread at a
+    time; use one Client per thread to run commands concurrently.
+    """
+
+    def __init__(self, path=None):
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self._socket.connect(path or default_socket())
+        except socket.error:
+            self._socket.close()
+            raise
+        self._file = self._socket.makefile("rwb")
+
+    def close(self):
+        self._file.close()
+        self._socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _command(self, command, payload=()):
+        data = [command] + list(payload)
+        self._file.write(("\n".join(data) + "\n").encode("utf-8"))
+        self._file.flush()
+        return self._reply()
+
+    def _reply(self):
+        line = self._file.readline().decode("utf-8").rstrip("\n")
+        if not line:
+            raise evemu.exception.DaemonError(0, "connection closed")
+        status, _, args = line.partition(" ")
+        if status == "OK":
+            return args
+        if status == "ERR":
+            err, _, message = args.partition(" ")
+            raise evemu.exception.DaemonError(int(err), message)
+        raise evemu.exception.DaemonError(0, "unexpected reply %r" % line)
+
+    def _id(self, device):
+        return device.id if isinstance(device, RemoteDevice) else int(device)
+
+    def create(self, prop_file):
+        """
+        Creates a device from a description, a file name or a file object,
+        and returns a RemoteDevice.
+        """
+        lines = _lines(prop_file)
+        reply = self._command("CREATE %d" % len(lines), lines)
+        id, _, devnode = reply.partition(" ")
+        return RemoteDevice(self, int(id), devnode)
+
+    def devices(self):
+        """
+        Returns a RemoteDevice for each device held by the daemon.
+        """
+        count = int(self._command("LIST"))
+        result = []
+        for _ in range(count):
+            line = self._file.readline().decode("utf-8").rstrip("\n")
+            id, devnode, name = line.split(" ", 2)
+            result.append(RemoteDevice(self, int(id), devnode, name))
+        return result
+
+    def send(self, device, events):
+        """
+        Writes events to the device, a RemoteDevice or id, in one batch.
+        events may be InputEvents, (type, code, value) tuples with names
+        or numbers, or "E:" lines. Frames must be terminated with a
+        SYN_REPORT explicitly. Returns the number of events written.
+        """
+        lines = [_format_event(e) for e in events]
+        return int(self._command("SEND %d %d" % (self._id(device),
+                                                 len(lines)), lines))
+
+    def play(self, device, events_file):
+        """
+        Replays the recording events_file in realtime and returns once it
+        has been replayed. events_file is a file name or a file object
+        with a name; it is opened by the daemon.
+        """
+        path = getattr(events_file, "name", events_file)
+        self._command("PLAY %d %s" % (self._id(device),
+                                      os.path.abspath(path)))
+
+    def destroy(self, device):
+        """
+        Destroys the device, a RemoteDevice or id.
+        """
+        self._command("DESTROY %d" % self._id(device))
@@ -0,0 +1,304 @@
+"""
+The compare module walks two evemu recordings in lockstep, one frame at a
+time, and reports where they diverge.
+
+Only the current frame of each recording is held in memory, so arbitrarily
+long recordings can be compared.
+"""
+
+import ctypes
+import os
+
+import evemu
+import evemu.base
+
+__all__ = ["Divergence",
+           "ComparisonResult",
+           "compare",
+           "resolve_event"]
+
+_EV_SYN = 0x00
+_SYN_REPORT = 0x00
+_EV_MAX = 0x1f
+
+
+def resolve_event(name):
+    """
+    Return a (type, code) tuple for the given event name. name may be an
+    event type ("EV_MSC"), in which case code is None, an event code
+    ("MSC_TIMESTAMP"), a "EV_MSC:MSC_TIMESTAMP" pair or a (type, code)
+    tuple of ints or strings.
+
+    Raises ValueError if the name cannot be resolved.
+    """
+    if isinstance(name, tuple):
+        event_type, event_code = name
+        t = evemu.event_get_value(event_type)
+        c = evemu.event_get_value(t, event_code) if t is not None else None
+        if c is None:
+            raise ValueError("unknown event %r" % (name,))
+        return (t, c)
+
+    name = str(name)
+    if ":" in name:
+        return resolve_event(tuple(name.split(":", 1)))
+
+    t = evemu.event_get_value(name)
+    if t is not None:
+        return (t, None)
+
+    for t in range(_EV_MAX + 1):
+        c = evemu.event_get_value(t, name)
+        if c is not None:
+            return (t, c)
+
+    raise ValueError("unknown event %r" % (name,))
+
+
+def _read_events(events_file):
+    """
+    Yields (time in us, type, code, value) tuples from the given file.
+    """
+    if isinstance(events_file, str):
+        with open(events_file) as f:
+            for e in _read_events(f):
+                yield e
+        return
+
+    if not hasattr(events_file, "fileno"):
+        raise TypeError("expected file")
+
+    libc = evemu.base.LibC()
+    libevemu = evemu.base.LibEvemu()
+    fs = libc.fdopen(os.dup(events_file.fileno()), b"r")
+    try:
+        event = evemu.base.InputEvent()
+        while libevemu.evemu_read_event(fs, ctypes.byref(event)) > 0:
+            yield (event.sec * 1000000 + event.usec,
+                   event.type, event.code, event.value)
+    finally:
+        libc.fclose(fs)
+
+
+def _read_frames(events_file, ignore):
+    """
+    Yields (time in us, [(type, code, value), ...]) for each frame, with
+    the time being that of the terminating SYN_REPORT. Ignored events are
+    dropped, the SYN_REPORT itself is not part of the event list.
+    """
+    frame = []
+    for (time, t, c, v) in _read_events(events_file):
+        if t == _EV_SYN and c == _SYN_REPORT:
+            yield (time, frame)
+            frame = []
+        elif t not in ignore and (t, c) not in ignore:
+            frame.append((t, c, v))
+
+    if frame:
+        yield (time, frame)
+
+
+class Divergence(object):
+    """
+    Describes a frame where the two recordings differ.
+
+    frame -- the index of the frame (0-based)
+    reason -- a human-readable description of the difference
+    expected -- the expected frame as (time, [(type, code, value), ...]),
+                or None if the expected recording ended early
+    actual -- the actual frame, in the same format as expected
+    """
+    __slots__ = 'frame', 'reason', 'expected', 'actual'
+
+    def __init__(self, frame, reason, expected, actual):
+        self.frame = frame
+        self.reason = reason
+        self.expected = expected
+        self.actual = actual
+
+    def __str__(self):
+        return "frame %d: %s" % (self.frame, self.reason)
+
+
+class ComparisonResult(object):
+    """
+    Summary of a comparison between two recordings.
+    """
+
+    def __init__(self):
+        self.frames = 0
+        self.events = 0
+        self.divergent_frames = 0
+        self.first_divergence = None
+        self.max_time_delta = 0
+        self._time_delta_sum = 0
+
+    @property
+    def matches(self):
+        """
+        True if no divergence was found.
+        """
+        return self.first_divergence is None
+
+    @property
+    def mean_time_delta(self):
+        """
+        The mean absolute timestamp difference across all compared frames
+        in microseconds.
+        """
+        if self.frames == 0:
+            return 0
+        return self._time_delta_sum / float(self.frames)
+
+    def __bool__(self):
+        return self.matches
+
+    __nonzero__ = __bool__
+
+    def __str__(self):
+        lines = ["frames compared: %d" % self.frames,
+                 "events compared: %d" % self.events,
+                 "divergent frames: %d" % self.divergent_frames,
+                 "max time delta: %dus" % self.max_time_delta,
+                 "mean time delta: %.1fus" % self.mean_time_delta]
+        if self.first_divergence is not None:
+            lines.append("first divergence: %s" % self.first_divergence)
+        return "\n".join(lines)
+
+
+def _compare_frame(expected, actual, value_tolerance):
+    """
+    Returns None if the frames' events match, or a string describing the
+    first difference.
+    """
+    if len(expected) != len(actual):
+        return "expected %d events, got %d" % (len(expected), len(actual))
+
+    for (e, a) in zip(expected, actual):
+        if e[0] != a[0] or e[1] != a[1]:
+            return "expected %s %s, got %s %s" % (
+                    evemu.event_get_name(e[0]),
+                    evemu.event_get_name(e[0], e[1]),
+                    evemu.event_get_name(a[0]),
+                    evemu.event_get_name(a[0], a[1]))
+        tolerance = value_tolerance.get((e[0], e[1]),
+                                        value_tolerance.get(e[0], 0))
+        if abs(e[2] - a[2]) > tolerance:
+            return "%s value %d differs from %d by more than %d" % (
+                    evemu.event_get_name(a[0], a[1]), a[2], e[2], tolerance)
+
+    return None
+
+
+def compare(expected, actual, time_tolerance=0, value_tolerance=None,
+            ignore=None, stop_at_first=False):
+    """
+    Compares two recordings frame by frame and returns a ComparisonResult.
+
+    expected and actual may be file names or file objects with fileno().
+    Timestamps are compared relative to the first frame of each recording.
+
+    args:
+    time_tolerance -- the maximum allowed timestamp difference in
+    microseconds
+    value_tolerance -- a dict mapping event codes to the maximum allowed
+    value difference, e.g. {"ABS_X": 10}. Keys may be anything accepted by
+    resolve_event(); a type applies to all codes of that type.
+    ignore -- a sequence of event types or codes to skip, e.g.
+    ["MSC_TIMESTAMP"]
+    stop_at_first -- stop at the first divergence instead of comparing the
+    remainder of the recordings
+    """
+    tolerances = {}
+    for (name, tolerance) in (value_tolerance or {}).items():
+        (t, c) = resolve_event(name)
+        tolerances[t if c is None else (t, c)] = tolerance
+
+    ignored = set()
+    for name in (ignore or []):
+        (t, c) = resolve_event(name)
+        ignored.add(t if c is None else (t, c))
+
+    result = ComparisonResult()
+    lhs = _read_frames(expected, ignored)
+    rhs = _read_frames(actual, ignored)
+    lhs_start = rhs_start = None
+
+    while True:
+        e = next(lhs, None)
+        a = next(rhs, None)
+        if e is None and a is None:
+            break
+
+        reason = None
+        if e is None:
+            reason = "expected recording ended early"
+        elif a is None:
+            reason = "actual recording ended early"
+        else:
+            if lhs_start is None:
+                lhs_start, rhs_start = e[0], a[0]
+            delta = abs((e[0] - lhs_start) - (a[0] - rhs_start))
+            result.max_time_delta = max(result.max_time_delta, delta)
+            result._time_delta_sum += delta
+            result.events += len(e[1])
+
+            reason = _compare_frame(e[1], a[1], tolerances)
+            if reason is None and delta > time_tolerance:
+                reason = "timestamp differs by %dus" % delta
+
+        if reason is not None:
+            result.divergent_frames += 1
+            if result.first_divergence is None:
+                result.first_divergence = Divergence(result.frames, reason,
+                                                     e, a)
+        result.frames += 1
+
+        if reason is not None and (stop_at_first or e is None or a is None):
+            break
+
+    return result
+
+
+def _parse_tolerance(arg):
+    name, _, value = arg.rpartition("=")
+    if not name:
+        raise ValueError("expected <event>=<tolerance>, got %r" % arg)
+    return (name, int(value))
+
+
+def main(args=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(
+            prog="python -m evemu.compare",
+            description="Compare two evemu recordings frame by frame.")
+    parser.add_argument("expected", help="the reference recording")
+    parser.add_argument("actual", help="the recording to check")
+    parser.add_argument("--time-tolerance", type=int, default=0,
+                        metavar="US",
+                        help="maximum timestamp difference in microseconds")
+    parser.add_argument("--tolerance", action="append", default=[],
+                        type=_parse_tolerance, metavar="EVENT=N",
+                        help="maximum value difference for an event type "
+                             "or code, e.g. ABS_X=10")
+    parser.add_argument("--ignore", action="append", default=[],
+                        metavar="EVENT",
+                        help="event type or code to ignore, "
+                             "e.g. MSC_TIMESTAMP")
+    parser.add_argument("--stop-at-first", action="store_true",
+                        help="stop at the first divergent frame")
+    args = parser.parse_args(args)
+
+    result = compare(args.expected, args.actual,
+                     time_tolerance=args.time_tolerance,
+                     value_tolerance=dict(args.tolerance),
+                     ignore=args.ignore,
+                     stop_at_first=args.stop_at_first)
+    print(result)
+    return 0 if result.matches else 1
+
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main())
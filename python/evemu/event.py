@@ -0,0 +1,240 @@
+"""
+The event module writes events to a device node, the Python counterpart
+of evemu-event --stdin:
+
+    with EventWriter("/dev/input/event5") as writer:
+        writer.write("EV_KEY", "KEY_A", 1)
+        writer.sync()
+        writer.write("EV_KEY", "KEY_A", 0)
+        writer.sync()
+
+Events are queued and written in batches, with one write per batch, so
+sequences of events do not pay a system call per event.
+"""
+
+import os
+import select
+import struct
+import time
+
+import evemu
+import evemu.base
+
+__all__ = ["EventWriter",
+           "parse_line",
+           "play_lines"]
+
+_EV_SYN = 0x00
+_SYN_REPORT = 0x00
+
+_EVENT_FORMAT = "llHHi"
+_EVENT_SIZE = struct.calcsize(_EVENT_FORMAT)
+_BATCH_SIZE = 64
+
+
+def _now():
+    return time.clock_gettime(time.CLOCK_MONOTONIC)
+
+
+def _resolve(event_type, event_code):
+    """
+    Returns (type, code) as ints for names or numbers, or raises
+    ValueError.
+    """
+    t = event_type
+    if not isinstance(t, int):
+        t = evemu.event_get_value(t)
+        if t is None:
+            t = int(event_type, 0)
+    c = event_code
+    if not isinstance(c, int):
+        c = evemu.event_get_value(t, c)
+        if c is None:
+            c = int(event_code, 0)
+    return (t, c)
+
+
+def parse_line(line):
+    """
+    Parses "<type> <code> <value>", with names or numbers, or an "E:" line
+    into (time in us or None, type, code, value). Returns None for blank
+    and comment lines and raises ValueError for invalid lines.
+    """
+    line = line.strip()
+    if not line or line.startswith("#"):
+        return None
+
+    fields = line.split()
+    if fields[0] == "E:":
+        if len(fields) < 5:
+            raise ValueError("invalid event %r" % line)
+        (sec, _, usec) = fields[1].partition(".")
+        return (int(sec) * 1000000 + int(usec), int(fields[2], 16),
+                int(fields[3], 16), int(fields[4]))
+
+    if len(fields) != 3:
+        raise ValueError("invalid event %r" % line)
+    (t, c) = _resolve(fields[0], fields[1])
+    return (None, t, c, int(fields[2], 0))
+
+
+class EventWriter(object):
+    """
+    Writes events to a device node in batches. device is a device node
+    path or a file descriptor opened for writing; a file descriptor is not
+    closed by close().
+    """
+
+    def __init__(self, device):
+        if isinstance(device, int):
+            self._fd = device
+            self._owned = False
+        else:
+            self._fd = os.open(device, os.O_WRONLY)
+            self._owned = True
+        self._batch = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, event_type, event_code, value):
+        """
+        Queues an event. The type and code may be names or numbers. The
+        batch is written once it is full.
+        """
+        (t, c) = _resolve(event_type, event_code)
+        self._batch.append((t, c, value))
+        if len(self._batch) >= _BATCH_SIZE:
+            self.flush()
+
+    def sync(self):
+        """
+        Queues a SYN_REPORT.
+        """
+        self.write(_EV_SYN, _SYN_REPORT, 0)
+
+    def flush(self):
+        """
+        Writes the queued events.
+        """
+        if not self._batch:
+            return
+        batch = self._batch
+        self._batch = []
+        size = len(batch) * _EVENT_SIZE
+        accelerator = evemu.base.accelerator
+        if accelerator is not None:
+            written = accelerator.write_events(self._fd, batch)
+        else:
+            data = b"".join(struct.pack(_EVENT_FORMAT, 0, 0, t, c, v)
+                            for (t, c, v) in batch)
+            written = os.write(self._fd, data)
+        if written < size:
+            raise IOError("short write to device (%d of %d bytes)" %
+                          (written, size))
+
+    def close(self):
+        """
+        Writes the queued events and closes the device node if it was
+        opened by this EventWriter.
+        """
+        if self._fd is None:
+            return
+        try:
+            self.flush()
+        finally:
+            if self._owned:
+                os.close(self._fd)
+            self._fd = None
+
+
+def play_lines(writer, lines, sync=False, timed=False, delay=0):
+    """
+    Writes the events from lines, see parse_line(), to the EventWriter.
+
+    args:
+    sync -- write a SYN_REPORT after each event that is not an EV_SYN
+    event itself
+    timed -- write the events of "E:" lines at the time of their
+    timestamp, relative to the first "E:" line
+    delay -- wait delay seconds after each SYN_REPORT
+
+    Returns the number of events read from lines.
+    """
+    start = _now()
+    first = None
+    next_frame = start
+    count = 0
+
+    for line in lines:
+        event = parse_line(line)
+        if event is None:
+            continue
+        (usec, t, c, v) = event
+        count += 1
+
+        if timed and usec is not None:
+            if first is None:
+                first = usec
+            writer.flush()
+            wait = start + (usec - first) / 1e6 - _now()
+            if wait > 0:
+                time.sleep(wait)
+
+        writer.write(t, c, v)
+        if sync and t != _EV_SYN:
+            writer.sync()
+
+        if delay > 0 and (sync or (t == _EV_SYN and c == _SYN_REPORT)):
+            writer.flush()
+            next_frame += delay
+            wait = next_frame - _now()
+            if wait > 0:
+                time.sleep(wait)
+
+    writer.flush()
+    return count
+
+
+def _unbuffered_lines(f, writer):
+    # flush whenever the input would block, so interactive input is not
+    # held back by the batching
+    for line in iter(f.readline, ""):
+        yield line
+        if not select.select([f], [], [], 0)[0]:
+            writer.flush()
+
+
+def main(args=None):
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(
+            prog="python -m evemu.event",
+            description="Write the events read from stdin to a device, "
+                        "one event per line.")
+    parser.add_argument("device", help="the device node")
+    parser.add_argument("--sync", action="store_true",
+                        help="write a SYN_REPORT after each event")
+    parser.add_argument("--timed", action="store_true",
+                        help="honour the timestamps of E: lines")
+    parser.add_argument("--delay", type=float, default=0, metavar="MS",
+                        help="wait after each SYN_REPORT")
+    args = parser.parse_args(args)
+
+    with EventWriter(args.device) as writer:
+        try:
+            play_lines(writer, _unbuffered_lines(sys.stdin, writer),
+                       sync=args.sync, timed=args.timed,
+                       delay=args.delay / 1000.0)
+        except ValueError as e:
+            parser.exit(1, "error: %s\n" % e)
+    return 0
+
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main())
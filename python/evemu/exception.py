@@ -18,5 +18,13 @@ class NullFileHandleError(EvEmuError):
     pass
 
 
+class DevnodeTimeoutError(EvEmuError):
+    pass
+
+
+class DaemonError(EvEmuError):
+    pass
+
+
 class SkipTest(Exception):
     pass
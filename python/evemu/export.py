@@ -0,0 +1,400 @@
+"""
+The export module converts evemu recordings into columnar files for
+analysis with NumPy, pandas or Arrow-based tools.
+
+The events table has one row per event with the columns time (int64,
+microseconds), type (uint16), code (uint16) and value (int32). The
+optional touches table has one row per active touch per frame with the
+columns frame, time, slot, tracking_id, x, y, pressure and touch_major,
+derived from the multitouch events. The device name, ids and absinfo are
+stored as metadata.
+
+Supported formats, chosen by the file extension:
+
+    .npz        one .npy array per column, the touch columns prefixed
+                with touch_, an absinfo array and metadata.json
+    .csv        the events; the touches and metadata are written to
+                <name>.touches.csv and <name>.json
+    .arrow      an Arrow IPC file with the metadata in the schema, the
+                touches in <name>.touches.arrow (requires pyarrow)
+    .parquet    as .arrow, but Parquet (requires pyarrow)
+
+The recording is converted in chunks, so memory use does not depend on
+the length of the recording. NPZ and CSV files are written with the
+standard library only and can be read with numpy.load() and
+pandas.read_csv().
+"""
+
+import array
+import csv
+import json
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import zipfile
+
+import evemu
+import evemu.exception
+import evemu.index
+
+__all__ = ["FORMATS",
+           "export"]
+
+_EV_SYN = 0x00
+_EV_ABS = 0x03
+_SYN_REPORT = 0x00
+_SYN_MT_REPORT = 0x02
+_ABS_MT_FIRST = 0x30
+_ABS_MT_SLOT = 0x2f
+_ABS_MT_TRACKING_ID = 0x39
+_ABS_MT_LAST = 0x3f
+
+# touch column -> ABS_MT code
+_TOUCH_AXES = (("tracking_id", _ABS_MT_TRACKING_ID),
+               ("x", 0x35),
+               ("y", 0x36),
+               ("pressure", 0x3a),
+               ("touch_major", 0x30))
+
+# the value of a touch column if the axis was never set
+_DEFAULTS = {_ABS_MT_TRACKING_ID: -1}
+
+_EVENT_COLUMNS = (("time", "q"), ("type", "H"), ("code", "H"),
+                  ("value", "i"))
+_TOUCH_COLUMNS = (("frame", "q"), ("time", "q"), ("slot", "i")) + tuple(
+        (name, "i") for (name, _) in _TOUCH_AXES)
+
+_DTYPES = {"q": "i8", "H": "u2", "i": "i4"}
+
+FORMATS = ("npz", "csv", "arrow", "parquet")
+
+
+class _CsvWriter(object):
+
+    def __init__(self, path, touches, metadata):
+        (stem, _) = os.path.splitext(path)
+        self.paths = [path]
+        self._files = {"events": open(path, "w")}
+        if touches:
+            self._files["touches"] = open(stem + ".touches.csv", "w")
+            self.paths.append(stem + ".touches.csv")
+        self._writers = {}
+        for (table, columns) in (("events", _EVENT_COLUMNS),
+                                 ("touches", _TOUCH_COLUMNS)):
+            if table in self._files:
+                writer = csv.writer(self._files[table], lineterminator="\n")
+                writer.writerow([name for (name, _) in columns])
+                self._writers[table] = writer
+        with open(stem + ".json", "w") as f:
+            json.dump(metadata, f, indent=1, sort_keys=True)
+        self.paths.append(stem + ".json")
+
+    def write(self, table, columns):
+        self._writers[table].writerows(zip(*columns))
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+
+
+def _npy_header(typecode, shape):
+    """
+    Returns a version 1.0 .npy header for an array of the given shape.
+    """
+    order = "<" if sys.byteorder == "little" else ">"
+    header = "{'descr': '%s%s', 'fortran_order': False, 'shape': (%s), }" % (
+            order, _DTYPES[typecode],
+            "".join("%d," % n for n in shape))
+    # magic, version and length take 10 bytes, the data is 64-byte aligned
+    header += " " * (63 - (10 + len(header)) % 64) + "\n"
+    return (b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) +
+            header.encode("latin1"))
+
+
+class _NpzWriter(object):
+    """
+    Spools each column to a temporary file and assembles the .npz
+    archive on close(), copying the columns in blocks.
+    """
+
+    def __init__(self, path, touches, metadata):
+        self.paths = [path]
+        self._path = path
+        self._metadata = metadata
+        self._tmpdir = tempfile.mkdtemp(dir=os.path.dirname(path) or ".")
+        self._columns = {}
+        for (table, columns) in (("events", _EVENT_COLUMNS),
+                                 ("touches", _TOUCH_COLUMNS)):
+            if table == "touches" and not touches:
+                continue
+            prefix = "touch_" if table == "touches" else ""
+            self._columns[table] = [
+                    (prefix + name, typecode,
+                     open(os.path.join(self._tmpdir, prefix + name), "wb"))
+                    for (name, typecode) in columns]
+        self._rows = dict((table, 0) for table in self._columns)
+
+    def write(self, table, columns):
+        for ((_, _, f), column) in zip(self._columns[table], columns):
+            column.tofile(f)
+        self._rows[table] += len(columns[0])
+
+    def close(self):
+        try:
+            with zipfile.ZipFile(self._path, "w", zipfile.ZIP_STORED,
+                                 allowZip64=True) as archive:
+                for (table, columns) in self._columns.items():
+                    for (name, typecode, f) in columns:
+                        f.close()
+                        self._add(archive, name, typecode,
+                                  (self._rows[table],), f.name)
+
+                absinfo = array.array("i")
+                for a in self._metadata["absinfo"]:
+                    absinfo.extend([a["code"], a["minimum"], a["maximum"],
+                                    a["fuzz"], a["flat"], a["resolution"]])
+                archive.writestr("absinfo.npy",
+                                 _npy_header("i", (len(absinfo) // 6, 6)) +
+                                 absinfo.tobytes())
+                archive.writestr("metadata.json",
+                                 json.dumps(self._metadata, indent=1,
+                                            sort_keys=True))
+        finally:
+            shutil.rmtree(self._tmpdir)
+
+    def _add(self, archive, name, typecode, shape, path):
+        with archive.open(name + ".npy", "w", force_zip64=True) as dst:
+            dst.write(_npy_header(typecode, shape))
+            with open(path, "rb") as src:
+                shutil.copyfileobj(src, dst, 1 << 20)
+
+
+class _ArrowWriter(object):
+
+    def __init__(self, path, touches, metadata, parquet=False):
+        try:
+            import pyarrow
+            if parquet:
+                import pyarrow.parquet
+        except ImportError:
+            raise evemu.exception.ExecutionError(
+                    "writing %s files requires pyarrow" %
+                    ("Parquet" if parquet else "Arrow"))
+
+        self._pa = pyarrow
+        (stem, ext) = os.path.splitext(path)
+        self.paths = [path]
+        self._writers = {}
+        self._schemas = {}
+        types = {"q": pyarrow.int64(), "H": pyarrow.uint16(),
+                 "i": pyarrow.int32()}
+        for (table, columns) in (("events", _EVENT_COLUMNS),
+                                 ("touches", _TOUCH_COLUMNS)):
+            if table == "touches":
+                if not touches:
+                    continue
+                path = stem + ".touches" + ext
+                self.paths.append(path)
+            schema = pyarrow.schema(
+                    [(name, types[typecode]) for (name, typecode) in columns],
+                    metadata={"evemu": json.dumps(metadata)})
+            if parquet:
+                writer = pyarrow.parquet.ParquetWriter(path, schema)
+            else:
+                writer = pyarrow.ipc.new_file(path, schema)
+            self._writers[table] = writer
+            self._schemas[table] = schema
+
+    def write(self, table, columns):
+        pa = self._pa
+        schema = self._schemas[table]
+        arrays = [pa.Array.from_buffers(field.type, len(column),
+                                        [None, pa.py_buffer(column)])
+                  for (field, column) in zip(schema, columns)]
+        batch = pa.RecordBatch.from_arrays(arrays, schema=schema)
+        if hasattr(self._writers[table], "write_batch"):
+            self._writers[table].write_batch(batch)
+        else:
+            self._writers[table].write_table(pa.Table.from_batches([batch]))
+
+    def close(self):
+        for writer in self._writers.values():
+            writer.close()
+
+
+def _open_writer(path, format, touches, metadata):
+    if format == "npz":
+        return _NpzWriter(path, touches, metadata)
+    if format == "csv":
+        return _CsvWriter(path, touches, metadata)
+    if format in ("arrow", "parquet"):
+        return _ArrowWriter(path, touches, metadata,
+                            parquet=(format == "parquet"))
+    raise ValueError("unknown format %r, expected one of %s" % (
+        format, ", ".join(FORMATS)))
+
+
+class _Table(object):
+    """
+    Column buffers that are flushed to the writer every chunk_size rows.
+    """
+
+    def __init__(self, name, columns, chunk_size):
+        self.name = name
+        self.rows = 0
+        self._typecodes = [typecode for (_, typecode) in columns]
+        self._chunk_size = chunk_size
+        self._reset()
+
+    def _reset(self):
+        self.columns = [array.array(t) for t in self._typecodes]
+
+    def append(self, writer, row):
+        for (column, value) in zip(self.columns, row):
+            column.append(value)
+        self.rows += 1
+        if len(self.columns[0]) >= self._chunk_size:
+            self.flush(writer)
+
+    def flush(self, writer):
+        if len(self.columns[0]):
+            writer.write(self.name, self.columns)
+            self._reset()
+
+
+def _read_events(recording, header):
+    """
+    Yields (time in us, type, code, value) for each event in the recording,
+    filling in the name, ids and absinfo in header as the description is
+    read.
+    """
+    for (tag, value) in evemu.index.read_recording(recording):
+        if tag == "E:":
+            yield value
+        elif tag == "N:":
+            header["name"] = value
+        elif tag == "I:":
+            header["ids"] = value
+        elif tag == "A:":
+            header["absinfo"].append(value)
+
+
+def _chain(first, rest):
+    if first is not None:
+        yield first
+    for e in rest:
+        yield e
+
+
+def _metadata(header):
+    return {"name": header.get("name"),
+            "bustype": header["ids"][0],
+            "vendor": header["ids"][1],
+            "product": header["ids"][2],
+            "version": header["ids"][3],
+            "absinfo": [dict(zip(("code", "minimum", "maximum", "fuzz",
+                                  "flat", "resolution"), a),
+                             name=evemu.event_get_name(_EV_ABS, a[0]))
+                        for a in header["absinfo"]]}
+
+
+def export(recording, output, format=None, touches=False,
+           chunk_size=65536):
+    """
+    Converts the recording at the path recording, optionally compressed
+    with gzip or bzip2, into columnar files and returns the list of files
+    written.
+
+    args:
+    output -- the path of the events file
+    format -- one of FORMATS, by default derived from the extension of
+    output
+    touches -- also write the per-frame touch table
+    chunk_size -- the number of rows converted at a time
+    """
+    if format is None:
+        format = os.path.splitext(output)[1][1:].lower()
+    if format not in FORMATS:
+        raise ValueError("unknown format %r, expected one of %s" % (
+            format, ", ".join(FORMATS)))
+    if chunk_size <= 0:
+        raise ValueError("chunk_size must be positive")
+
+    header = {"name": None, "ids": None, "absinfo": []}
+    stream = _read_events(recording, header)
+    # the header is complete once the first event has been read
+    first = next(stream, None)
+    if header["ids"] is None:
+        raise ValueError("%s: no device description" % recording)
+
+    writer = _open_writer(output, format, touches, _metadata(header))
+    events = _Table("events", _EVENT_COLUMNS, chunk_size)
+    touch_table = _Table("touches", _TOUCH_COLUMNS, chunk_size)
+    slot = 0
+    slots = {}
+    mt_touches = []
+    frame = 0
+
+    try:
+        for event in _chain(first, stream):
+            events.append(writer, event)
+            if not touches:
+                continue
+
+            (time, t, c, v) = event
+            if t == _EV_ABS and c == _ABS_MT_SLOT:
+                slot = v
+            elif t == _EV_ABS and _ABS_MT_FIRST <= c <= _ABS_MT_LAST:
+                slots.setdefault(slot, {})[c] = v
+            elif t == _EV_SYN and c == _SYN_MT_REPORT:
+                # protocol A: a touch per report, no state across frames
+                mt_touches.append(slots.pop(slot, {}))
+            elif t == _EV_SYN and c == _SYN_REPORT:
+                if mt_touches:
+                    active = list(enumerate(mt_touches))
+                    mt_touches = []
+                else:
+                    active = [(s, slots[s]) for s in sorted(slots)
+                              if slots[s].get(_ABS_MT_TRACKING_ID, -1) != -1]
+                for (s, state) in active:
+                    touch_table.append(writer, [frame, time, s] +
+                                       [state.get(code, _DEFAULTS.get(code, 0))
+                                        for (_, code) in _TOUCH_AXES])
+                frame += 1
+
+        events.flush(writer)
+        if touches:
+            touch_table.flush(writer)
+    finally:
+        writer.close()
+    return writer.paths
+
+
+def main(args=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(
+            prog="python -m evemu.export",
+            description="Convert an evemu recording into columnar files.")
+    parser.add_argument("recording", help="the recording to convert")
+    parser.add_argument("output", help="the output file")
+    parser.add_argument("--format", choices=FORMATS, default=None,
+                        help="the output format (default: from the "
+                             "output file extension)")
+    parser.add_argument("--touches", action="store_true",
+                        help="also write the per-frame touch table")
+    parser.add_argument("--chunk-size", type=int, default=65536,
+                        metavar="ROWS",
+                        help="rows converted at a time (default: 65536)")
+    args = parser.parse_args(args)
+
+    for path in export(args.recording, args.output, format=args.format,
+                       touches=args.touches, chunk_size=args.chunk_size):
+        print(path)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,489 @@
+"""
+The index module keeps an SQLite index of the metadata of a corpus of
+evemu recordings, so recordings can be selected without opening them:
+
+    index = Index("corpus.sqlite")
+    index.update(["recordings/"])
+    paths = index.find(props=["INPUT_PROP_BUTTONPAD"], min_touches=4)
+
+For each recording, the index holds the device name and ids, properties,
+supported event codes and axis ranges from the description, and the
+number of events per code, the duration and the maximum number of
+simultaneous touches from the events.
+
+Files are parsed in a process pool. A file whose size and modification
+time did not change since the last update is not parsed again. Files
+compressed with gzip or bzip2 are read transparently.
+"""
+
+import bz2
+import gzip
+import multiprocessing
+import os
+import sqlite3
+
+import evemu
+import evemu.compare
+
+__all__ = ["Index",
+           "read_recording"]
+
+_EV_SYN = 0x00
+_EV_KEY = 0x01
+_EV_ABS = 0x03
+_SYN_REPORT = 0x00
+_SYN_MT_REPORT = 0x02
+_ABS_MT_SLOT = 0x2f
+_ABS_MT_TRACKING_ID = 0x39
+
+# BTN_TOOL_FINGER, BTN_TOOL_DOUBLETAP, ... BTN_TOOL_QUINTTAP
+_BTN_TOOL_TOUCHES = {0x145: 1, 0x14d: 2, 0x14e: 3, 0x14f: 4, 0x148: 5}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS recordings (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL,
+    name TEXT,
+    bustype INTEGER,
+    vendor INTEGER,
+    product INTEGER,
+    version INTEGER,
+    events INTEGER,
+    frames INTEGER,
+    duration INTEGER,
+    max_touches INTEGER
+);
+CREATE TABLE IF NOT EXISTS props (
+    recording INTEGER NOT NULL REFERENCES recordings(id) ON DELETE CASCADE,
+    prop INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS capabilities (
+    recording INTEGER NOT NULL REFERENCES recordings(id) ON DELETE CASCADE,
+    type INTEGER NOT NULL,
+    code INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS absinfo (
+    recording INTEGER NOT NULL REFERENCES recordings(id) ON DELETE CASCADE,
+    code INTEGER NOT NULL,
+    minimum INTEGER,
+    maximum INTEGER,
+    fuzz INTEGER,
+    flat INTEGER,
+    resolution INTEGER
+);
+CREATE TABLE IF NOT EXISTS event_counts (
+    recording INTEGER NOT NULL REFERENCES recordings(id) ON DELETE CASCADE,
+    type INTEGER NOT NULL,
+    code INTEGER NOT NULL,
+    count INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS props_prop ON props (prop, recording);
+CREATE INDEX IF NOT EXISTS capabilities_code
+    ON capabilities (type, code, recording);
+CREATE INDEX IF NOT EXISTS event_counts_code
+    ON event_counts (type, code, recording);
+CREATE INDEX IF NOT EXISTS absinfo_recording ON absinfo (recording);
+"""
+
+
+def _open(path):
+    if path.endswith(".gz"):
+        return gzip.open(path)
+    if path.endswith(".bz2"):
+        return bz2.BZ2File(path)
+    return open(path)
+
+
+def _lines(path):
+    f = _open(path)
+    try:
+        for line in f:
+            if isinstance(line, bytes):
+                line = line.decode("iso8859-1")
+            yield line
+    finally:
+        f.close()
+
+
+def read_recording(path):
+    """
+    Parses the recording at path, which may be compressed with gzip or
+    bzip2. Yields (tag, value) for each line of the following tags, other
+    lines are skipped:
+
+    "E:" -- (time in us, type, code, value) of an event
+    "N:" -- the device name
+    "I:" -- the bustype, vendor, product and version
+    "P:", "B:" -- the list of numbers on the line
+    "A:" -- (code, minimum, maximum, fuzz, flat, resolution) of an axis
+
+    Raises ValueError or IndexError for a malformed line.
+    """
+    for line in _lines(path):
+        tag = line[:2]
+        if tag == "E:":
+            fields = line.split()
+            (sec, _, usec) = fields[1].partition(".")
+            yield (tag, (int(sec) * 1000000 + int(usec), int(fields[2], 16),
+                         int(fields[3], 16), int(fields[4])))
+        elif tag == "N:":
+            yield (tag, line[2:].strip())
+        elif tag in ("I:", "P:", "B:"):
+            yield (tag, [int(x, 16) for x in line[2:].split()])
+        elif tag == "A:":
+            fields = line[2:].split()
+            values = [int(fields[0], 16)] + [int(x) for x in fields[1:6]]
+            yield (tag, tuple((values + [0] * 6)[:6]))
+
+
+def _bits(values, offset=0):
+    for (i, byte) in enumerate(values):
+        for bit in range(8):
+            if byte & (1 << bit):
+                yield offset + i * 8 + bit
+
+
+def _scan(path):
+    """
+    Parses the recording at path. Returns a dict with its metadata, or
+    None if path is not an evemu recording.
+    """
+    info = {"name": None, "ids": None, "props": [], "capabilities": [],
+            "absinfo": [], "counts": {}, "events": 0, "frames": 0,
+            "duration": 0, "max_touches": 0}
+    offsets = {}
+    prop_offset = 0
+    first = last = None
+    counts = info["counts"]
+
+    slot = 0
+    active = set()
+    mt_reports = 0
+    tool_touches = 0
+    max_touches = 0
+
+    try:
+        for (tag, value) in read_recording(path):
+            if tag == "E:":
+                (time, t, c, v) = value
+                if first is None:
+                    first = time
+                last = time
+                info["events"] += 1
+                counts[(t, c)] = counts.get((t, c), 0) + 1
+
+                if t == _EV_SYN and c == _SYN_REPORT:
+                    info["frames"] += 1
+                    max_touches = max(max_touches, len(active), mt_reports,
+                                      tool_touches)
+                    mt_reports = 0
+                elif t == _EV_SYN and c == _SYN_MT_REPORT:
+                    mt_reports += 1
+                elif t == _EV_ABS and c == _ABS_MT_SLOT:
+                    slot = v
+                elif t == _EV_ABS and c == _ABS_MT_TRACKING_ID:
+                    if v == -1:
+                        active.discard(slot)
+                    else:
+                        active.add(slot)
+                elif t == _EV_KEY and c in _BTN_TOOL_TOUCHES:
+                    if v:
+                        tool_touches = _BTN_TOOL_TOUCHES[c]
+                    elif tool_touches == _BTN_TOOL_TOUCHES[c]:
+                        tool_touches = 0
+            elif tag == "N:":
+                info["name"] = value
+            elif tag == "I:":
+                info["ids"] = value
+            elif tag == "P:":
+                info["props"].extend(_bits(value, prop_offset))
+                prop_offset += len(value) * 8
+            elif tag == "B:":
+                t = value[0]
+                offset = offsets.get(t, 0)
+                info["capabilities"].extend((t, c) for c in
+                                            _bits(value[1:], offset))
+                offsets[t] = offset + (len(value) - 1) * 8
+            elif tag == "A:":
+                info["absinfo"].append(list(value))
+    except (IOError, OSError, ValueError, IndexError, UnicodeDecodeError,
+            EOFError):
+        return None
+
+    if info["name"] is None or info["ids"] is None or len(info["ids"]) != 4:
+        return None
+
+    if first is not None:
+        info["duration"] = last - first
+    info["max_touches"] = max_touches
+    return info
+
+
+def _scan_one(args):
+    (path, mtime, size) = args
+    return (path, mtime, size, _scan(path))
+
+
+class Index(object):
+    """
+    An SQLite index of recordings. The database is created if it does not
+    exist. An Index may be used from one thread at a time.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._db = sqlite3.connect(path)
+        self._db.execute("PRAGMA foreign_keys = ON")
+        self._db.executescript(_SCHEMA)
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self._db.execute("SELECT COUNT(*) FROM recordings "
+                                "WHERE name IS NOT NULL").fetchone()[0]
+
+    def update(self, paths, processes=None, prune=True):
+        """
+        Indexes the given files and, recursively, the files in the given
+        directories. Files that are not evemu recordings are remembered
+        as such, so they are not parsed again either.
+
+        args:
+        processes -- the size of the process pool, by default the number
+        of CPUs. With 1, files are parsed in this process.
+        prune -- remove indexed files below the given directories that no
+        longer exist
+
+        Returns a tuple (indexed, unchanged, removed) with the number of
+        files parsed, skipped and removed from the index.
+        """
+        files = {}
+        roots = []
+        # the database and its journal may be below one of the paths
+        database = os.path.abspath(self.path)
+        for path in paths:
+            path = os.path.abspath(path)
+            if os.path.isdir(path):
+                roots.append(path)
+                for (dirpath, _, filenames) in os.walk(path):
+                    for filename in filenames:
+                        filename = os.path.join(dirpath, filename)
+                        if not filename.startswith(database):
+                            files[filename] = None
+            else:
+                files[path] = None
+
+        known = dict((row[0], (row[1], row[2])) for row in
+                     self._db.execute("SELECT path, mtime, size "
+                                      "FROM recordings"))
+
+        jobs = []
+        for path in sorted(files):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if known.get(path) != (st.st_mtime, st.st_size):
+                jobs.append((path, st.st_mtime, st.st_size))
+
+        removed = 0
+        if prune:
+            for path in known:
+                if path in files or os.path.exists(path):
+                    continue
+                if any(path.startswith(root + os.sep) for root in roots):
+                    self._db.execute("DELETE FROM recordings WHERE path = ?",
+                                     (path,))
+                    removed += 1
+
+        if processes == 1 or len(jobs) < 2:
+            results = map(_scan_one, jobs)
+            self._store_all(results)
+        else:
+            pool = multiprocessing.Pool(processes)
+            try:
+                self._store_all(pool.imap_unordered(_scan_one, jobs,
+                                                    chunksize=8))
+            finally:
+                pool.close()
+                pool.join()
+
+        self._db.commit()
+        return (len(jobs), len(files) - len(jobs), removed)
+
+    def _store_all(self, results):
+        for (path, mtime, size, info) in results:
+            self._store(path, mtime, size, info)
+
+    def _store(self, path, mtime, size, info):
+        db = self._db
+        db.execute("DELETE FROM recordings WHERE path = ?", (path,))
+        if info is None:
+            db.execute("INSERT INTO recordings (path, mtime, size) "
+                       "VALUES (?, ?, ?)", (path, mtime, size))
+            return
+
+        rowid = db.execute(
+                "INSERT INTO recordings (path, mtime, size, name, bustype, "
+                "vendor, product, version, events, frames, duration, "
+                "max_touches) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [path, mtime, size, info["name"]] + info["ids"] +
+                [info["events"], info["frames"], info["duration"],
+                 info["max_touches"]]).lastrowid
+        db.executemany("INSERT INTO props VALUES (?, ?)",
+                       [(rowid, p) for p in info["props"]])
+        db.executemany("INSERT INTO capabilities VALUES (?, ?, ?)",
+                       [(rowid, t, c) for (t, c) in info["capabilities"]])
+        db.executemany("INSERT INTO absinfo VALUES (?, ?, ?, ?, ?, ?, ?)",
+                       [[rowid] + a for a in info["absinfo"]])
+        db.executemany("INSERT INTO event_counts VALUES (?, ?, ?, ?)",
+                       [(rowid, t, c, n) for ((t, c), n)
+                        in info["counts"].items()])
+
+    def find(self, name=None, vendor=None, product=None, props=(),
+             capabilities=(), events=(), min_touches=None,
+             min_duration=None, max_duration=None):
+        """
+        Returns the sorted paths of the indexed recordings matching all of
+        the given criteria.
+
+        args:
+        name, vendor, product -- the device name and ids
+        props -- input properties the device must have, as names
+        ("INPUT_PROP_BUTTONPAD") or numbers
+        capabilities -- event codes the device must support
+        events -- event codes the recording must contain
+        min_touches -- the minimum number of simultaneous touches
+        min_duration, max_duration -- the duration range in microseconds
+
+        Event codes may be anything accepted by
+        evemu.compare.resolve_event(); an event type matches any code of
+        that type.
+        """
+        where = ["name IS NOT NULL"]
+        params = []
+        for (column, value) in (("name", name), ("vendor", vendor),
+                                ("product", product)):
+            if value is not None:
+                where.append("%s = ?" % column)
+                params.append(value)
+        if min_touches is not None:
+            where.append("max_touches >= ?")
+            params.append(min_touches)
+        if min_duration is not None:
+            where.append("duration >= ?")
+            params.append(min_duration)
+        if max_duration is not None:
+            where.append("duration <= ?")
+            params.append(max_duration)
+
+        for prop in props:
+            if not isinstance(prop, int):
+                value = evemu.input_prop_get_value(prop)
+                if value is None:
+                    raise ValueError("unknown property %r" % (prop,))
+                prop = value
+            where.append("id IN (SELECT recording FROM props "
+                         "WHERE prop = ?)")
+            params.append(prop)
+
+        for (table, codes) in (("capabilities", capabilities),
+                               ("event_counts", events)):
+            for code in codes:
+                (t, c) = evemu.compare.resolve_event(code)
+                if c is None:
+                    where.append("id IN (SELECT recording FROM %s "
+                                 "WHERE type = ?)" % table)
+                    params.append(t)
+                else:
+                    where.append("id IN (SELECT recording FROM %s "
+                                 "WHERE type = ? AND code = ?)" % table)
+                    params.extend((t, c))
+
+        sql = ("SELECT path FROM recordings WHERE %s ORDER BY path" %
+               " AND ".join(where))
+        return [row[0] for row in self._db.execute(sql, params)]
+
+    def get(self, path):
+        """
+        Returns the indexed metadata of the recording at path as a dict,
+        or None if path is not an indexed recording.
+        """
+        db = self._db
+        row = db.execute("SELECT id, name, bustype, vendor, product, "
+                         "version, events, frames, duration, max_touches "
+                         "FROM recordings WHERE path = ? AND "
+                         "name IS NOT NULL",
+                         (os.path.abspath(path),)).fetchone()
+        if row is None:
+            return None
+
+        rowid = row[0]
+        keys = ("name", "bustype", "vendor", "product", "version", "events",
+                "frames", "duration", "max_touches")
+        result = dict(zip(keys, row[1:]))
+        result["props"] = [p for (p,) in db.execute(
+                "SELECT prop FROM props WHERE recording = ? ORDER BY prop",
+                (rowid,))]
+        result["absinfo"] = dict((a[0], a[1:]) for a in db.execute(
+                "SELECT code, minimum, maximum, fuzz, flat, resolution "
+                "FROM absinfo WHERE recording = ?", (rowid,)))
+        result["counts"] = dict(((t, c), n) for (t, c, n) in db.execute(
+                "SELECT type, code, count FROM event_counts "
+                "WHERE recording = ?", (rowid,)))
+        return result
+
+
+def main(args=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(
+            prog="python -m evemu.index",
+            description="Index evemu recordings and query the index.")
+    parser.add_argument("database", help="the index database")
+    parser.add_argument("--update", action="append", default=[],
+                        metavar="PATH",
+                        help="index the recording or directory first")
+    parser.add_argument("--processes", type=int, default=None,
+                        help="the number of indexing processes")
+    parser.add_argument("--name", help="the device name")
+    parser.add_argument("--prop", action="append", default=[],
+                        help="a required input property, "
+                             "e.g. INPUT_PROP_BUTTONPAD")
+    parser.add_argument("--capability", action="append", default=[],
+                        metavar="EVENT",
+                        help="an event code the device must support")
+    parser.add_argument("--event", action="append", default=[],
+                        help="an event code the recording must contain")
+    parser.add_argument("--min-touches", type=int, default=None,
+                        metavar="N",
+                        help="the minimum number of simultaneous touches")
+    args = parser.parse_args(args)
+
+    with Index(args.database) as index:
+        if args.update:
+            (indexed, unchanged, removed) = index.update(
+                    args.update, processes=args.processes)
+            print("indexed %d, unchanged %d, removed %d" % (
+                indexed, unchanged, removed))
+        else:
+            for path in index.find(name=args.name, props=args.prop,
+                                   capabilities=args.capability,
+                                   events=args.event,
+                                   min_touches=args.min_touches):
+                print(path)
+    return 0
+
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main())
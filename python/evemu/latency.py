@@ -0,0 +1,387 @@
+"""
+The latency module measures the round-trip time of injected events: from
+writing a frame to the device node of a uinput device until the frame is
+readable on that node.
+
+A dedicated probe device is created with evemu_create_managed(). Each frame
+is a MSC_SCAN event carrying a sequence number, followed by a SYN_REPORT.
+Frames are written at a configurable rate, optionally in bursts, while a
+reader process reads them back with CLOCK_MONOTONIC event timestamps. The
+reader runs in its own process, so it does not wait for the writer to
+release the GIL before it sees a frame.
+
+The measured time includes the Python overhead on both sides, which is
+constant enough to compare kernels and system load configurations.
+"""
+
+import ctypes
+import fcntl
+import multiprocessing
+import os
+import select
+import struct
+import tempfile
+import time
+
+import evemu
+import evemu.base
+
+__all__ = ["Latencies",
+           "LatencyResult",
+           "measure"]
+
+_EV_SYN = 0x00
+_EV_MSC = 0x04
+_SYN_REPORT = 0x00
+_SYN_DROPPED = 0x03
+_MSC_SCAN = 0x04
+
+# _IOW('E', 0xa0, int)
+_EVIOCSCLOCKID = 0x400445a0
+
+_EVENT_FORMAT = "llHHi"
+_EVENT_SIZE = struct.calcsize(_EVENT_FORMAT)
+
+_PROBE_DESCRIPTION = """# EVEMU 1.2
+N: evemu latency probe
+I: 0006 0000 0000 0000
+P: 00 00 00 00 00 00 00 00
+B: 00 11 00 00 00 00 00 00 00
+B: 04 10 00 00 00 00 00 00 00
+"""
+
+
+def _now():
+    return time.clock_gettime(time.CLOCK_MONOTONIC)
+
+
+class Latencies(object):
+    """
+    A set of latency samples in microseconds.
+    """
+
+    def __init__(self, samples):
+        self.samples = sorted(samples)
+
+    def __len__(self):
+        return len(self.samples)
+
+    def percentile(self, p):
+        """
+        Returns the p'th percentile (0 < p <= 100) using the nearest-rank
+        method, or None if there are no samples.
+        """
+        if not self.samples:
+            return None
+        rank = int(-(-p * len(self.samples) // 100))
+        return self.samples[max(rank, 1) - 1]
+
+    @property
+    def p50(self):
+        return self.percentile(50)
+
+    @property
+    def p99(self):
+        return self.percentile(99)
+
+    @property
+    def p999(self):
+        return self.percentile(99.9)
+
+    @property
+    def min(self):
+        return self.samples[0] if self.samples else None
+
+    @property
+    def max(self):
+        return self.samples[-1] if self.samples else None
+
+    @property
+    def mean(self):
+        if not self.samples:
+            return None
+        return sum(self.samples) / float(len(self.samples))
+
+    def as_dict(self):
+        return {"count": len(self),
+                "min": self.min,
+                "mean": self.mean,
+                "p50": self.p50,
+                "p99": self.p99,
+                "p99.9": self.p999,
+                "max": self.max}
+
+    def __str__(self):
+        if not self.samples:
+            return "no samples"
+        return ("min %.1fus mean %.1fus p50 %.1fus p99 %.1fus "
+                "p99.9 %.1fus max %.1fus" % (self.min, self.mean, self.p50,
+                                             self.p99, self.p999, self.max))
+
+
+class LatencyResult(object):
+    """
+    The result of a measurement.
+
+    round_trip -- Latencies from writing a frame until it was read back
+    to_kernel -- Latencies from writing a frame until the kernel
+    timestamped it
+    sent -- the number of frames written
+    received -- the number of frames read back
+    dropped -- the number of SYN_DROPPED events seen by the reader
+    """
+
+    def __init__(self, rate, burst, sent, received, dropped, round_trip,
+                 to_kernel):
+        self.rate = rate
+        self.burst = burst
+        self.sent = sent
+        self.received = received
+        self.dropped = dropped
+        self.round_trip = Latencies(round_trip)
+        self.to_kernel = Latencies(to_kernel)
+
+    @property
+    def lost(self):
+        """
+        The number of frames written but not read back.
+        """
+        return self.sent - self.received
+
+    def as_dict(self):
+        return {"rate": self.rate,
+                "burst": self.burst,
+                "sent": self.sent,
+                "received": self.received,
+                "lost": self.lost,
+                "dropped": self.dropped,
+                "round_trip": self.round_trip.as_dict(),
+                "to_kernel": self.to_kernel.as_dict()}
+
+    def __str__(self):
+        return "\n".join([
+            "frames sent: %d at %dHz, bursts of %d" % (self.sent, self.rate,
+                                                      self.burst),
+            "frames received: %d (%d lost, %d SYN_DROPPED)" % (
+                self.received, self.lost, self.dropped),
+            "round trip: %s" % self.round_trip,
+            "write to kernel timestamp: %s" % self.to_kernel])
+
+
+def _read_frames(devnode, count, ready, done, conn):
+    """
+    Reads the probe frames back until count frames were read or done is
+    set, then sends ([(sequence number, kernel time, read time)], number
+    of SYN_DROPPED) through conn.
+    """
+    fd = os.open(devnode, os.O_RDONLY | os.O_NONBLOCK)
+    fcntl.ioctl(fd, _EVIOCSCLOCKID, struct.pack("i", time.CLOCK_MONOTONIC))
+    ready.set()
+
+    frames = []
+    dropped = 0
+    seq = None
+    stamp = None
+    try:
+        while len(frames) < count and not done.is_set():
+            if not select.select([fd], [], [], 0.1)[0]:
+                continue
+            data = os.read(fd, _EVENT_SIZE * 64)
+            now = _now()
+            for offset in range(0, len(data), _EVENT_SIZE):
+                (sec, usec, t, c, v) = struct.unpack_from(_EVENT_FORMAT,
+                                                          data, offset)
+                if t == _EV_MSC and c == _MSC_SCAN:
+                    seq = v
+                    stamp = sec + usec / 1e6
+                elif t == _EV_SYN and c == _SYN_DROPPED:
+                    dropped += 1
+                    seq = None
+                elif t == _EV_SYN and c == _SYN_REPORT:
+                    if seq is not None:
+                        frames.append((seq, stamp, now))
+                    seq = None
+    finally:
+        os.close(fd)
+    conn.send((frames, dropped))
+    conn.close()
+
+
+class _Reader(object):
+    """
+    Reads the probe frames back in a separate process, see _read_frames().
+    Used as context manager, the reader is started on entry and stopped on
+    exit.
+    """
+
+    def __init__(self, devnode, count):
+        self.frames = []
+        self.dropped = 0
+        self._ready = multiprocessing.Event()
+        self._done = multiprocessing.Event()
+        (self._conn, conn) = multiprocessing.Pipe(duplex=False)
+        self._process = multiprocessing.Process(
+                target=_read_frames,
+                args=(devnode, count, self._ready, self._done, conn))
+        self._process.daemon = True
+
+    def __enter__(self):
+        try:
+            self.start()
+        except:
+            self.close()
+            raise
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def start(self):
+        """
+        Starts the reader and returns once it has opened the device node.
+        """
+        self._process.start()
+        while not self._ready.wait(0.1):
+            if not self._process.is_alive():
+                raise OSError("could not read the probe device")
+
+    def finish(self, timeout):
+        """
+        Waits up to timeout seconds for the outstanding frames, then stops
+        the reader and collects the frames it read.
+        """
+        if not self._conn.poll(timeout):
+            self._done.set()
+        (self.frames, self.dropped) = self._conn.recv()
+        self._process.join()
+
+    def close(self):
+        """
+        Stops the reader if it is still running, discarding the frames it
+        did not send yet.
+        """
+        self._done.set()
+        if self._process.is_alive():
+            self._process.join(1.0)
+            if self._process.is_alive():
+                self._process.terminate()
+                self._process.join()
+        self._conn.close()
+
+
+def _create_probe():
+    with tempfile.NamedTemporaryFile(mode="w+t", suffix=".prop") as f:
+        f.write(_PROBE_DESCRIPTION)
+        f.flush()
+        f.seek(0)
+        return evemu.Device(f)
+
+
+def _inject(device, count, rate, burst):
+    """
+    Writes count probe frames to device, in bursts at the given rate.
+    Returns the write time of each frame.
+    """
+    libevemu = evemu.base.LibEvemu()
+    fd = device._file.fileno()
+
+    msc = evemu.base.InputEvent()
+    msc.type = _EV_MSC
+    msc.code = _MSC_SCAN
+    syn = evemu.base.InputEvent()
+    syn.type = _EV_SYN
+    syn.code = _SYN_REPORT
+
+    written = [None] * count
+    interval = 1.0 / rate
+    start = _now()
+    seq = 0
+    tick = 0
+    while seq < count:
+        deadline = start + tick * interval
+        delay = deadline - _now()
+        if delay > 0:
+            time.sleep(delay)
+        for _ in range(min(burst, count - seq)):
+            msc.value = seq
+            written[seq] = _now()
+            libevemu.evemu_play_one(fd, ctypes.byref(msc))
+            libevemu.evemu_play_one(fd, ctypes.byref(syn))
+            seq += 1
+        tick += 1
+    return written
+
+
+def measure(rate=1000, count=1000, burst=1, timeout=1.0):
+    """
+    Creates a probe device, injects count frames at the given rate and
+    returns a LatencyResult.
+
+    args:
+    rate -- the number of bursts per second
+    count -- the total number of frames to write
+    burst -- the number of frames written back-to-back per burst
+    timeout -- how long to wait for outstanding frames after the last
+    write, in seconds
+
+    This requires write access to /dev/uinput (usually root).
+    """
+    if rate <= 0 or count <= 0 or burst <= 0:
+        raise ValueError("rate, count and burst must be positive")
+
+    device = _create_probe()
+    try:
+        with _Reader(device.devnode, count) as reader:
+            written = _inject(device, count, rate, burst)
+            reader.finish(timeout)
+    finally:
+        # destroys the probe device
+        del device
+
+    round_trip = []
+    to_kernel = []
+    for (seq, stamp, read) in reader.frames:
+        if seq < 0 or seq >= count or written[seq] is None:
+            continue
+        round_trip.append((read - written[seq]) * 1e6)
+        to_kernel.append((stamp - written[seq]) * 1e6)
+
+    return LatencyResult(rate, burst, count, len(round_trip), reader.dropped,
+                         round_trip, to_kernel)
+
+
+def main(args=None):
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(
+            prog="python -m evemu.latency",
+            description="Measure the round-trip latency of events injected "
+                        "through a uinput device.")
+    parser.add_argument("--rate", type=int, default=1000, metavar="HZ",
+                        help="bursts written per second (default: 1000)")
+    parser.add_argument("--count", type=int, default=10000,
+                        help="total number of frames (default: 10000)")
+    parser.add_argument("--burst", type=int, default=1,
+                        help="frames written back-to-back per burst "
+                             "(default: 1)")
+    parser.add_argument("--timeout", type=float, default=1.0,
+                        metavar="SEC",
+                        help="time to wait for outstanding frames "
+                             "(default: 1.0)")
+    parser.add_argument("--json", action="store_true",
+                        help="print the result as JSON")
+    args = parser.parse_args(args)
+
+    result = measure(rate=args.rate, count=args.count, burst=args.burst,
+                     timeout=args.timeout)
+    if args.json:
+        print(json.dumps(result.as_dict(), indent=2, sort_keys=True))
+    else:
+        print(result)
+    return 0 if result.lost == 0 else 1
+
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main())
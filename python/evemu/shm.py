@@ -0,0 +1,224 @@
+"""
+The shm module shares the live events of a device between processes
+through a ring buffer in POSIX shared memory, see evemu_shm_new(). One
+process publishes the events:
+
+    with Publisher("/touchpad") as publisher:
+        publisher.record(evemu.Device("/dev/input/event5", create=False))
+
+and any number of processes subscribe to them, without opening the device
+node themselves:
+
+    with Subscriber("/touchpad") as subscriber:
+        for view in subscriber:
+            for event in unpack(view):
+                ...
+
+Subscribers read the events in place, read() returns a read-only
+memoryview of the raw struct input_event in the shared memory. The
+publisher never waits for subscribers: a subscriber that falls behind by
+more than the capacity of the ring skips the overwritten events (see
+Subscriber.lost), and a view that was overwritten while in use is
+detected by Subscriber.valid().
+"""
+
+import ctypes
+import errno
+import struct
+
+import evemu
+import evemu.base
+
+__all__ = ["Publisher",
+           "Subscriber",
+           "unpack"]
+
+_EVENT_FORMAT = "llHHi"
+_EVENT_SIZE = struct.calcsize(_EVENT_FORMAT)
+
+
+def unpack(view):
+    """
+    Yields an InputEvent for each event of a view returned by
+    Subscriber.read(). The events are copied, check Subscriber.valid()
+    once done.
+    """
+    for event in struct.iter_unpack(_EVENT_FORMAT, view):
+        yield evemu.InputEvent(*event)
+
+
+class Publisher(object):
+    """
+    Publishes events in a shared memory segment. An existing segment with
+    the same name is replaced, the segment is removed by close().
+    """
+
+    def __init__(self, name, size=1024 * 1024):
+        """
+        args:
+        name -- the name of the segment, starting with a slash
+        size -- the memory used for events, in bytes; the ring holds the
+        largest power of two of events that fits
+        """
+        self._libevemu = evemu.base.LibEvemu()
+        self._shm = self._libevemu.evemu_shm_new(name.encode("iso8859-1"),
+                                                 size)
+        self._context = self._libevemu.evemu_context_new()
+
+    def __del__(self):
+        self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def capacity(self):
+        """
+        The number of events the ring holds.
+        """
+        return self._libevemu.evemu_shm_get_capacity(self._shm)
+
+    def publish(self, events):
+        """
+        Publishes a batch of InputEvents or (sec, usec, type, code, value)
+        tuples at once. Returns the number of events published.
+        """
+        events = list(events)
+        batch = (evemu.base.InputEvent * len(events))()
+        for (i, e) in enumerate(events):
+            if isinstance(e, evemu.InputEvent):
+                e = (e.sec, e.usec, e.type, e.code, e.value)
+            (batch[i].sec, batch[i].usec, batch[i].type, batch[i].code,
+             batch[i].value) = e
+        return self._libevemu.evemu_shm_publish(self._shm, batch, len(events))
+
+    def record(self, device, timeout=10000, filter=None):
+        """
+        Publishes the events of the Device until no event arrives for
+        timeout milliseconds. The events keep their kernel timestamps.
+
+        If filter is not None, only events passing the Filter are
+        published.
+
+        Returns the number of events published.
+        """
+        self._filter = filter
+        self._libevemu.evemu_context_set_filter(
+                self._context, filter._filter if filter is not None else None)
+
+        count = 0
+        while True:
+            n = self._libevemu.evemu_context_record_shm(
+                    self._context, self._shm, device._file.fileno(), timeout)
+            if n < 0:
+                raise OSError(-n, "could not record %s" % device.devnode)
+            if n == 0:
+                return count
+            count += n
+
+    def close(self):
+        """
+        Removes the segment, subscribers see the end of the events once
+        they have read the remaining ones.
+        """
+        if getattr(self, "_shm", None) is not None:
+            self._libevemu.evemu_shm_delete(self._shm)
+            self._shm = None
+        if getattr(self, "_context", None) is not None:
+            self._libevemu.evemu_context_delete(self._context)
+            self._context = None
+
+
+class Subscriber(object):
+    """
+    Reads the events published in a shared memory segment, starting with
+    the events published after the Subscriber was created.
+    """
+
+    def __init__(self, name):
+        """
+        args:
+        name -- the name the Publisher was created with
+        """
+        self._libevemu = evemu.base.LibEvemu()
+        self._shm = self._libevemu.evemu_shm_open(name.encode("iso8859-1"))
+        self.closed = False
+
+    def __del__(self):
+        self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __iter__(self):
+        """
+        Yields the views of read() until the publisher is gone.
+        """
+        while True:
+            view = self.read()
+            if view is None:
+                return
+            yield view
+
+    @property
+    def capacity(self):
+        """
+        The number of events the ring holds.
+        """
+        return self._libevemu.evemu_shm_get_capacity(self._shm)
+
+    @property
+    def lost(self):
+        """
+        The number of events skipped because the publisher overwrote them
+        before they were read.
+        """
+        return self._libevemu.evemu_shm_get_lost(self._shm)
+
+    def read(self, timeout=None):
+        """
+        Waits up to timeout seconds, or forever if None, for new events
+        and returns a read-only memoryview of them in the shared memory.
+        Where the ring wraps around, the remaining events are returned by
+        the next call. The view must not be used after close(). Before
+        Python 3.8, the view is writable but must not be written to.
+
+        Returns None on timeout or, setting closed, once the publisher
+        closed the segment and all events were read.
+        """
+        ms = -1 if timeout is None else int(timeout * 1000)
+        events = ctypes.c_void_p()
+        n = self._libevemu.evemu_shm_read(self._shm, ctypes.byref(events), ms)
+        if n == -errno.EPIPE:
+            self.closed = True
+            return None
+        if n < 0:
+            raise OSError(-n, "could not read events")
+        if n == 0:
+            return None
+
+        data = (ctypes.c_char * (n * _EVENT_SIZE)).from_address(events.value)
+        view = memoryview(data).cast("B")
+        # memoryview.toreadonly() is new in Python 3.8
+        if hasattr(view, "toreadonly"):
+            view = view.toreadonly()
+        return view
+
+    def valid(self):
+        """
+        Returns True if the events of the last view returned by read()
+        have not been overwritten since. Check this after processing or
+        copying the view.
+        """
+        return self._libevemu.evemu_shm_valid(self._shm) != 0
+
+    def close(self):
+        if getattr(self, "_shm", None) is not None:
+            self._libevemu.evemu_shm_delete(self._shm)
+            self._shm = None
@@ -0,0 +1,332 @@
+"""
+The store module keeps a corpus of evemu recordings in a local,
+content-addressed directory.
+
+Each recording is split into a device description and an event stream,
+stored as separate blobs named after the SHA-256 of their content. Many
+recordings of the same device share one description blob. Checkpoints
+recorded before the first event stay with the events. An index of the
+recordings and the name and ids of each description is kept alongside, so
+recordings can be queried without reading any description, and a
+description is parsed at most once per Store:
+
+    store = Store("corpus")
+    store.add("touchpad-2024-05-01.evemu")
+    for recording in store.find(name="SynPS/2 Synaptics TouchPad"):
+        device = store.device(recording)
+        with store.open(recording) as events_file:
+            ...
+
+The directory layout is
+
+    index.jsonl                 the recordings and descriptions, one JSON
+                                object per line, appended to by add()
+    descriptions/<sha256>       the description, as read by Device()
+    events/<sha256>             the events, as read by Device.play()
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+
+import evemu
+
+__all__ = ["StoredRecording",
+           "Store"]
+
+_INDEX = "index.jsonl"
+_DESCRIPTIONS = "descriptions"
+_EVENTS = "events"
+
+
+def _is_description(line):
+    return (line[:2] in ("N:", "I:", "P:", "B:", "A:", "L:", "S:") or
+            line.startswith("# EVEMU"))
+
+
+def _is_checkpoint(line):
+    return line.startswith("# C:") or line.startswith("# R:")
+
+
+class StoredRecording(object):
+    """
+    A recording in a Store.
+
+    id -- the key of the recording, derived from its description and
+    events
+    description -- the SHA-256 of the description blob
+    events -- the SHA-256 of the events blob
+    source -- the base name of the file the recording was added from
+    name, bustype, vendor, product, version -- the device name and ids
+    from the description
+    """
+    __slots__ = ('id', 'description', 'events', 'source', 'name', 'bustype',
+                 'vendor', 'product', 'version')
+
+    def __init__(self, id, description, events, source, info):
+        self.id = id
+        self.description = description
+        self.events = events
+        self.source = source
+        self.name = info["name"]
+        self.bustype = info["bustype"]
+        self.vendor = info["vendor"]
+        self.product = info["product"]
+        self.version = info["version"]
+
+    def __repr__(self):
+        return "StoredRecording(%s, %r)" % (self.id[:12], self.source)
+
+
+class Store(object):
+    """
+    A directory of deduplicated recordings. The directory is created if it
+    does not exist.
+
+    A Store caches the parsed descriptions it hands out with device(). It
+    is not safe to modify one store directory from several processes at a
+    time.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        for d in (_DESCRIPTIONS, _EVENTS):
+            d = os.path.join(path, d)
+            if not os.path.isdir(d):
+                os.makedirs(d)
+
+        self._descriptions = {}
+        self._recordings = {}
+        self._devices = {}
+        index = os.path.join(path, _INDEX)
+        if os.path.exists(index):
+            with open(index) as f:
+                for line in f:
+                    entry = json.loads(line)
+                    if "recording" in entry:
+                        self._recordings[entry.pop("recording")] = entry
+                    else:
+                        self._descriptions[entry.pop("description")] = entry
+
+    def __len__(self):
+        return len(self._recordings)
+
+    def __contains__(self, id):
+        return id in self._recordings
+
+    def __iter__(self):
+        for id in sorted(self._recordings):
+            yield self.get(id)
+
+    def get(self, id):
+        """
+        Returns the StoredRecording with the given id. Raises KeyError if
+        there is no such recording.
+        """
+        r = self._recordings[id]
+        return StoredRecording(id, r["description"], r["events"],
+                               r["source"],
+                               self._descriptions[r["description"]])
+
+    def find(self, name=None, bustype=None, vendor=None, product=None,
+             version=None):
+        """
+        Returns the StoredRecordings whose device matches all of the given
+        name and ids. This only reads the index.
+        """
+        query = {"name": name, "bustype": bustype, "vendor": vendor,
+                 "product": product, "version": version}
+        query = dict((k, v) for (k, v) in query.items() if v is not None)
+        return [r for r in self
+                if all(getattr(r, k) == v for (k, v) in query.items())]
+
+    def add(self, recording):
+        """
+        Adds a recording, a file name or a file object with the device
+        description followed by the events, as written by evemu-record.
+        Returns the StoredRecording. Adding a recording again returns the
+        existing entry.
+        """
+        if isinstance(recording, str):
+            with open(recording) as f:
+                return self.add(f)
+
+        source = os.path.basename(getattr(recording, "name", "") or "")
+        description = []
+        header = []
+        line = ""
+        for line in recording:
+            if line.startswith("E:"):
+                break
+            if _is_description(line):
+                description.append(line)
+            elif _is_checkpoint(line):
+                header.append(line)
+        else:
+            line = ""
+        if line:
+            header.append(line)
+
+        if not any(l.startswith("N:") for l in description):
+            raise ValueError("%s: no device description" %
+                             (source or "recording"))
+
+        description = "".join(description)
+        desc_hash = self._write_blob(_DESCRIPTIONS, [description])
+        events = self._write_blob(_EVENTS, _chain(header, recording))
+        id = hashlib.sha256(("%s %s" % (desc_hash, events)).encode(
+                "ascii")).hexdigest()
+
+        if desc_hash not in self._descriptions:
+            info = self._describe(desc_hash)
+            self._descriptions[desc_hash] = info
+            self._append_index(dict(info, description=desc_hash))
+        if id not in self._recordings:
+            entry = {"description": desc_hash,
+                     "events": events,
+                     "source": source}
+            self._recordings[id] = entry
+            self._append_index(dict(entry, recording=id))
+
+        return self.get(id)
+
+    def description_path(self, recording):
+        """
+        The path of the description blob of the given StoredRecording.
+        """
+        return os.path.join(self.path, _DESCRIPTIONS, recording.description)
+
+    def events_path(self, recording):
+        """
+        The path of the events blob of the given StoredRecording.
+        """
+        return os.path.join(self.path, _EVENTS, recording.events)
+
+    def open(self, recording):
+        """
+        Opens the events of the given StoredRecording for reading. The
+        file can be passed to Device.play() and Device.events().
+        """
+        return open(self.events_path(recording))
+
+    def device(self, recording, create=False):
+        """
+        Returns a Device for the description of the given StoredRecording.
+
+        Without create, the Device is parsed once per description and
+        shared by all recordings of that device. With create, a new uinput
+        device is created each time.
+        """
+        if create:
+            return evemu.Device(self.description_path(recording))
+
+        device = self._devices.get(recording.description)
+        if device is None:
+            device = evemu.Device(self.description_path(recording),
+                                  create=False)
+            self._devices[recording.description] = device
+        return device
+
+    def export(self, recording, f):
+        """
+        Writes the given StoredRecording as a single recording, with the
+        description followed by the events, to the file object f.
+        """
+        for path in (self.description_path(recording),
+                     self.events_path(recording)):
+            with open(path) as blob:
+                for line in blob:
+                    f.write(line)
+
+    def _describe(self, desc_hash):
+        device = evemu.Device(os.path.join(self.path, _DESCRIPTIONS,
+                                           desc_hash), create=False)
+        self._devices[desc_hash] = device
+        return {"name": device.name,
+                "bustype": device.id_bustype,
+                "vendor": device.id_vendor,
+                "product": device.id_product,
+                "version": device.id_version}
+
+    def _write_blob(self, kind, chunks):
+        """
+        Writes chunks to a blob of the given kind and returns its hash.
+        The blob is written to a temporary file first and renamed into
+        place, or discarded if a blob with the same content exists.
+        """
+        directory = os.path.join(self.path, kind)
+        sha = hashlib.sha256()
+        (fd, tmp) = tempfile.mkstemp(dir=directory, prefix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                for chunk in chunks:
+                    sha.update(chunk.encode("utf-8"))
+                    f.write(chunk)
+            digest = sha.hexdigest()
+            path = os.path.join(directory, digest)
+            if os.path.exists(path):
+                os.unlink(tmp)
+            else:
+                os.rename(tmp, path)
+        except:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+        return digest
+
+    def _append_index(self, entry):
+        """
+        Appends one entry to the index. Entries are only ever added, so
+        the index is not rewritten for each recording.
+        """
+        with open(os.path.join(self.path, _INDEX), "a") as f:
+            f.write(json.dumps(entry, sort_keys=True) + "\n")
+
+
+def _chain(first, rest):
+    for line in first:
+        yield line
+    for line in rest:
+        yield line
+
+
+def main(args=None):
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(
+            prog="python -m evemu.store",
+            description="Manage a store of deduplicated evemu recordings.")
+    parser.add_argument("store", help="the store directory")
+    commands = parser.add_subparsers(dest="command")
+    add = commands.add_parser("add", help="add recordings to the store")
+    add.add_argument("recordings", nargs="+", metavar="recording")
+    ls = commands.add_parser("list", help="list the stored recordings")
+    ls.add_argument("--name", help="only list recordings of this device")
+    cat = commands.add_parser("cat", help="print a stored recording")
+    cat.add_argument("id", help="the recording id or a unique prefix")
+    args = parser.parse_args(args)
+
+    store = Store(args.store)
+    if args.command == "add":
+        for path in args.recordings:
+            print("%s %s" % (store.add(path).id, path))
+    elif args.command == "list":
+        for r in store.find(name=args.name):
+            print("%s %04x:%04x %s (%s)" % (r.id, r.vendor, r.product,
+                                             r.name, r.source))
+    elif args.command == "cat":
+        matches = [id for id in store._recordings if id.startswith(args.id)]
+        if len(matches) != 1:
+            parser.error("%s: %s recording id" % (
+                args.id, "unknown" if not matches else "ambiguous"))
+        store.export(store.get(matches[0]), sys.stdout)
+    else:
+        parser.error("a command is required")
+    return 0
+
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main())
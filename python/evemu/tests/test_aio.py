@@ -0,0 +1,60 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import unittest
+
+import evemu
+import evemu.aio
+import evemu.exception
+import evemu.testing.testcase
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+class AioTestCase(evemu.testing.testcase.BaseTestCase):
+    """
+    Verifies the asyncio device creation.
+    """
+
+    def setUp(self):
+        super(AioTestCase, self).setUp()
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+        super(AioTestCase, self).tearDown()
+
+    def test_wait_for_devnodes(self):
+        devnode = os.path.join(self.dir, "event0")
+
+        async def create_later():
+            await asyncio.sleep(0.05)
+            open(devnode, "w").close()
+
+        async def wait():
+            creator = asyncio.ensure_future(create_later())
+            await evemu.aio.wait_for_devnodes([devnode], timeout=5)
+            await creator
+
+        run(wait())
+
+    def test_wait_for_devnodes_timeout(self):
+        devnode = os.path.join(self.dir, "event0")
+        self.assertRaises(evemu.exception.DevnodeTimeoutError, run,
+                          evemu.aio.wait_for_devnodes([devnode], timeout=0.01))
+
+    def test_create_devices(self):
+        devices = run(evemu.aio.create_devices([self.get_device_file()] * 3))
+        self.assertEqual(len(set(d.devnode for d in devices)), 3)
+        for d in devices:
+            self.assertTrue(d.has_event("EV_ABS", "ABS_X"))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,3 +1,8 @@
+import os
+import struct
+import tempfile
+import threading
+import time
 import unittest
 
 import evemu.base
@@ -52,5 +57,45 @@ class EvEmuBaseTestCase(evemu.testing.testcase.BaseTestCase):
 
         self.assertEqual(first._loaded_lib, second._loaded_lib)
 
+    def test_blocking_calls_release_gil(self):
+        libc = evemu.base.LibC()
+        libevemu = evemu.base.LibEvemu()
+        pipes = [os.pipe() for _ in range(2)]
+        files = [tempfile.TemporaryFile() for _ in pipes]
+        started = [threading.Event() for _ in pipes]
+        nevents = 5
+
+        def record(out, fd, started):
+            fs = libc.fdopen(out.fileno(), b"w")
+            started.set()
+            # returns once no event arrived for the full timeout
+            libevemu.evemu_record(fs, fd, 500)
+            libc.fflush(fs)
+
+        threads = [threading.Thread(target=record, args=(f, p[0], s))
+                   for (f, p, s) in zip(files, pipes, started)]
+        for t in threads:
+            t.start()
+        for s in started:
+            s.wait()
+        # only recorded if this thread runs while both records block
+        event = struct.pack("llHHi", 0, 0, 0x02, 0x00, 1)
+        for _ in range(nevents):
+            time.sleep(0.01)
+            for (r, w) in pipes:
+                os.write(w, event)
+        for t in threads:
+            t.join()
+
+        for (r, w) in pipes:
+            os.close(r)
+            os.close(w)
+        for f in files:
+            f.seek(0)
+            lines = f.read().decode("ascii").splitlines()
+            f.close()
+            self.assertEqual(len([l for l in lines if l.startswith("E:")]),
+                             nevents)
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,127 @@
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+
+import evemu
+import evemu.client
+import evemu.exception
+import evemu.testing.testcase
+
+
+class FakeDaemon(threading.Thread):
+    """
+    Accepts one connection, records the lines received and answers each
+    command with the next of the given replies. Payload lines are
+    recognized by the count in CREATE and SEND commands.
+    """
+
+    def __init__(self, path, replies):
+        super(FakeDaemon, self).__init__()
+        self.daemon = True
+        self.received = []
+        self._replies = list(replies)
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.bind(path)
+        self._socket.listen(1)
+
+    def run(self):
+        conn, _ = self._socket.accept()
+        f = conn.makefile("rwb")
+        while self._replies:
+            line = f.readline().decode().rstrip("\n")
+            if not line:
+                break
+            command = line.split()
+            payload = 0
+            if command[0] == "CREATE":
+                payload = int(command[1])
+            elif command[0] == "SEND":
+                payload = int(command[2])
+            self.received.append(line)
+            for _ in range(payload):
+                self.received.append(f.readline().decode().rstrip("\n"))
+            f.write(self._replies.pop(0).encode())
+            f.flush()
+        f.close()
+        conn.close()
+        self._socket.close()
+
+
+class ClientTestCase(evemu.testing.testcase.BaseTestCase):
+    """
+    Verifies the evemu-daemon client against a scripted daemon.
+    """
+
+    def setUp(self):
+        super(ClientTestCase, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "evemu.socket")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        super(ClientTestCase, self).tearDown()
+
+    def connect(self, *replies):
+        self.server = FakeDaemon(self.path, replies)
+        self.server.start()
+        return evemu.client.Client(self.path)
+
+    def test_create(self):
+        with self.connect("OK 3 /dev/input/event7\n",
+                          "OK\n") as client:
+            device = client.create(self.get_device_file())
+            self.assertEqual(device.id, 3)
+            self.assertEqual(device.devnode, "/dev/input/event7")
+            device.destroy()
+        self.server.join()
+
+        with open(self.get_device_file()) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(self.server.received,
+                         ["CREATE %d" % len(lines)] + lines + ["DESTROY 3"])
+
+    def test_send(self):
+        events = [evemu.InputEvent(0, 0, 0x01, 0x110, 1),
+                  ("EV_SYN", "SYN_REPORT", 0),
+                  "E: 0.000000 0001 0110 0000"]
+        with self.connect("OK 3\n") as client:
+            self.assertEqual(client.send(2, events), 3)
+        self.server.join()
+        self.assertEqual(self.server.received,
+                         ["SEND 2 3", "1 272 1", "EV_SYN SYN_REPORT 0",
+                          "E: 0.000000 0001 0110 0000"])
+
+    def test_play(self):
+        with self.connect("OK\n") as client:
+            client.play(evemu.client.RemoteDevice(client, 4, None),
+                        self.get_events_file())
+        self.server.join()
+        self.assertEqual(self.server.received,
+                         ["PLAY 4 %s" % os.path.abspath(
+                             self.get_events_file())])
+
+    def test_list(self):
+        with self.connect("OK 2\n1 /dev/input/event5 foo bar\n"
+                          "2 /dev/input/event6 baz\n") as client:
+            devices = client.devices()
+        self.assertEqual([(d.id, d.devnode, d.name) for d in devices],
+                         [(1, "/dev/input/event5", "foo bar"),
+                          (2, "/dev/input/event6", "baz")])
+
+    def test_error(self):
+        with self.connect("ERR 19 no such device\n") as client:
+            try:
+                client.destroy(9)
+            except evemu.exception.DaemonError as e:
+                self.assertEqual(e.args, (19, "no such device"))
+            else:
+                self.fail("DaemonError not raised")
+
+    def test_no_daemon(self):
+        self.assertRaises(socket.error, evemu.client.Client, self.path)
+
+if __name__ == "__main__":
+    unittest.main()
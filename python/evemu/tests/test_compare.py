@@ -0,0 +1,93 @@
+import os
+import tempfile
+import unittest
+
+import evemu
+import evemu.compare
+import evemu.testing.testcase
+
+
+def modify_events(source, dest, frame_index, delta):
+    """
+    Copy the event lines from source to dest, adding delta to the value of
+    the first event of the frame_index'th frame.
+    """
+    frame = 0
+    modified = False
+    with open(source) as f:
+        for line in f:
+            if not line.startswith("E:"):
+                continue
+            fields = line.split()
+            if frame == frame_index and not modified:
+                fields[4] = str(int(fields[4]) + delta)
+                modified = True
+            if fields[2:4] == ["0000", "0000"]:
+                frame += 1
+            dest.write(" ".join(fields[:5]) + "\n")
+    dest.flush()
+    dest.seek(0)
+
+
+class CompareTestCase(evemu.testing.testcase.BaseTestCase):
+    """
+    Verifies the frame-by-frame recording comparison.
+    """
+
+    def test_resolve_event(self):
+        self.assertEqual(evemu.compare.resolve_event("EV_MSC"), (0x04, None))
+        self.assertEqual(evemu.compare.resolve_event("ABS_Y"), (0x03, 0x01))
+        self.assertEqual(evemu.compare.resolve_event("EV_KEY:KEY_Z"),
+                         (0x01, 44))
+        self.assertEqual(evemu.compare.resolve_event(("EV_ABS", 0x00)),
+                         (0x03, 0x00))
+        self.assertRaises(ValueError, evemu.compare.resolve_event, "FOO_BAR")
+
+    def test_compare_identical(self):
+        events_file = self.get_events_file()
+        result = evemu.compare.compare(events_file, events_file)
+        self.assertTrue(result.matches)
+        self.assertTrue(result.frames > 1)
+        self.assertTrue(result.events > 1)
+        self.assertEqual(result.divergent_frames, 0)
+        self.assertEqual(result.max_time_delta, 0)
+
+    def test_compare_closes_streams(self):
+        events_file = self.get_events_file()
+        fds = len(os.listdir("/proc/self/fd"))
+        for _ in range(3):
+            evemu.compare.compare(events_file, events_file)
+        self.assertEqual(len(os.listdir("/proc/self/fd")), fds)
+
+    def test_compare_divergent_value(self):
+        events_file = self.get_events_file()
+        with tempfile.NamedTemporaryFile(mode="w+t") as t:
+            modify_events(events_file, t, 3, 5)
+            result = evemu.compare.compare(events_file, t.name)
+            self.assertFalse(result.matches)
+            self.assertEqual(result.divergent_frames, 1)
+            self.assertEqual(result.first_divergence.frame, 3)
+
+    def test_compare_value_tolerance(self):
+        events_file = self.get_events_file()
+        with tempfile.NamedTemporaryFile(mode="w+t") as t:
+            modify_events(events_file, t, 3, 5)
+            result = evemu.compare.compare(events_file, t.name,
+                                           value_tolerance={"EV_ABS": 5,
+                                                            "EV_KEY": 5})
+            self.assertTrue(result.matches)
+
+    def test_compare_ignore(self):
+        events_file = self.get_events_file()
+        with tempfile.NamedTemporaryFile(mode="w+t") as t:
+            modify_events(events_file, t, 3, 5)
+            result = evemu.compare.compare(events_file, t.name,
+                                           ignore=["EV_ABS", "EV_KEY"])
+            self.assertTrue(result.matches)
+
+    def test_compare_main(self):
+        events_file = self.get_events_file()
+        self.assertEqual(evemu.compare.main([events_file, events_file]), 0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,10 +1,19 @@
 from multiprocessing import Process, Queue, Event
 
+import ctypes
+import json
+import os
 import re
+import select
+import shutil
+import struct
 import tempfile
+import threading
+import time
 import unittest
 
 import evemu
+import evemu.exception
 import evemu.testing.testcase
 
 
@@ -39,6 +48,48 @@ def extract_events(data):
     """
     return [line for line in data if line.startswith("E:")]
 
+class NodeReader(threading.Thread):
+    """
+    Reads the events a device emits while it runs, so the buffer of the
+    event node cannot overflow. stop() returns them as (time, type, code,
+    value) tuples with the kernel timestamps.
+    """
+    _FORMAT = "llHHi"
+
+    def __init__(self, devnode):
+        super(NodeReader, self).__init__()
+        # opened here, events written after the constructor are not missed
+        self._fd = os.open(devnode, os.O_RDONLY | os.O_NONBLOCK)
+        self._done = threading.Event()
+        self.events = []
+        self.start()
+
+    def run(self):
+        size = struct.calcsize(self._FORMAT)
+        while True:
+            if not select.select([self._fd], [], [], 0.1)[0]:
+                if self._done.is_set():
+                    return
+                continue
+            data = os.read(self._fd, size * 64)
+            if not data:
+                return
+            for (sec, usec, t, c, v) in struct.iter_unpack(self._FORMAT,
+                                                           data):
+                self.events.append((sec + usec / 1000000.0, t, c, v))
+
+    def stop(self):
+        self._done.set()
+        self.join()
+        os.close(self._fd)
+        return self.events
+
+def event_values(events):
+    """
+    The (type, code, value) of events read by a NodeReader.
+    """
+    return [e[1:] for e in events]
+
 class DeviceActionTestCase(evemu.testing.testcase.BaseTestCase):
     """
     Verifies the high-level Device functions (create, describe, play, record).
@@ -155,6 +206,360 @@ class DeviceActionTestCase(evemu.testing.testcase.BaseTestCase):
             self.assertEquals(len(e1), len(e2))
             self.assertEquals(e1, e2)
 
+    def expected_events(self):
+        device = evemu.Device(self.get_device_file(), create=False)
+        with open(self.get_events_file()) as ef:
+            return [(e.type, e.code, e.value) for e in device.events(ef)]
+
+    def test_play_many(self):
+        expected = self.expected_events()
+        devices = [evemu.Device(self.get_device_file()) for _ in range(3)]
+        readers = [NodeReader(d.devnode) for d in devices]
+        files = [open(self.get_events_file()) for _ in devices]
+        for d in devices:
+            d.enable_stats()
+        evemu.play_many(zip(devices, files))
+        for (d, f) in zip(devices, files):
+            f.close()
+
+        # each device got its own complete event stream
+        for (d, r) in zip(devices, readers):
+            self.assertEqual(event_values(r.stop()), expected)
+            self.assertEqual(d.stats["events_written"], len(expected))
+
+    def test_play_many_error(self):
+        device = evemu.Device(self.get_device_file(), create=False)
+        self.assertRaises(TypeError, evemu.play_many,
+                          [(device, "not a file")])
+
+    def test_recording(self):
+        events_file = self.get_events_file()
+        recording = evemu.Recording(events_file)
+        with open(events_file) as e:
+            nframes = len([l for l in extract_events(e.readlines())
+                           if l.split()[2:4] == ["0000", "0000"]])
+        self.assertEqual(recording.frames, nframes)
+        self.assertTrue(recording.duration > 0)
+
+        f = evemu.Filter("time=1299660667.1-")
+        recording = evemu.Recording(events_file, filter=f)
+        self.assertTrue(0 < recording.frames < nframes)
+
+    def test_player(self):
+        expected = self.expected_events()
+        keyboard = evemu.Device(self.get_device_file())
+        touchscreen = evemu.Device(self.get_device_file())
+        readers = [NodeReader(d.devnode) for d in (keyboard, touchscreen)]
+        recording = evemu.Recording(self.get_events_file())
+        # longer than the recording, so the streams do not overlap
+        offset = recording.duration / 1000.0 + 100
+        player = evemu.Player()
+        player.add(keyboard, recording)
+        player.add(touchscreen, recording, offset=offset)
+        player.run()
+
+        (first, second) = [r.stop() for r in readers]
+        self.assertEqual(event_values(first), expected)
+        self.assertEqual(event_values(second), expected)
+        # the second device starts offset ms after the first one, once
+        # all frames of the first device were dispatched
+        self.assertGreater(second[0][0], first[-1][0])
+        self.assertAlmostEqual(second[0][0] - first[0][0], offset / 1000.0,
+                               delta=0.05)
+
+    def test_fan_out(self):
+        expected = self.expected_events()
+        player = evemu.fan_out(self.get_device_file(), self.get_events_file(),
+                               3, offsets=[0, 200], stagger=100)
+        devices = player.devices
+        self.assertEqual(len(devices), 3)
+        self.assertEqual(len(set(d.devnode for d in devices)), 3)
+        readers = [NodeReader(d.devnode) for d in devices]
+        player.run()
+
+        events = [r.stop() for r in readers]
+        for e in events:
+            self.assertEqual(event_values(e), expected)
+        # the n-th device starts at its offset plus n * stagger
+        for (e, start) in zip(events, [0, 0.3, 0.2]):
+            self.assertAlmostEqual(e[0][0] - events[0][0][0], start,
+                                   delta=0.05)
+
+    def test_fan_out_invalid(self):
+        self.assertRaises(ValueError, evemu.fan_out, self.get_device_file(),
+                          self.get_events_file(), 0)
+
+    def test_flight_recorder(self):
+        device = evemu.Device(self.get_device_file())
+        triggered = threading.Event()
+        recorder = evemu.FlightRecorder(device, seconds=10,
+                                        triggers=["EV_KEY:BTN_TOUCH=0"],
+                                        on_trigger=lambda r: triggered.set())
+        with recorder:
+            with open(self.get_events_file()) as e:
+                device.play(e)
+            self.assertTrue(triggered.wait(5))
+            with tempfile.NamedTemporaryFile(mode="w+t") as f:
+                nevents = recorder.dump(f)
+                self.assertTrue(nevents > 0)
+                f.seek(0)
+                self.assertEqual(len(extract_events(f.readlines())),
+                                 nevents)
+        self.assertEqual(recorder.error, None)
+
+        recorder.clear()
+        self.assertEqual(len(recorder), 0)
+
+    def test_flight_recorder_invalid_trigger(self):
+        device = evemu.Device(self.get_device_file(), create=False)
+        self.assertRaises(evemu.exception.ExecutionError,
+                          evemu.FlightRecorder, device, triggers=["foo"])
+
+    def test_list_devices(self):
+        device = evemu.Device(self.get_device_file())
+        infos = [d for d in evemu.list_devices()
+                 if d.devnode == device.devnode]
+        self.assertEqual(len(infos), 1)
+        info = infos[0]
+        self.assertEqual(info.name, device.name)
+        self.assertEqual(info.id_vendor, device.id_vendor)
+        self.assertTrue(info.has_event("EV_ABS", "ABS_X"))
+        self.assertFalse(info.has_event("EV_REL", "REL_X"))
+
+        # the node is removed asynchronously
+        devnode = device.devnode
+        del device
+        for _ in range(50):
+            if devnode not in [d.devnode for d in evemu.list_devices()]:
+                break
+            time.sleep(0.1)
+        else:
+            self.fail("%s still listed" % devnode)
+
+    def test_list_devices_cached(self):
+        self.assertEqual([d.devnode for d in evemu.list_devices()],
+                         [d.devnode for d in evemu.list_devices()])
+
+    def test_wait_for_devnodes(self):
+        tmpdir = tempfile.mkdtemp()
+        devnode = os.path.join(tmpdir, "input", "event0")
+
+        def create_later():
+            time.sleep(0.05)
+            os.mkdir(os.path.dirname(devnode))
+            open(devnode, "w").close()
+
+        creator = threading.Thread(target=create_later)
+        creator.start()
+        try:
+            evemu.wait_for_devnodes([devnode], timeout=5)
+        finally:
+            creator.join()
+            shutil.rmtree(tmpdir)
+
+    def test_wait_for_devnodes_timeout(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            self.assertRaises(evemu.exception.DevnodeTimeoutError,
+                              evemu.wait_for_devnodes,
+                              [os.path.join(tmpdir, "event0")], 0.01)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_node_watch_dispatch(self):
+        tmpdir = tempfile.mkdtemp()
+        devnode = os.path.join(tmpdir, "event0")
+        try:
+            watch = evemu.NodeWatch([devnode])
+            self.assertEqual(watch.dispatch(), 1)
+            open(devnode, "w").close()
+            select.select([watch.fileno()], [], [], 5)
+            self.assertEqual(watch.dispatch(), 0)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_create_devices(self):
+        devices = evemu.create_devices([self.get_device_file()] * 3)
+        self.assertEqual(len(set(d.devnode for d in devices)), 3)
+        for d in devices:
+            self.assertTrue(d.has_event("EV_ABS", "ABS_X"))
+
+    def test_stats_disabled(self):
+        device = evemu.Device(self.get_device_file(), create=False)
+        self.assertEqual(device.stats, None)
+
+    def test_play_stats(self):
+        device = evemu.Device(self.get_device_file())
+        device.enable_stats()
+        with open(self.get_events_file()) as e:
+            nevents = len(extract_events(e.readlines()))
+            e.seek(0)
+            device.play(e)
+
+        stats = device.stats
+        self.assertEqual(stats["events_read"], nevents)
+        self.assertEqual(stats["events_written"], nevents)
+        self.assertEqual(stats["write_calls"], nevents)
+        self.assertEqual(stats["parse_failures"], 0)
+        self.assertEqual(stats["short_writes"], 0)
+        self.assertEqual(sum(stats["sleep_overshoot"]), stats["sleeps"])
+
+    def test_play_trace(self):
+        device = evemu.Device(self.get_device_file())
+        with open(self.get_events_file()) as e:
+            nevents = len(extract_events(e.readlines()))
+            e.seek(0)
+            with tempfile.TemporaryFile(mode="w+") as trace:
+                device.play(e, trace=trace)
+                trace.seek(0)
+                events = json.load(trace)["traceEvents"]
+
+        names = [t["name"] for t in events]
+        self.assertEqual(names.count("parse"), nevents)
+        self.assertEqual(names.count("write"), nevents)
+        self.assertEqual(names.count("frame"), names.count("lateness_us"))
+
+    def test_latency(self):
+        device = evemu.Device(self.get_device_file(), create=False)
+        self.assertEqual(device.latency, None)
+        device.enable_latency(stall=0.01)
+        latency = device.latency
+        self.assertEqual(latency["frames"], 0)
+        self.assertEqual(len(latency["histogram"]),
+                         evemu.base.EVEMU_LATENCY_BUCKETS)
+        self.assertEqual(latency["stall"], [])
+
+    def test_add_checkpoints(self):
+        device = evemu.Device(self.get_device_file(), create=False)
+        with open(self.get_events_file()) as ef:
+            with tempfile.TemporaryFile(mode="w+") as out:
+                evemu.add_checkpoints(ef, out, interval=0.5)
+                out.seek(0)
+                lines = out.readlines()
+                self.assertTrue(lines[0].startswith("# EVEMU"))
+                checkpoints = [l for l in lines if l.startswith("# C:")]
+                self.assertTrue(len(checkpoints) > 1)
+                self.assertEqual(checkpoints[0].split()[2], "0.000000")
+
+                # readers skip the checkpoints
+                out.seek(0)
+                ef.seek(0)
+                self.assertEqual(
+                        [(e.type, e.code, e.value) for e in device.events(out)],
+                        [(e.type, e.code, e.value) for e in device.events(ef)])
+
+        self.assertRaises(ValueError, evemu.add_checkpoints, ef, ef, 0)
+        self.assertRaises(TypeError, evemu.add_checkpoints, "a", "b")
+
+    def seek(self, device, events_file, start):
+        """
+        Returns the state-restore frame of evemu_seek() at start and the
+        events after it, as (type, code, value) tuples.
+        """
+        libc = evemu.base.LibC()
+        libevemu = evemu.base.LibEvemu()
+        fs = libc.fdopen(os.dup(events_file.fileno()), b"r")
+        frame = ctypes.POINTER(evemu.base.InputEvent)()
+        n = libevemu.evemu_seek(device._evemu_device, fs,
+                                int(start * 1000000), ctypes.byref(frame))
+        restore = [(frame[i].type, frame[i].code, frame[i].value)
+                   for i in range(n)]
+        libc.free(frame)
+
+        event = evemu.base.InputEvent()
+        events = []
+        while libevemu.evemu_read_event(fs, ctypes.byref(event)) > 0:
+            events.append((event.type, event.code, event.value))
+        libc.fclose(fs)
+        events_file.seek(0)
+
+        return (restore, events)
+
+    def test_play_from_checkpoint(self):
+        # the recording has absolute timestamps, a touch is down then
+        start = 1299660667.1
+        device = evemu.Device(self.get_device_file())
+        with open(self.get_events_file()) as ef:
+            with tempfile.TemporaryFile(mode="w+") as out:
+                evemu.add_checkpoints(ef, out, interval=0.05)
+                out.seek(0)
+                (restore, events) = self.seek(device, out, start)
+                self.assertTrue(len(restore) > 1)
+                self.assertEqual(restore[-1], (0x00, 0x00, 0))
+                self.assertIn((0x01, 0x14a, 1), restore)
+
+                reader = NodeReader(device.devnode)
+                device.play(out, start=start)
+
+        # one frame restores the state at start, then the events from the
+        # first frame at or after start follow
+        self.assertEqual(event_values(reader.stop()), restore + events)
+
+    def test_read_events_filtered(self):
+        device = evemu.Device(self.get_device_file(), create=False)
+        events_file = self.get_events_file()
+        with open(events_file) as ef:
+            f = evemu.Filter("select=EV_KEY")
+            events = [e for e in device.events(ef, filter=f)]
+            self.assertTrue(len(events) > 1)
+            for e in events:
+                self.assertTrue(e.matches("EV_KEY") or e.matches("EV_SYN"))
+
+    def test_follow_events(self):
+        device = evemu.Device(self.get_device_file(), create=False)
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        output = os.path.join(tmpdir, "out")
+
+        def append(segment, value):
+            time.sleep(0.05)
+            with open("%s.2026-01-01-00:00:0%d" % (output, segment), "a") as f:
+                f.write("E: 0.000001 0002 0000 %04d\n" % value)
+
+        append(0, 1)
+        with open("%s.2026-01-01-00:00:00" % output) as f:
+            # a file is followed from its current offset
+            f.readline()
+            thread = threading.Thread(target=append, args=(0, 2))
+            thread.start()
+            events = device.events(f, follow=True, timeout=1)
+            self.assertEqual(next(events).value, 2)
+            thread.join()
+
+        thread = threading.Thread(target=append, args=(1, 3))
+        thread.start()
+        events = [e.value for e in device.events(output, follow=True,
+                                                 timeout=0.5)]
+        thread.join()
+        self.assertEqual(events, [1, 2, 3])
+
+    def test_filter_remap(self):
+        f = evemu.Filter("remap=BTN_LEFT=BTN_RIGHT,drop=EV_MSC")
+        events = [evemu.InputEvent(0, 0, 0x01, 0x110, 1),
+                  evemu.InputEvent(0, 0, 0x04, 0x05, 1),
+                  evemu.InputEvent(0, 0, 0x00, 0x00, 0)]
+        out = [(e.type, e.code, e.value) for e in f.filter(events)]
+        self.assertEqual(out, [(0x01, 0x111, 1), (0x00, 0x00, 0)])
+
+    def test_filter_reduction(self):
+        device = evemu.Device(self.get_device_file(), create=False)
+        f = evemu.Filter()
+        f.enable_reduction(device)
+        events = [evemu.InputEvent(0, 0, 0x01, 0x14a, 1),
+                  evemu.InputEvent(0, 0, 0x03, 0x00, 1000),
+                  evemu.InputEvent(0, 0, 0x00, 0x00, 0),
+                  evemu.InputEvent(0, 0, 0x01, 0x14a, 1),
+                  evemu.InputEvent(0, 0, 0x03, 0x00, 1010),
+                  evemu.InputEvent(0, 0, 0x00, 0x00, 0)]
+        out = [(e.type, e.code, e.value) for e in f.filter(events)]
+        self.assertEqual(out, [(0x01, 0x14a, 1), (0x03, 0x00, 1000),
+                               (0x00, 0x00, 0)])
+        self.assertEqual(f.reduced, 3)
+
+    def test_filter_invalid_rule(self):
+        self.assertRaises(evemu.exception.ExecutionError,
+                          evemu.Filter, "foo=bar")
+
 class DevicePropertiesTestCase(evemu.testing.testcase.BaseTestCase):
     """
     Verifies the workings of the various device property accessors.
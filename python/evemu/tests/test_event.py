@@ -0,0 +1,82 @@
+import os
+import struct
+import tempfile
+import time
+import unittest
+
+import evemu
+import evemu.event
+import evemu.testing.testcase
+
+
+class EventTestCase(evemu.testing.testcase.BaseTestCase):
+    """
+    Verifies the batched event writer.
+    """
+
+    def setUp(self):
+        super(EventTestCase, self).setUp()
+        self.output = tempfile.TemporaryFile()
+
+    def tearDown(self):
+        self.output.close()
+        super(EventTestCase, self).tearDown()
+
+    def written(self):
+        self.output.seek(0)
+        data = self.output.read()
+        size = struct.calcsize("llHHi")
+        return [struct.unpack_from("llHHi", data, offset)[2:]
+                for offset in range(0, len(data), size)]
+
+    def test_parse_line(self):
+        parse = evemu.event.parse_line
+        self.assertEqual(parse("EV_KEY KEY_A 1"), (None, 0x01, 30, 1))
+        self.assertEqual(parse("  1 30 0x0 "), (None, 0x01, 30, 0))
+        self.assertEqual(parse("E: 1.000020 0003 0035 -1"),
+                         (1000020, 0x03, 0x35, -1))
+        self.assertEqual(parse("# comment"), None)
+        self.assertEqual(parse(""), None)
+        self.assertRaises(ValueError, parse, "EV_FOO KEY_A 1")
+        self.assertRaises(ValueError, parse, "EV_KEY KEY_A")
+        self.assertRaises(ValueError, parse, "E: 1.0")
+
+    def test_batch(self):
+        writer = evemu.event.EventWriter(self.output.fileno())
+        for i in range(63):
+            writer.write("EV_REL", "REL_X", i)
+        self.assertEqual(self.written(), [])
+        writer.sync()
+        self.assertEqual(len(self.written()), 64)
+        writer.write(0x01, 30, 1)
+        writer.close()
+        self.assertEqual(self.written()[-1], (0x01, 30, 1))
+        # the caller's file descriptor stays open
+        os.fstat(self.output.fileno())
+
+    def test_play_lines(self):
+        lines = ["EV_KEY KEY_A 1", "# comment", "EV_KEY KEY_A 0"]
+        with evemu.event.EventWriter(self.output.fileno()) as writer:
+            count = evemu.event.play_lines(writer, lines, sync=True)
+        self.assertEqual(count, 2)
+        self.assertEqual(self.written(), [(0x01, 30, 1), (0x00, 0, 0),
+                                          (0x01, 30, 0), (0x00, 0, 0)])
+
+    def test_play_lines_timed(self):
+        lines = ["E: 5.000000 0001 001e 0001", "E: 5.000000 0000 0000 0000",
+                 "E: 5.100000 0001 001e 0000", "E: 5.100000 0000 0000 0000"]
+        start = time.time()
+        with evemu.event.EventWriter(self.output.fileno()) as writer:
+            evemu.event.play_lines(writer, lines, timed=True)
+        self.assertTrue(time.time() - start >= 0.1)
+        self.assertEqual(len(self.written()), 4)
+
+    def test_play_lines_delay(self):
+        lines = ["EV_KEY KEY_A 1", "EV_KEY KEY_A 0"]
+        start = time.time()
+        with evemu.event.EventWriter(self.output.fileno()) as writer:
+            evemu.event.play_lines(writer, lines, sync=True, delay=0.05)
+        self.assertTrue(time.time() - start >= 0.1)
+
+if __name__ == "__main__":
+    unittest.main()
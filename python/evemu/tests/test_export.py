@@ -0,0 +1,160 @@
+import array
+import ast
+import csv
+import json
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+import zipfile
+
+import evemu
+import evemu.exception
+import evemu.export
+import evemu.testing.testcase
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+def read_npy(data):
+    """
+    Returns (descr, shape, array.array) for the given .npy file content.
+    """
+    (length,) = struct.unpack("<H", data[8:10])
+    header = ast.literal_eval(data[10:10 + length].decode("latin1"))
+    typecode = {"i8": "q", "u2": "H", "i4": "i"}[header["descr"][1:]]
+    values = array.array(typecode)
+    values.frombytes(data[10 + length:])
+    return (header["descr"], header["shape"], values)
+
+
+class ExportTestCase(evemu.testing.testcase.BaseTestCase):
+    """
+    Verifies the columnar recording export.
+    """
+
+    def setUp(self):
+        super(ExportTestCase, self).setUp()
+        self.outdir = tempfile.mkdtemp()
+        self.events = []
+        with open(self.get_events_file()) as f:
+            for line in f:
+                if line.startswith("E:"):
+                    fields = line.split()
+                    (sec, usec) = fields[1].split(".")
+                    self.events.append((int(sec) * 1000000 + int(usec),
+                                        int(fields[2], 16),
+                                        int(fields[3], 16),
+                                        int(fields[4])))
+
+    def tearDown(self):
+        shutil.rmtree(self.outdir)
+        super(ExportTestCase, self).tearDown()
+
+    def output(self, name):
+        return os.path.join(self.outdir, name)
+
+    def test_npz(self):
+        paths = evemu.export.export(self.get_events_file(),
+                                    self.output("events.npz"),
+                                    touches=True, chunk_size=7)
+        self.assertEqual(paths, [self.output("events.npz")])
+        self.assertEqual(os.listdir(self.outdir), ["events.npz"])
+
+        with zipfile.ZipFile(paths[0]) as archive:
+            columns = {}
+            for name in ("time", "type", "code", "value"):
+                (_, shape, values) = read_npy(archive.read(name + ".npy"))
+                self.assertEqual(shape, (len(self.events),))
+                columns[name] = values
+            self.assertEqual(list(zip(columns["time"], columns["type"],
+                                      columns["code"], columns["value"])),
+                             self.events)
+
+            (descr, shape, absinfo) = read_npy(archive.read("absinfo.npy"))
+            self.assertEqual(shape[1], 6)
+            self.assertEqual(list(absinfo[:6]), [0, 0, 9600, 75, 0, 0])
+
+            (_, shape, frames) = read_npy(archive.read("touch_frame.npy"))
+            self.assertTrue(shape[0] > 0)
+            self.assertEqual(list(frames), sorted(frames))
+
+            metadata = json.loads(archive.read("metadata.json").decode())
+            self.assertEqual(metadata["vendor"], 0x1b96)
+            self.assertEqual(metadata["absinfo"][0]["name"], "ABS_X")
+
+    def test_chunk_size(self):
+        a = evemu.export.export(self.get_events_file(), self.output("a.npz"),
+                                touches=True, chunk_size=1)[0]
+        b = evemu.export.export(self.get_events_file(), self.output("b.npz"),
+                                touches=True)[0]
+        with zipfile.ZipFile(a) as za:
+            with zipfile.ZipFile(b) as zb:
+                for name in za.namelist():
+                    self.assertEqual(za.read(name), zb.read(name))
+
+    def test_csv(self):
+        paths = evemu.export.export(self.get_events_file(),
+                                    self.output("events.csv"),
+                                    touches=True)
+        self.assertEqual(sorted(paths), [self.output("events.csv"),
+                                         self.output("events.json"),
+                                         self.output("events.touches.csv")])
+        with open(self.output("events.csv")) as f:
+            rows = list(csv.reader(f))
+        self.assertEqual(rows[0], ["time", "type", "code", "value"])
+        self.assertEqual([tuple(int(v) for v in row) for row in rows[1:]],
+                         self.events)
+
+        with open(self.output("events.touches.csv")) as f:
+            touches = list(csv.DictReader(f))
+        # three fingers in the first frame
+        self.assertEqual([t["slot"] for t in touches if t["frame"] == "0"],
+                         ["0", "1", "2"])
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, evemu.export.export,
+                          self.get_events_file(), self.output("events.foo"))
+        self.assertRaises(ValueError, evemu.export.export,
+                          self.get_events_file(), self.output("events.npz"),
+                          chunk_size=0)
+
+    @unittest.skipIf(pyarrow is not None, "pyarrow is installed")
+    def test_arrow_unavailable(self):
+        self.assertRaises(evemu.exception.ExecutionError,
+                          evemu.export.export, self.get_events_file(),
+                          self.output("events.arrow"))
+
+    @unittest.skipIf(pyarrow is None, "pyarrow is not installed")
+    def test_arrow(self):
+        import pyarrow.ipc
+        path = evemu.export.export(self.get_events_file(),
+                                   self.output("events.arrow"),
+                                   chunk_size=7)[0]
+        table = pyarrow.ipc.open_file(path).read_all()
+        self.assertEqual(table.num_rows, len(self.events))
+        self.assertEqual(table.column("value").to_pylist(),
+                         [e[3] for e in self.events])
+
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_numpy_load(self):
+        path = evemu.export.export(self.get_events_file(),
+                                   self.output("events.npz"),
+                                   touches=True)[0]
+        data = numpy.load(path)
+        self.assertEqual(data["time"].dtype, numpy.int64)
+        self.assertEqual(data["code"].dtype, numpy.uint16)
+        self.assertEqual(list(data["value"]), [e[3] for e in self.events])
+        self.assertEqual(data["absinfo"].shape[1], 6)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+import evemu
+import evemu.index
+import evemu.testing.testcase
+
+
+class IndexTestCase(evemu.testing.testcase.BaseTestCase):
+    """
+    Verifies the SQLite recording index.
+    """
+
+    def setUp(self):
+        super(IndexTestCase, self).setUp()
+        self.corpus = tempfile.mkdtemp()
+        for name in ("ntrig-dell-xt2.event", "3m.event", "synaptics.prop"):
+            shutil.copy(os.path.join(self.data_dir, name), self.corpus)
+        with open(os.path.join(self.corpus, "README"), "w") as f:
+            f.write("not a recording\n")
+        self.index = evemu.index.Index(os.path.join(self.corpus, ".index"))
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.corpus)
+        super(IndexTestCase, self).tearDown()
+
+    def path(self, name):
+        return os.path.join(self.corpus, name)
+
+    def test_update(self):
+        (indexed, unchanged, removed) = self.index.update([self.corpus])
+        self.assertEqual((indexed, unchanged, removed), (4, 0, 0))
+        self.assertEqual(len(self.index), 3)
+
+        (indexed, unchanged, removed) = self.index.update([self.corpus],
+                                                          processes=1)
+        self.assertEqual((indexed, unchanged, removed), (0, 4, 0))
+
+        with open(self.path("3m.event"), "a") as f:
+            f.write("E: 100.000000 0000 0000 0000\n")
+        os.unlink(self.path("synaptics.prop"))
+        (indexed, unchanged, removed) = self.index.update([self.corpus])
+        self.assertEqual((indexed, unchanged, removed), (1, 2, 1))
+        self.assertEqual(len(self.index), 2)
+
+    def test_get(self):
+        self.index.update([self.corpus])
+        info = self.index.get(self.path("ntrig-dell-xt2.event"))
+        self.assertEqual(info["name"], "N-Trig-MultiTouch-Virtual-Device")
+        self.assertEqual(info["vendor"], 0x1b96)
+        self.assertEqual(info["absinfo"][0x00], (0, 9600, 75, 0, 0))
+        self.assertTrue(info["frames"] > 1)
+        self.assertEqual(sum(info["counts"].values()), info["events"])
+        self.assertEqual(self.index.get(self.path("README")), None)
+
+    def test_find(self):
+        self.index.update([self.corpus])
+        ntrig = self.path("ntrig-dell-xt2.event")
+        synaptics = self.path("synaptics.prop")
+        self.assertEqual(self.index.find(vendor=0x1b96), [ntrig])
+        self.assertTrue(ntrig in self.index.find(min_touches=2))
+        self.assertFalse(synaptics in self.index.find(min_touches=1))
+        self.assertEqual(self.index.find(name="foo"), [])
+        self.assertTrue(synaptics in
+                        self.index.find(capabilities=["BTN_TOOL_TRIPLETAP"]))
+        self.assertFalse(synaptics in
+                         self.index.find(events=["EV_ABS"]))
+        self.assertTrue(ntrig in
+                        self.index.find(events=["EV_ABS:ABS_MT_POSITION_X"]))
+        self.assertRaises(ValueError, self.index.find,
+                          props=["INPUT_PROP_FOO"])
+
+    def test_compressed(self):
+        with open(self.path("3m.event"), "rb") as src:
+            with gzip.open(self.path("3m.event.gz"), "wb") as dst:
+                dst.write(src.read())
+        self.index.update([self.path("3m.event"), self.path("3m.event.gz")])
+        plain = self.index.get(self.path("3m.event"))
+        compressed = self.index.get(self.path("3m.event.gz"))
+        self.assertEqual(plain, compressed)
+
+    def test_read_recording(self):
+        lines = list(evemu.index.read_recording(
+                self.path("ntrig-dell-xt2.event")))
+        tags = dict(lines)
+        self.assertEqual(tags["N:"], "N-Trig-MultiTouch-Virtual-Device")
+        self.assertEqual(tags["I:"], [0x03, 0x1b96, 0x01, 0x110])
+        self.assertTrue(("A:", (0x00, 0, 9600, 75, 0, 0)) in lines)
+        events = [v for (tag, v) in lines if tag == "E:"]
+        self.assertEqual(len(events[0]), 4)
+        self.assertEqual(list(evemu.index.read_recording(self.path("README"))),
+                         [])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+import tempfile
+import unittest
+
+import evemu.latency
+import evemu.testing.testcase
+
+
+class LatencyTestCase(evemu.testing.testcase.BaseTestCase):
+    """
+    Verifies the round-trip latency harness.
+    """
+
+    def test_percentiles(self):
+        latencies = evemu.latency.Latencies(range(1000, 0, -1))
+        self.assertEqual(latencies.min, 1)
+        self.assertEqual(latencies.max, 1000)
+        self.assertEqual(latencies.p50, 500)
+        self.assertEqual(latencies.p99, 990)
+        self.assertEqual(latencies.p999, 999)
+        self.assertEqual(latencies.percentile(100), 1000)
+        self.assertEqual(latencies.mean, 500.5)
+
+    def test_no_samples(self):
+        latencies = evemu.latency.Latencies([])
+        self.assertEqual(latencies.p50, None)
+        self.assertEqual(str(latencies), "no samples")
+
+    def test_invalid_arguments(self):
+        self.assertRaises(ValueError, evemu.latency.measure, rate=0)
+        self.assertRaises(ValueError, evemu.latency.measure, burst=-1)
+
+    def test_reader_closed_on_error(self):
+        # not an evdev node, the reader fails to set its clock
+        with tempfile.NamedTemporaryFile() as f:
+            reader = evemu.latency._Reader(f.name, 1)
+            with self.assertRaises(OSError):
+                with reader:
+                    pass
+        self.assertFalse(reader._process.is_alive())
+        self.assertTrue(reader._conn.closed)
+
+    def test_measure(self):
+        result = evemu.latency.measure(rate=500, count=100, burst=2)
+        self.assertEqual(result.sent, 100)
+        self.assertEqual(result.received, 100)
+        self.assertEqual(result.lost, 0)
+        self.assertEqual(len(result.round_trip), 100)
+        self.assertTrue(result.round_trip.p50 > 0)
+        self.assertTrue(result.round_trip.p999 >= result.round_trip.p50)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+import os
+import struct
+import threading
+import unittest
+
+import evemu
+import evemu.exception
+import evemu.shm
+import evemu.testing.testcase
+
+
+class ShmTestCase(evemu.testing.testcase.BaseTestCase):
+    """
+    Verifies the shared memory fan-out of events.
+    """
+
+    def setUp(self):
+        super(ShmTestCase, self).setUp()
+        self.name = "/evemu-test-shm-%d" % os.getpid()
+        # rounded down to 16 events
+        self.publisher = evemu.shm.Publisher(
+                self.name, 19 * struct.calcsize("llHHi"))
+
+    def tearDown(self):
+        self.publisher.close()
+        super(ShmTestCase, self).tearDown()
+
+    def publish(self, first, count):
+        events = [(1, i, 0x03, 0x00, i) for i in range(first, first + count)]
+        self.assertEqual(self.publisher.publish(events), count)
+
+    def values(self, view):
+        return [e.value for e in evemu.shm.unpack(view)]
+
+    def test_read(self):
+        self.assertEqual(self.publisher.capacity, 16)
+        self.publish(100, 2)
+        with evemu.shm.Subscriber(self.name) as subscriber:
+            self.assertEqual(subscriber.capacity, 16)
+            # only events published from now on
+            self.assertEqual(subscriber.read(timeout=0), None)
+
+            self.publisher.publish([evemu.InputEvent(2, 5, 0x01, 0x110, 1)])
+            view = subscriber.read(timeout=0)
+            self.assertTrue(view.readonly)
+            event = list(evemu.shm.unpack(view))[0]
+            self.assertEqual((event.sec, event.usec, event.type, event.code,
+                              event.value), (2, 5, 0x01, 0x110, 1))
+            self.assertTrue(subscriber.valid())
+
+            # the ring wraps after 13 more events
+            self.publish(0, 15)
+            self.assertEqual(self.values(subscriber.read(timeout=0)),
+                             list(range(0, 13)))
+            self.assertEqual(self.values(subscriber.read(timeout=0)),
+                             [13, 14])
+
+            self.publisher.close()
+            self.assertEqual(list(subscriber), [])
+            self.assertTrue(subscriber.closed)
+
+    def test_overrun(self):
+        with evemu.shm.Subscriber(self.name) as subscriber:
+            self.publish(0, 4)
+            view = subscriber.read(timeout=0)
+            self.assertEqual(self.values(view), [0, 1, 2, 3])
+            self.publish(4, 12)
+            self.assertTrue(subscriber.valid())
+            self.publish(16, 1)
+            self.assertFalse(subscriber.valid())
+
+            # 13 events left in the ring, 20 more overwrite them
+            self.publish(17, 20)
+            self.assertEqual(self.values(subscriber.read(timeout=0))[0], 21)
+            self.assertEqual(subscriber.lost, 17)
+
+    def test_wakeup(self):
+        subscriber = evemu.shm.Subscriber(self.name)
+        values = []
+
+        def read():
+            for view in subscriber:
+                values.extend(self.values(view))
+
+        thread = threading.Thread(target=read)
+        thread.start()
+        self.publish(0, 3)
+        self.publisher.close()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(values, [0, 1, 2])
+        subscriber.close()
+
+    def test_no_segment(self):
+        self.publisher.close()
+        self.assertRaises(evemu.exception.ExecutionError,
+                          evemu.shm.Subscriber, self.name)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+import os
+import struct
+import tempfile
+import unittest
+
+import evemu
+import evemu.base
+import evemu.event
+import evemu.testing.testcase
+
+
+class SpeedupsTestCase(evemu.testing.testcase.BaseTestCase):
+    """
+    Verifies that the compiled accelerator and the ctypes fallback give the
+    same results.
+    """
+
+    def setUp(self):
+        super(SpeedupsTestCase, self).setUp()
+        if evemu.base.accelerator is None:
+            self.skipTest("evemu._speedups is not available")
+        self.accelerator = evemu.base.accelerator
+        self.prop = open(self.get_device_file())
+        self.dev = evemu.Device(self.prop, create=False)
+
+    def tearDown(self):
+        evemu.base.accelerator = self.accelerator
+        super(SpeedupsTestCase, self).tearDown()
+
+    def both(self, func):
+        """
+        Returns (accelerated, fallback) results of func().
+        """
+        accelerated = func()
+        evemu.base.accelerator = None
+        try:
+            fallback = func()
+        finally:
+            evemu.base.accelerator = self.accelerator
+        return (accelerated, fallback)
+
+    def read_events(self, f):
+        events = [(e.sec, e.usec, e.type, e.code, e.value)
+                  for e in self.dev.events(f)]
+        # the file is rewound after the last event
+        self.assertEqual(os.lseek(f.fileno(), 0, os.SEEK_CUR), 0)
+        return events
+
+    def test_events(self):
+        with open(self.get_events_file()) as f:
+            (accelerated, fallback) = self.both(lambda: self.read_events(f))
+        self.assertTrue(len(accelerated) > 100)
+        self.assertEqual(accelerated, fallback)
+
+    def test_events_invalid(self):
+        with tempfile.TemporaryFile("w+") as f:
+            f.write("E: 0.000001 0003 0000 0010\n"
+                    "E: 0.000001 0000 0000 0000\n"
+                    "E: foo\n"
+                    "E: 0.000002 0000 0000 0000\n")
+            f.flush()
+            f.seek(0)
+            (accelerated, fallback) = self.both(lambda: self.read_events(f))
+        self.assertEqual(accelerated, [(0, 1, 3, 0, 10), (0, 1, 0, 0, 0)])
+        self.assertEqual(accelerated, fallback)
+
+    def test_format(self):
+        events = [evemu.InputEvent(0, 0, 0x00, 0x00, 0),
+                  evemu.InputEvent(1, 20, 0x03, 0x35, -1),
+                  evemu.InputEvent(1, 20, 0x01, 0x14a, 1),
+                  evemu.InputEvent(1, 20, 0x00, 0x00, 0),
+                  evemu.InputEvent(1, 9020, 0x00, 0x00, 0),
+                  evemu.InputEvent(2, 0, 0x11, 0x01, 1)]
+        # the +Nms of a SYN_REPORT is relative to the previous one, so the
+        # first one only sets a common start
+        (accelerated, fallback) = self.both(
+                lambda: [str(e) for e in events])
+        self.assertEqual(accelerated[1], "E: 1.000020 0003 0035 -001\t"
+                                         "# EV_ABS / ABS_MT_POSITION_X    -1")
+        self.assertTrue(accelerated[4].endswith("+9ms"))
+        self.assertEqual(accelerated[1:], fallback[1:])
+
+    def test_write_events(self):
+        def write():
+            with tempfile.TemporaryFile() as f:
+                with evemu.event.EventWriter(f.fileno()) as writer:
+                    writer.write("EV_ABS", "ABS_X", 100)
+                    writer.write(0x01, 0x14a, -1)
+                    writer.sync()
+                f.seek(0)
+                return f.read()
+
+        (accelerated, fallback) = self.both(write)
+        self.assertEqual(len(accelerated), 3 * struct.calcsize("llHHi"))
+        self.assertEqual(accelerated, fallback)
+
+    def test_capabilities(self):
+        libevemu = evemu.base.LibEvemu()
+        (accelerated, fallback) = self.both(
+                lambda: evemu._capabilities(libevemu, self.dev._evemu_device))
+        self.assertEqual(sorted(accelerated), [0x00, 0x01, 0x03])
+        self.assertEqual(accelerated, fallback)
+
+if __name__ == "__main__":
+    unittest.main()
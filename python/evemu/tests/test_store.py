@@ -0,0 +1,142 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import evemu
+import evemu.store
+import evemu.testing.testcase
+
+
+class StoreTestCase(evemu.testing.testcase.BaseTestCase):
+    """
+    Verifies the content-addressed recording store.
+    """
+
+    def setUp(self):
+        super(StoreTestCase, self).setUp()
+        self.store_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.store_dir)
+        super(StoreTestCase, self).tearDown()
+
+    def make_recording(self, skip=0):
+        """
+        Writes the test device and its events, minus the first skip event
+        lines, to a temporary recording.
+        """
+        f = tempfile.NamedTemporaryFile(mode="w+t", suffix=".evemu")
+        with open(self.get_device_file()) as prop_file:
+            f.write(prop_file.read())
+        with open(self.get_events_file()) as events_file:
+            events = [l for l in events_file if l.startswith("E:")]
+        f.writelines(events[skip:])
+        f.flush()
+        f.seek(0)
+        return f
+
+    def count_events(self, f):
+        return len([l for l in f if l.startswith("E:")])
+
+    def test_add(self):
+        store = evemu.store.Store(self.store_dir)
+        with self.make_recording() as f:
+            recording = store.add(f.name)
+            self.assertEqual(store.add(f.name).id, recording.id)
+            f.seek(0)
+            expected = self.count_events(f)
+
+        self.assertEqual(len(store), 1)
+        self.assertTrue(recording.id in store)
+        self.assertEqual(recording.name, "N-Trig-MultiTouch-Virtual-Device")
+        self.assertEqual(recording.vendor, 0x1b96)
+        with store.open(recording) as events_file:
+            self.assertEqual(self.count_events(events_file), expected)
+
+    def test_deduplicate(self):
+        store = evemu.store.Store(self.store_dir)
+        with self.make_recording() as f1:
+            with self.make_recording(skip=10) as f2:
+                r1 = store.add(f1)
+                r2 = store.add(f2)
+
+        self.assertNotEqual(r1.id, r2.id)
+        self.assertEqual(r1.description, r2.description)
+        self.assertEqual(len(os.listdir(os.path.join(self.store_dir,
+                                                     "descriptions"))), 1)
+        self.assertEqual(len(os.listdir(os.path.join(self.store_dir,
+                                                     "events"))), 2)
+        self.assertTrue(store.device(r1) is store.device(r2))
+
+    def test_reopen(self):
+        with self.make_recording() as f:
+            recording = evemu.store.Store(self.store_dir).add(f)
+
+        store = evemu.store.Store(self.store_dir)
+        self.assertEqual([r.id for r in store], [recording.id])
+        self.assertEqual(len(store.find(vendor=0x1b96, product=0x01)), 1)
+        self.assertEqual(store.find(name="foo"), [])
+        self.assertEqual(store.device(recording).id_vendor, 0x1b96)
+
+    def test_export(self):
+        store = evemu.store.Store(self.store_dir)
+        with self.make_recording() as f:
+            recording = store.add(f)
+            f.seek(0)
+            expected = self.count_events(f)
+
+        with tempfile.NamedTemporaryFile(mode="w+t") as out:
+            store.export(recording, out)
+            out.flush()
+            out.seek(0)
+            self.assertEqual(self.count_events(out), expected)
+            out.seek(0)
+            self.assertEqual(store.add(out).id, recording.id)
+
+    def test_checkpoint_header(self):
+        store = evemu.store.Store(self.store_dir)
+        checkpoint = ["# C: 0.000000 1\n", "# R: 0003 0000 100\n"]
+        with tempfile.NamedTemporaryFile(mode="w+t") as f:
+            with open(self.get_device_file()) as prop_file:
+                f.write(prop_file.read())
+            f.writelines(checkpoint)
+            with open(self.get_events_file()) as events_file:
+                f.writelines(l for l in events_file if l.startswith("E:"))
+            f.flush()
+            f.seek(0)
+            recording = store.add(f)
+
+        with store.open(recording) as events_file:
+            lines = events_file.readlines()
+        self.assertEqual(lines[:2], checkpoint)
+        self.assertTrue(lines[2].startswith("E:"))
+        with open(store.description_path(recording)) as desc_file:
+            self.assertFalse(any(l.startswith("# C:") for l in desc_file))
+
+    def test_index_appended(self):
+        store = evemu.store.Store(self.store_dir)
+        with self.make_recording() as f1:
+            with self.make_recording(skip=10) as f2:
+                store.add(f1)
+                store.add(f2)
+                f1.seek(0)
+                store.add(f1)
+
+        # one description and two recordings
+        with open(os.path.join(self.store_dir, "index.jsonl")) as index:
+            self.assertEqual(len(index.readlines()), 3)
+        self.assertEqual(len(evemu.store.Store(self.store_dir)), 2)
+
+    def test_no_description(self):
+        store = evemu.store.Store(self.store_dir)
+        with tempfile.NamedTemporaryFile(mode="w+t") as f:
+            with open(self.get_events_file()) as events_file:
+                f.writelines(l for l in events_file if l.startswith("E:"))
+            f.flush()
+            f.seek(0)
+            self.assertRaises(ValueError, store.add, f)
+        self.assertEqual(len(store), 0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+import unittest
+
+import evemu
+import evemu.verify
+import evemu.testing.testcase
+
+
+def frames(*times):
+    """
+    One single-event frame per timestamp, each with a distinct value.
+    """
+    return [(t, [(0x03, 0x00, n)]) for (n, t) in enumerate(times)]
+
+
+class VerifyTestCase(evemu.testing.testcase.BaseTestCase):
+    """
+    Verifies the loopback replay verification.
+    """
+
+    def match(self, expected, received, time_tolerance=None):
+        result = evemu.verify.VerifyResult()
+        return evemu.verify._match_frames(result, expected, received,
+                                          time_tolerance)
+
+    def test_match_identical(self):
+        expected = frames(0, 1000, 2000)
+        result = self.match(expected, frames(500, 1500, 2500))
+        self.assertTrue(result.faithful)
+        self.assertEqual(result.matched, 3)
+        self.assertEqual(result.timing.max, 0)
+        self.assertEqual(result.first_divergence, None)
+
+    def test_match_missing(self):
+        expected = frames(0, 1000, 2000, 3000)
+        received = [expected[0], expected[2]]
+        result = self.match(expected, received)
+        self.assertFalse(result.faithful)
+        self.assertEqual(result.matched, 2)
+        self.assertEqual(result.missing, 2)
+        self.assertEqual(result.extra, 0)
+        self.assertEqual(result.first_divergence.frame, 1)
+
+    def test_match_extra(self):
+        expected = frames(0, 1000)
+        received = [expected[0], (1000, [(0x01, 0x110, 1)]), expected[1]]
+        result = self.match(expected, received)
+        self.assertFalse(result.faithful)
+        self.assertEqual(result.matched, 2)
+        self.assertEqual(result.extra, 1)
+        self.assertEqual(result.missing, 0)
+        self.assertEqual(result.first_divergence.frame, 1)
+
+    def test_match_timing(self):
+        expected = frames(0, 1000, 2000)
+        result = self.match(expected, frames(0, 1300, 1900),
+                            time_tolerance=200)
+        self.assertFalse(result.faithful)
+        self.assertEqual(result.late, 1)
+        self.assertEqual(result.timing.max, 300)
+        self.assertEqual(result.missing, 0)
+
+    def test_expected_frames(self):
+        with open(self.get_device_file()) as prop_file:
+            device = evemu.Device(prop_file, create=False)
+            with open(self.get_events_file()) as events_file:
+                (expected, filtered) = evemu.verify._expected_frames(
+                        device, events_file, ["drop=EV_MSC"])
+        self.assertTrue(len(expected) > 1)
+        self.assertTrue(all(frame for (_, frame) in expected))
+        for (_, frame) in expected:
+            self.assertFalse([e for e in frame if e[0] == 0x04])
+
+    def test_invalid_file(self):
+        self.assertRaises(TypeError, evemu.verify.verify, None, "foo")
+
+    def test_verify(self):
+        device = evemu.Device(self.get_device_file())
+        with open(self.get_events_file()) as events_file:
+            result = evemu.verify.verify(device, events_file)
+        self.assertTrue(result.expected > 1)
+        self.assertEqual(result.received, result.expected)
+        self.assertEqual(result.dropped, 0)
+        self.assertTrue(result.faithful, str(result))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,321 @@
+"""
+The verify module replays a recording through a uinput device and checks
+what comes out of the device node against the source, frame by frame.
+
+The device node is opened before the replay starts and a reader thread
+reads the emitted events in batches while libevemu replays the recording.
+The source is run through a Filter with reduction enabled, so events the
+kernel is expected to discard (repeated key states, values within the
+axis fuzz, empty frames) are counted as filtered rather than missing.
+
+Frames lost to a full evdev client buffer show up as SYN_DROPPED and as
+missing frames, frames delivered late show up in the timing errors.
+"""
+
+import fcntl
+import os
+import select
+import struct
+import threading
+import time
+
+import evemu
+import evemu.compare
+import evemu.latency
+
+__all__ = ["VerifyResult",
+           "verify"]
+
+_EV_SYN = 0x00
+_SYN_REPORT = 0x00
+_SYN_DROPPED = 0x03
+
+# _IOW('E', 0xa0, int)
+_EVIOCSCLOCKID = 0x400445a0
+
+_EVENT_FORMAT = "llHHi"
+_EVENT_SIZE = struct.calcsize(_EVENT_FORMAT)
+_BATCH_SIZE = 64
+
+# how many expected frames a received frame may skip ahead
+_LOOKAHEAD = 64
+
+
+class VerifyResult(object):
+    """
+    The result of a verified replay.
+
+    expected -- the number of frames the device should have emitted
+    received -- the number of complete frames read from the device node
+    matched -- the number of received frames that matched an expected frame
+    missing -- the number of expected frames that were never received
+    extra -- the number of received frames that matched no expected frame
+    late -- the number of matched frames outside the time tolerance
+    dropped -- the number of SYN_DROPPED events seen by the reader
+    discarded -- the number of events discarded after a SYN_DROPPED
+    filtered -- the number of source events the kernel was expected to
+    discard
+    timing -- Latencies of the absolute timing error of each matched frame
+    in microseconds, relative to the first matched frame
+    first_divergence -- an evemu.compare.Divergence for the first missing
+    or extra frame, or None
+    """
+
+    def __init__(self):
+        self.expected = 0
+        self.received = 0
+        self.matched = 0
+        self.missing = 0
+        self.extra = 0
+        self.late = 0
+        self.dropped = 0
+        self.discarded = 0
+        self.filtered = 0
+        self.timing = evemu.latency.Latencies([])
+        self.first_divergence = None
+
+    @property
+    def faithful(self):
+        """
+        True if every expected frame was received in time and nothing else
+        was.
+        """
+        return (self.missing == 0 and self.extra == 0 and self.late == 0 and
+                self.dropped == 0)
+
+    def __bool__(self):
+        return self.faithful
+
+    __nonzero__ = __bool__
+
+    def as_dict(self):
+        return {"expected": self.expected,
+                "received": self.received,
+                "matched": self.matched,
+                "missing": self.missing,
+                "extra": self.extra,
+                "late": self.late,
+                "dropped": self.dropped,
+                "discarded": self.discarded,
+                "filtered": self.filtered,
+                "timing": self.timing.as_dict(),
+                "first_divergence": (str(self.first_divergence)
+                                     if self.first_divergence else None)}
+
+    def __str__(self):
+        lines = ["frames expected: %d (%d events filtered)" % (
+                    self.expected, self.filtered),
+                 "frames received: %d (%d SYN_DROPPED, %d events "
+                 "discarded)" % (self.received, self.dropped,
+                                 self.discarded),
+                 "frames matched: %d (%d missing, %d extra, %d late)" % (
+                    self.matched, self.missing, self.extra, self.late),
+                 "timing error: %s" % self.timing]
+        if self.first_divergence is not None:
+            lines.append("first divergence: %s" % self.first_divergence)
+        return "\n".join(lines)
+
+
+class _Reader(threading.Thread):
+    """
+    Reads the frames emitted by a device node as
+    (time in us, [(type, code, value), ...]) tuples, discarding the events
+    after a SYN_DROPPED up to the next SYN_REPORT.
+    """
+
+    def __init__(self, devnode, count):
+        super(_Reader, self).__init__()
+        self.daemon = True
+        self.frames = []
+        self.dropped = 0
+        self.discarded = 0
+        self._count = count
+        self._done = threading.Event()
+        self._fd = os.open(devnode, os.O_RDONLY | os.O_NONBLOCK)
+        fcntl.ioctl(self._fd, _EVIOCSCLOCKID,
+                    struct.pack("i", time.CLOCK_MONOTONIC))
+
+    def stop(self):
+        self._done.set()
+
+    def run(self):
+        frame = []
+        syncing = False
+        try:
+            while len(self.frames) < self._count and not self._done.is_set():
+                if not select.select([self._fd], [], [], 0.1)[0]:
+                    continue
+                data = os.read(self._fd, _EVENT_SIZE * _BATCH_SIZE)
+                for offset in range(0, len(data), _EVENT_SIZE):
+                    (sec, usec, t, c, v) = struct.unpack_from(
+                            _EVENT_FORMAT, data, offset)
+                    if t == _EV_SYN and c == _SYN_DROPPED:
+                        self.dropped += 1
+                        self.discarded += len(frame)
+                        frame = []
+                        syncing = True
+                    elif t == _EV_SYN and c == _SYN_REPORT:
+                        if not syncing:
+                            self.frames.append((sec * 1000000 + usec, frame))
+                        frame = []
+                        syncing = False
+                    elif syncing:
+                        self.discarded += 1
+                    else:
+                        frame.append((t, c, v))
+        finally:
+            os.close(self._fd)
+
+
+def _expected_frames(device, events_file, rules):
+    """
+    Returns the frames device should emit for events_file, and the number
+    of events the kernel is expected to discard.
+    """
+    model = evemu.Filter(*rules)
+    model.enable_reduction(device)
+
+    frames = []
+    frame = []
+    for e in device.events(events_file, filter=model):
+        if e.type == _EV_SYN and e.code == _SYN_REPORT:
+            frames.append((e.sec * 1000000 + e.usec, frame))
+            frame = []
+        else:
+            frame.append((e.type, e.code, e.value))
+
+    return (frames, model.reduced)
+
+
+def _match_frames(result, expected, received, time_tolerance=None):
+    """
+    Matches the received frames against the expected frames in order and
+    updates result. A received frame may match an expected frame up to
+    _LOOKAHEAD frames ahead, the frames skipped are missing.
+    """
+    result.expected = len(expected)
+    result.received = len(received)
+
+    errors = []
+    start = None
+    index = 0
+    for (n, actual) in enumerate(received):
+        end = min(index + _LOOKAHEAD, len(expected))
+        for i in range(index, end):
+            if expected[i][1] == actual[1]:
+                break
+        else:
+            result.extra += 1
+            if result.first_divergence is None:
+                e = expected[index] if index < len(expected) else None
+                result.first_divergence = evemu.compare.Divergence(
+                        index, "unexpected frame %d" % n, e, actual)
+            continue
+
+        if i > index:
+            result.missing += i - index
+            if result.first_divergence is None:
+                result.first_divergence = evemu.compare.Divergence(
+                        index, "frame missing", expected[index], None)
+
+        if start is None:
+            start = (expected[i][0], actual[0])
+        error = abs((actual[0] - start[1]) - (expected[i][0] - start[0]))
+        errors.append(error)
+        if time_tolerance is not None and error > time_tolerance:
+            result.late += 1
+        result.matched += 1
+        index = i + 1
+
+    if index < len(expected):
+        result.missing += len(expected) - index
+        if result.first_divergence is None:
+            result.first_divergence = evemu.compare.Divergence(
+                    index, "frame missing", expected[index], None)
+
+    result.timing = evemu.latency.Latencies(errors)
+    return result
+
+
+def verify(device, events_file, rules=(), time_tolerance=None, timeout=1.0):
+    """
+    Replays events_file through device and returns a VerifyResult
+    comparing the frames read back from the device node with the source.
+
+    device should be freshly created: its state is assumed to be the
+    initial state when the kernel filtering is modelled.
+
+    args:
+    events_file -- a real file with fileno(), as for Device.play()
+    rules -- filter rules applied to the replay, see Filter
+    time_tolerance -- the maximum timing error of a frame in
+    microseconds, or None to only report the timing errors
+    timeout -- how long to wait for outstanding frames after the replay,
+    in seconds
+
+    This requires write access to /dev/uinput and read access to the
+    device node (usually root).
+    """
+    if not hasattr(events_file, "fileno"):
+        raise TypeError("expected file")
+
+    (expected, filtered) = _expected_frames(device, events_file, rules)
+
+    reader = _Reader(device.devnode, len(expected))
+    reader.start()
+    try:
+        device.play(events_file,
+                    filter=evemu.Filter(*rules) if rules else None)
+        reader.join(timeout)
+    finally:
+        reader.stop()
+        reader.join()
+
+    result = VerifyResult()
+    result.dropped = reader.dropped
+    result.discarded = reader.discarded
+    result.filtered = filtered
+    return _match_frames(result, expected, reader.frames, time_tolerance)
+
+
+def main(args=None):
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(
+            prog="python -m evemu.verify",
+            description="Replay a recording through a new uinput device and "
+                        "verify the events emitted by its device node.")
+    parser.add_argument("device", help="the device description file")
+    parser.add_argument("events", help="the recording to replay")
+    parser.add_argument("--filter", action="append", default=[],
+                        metavar="RULE",
+                        help="filter rule applied to the replay, "
+                             "e.g. drop=EV_MSC")
+    parser.add_argument("--time-tolerance", type=int, default=None,
+                        metavar="US",
+                        help="maximum timing error of a frame in "
+                             "microseconds")
+    parser.add_argument("--timeout", type=float, default=1.0,
+                        metavar="SEC",
+                        help="time to wait for outstanding frames "
+                             "(default: 1.0)")
+    parser.add_argument("--json", action="store_true",
+                        help="print the result as JSON")
+    args = parser.parse_args(args)
+
+    device = evemu.Device(args.device)
+    with open(args.events) as events_file:
+        result = verify(device, events_file, rules=args.filter,
+                        time_tolerance=args.time_tolerance,
+                        timeout=args.timeout)
+    if args.json:
+        print(json.dumps(result.as_dict(), indent=2, sort_keys=True))
+    else:
+        print(result)
+    return 0 if result.faithful else 1
+
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main())
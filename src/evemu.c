@@ -43,6 +43,7 @@
 #define _GNU_SOURCE
 #include "evemu-impl.h"
 #include <stdint.h>
+#include <limits.h>
 #include <stdarg.h>
 #include <stdlib.h>
 #include <string.h>
@@ -51,7 +52,16 @@
 #include <errno.h>
 #include <poll.h>
 #include <ctype.h>
+#include <time.h>
 #include <unistd.h>
+#include <dirent.h>
+#include <pthread.h>
+#include <sys/inotify.h>
+#include <sys/ioctl.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <sys/syscall.h>
+#include <linux/futex.h>
 #include <sys/utsname.h>
 
 #include "version.h"
@@ -236,7 +246,7 @@ int evemu_extract(struct evemu_device *dev, int fd)
 	return libevdev_set_fd(dev->evdev, fd);
 }
 
-static inline int bit_is_set(unsigned char *mask, int bit)
+static inline int bit_is_set(const unsigned char *mask, int bit)
 {
 	return !!(mask[bit/8] & (1 << (bit & 0x7)));
 }
@@ -590,7 +600,7 @@ static int parse_abs(struct evemu_device *dev, const char *line, struct version
 	return 1;
 }
 
-static int parse_led(const char *line)
+static int parse_led(struct evemu_device *dev, const char *line)
 {
 	int matched;
 	unsigned int index;
@@ -607,12 +617,15 @@ static int parse_led(const char *line)
 	}
 
 	/* We can't set the LEDs directly, we'd have to send an event
-	 * through the device but that's potentially racy */
+	 * through the device but that's potentially racy. Keep the state
+	 * as the device's initial state for replaying from a checkpoint,
+	 * see evemu_seek() */
+	libevdev_set_event_value(dev->evdev, EV_LED, index, state);
 
 	return 1;
 }
 
-static int parse_sw(const char *line)
+static int parse_sw(struct evemu_device *dev, const char *line)
 {
 	int matched;
 	unsigned int index;
@@ -629,7 +642,10 @@ static int parse_sw(const char *line)
 	}
 
 	/* We can't set the switches directly, we'd have to send an event
-	 * through the device but that's potentially racy */
+	 * through the device but that's potentially racy. Keep the state
+	 * as the device's initial state for replaying from a checkpoint,
+	 * see evemu_seek() */
+	libevdev_set_event_value(dev->evdev, EV_SW, index, state);
 
 	return 1;
 }
@@ -712,13 +728,13 @@ int evemu_read(struct evemu_device *dev, FILE *fp)
 	if (rc == -1)
 		goto out;
 
-	while((rc = parse_led(line)) > 0)
+	while((rc = parse_led(dev, line)) > 0)
 		if (!next_line(fp, &line, &size))
 			break;
 	if (rc == -1)
 		goto out;
 
-	while((rc = parse_sw(line)) > 0)
+	while((rc = parse_sw(dev, line)) > 0)
 		if (!next_line(fp, &line, &size))
 			break;
 	if (rc == -1)
@@ -738,10 +754,10 @@ static inline unsigned long millis(const struct timeval *tv)
 	return tv->tv_sec * 1000 + tv->tv_usec/1000;
 }
 
-static int write_event_desc(FILE *fp, const struct input_event *ev)
+static int write_event_desc(FILE *fp, const struct input_event *ev,
+			    unsigned long *last_ms)
 {
 	int rc;
-	static unsigned long last_ms = 0;
 	unsigned long time, dt;
 
 	if (ev->type == EV_SYN) {
@@ -751,8 +767,8 @@ static int write_event_desc(FILE *fp, const struct input_event *ev)
 				     ev->value);
 		} else {
 			time = millis(&ev->time);
-			dt = time - last_ms;
-			last_ms = time;
+			dt = time - *last_ms;
+			*last_ms = time;
 			rc = fprintf(fp, "# ------------ %s (%d) ---------- %+ldms\n",
 				     libevdev_event_code_get_name(ev->type, ev->code),
 				     ev->value,
@@ -767,16 +783,25 @@ static int write_event_desc(FILE *fp, const struct input_event *ev)
 	return rc;
 }
 
-int evemu_write_event(FILE *fp, const struct input_event *ev)
+static int write_event(FILE *fp, const struct input_event *ev,
+		       unsigned long *last_ms)
 {
 	int rc;
 	rc = fprintf(fp, "E: %lu.%06u %04x %04x %04d	",
 		     ev->time.tv_sec, (unsigned)ev->time.tv_usec,
 		     ev->type, ev->code, ev->value);
-	rc += write_event_desc(fp, ev);
+	rc += write_event_desc(fp, ev, last_ms);
 	return rc;
 }
 
+int evemu_write_event(FILE *fp, const struct input_event *ev)
+{
+	/* callers without a context get one time base per thread */
+	static __thread unsigned long last_ms = 0;
+
+	return write_event(fp, ev, &last_ms);
+}
+
 static inline long time_to_long(const struct timeval *tv) {
 	return tv->tv_sec * 1000000L + tv->tv_usec;
 }
@@ -788,38 +813,28 @@ static inline struct timeval long_to_time(long time) {
 	return tv;
 }
 
-int evemu_record(FILE *fp, int fd, int ms)
+/* Parses an "E:" line, returns zero if it is not a valid event */
+static int parse_event_line(const char *line, struct input_event *ev)
 {
-	struct pollfd fds = { fd, POLLIN, 0 };
-	struct input_event ev;
-	int ret;
-	long offset = 0;
-
-	while (poll(&fds, 1, ms) > 0) {
-		SYSCALL(ret = read(fd, &ev, sizeof(ev)));
-		if (ret < 0)
-			return ret;
-		if (ret == sizeof(ev)) {
-			long time;
+	unsigned long sec;
+	unsigned usec, type, code;
+	int value;
 
-			if (offset == 0)
-				offset = time_to_long(&ev.time) - 1;
+	if (sscanf(line, "E: %lu.%06u %04x %04x %d\n",
+		   &sec, &usec, &type, &code, &value) != 5)
+		return 0;
 
-			time = time_to_long(&ev.time);
-			ev.time = long_to_time(time - offset);
-			evemu_write_event(fp, &ev);
-			fflush(fp);
-		}
-	}
+	ev->time.tv_sec = sec;
+	ev->time.tv_usec = usec;
+	ev->type = type;
+	ev->code = code;
+	ev->value = value;
 
-	return 0;
+	return 1;
 }
 
 int evemu_read_event(FILE *fp, struct input_event *ev)
 {
-	unsigned long sec;
-	unsigned usec, type, code;
-	int value;
 	int matched = 0;
 	char *line = NULL;
 	size_t size = 0;
@@ -832,19 +847,12 @@ int evemu_read_event(FILE *fp, struct input_event *ev)
 	if (strlen(line) <= 2 || strncmp(line, "E:", 2) != 0)
 		goto out;
 
-	matched = sscanf(line, "E: %lu.%06u %04x %04x %d\n",
-			 &sec, &usec, &type, &code, &value);
-	if (matched != 5) {
+	matched = parse_event_line(line, ev);
+	if (!matched) {
 		error(FATAL, "Invalid event format: %s\n", line);
 		return -1;
 	}
 
-	ev->time.tv_sec = sec;
-	ev->time.tv_usec = usec;
-	ev->type = type;
-	ev->code = code;
-	ev->value = value;
-
 out:
 	free(line);
 	return matched > 0;
@@ -860,96 +868,3563 @@ int evemu_create_event(struct input_event *ev, int type, int code, int value)
 	return 0;
 }
 
-static inline unsigned long s2us(unsigned long s)
+#define NBYTES(x) (((x) + 7)/8)
+
+static inline void clear_bit(unsigned char *mask, int bit)
 {
-	return s * 1000000L;
+	mask[bit/8] &= ~(1 << (bit & 0x7));
 }
 
-static inline unsigned long us2s(unsigned long us)
+#ifndef ABS_MT_TOOL_Y
+#define ABS_MT_TOOL_Y 0x3d
+#endif
+/* the per-slot axes, same as the kernel's ABS_MT_FIRST/ABS_MT_LAST */
+#define ABS_MT_FIRST ABS_MT_TOUCH_MAJOR
+#define ABS_MT_LAST ABS_MT_TOOL_Y
+#define ABS_MT_CNT (ABS_MT_LAST - ABS_MT_FIRST + 1)
+
+static inline int is_mt_axis(unsigned int code)
 {
-	return us / 1000000L;
+	return code >= ABS_MT_FIRST && code <= ABS_MT_LAST;
 }
 
-int evemu_read_event_realtime(FILE *fp, struct input_event *ev,
-			      struct timeval *evtime)
+/* A shadow of the kernel's view of a device, used to predict which
+ * events the kernel's input core will discard */
+struct evemu_state {
+	unsigned char supported[EV_CNT][NBYTES(KEY_CNT)];
+	int fuzz[ABS_CNT];
+
+	unsigned char key[NBYTES(KEY_CNT)];
+	unsigned char sw[NBYTES(SW_CNT)];
+	unsigned char led[NBYTES(LED_CNT)];
+	int abs[ABS_CNT];
+
+	/* the slot staged by the last ABS_MT_SLOT event */
+	int nslots, slot;
+	int (*mt)[ABS_MT_CNT];
+};
+
+static struct evemu_state *state_new(const struct evemu_device *dev)
 {
-	unsigned long usec;
-	const unsigned long ERROR_MARGIN = 150; /* µs */
-	int ret;
+	struct evemu_state *state;
+	int has_fd = libevdev_get_fd(dev->evdev) != -1;
+	int type, code, slot;
 
-	ret = evemu_read_event(fp, ev);
-	if (ret <= 0)
-		return ret;
+	state = calloc(1, sizeof(struct evemu_state));
+	if (!state)
+		return NULL;
+
+	for (type = 0; type < EV_CNT; type++) {
+		int max = libevdev_event_type_get_max(type);
 
-	if (evtime) {
-		if (evtime->tv_sec == 0 && evtime->tv_usec == 0)
-			*evtime = ev->time;
-		usec = time_to_long(&ev->time) - time_to_long(evtime);
-		if (usec > ERROR_MARGIN * 2) {
-			if (usec > s2us(10))
-				error(INFO, "Sleeping for %lds.\n", us2s(usec));
-			usleep(usec - ERROR_MARGIN);
-			*evtime = ev->time;
+		for (code = 0; code <= max; code++) {
+			if (!evemu_has_event(dev, type, code))
+				continue;
+
+			set_bit(state->supported[type], code);
+
+			switch (type) {
+			case EV_KEY:
+				if (libevdev_get_event_value(dev->evdev, type, code))
+					set_bit(state->key, code);
+				break;
+			case EV_SW:
+				if (libevdev_get_event_value(dev->evdev, type, code))
+					set_bit(state->sw, code);
+				break;
+			case EV_LED:
+				if (libevdev_get_event_value(dev->evdev, type, code))
+					set_bit(state->led, code);
+				break;
+			case EV_ABS:
+				state->fuzz[code] = evemu_get_abs_fuzz(dev, code);
+				state->abs[code] = evemu_get_abs_current_value(dev, code);
+				break;
+			}
 		}
 	}
 
-	return ret;
+	if (!evemu_has_event(dev, EV_ABS, ABS_MT_SLOT))
+		return state;
+
+	state->nslots = evemu_get_abs_maximum(dev, ABS_MT_SLOT) + 1;
+	state->mt = calloc(state->nslots, sizeof(*state->mt));
+	if (!state->mt) {
+		free(state);
+		return NULL;
+	}
+
+	/* a device created from a description has all slots unused, an
+	 * existing device tells us its slot state */
+	state->slot = has_fd ? libevdev_get_current_slot(dev->evdev) : 0;
+	for (slot = 0; slot < state->nslots; slot++) {
+		for (code = ABS_MT_FIRST; code <= ABS_MT_LAST; code++) {
+			int value = 0;
+
+			if (has_fd)
+				value = libevdev_get_slot_value(dev->evdev, slot, code);
+			else if (code == ABS_MT_TRACKING_ID)
+				value = -1;
+			state->mt[slot][code - ABS_MT_FIRST] = value;
+		}
+	}
+
+	return state;
 }
 
-int evemu_play_one(int fd, const struct input_event *ev)
+static void state_free(struct evemu_state *state)
 {
-	int ret;
-	SYSCALL(ret = write(fd, ev, sizeof(*ev)));
-	return (ret == -1 || (size_t)ret < sizeof(*ev)) ? -1 : 0;
+	if (state == NULL)
+		return;
+
+	free(state->mt);
+	free(state);
 }
 
-static void evemu_warn_about_incompatible_event(struct input_event *ev)
+/* Same as the kernel's input_defuzz_abs_event() */
+static int defuzz(int value, int old, int fuzz)
 {
-	const int max_warnings = 3;
-	static int warned = 0;
+	if (fuzz) {
+		if (value > old - fuzz / 2 && value < old + fuzz / 2)
+			return old;
+		if (value > old - fuzz && value < old + fuzz)
+			return (old * 3 + value) / 4;
+		if (value > old - fuzz * 2 && value < old + fuzz * 2)
+			return (old + value) / 2;
+	}
 
-	if (++warned <= max_warnings) {
-		if (warned == 1)
-			error(WARNING, "You are trying to play events incompatbile with this device. "
-					"Is this the right device/recordings file?\n");
-		error(WARNING, "%s %s is not supported by this device.\n",
-				libevdev_event_type_get_name(ev->type),
-				libevdev_event_code_get_name(ev->type, ev->code));
-	} else if (warned == max_warnings + 1) {
-		error(INFO, "warned about incompatible events %d times. Will be quiet now.\n",
-				warned - 1);
+	return value;
+}
+
+static int update_abs_state(struct evemu_state *state,
+			    const struct input_event *ev)
+{
+	int *old;
+	int value;
+
+	if (ev->code == ABS_MT_SLOT) {
+		/* the kernel only stages the slot, writing the current slot
+		 * again or an invalid one does nothing */
+		if (!state->mt || ev->value == state->slot ||
+		    ev->value < 0 || ev->value >= state->nslots)
+			return 0;
+		state->slot = ev->value;
+		return 1;
 	}
+
+	if (!is_mt_axis(ev->code))
+		old = &state->abs[ev->code];
+	else if (state->mt)
+		old = &state->mt[state->slot][ev->code - ABS_MT_FIRST];
+	else
+		return 1; /* no filtering for type A multitouch */
+
+	value = defuzz(ev->value, *old, state->fuzz[ev->code]);
+	if (value == *old)
+		return 0;
+
+	*old = value;
+	return 1;
 }
 
-int evemu_play(FILE *fp, int fd)
+static int update_bit_state(unsigned char *mask, const struct input_event *ev)
 {
-	struct input_event ev;
-	struct timeval evtime;
-	int ret;
-	struct evemu_device *dev;
+	if (bit_is_set(mask, ev->code) == !!ev->value)
+		return 0;
 
-	dev = evemu_new(NULL);
-	if (dev) {
-		if (evemu_extract(dev, fd) != 0) {
-			evemu_delete(dev);
-			dev = NULL;
+	if (ev->value)
+		set_bit(mask, ev->code);
+	else
+		clear_bit(mask, ev->code);
+
+	return 1;
+}
+
+/* Returns 1 if the kernel would pass the event on to its clients, 0 if
+ * it would discard it. Mirrors input_get_disposition() */
+static int update_state(struct evemu_state *state, const struct input_event *ev)
+{
+	if (ev->type == EV_SYN)
+		return ev->code == SYN_REPORT || ev->code == SYN_MT_REPORT ||
+		       ev->code == SYN_CONFIG;
+
+	if (ev->type >= EV_CNT || ev->code >= KEY_CNT ||
+	    !bit_is_set(state->supported[ev->type], ev->code))
+		return 0;
+
+	switch (ev->type) {
+	case EV_KEY:
+		if (ev->value == 2) /* autorepeat */
+			return 1;
+		return update_bit_state(state->key, ev);
+	case EV_SW:
+		return update_bit_state(state->sw, ev);
+	case EV_LED:
+		return update_bit_state(state->led, ev);
+	case EV_ABS:
+		return update_abs_state(state, ev);
+	case EV_REL:
+		return ev->value != 0;
+	default:
+		return 1;
+	}
+}
+
+struct evemu_remap {
+	unsigned int type, code;
+	unsigned int new_type, new_code;
+};
+
+struct evemu_filter {
+	/* the compiled type/code predicate, a bit is set for each event
+	 * that passes the filter. Recompiled from the selected and dropped
+	 * masks whenever a rule is added */
+	unsigned char keep[EV_CNT][NBYTES(KEY_CNT)];
+	unsigned char selected[EV_CNT][NBYTES(KEY_CNT)];
+	unsigned char dropped[EV_CNT][NBYTES(KEY_CNT)];
+	int have_selection;
+
+	unsigned char remapped[EV_CNT][NBYTES(KEY_CNT)];
+	struct evemu_remap *remaps;
+	size_t nremaps;
+
+	/* time window in µs, -1 if unbounded */
+	long start, end;
+
+	/* events kept/dropped in the current frame */
+	unsigned int frame_kept, frame_dropped;
+
+	/* if not NULL, drop events the kernel would discard */
+	struct evemu_state *state;
+	unsigned long reduced;
+};
+
+struct evemu_filter *evemu_filter_new(void)
+{
+	struct evemu_filter *filter = calloc(1, sizeof(struct evemu_filter));
+
+	if (filter) {
+		memset(filter->keep, 0xff, sizeof(filter->keep));
+		filter->start = -1;
+		filter->end = -1;
+	}
+
+	return filter;
+}
+
+void evemu_filter_delete(struct evemu_filter *filter)
+{
+	if (filter == NULL)
+		return;
+
+	state_free(filter->state);
+	free(filter->remaps);
+	free(filter);
+}
+
+static int parse_number(const char *str, int max)
+{
+	char *endp;
+	long v;
+
+	v = strtol(str, &endp, 0);
+	if (*str == '\0' || *endp != '\0' || v < 0 || v > max)
+		return -1;
+
+	return v;
+}
+
+static int parse_type(const char *str)
+{
+	int type = libevdev_event_type_from_name(str);
+
+	if (type == -1)
+		type = parse_number(str, EV_MAX);
+
+	return type;
+}
+
+static int parse_code(int type, const char *str)
+{
+	int max = libevdev_event_type_get_max(type);
+	int code;
+
+	if (max == -1)
+		return -1;
+
+	code = libevdev_event_code_from_name(type, str);
+	if (code == -1)
+		code = parse_number(str, max);
+
+	return code;
+}
+
+/* Parse "EV_ABS", "EV_ABS:ABS_X", "ABS_X" or the numeric equivalents.
+ * code is set to -1 for a type-only match */
+static int parse_event(const char *str, int *type, int *code)
+{
+	char buf[64];
+	const char *colon = strchr(str, ':');
+	int t;
+
+	if (colon) {
+		if ((size_t)(colon - str) >= sizeof(buf))
+			return -EINVAL;
+		memcpy(buf, str, colon - str);
+		buf[colon - str] = '\0';
+		*type = parse_type(buf);
+		if (*type == -1)
+			return -EINVAL;
+		*code = parse_code(*type, colon + 1);
+		return *code == -1 ? -EINVAL : 0;
+	}
+
+	*type = parse_type(str);
+	if (*type != -1) {
+		*code = -1;
+		return 0;
+	}
+
+	for (t = 0; t < EV_CNT; t++) {
+		*code = libevdev_event_code_from_name(t, str);
+		if (*code != -1) {
+			*type = t;
+			return 0;
 		}
 	}
 
-	memset(&evtime, 0, sizeof(evtime));
-	while (evemu_read_event_realtime(fp, &ev, &evtime) > 0) {
-		if (dev &&
-		    (ev.type != EV_SYN || ev.code != SYN_MT_REPORT) &&
-		    !evemu_has_event(dev, ev.type, ev.code))
-			evemu_warn_about_incompatible_event(&ev);
-		SYSCALL(ret = write(fd, &ev, sizeof(ev)));
+	return -EINVAL;
+}
+
+static void set_event_bits(unsigned char mask[EV_CNT][NBYTES(KEY_CNT)],
+			   int type, int code)
+{
+	int max = libevdev_event_type_get_max(type);
+	int i;
+
+	if (code != -1) {
+		set_bit(mask[type], code);
+		return;
 	}
 
-	if (dev)
-		evemu_delete(dev);
+	for (i = 0; i <= max; i++)
+		set_bit(mask[type], i);
+}
+
+static void compile_filter(struct evemu_filter *filter)
+{
+	unsigned int type, i;
+
+	for (type = 0; type < EV_CNT; type++) {
+		for (i = 0; i < NBYTES(KEY_CNT); i++) {
+			unsigned char keep = 0xff;
+
+			/* a selection never removes EV_SYN, we need the
+			 * frame boundaries */
+			if (filter->have_selection && type != EV_SYN)
+				keep = filter->selected[type][i];
+			filter->keep[type][i] = keep & ~filter->dropped[type][i];
+		}
+	}
+}
+
+static int parse_time(const char *str, long *start, long *end)
+{
+	char *endp;
+	double v;
+
+	*start = -1;
+	*end = -1;
+
+	if (*str != '-') {
+		v = strtod(str, &endp);
+		if (endp == str || *endp != '-' || v < 0)
+			return -EINVAL;
+		*start = v * 1000000L;
+		str = endp;
+	}
+
+	str++; /* skip the '-' */
+	if (*str != '\0') {
+		v = strtod(str, &endp);
+		if (endp == str || *endp != '\0' || v < 0)
+			return -EINVAL;
+		*end = v * 1000000L;
+	}
+
+	if (*start != -1 && *end != -1 && *end < *start)
+		return -EINVAL;
+
 	return 0;
 }
 
+static int add_remap(struct evemu_filter *filter, const char *str)
+{
+	char buf[64];
+	const char *eq = strchr(str, '=');
+	struct evemu_remap remap, *remaps;
+	int type, code, new_type, new_code;
+
+	if (!eq || (size_t)(eq - str) >= sizeof(buf))
+		return -EINVAL;
+
+	memcpy(buf, str, eq - str);
+	buf[eq - str] = '\0';
+
+	if (parse_event(buf, &type, &code) || code == -1 ||
+	    parse_event(eq + 1, &new_type, &new_code) || new_code == -1)
+		return -EINVAL;
+
+	remaps = realloc(filter->remaps,
+			 (filter->nremaps + 1) * sizeof(*remaps));
+	if (!remaps)
+		return -ENOMEM;
+
+	remap.type = type;
+	remap.code = code;
+	remap.new_type = new_type;
+	remap.new_code = new_code;
+	remaps[filter->nremaps++] = remap;
+	filter->remaps = remaps;
+	set_bit(filter->remapped[type], code);
+
+	return 0;
+}
+
+static int add_filter_rule(struct evemu_filter *filter, const char *rule)
+{
+	const char *arg = strchr(rule, '=');
+	size_t len;
+	int type, code;
+	int rc;
+
+	if (!arg)
+		return -EINVAL;
+
+	len = arg - rule;
+	arg++;
+
+	if (len == 6 && strncmp(rule, "select", len) == 0) {
+		if ((rc = parse_event(arg, &type, &code)))
+			return rc;
+		set_event_bits(filter->selected, type, code);
+		filter->have_selection = 1;
+	} else if (len == 4 && strncmp(rule, "drop", len) == 0) {
+		if ((rc = parse_event(arg, &type, &code)))
+			return rc;
+		set_event_bits(filter->dropped, type, code);
+	} else if (len == 4 && strncmp(rule, "time", len) == 0) {
+		return parse_time(arg, &filter->start, &filter->end);
+	} else if (len == 5 && strncmp(rule, "remap", len) == 0) {
+		return add_remap(filter, arg);
+	} else {
+		return -EINVAL;
+	}
+
+	compile_filter(filter);
+
+	return 0;
+}
+
+int evemu_filter_add(struct evemu_filter *filter, const char *spec)
+{
+	char *rules, *rule, *saveptr = NULL;
+	int rc = 0;
+
+	rules = strdup(spec);
+	if (!rules)
+		return -ENOMEM;
+
+	for (rule = strtok_r(rules, ",", &saveptr);
+	     rule;
+	     rule = strtok_r(NULL, ",", &saveptr)) {
+		rc = add_filter_rule(filter, rule);
+		if (rc) {
+			error(FATAL, "Invalid filter rule: %s\n", rule);
+			break;
+		}
+	}
+
+	free(rules);
+	return rc;
+}
+
+static void remap_event(const struct evemu_filter *filter,
+			struct input_event *ev)
+{
+	size_t i;
+
+	for (i = 0; i < filter->nremaps; i++) {
+		const struct evemu_remap *r = &filter->remaps[i];
+
+		if (r->type == ev->type && r->code == ev->code) {
+			ev->type = r->new_type;
+			ev->code = r->new_code;
+			return;
+		}
+	}
+}
+
+int evemu_filter_enable_reduction(struct evemu_filter *filter,
+				  const struct evemu_device *dev)
+{
+	struct evemu_state *state = state_new(dev);
+
+	if (!state)
+		return -ENOMEM;
+
+	state_free(filter->state);
+	filter->state = state;
+	filter->reduced = 0;
+
+	return 0;
+}
+
+unsigned long evemu_filter_get_reduced_count(const struct evemu_filter *filter)
+{
+	return filter->reduced;
+}
+
+int evemu_filter_event(struct evemu_filter *filter, struct input_event *ev)
+{
+	long time = time_to_long(&ev->time);
+	int keep;
+
+	if (ev->type >= EV_CNT || ev->code >= KEY_CNT)
+		keep = !filter->have_selection;
+	else
+		keep = bit_is_set(filter->keep[ev->type], ev->code);
+
+	if ((filter->start != -1 && time < filter->start) ||
+	    (filter->end != -1 && time > filter->end))
+		keep = 0;
+
+	if (ev->type == EV_SYN && ev->code == SYN_REPORT) {
+		/* drop frames that the filter emptied. With reduction
+		 * enabled, drop all empty frames, the kernel does too */
+		if (keep && filter->frame_kept == 0 &&
+		    (filter->frame_dropped > 0 || filter->state)) {
+			keep = 0;
+			if (filter->state)
+				filter->reduced++;
+		}
+		filter->frame_kept = 0;
+		filter->frame_dropped = 0;
+		return keep;
+	}
+
+	if (!keep) {
+		filter->frame_dropped++;
+		return 0;
+	}
+
+	if (ev->type < EV_CNT && ev->code < KEY_CNT &&
+	    bit_is_set(filter->remapped[ev->type], ev->code))
+		remap_event(filter, ev);
+
+	if (filter->state && !update_state(filter->state, ev)) {
+		filter->reduced++;
+		return 0;
+	}
+
+	filter->frame_kept++;
+
+	return 1;
+}
+
+/* A checkpoint is a block of comment lines, readers that do not know
+ * checkpoints skip them:
+ *
+ *   # C: <time> <n>
+ *   # R: <type> <code> <value>		(n times)
+ *
+ * The R: events take a device from its initial state, all keys up and
+ * all slots unused, to the state at the end of the frame at <time>.
+ * Times in a recording increase, so checkpoints can be found by
+ * bisecting the file */
+
+#define MT_TRACKING_ID (ABS_MT_TRACKING_ID - ABS_MT_FIRST)
+
+/* The state of a recorded event stream. Recorded events already passed
+ * the kernel's fuzz filter, so they are tracked without it */
+static struct evemu_state *checkpoint_state_new(const struct evemu_device *dev)
+{
+	struct evemu_state *state = state_new(dev);
+
+	if (state)
+		memset(state->fuzz, 0, sizeof(state->fuzz));
+
+	return state;
+}
+
+static void state_reset(struct evemu_state *state)
+{
+	int slot;
+
+	memset(state->key, 0, sizeof(state->key));
+	memset(state->sw, 0, sizeof(state->sw));
+	memset(state->led, 0, sizeof(state->led));
+	memset(state->abs, 0, sizeof(state->abs));
+
+	state->slot = 0;
+	for (slot = 0; slot < state->nslots; slot++) {
+		memset(state->mt[slot], 0, sizeof(state->mt[slot]));
+		state->mt[slot][MT_TRACKING_ID] = -1;
+	}
+}
+
+/* The maximum number of events state_diff() returns, plus a SYN_REPORT */
+static size_t state_frame_size(const struct evemu_state *state)
+{
+	return KEY_CNT + SW_CNT + LED_CNT + ABS_CNT +
+	       state->nslots * (ABS_MT_CNT + 1) + 2;
+}
+
+static void diff_bits(const unsigned char *supported, const unsigned char *to,
+		      const unsigned char *from, int type, int max,
+		      struct input_event *frame, size_t *n)
+{
+	int code;
+
+	for (code = 0; code < max; code++) {
+		int value = bit_is_set(to, code);
+
+		if (bit_is_set(supported, code) &&
+		    value != (from && bit_is_set(from, code)))
+			evemu_create_event(&frame[(*n)++], type, code, value);
+	}
+}
+
+/* Fills frame with the events that take a device from the state from,
+ * or the initial state if from is NULL, to the state to. Both states
+ * must be of the same device. Returns the number of events, the frame
+ * is not terminated by a SYN_REPORT */
+static size_t state_diff(const struct evemu_state *to,
+			 const struct evemu_state *from,
+			 struct input_event *frame)
+{
+	const unsigned char *abs = to->supported[EV_ABS];
+	size_t n = 0;
+	int code, slot, staged, i;
+
+	diff_bits(to->supported[EV_KEY], to->key, from ? from->key : NULL,
+		  EV_KEY, KEY_CNT, frame, &n);
+	diff_bits(to->supported[EV_SW], to->sw, from ? from->sw : NULL,
+		  EV_SW, SW_CNT, frame, &n);
+	diff_bits(to->supported[EV_LED], to->led, from ? from->led : NULL,
+		  EV_LED, LED_CNT, frame, &n);
+
+	for (code = 0; code < ABS_CNT; code++) {
+		if (!bit_is_set(abs, code) || code == ABS_MT_SLOT ||
+		    is_mt_axis(code))
+			continue;
+		if (to->abs[code] != (from ? from->abs[code] : 0))
+			evemu_create_event(&frame[n++], EV_ABS, code,
+					   to->abs[code]);
+	}
+
+	staged = from ? from->slot : 0;
+	for (slot = 0; slot < to->nslots; slot++) {
+		const int *values = to->mt[slot];
+		int active = values[MT_TRACKING_ID] != -1;
+
+		for (i = 0; i < ABS_MT_CNT; i++) {
+			int old = i == MT_TRACKING_ID ? -1 : 0;
+
+			if (from)
+				old = from->mt[slot][i];
+
+			/* the axes of an unused slot do not matter */
+			if (!bit_is_set(abs, ABS_MT_FIRST + i) ||
+			    values[i] == old ||
+			    (!active && i != MT_TRACKING_ID))
+				continue;
+
+			if (staged != slot) {
+				evemu_create_event(&frame[n++], EV_ABS,
+						   ABS_MT_SLOT, slot);
+				staged = slot;
+			}
+			evemu_create_event(&frame[n++], EV_ABS,
+					   ABS_MT_FIRST + i, values[i]);
+		}
+	}
+	if (to->mt && staged != to->slot)
+		evemu_create_event(&frame[n++], EV_ABS, ABS_MT_SLOT, to->slot);
+
+	return n;
+}
+
+static int write_checkpoint(FILE *fp, const struct evemu_state *state,
+			    long time)
+{
+	struct input_event *frame;
+	size_t i, n;
+	int rc;
+
+	frame = calloc(state_frame_size(state), sizeof(*frame));
+	if (!frame)
+		return -ENOMEM;
+
+	n = state_diff(state, NULL, frame);
+	rc = fprintf(fp, "# C: %ld.%06ld %zu\n",
+		     time / 1000000L, time % 1000000L, n);
+	for (i = 0; i < n; i++)
+		rc += fprintf(fp, "# R: %04x %04x %d\n",
+			      frame[i].type, frame[i].code, frame[i].value);
+
+	free(frame);
+	return rc;
+}
+
+static int parse_checkpoint(const char *line, long *time, unsigned int *n)
+{
+	unsigned long sec;
+	unsigned int usec;
+
+	if (strncmp(line, "# C:", 4) != 0 ||
+	    sscanf(line, "# C: %lu.%06u %u\n", &sec, &usec, n) != 3)
+		return 0;
+
+	*time = sec * 1000000L + usec;
+	return 1;
+}
+
+static int is_checkpoint_line(const char *line)
+{
+	return strncmp(line, "# C:", 4) == 0 || strncmp(line, "# R:", 4) == 0;
+}
+
+/* Reads the checkpoint at the current position into state. Returns the
+ * time of the checkpoint or a negative errno */
+static long read_checkpoint(FILE *fp, struct evemu_state *state)
+{
+	struct input_event ev;
+	char *line = NULL;
+	size_t sz = 0;
+	unsigned int i, n, type, code;
+	int value;
+	long time = -EINVAL;
+
+	if (getline(&line, &sz, fp) < 0 || !parse_checkpoint(line, &time, &n))
+		goto out;
+
+	state_reset(state);
+	for (i = 0; i < n; i++) {
+		if (getline(&line, &sz, fp) < 0 ||
+		    sscanf(line, "# R: %04x %04x %d\n",
+			   &type, &code, &value) != 3) {
+			error(FATAL, "Invalid checkpoint: %s\n", line);
+			time = -EINVAL;
+			goto out;
+		}
+		evemu_create_event(&ev, type, code, value);
+		update_state(state, &ev);
+	}
+
+out:
+	free(line);
+	return time;
+}
+
+/* Returns the offset of the last checkpoint before time whose line
+ * starts between the offsets begin and end, or -1. A checkpoint holds
+ * the state after its frame, seeking to time stops before the frame at
+ * time. The checkpoint at 0 holds the state before the first frame */
+static long find_checkpoint(FILE *fp, long begin, long end, long time)
+{
+	char *line = NULL;
+	size_t sz = 0;
+	long lo = begin, hi = end, best = -1;
+
+	while (lo < hi) {
+		long mid = lo + (hi - lo) / 2;
+		long offset = -1, t = 0;
+		unsigned int n;
+
+		/* continue at the first line starting at or after mid */
+		if (fseek(fp, mid > begin ? mid - 1 : begin, SEEK_SET) != 0)
+			break;
+		if (mid > begin && getline(&line, &sz, fp) < 0) {
+			hi = mid;
+			continue;
+		}
+
+		while (1) {
+			long pos = ftell(fp);
+
+			if (pos < 0 || pos >= hi ||
+			    getline(&line, &sz, fp) < 0)
+				break;
+			if (parse_checkpoint(line, &t, &n)) {
+				offset = pos;
+				break;
+			}
+		}
+
+		if (offset == -1 || (t >= time && t != 0)) {
+			hi = mid;
+		} else {
+			best = offset;
+			lo = ftell(fp);
+		}
+	}
+
+	free(line);
+	return best;
+}
+
+int evemu_seek(const struct evemu_device *dev, FILE *fp, long time,
+	       struct input_event **frame)
+{
+	struct evemu_state *state, *initial;
+	struct input_event ev, *events = NULL;
+	struct timeval evtime = long_to_time(time);
+	long begin, end, checkpoint;
+	int in_frame = 0;
+	int rc = -ENOMEM;
+	size_t i, n;
+
+	*frame = NULL;
+
+	begin = ftell(fp);
+	if (begin < 0 || fseek(fp, 0, SEEK_END) != 0 || (end = ftell(fp)) < 0)
+		return -errno;
+
+	state = checkpoint_state_new(dev);
+	initial = state_new(dev);
+	if (!state || !initial)
+		goto out;
+
+	checkpoint = find_checkpoint(fp, begin, end, time);
+	if (fseek(fp, checkpoint >= 0 ? checkpoint : begin, SEEK_SET) != 0) {
+		rc = -errno;
+		goto out;
+	}
+	if (checkpoint >= 0) {
+		/* the checkpoint time does not fit into rc */
+		long t = read_checkpoint(fp, state);
+
+		if (t < 0) {
+			rc = t;
+			goto out;
+		}
+	}
+
+	/* fast-forward through the frames before time */
+	while (1) {
+		long offset = ftell(fp);
+
+		rc = evemu_read_event(fp, &ev);
+		if (rc < 0) {
+			rc = -EINVAL;
+			goto out;
+		}
+		if (rc == 0)
+			break;
+
+		if (!in_frame && time_to_long(&ev.time) >= time) {
+			fseek(fp, offset, SEEK_SET);
+			evtime = ev.time;
+			break;
+		}
+
+		update_state(state, &ev);
+		in_frame = ev.type != EV_SYN || ev.code != SYN_REPORT;
+	}
+
+	rc = -ENOMEM;
+	events = calloc(state_frame_size(state), sizeof(*events));
+	if (!events)
+		goto out;
+
+	n = state_diff(state, initial, events);
+	if (n > 0) {
+		evemu_create_event(&events[n++], EV_SYN, SYN_REPORT, 0);
+		for (i = 0; i < n; i++)
+			events[i].time = evtime;
+		*frame = events;
+		events = NULL;
+	}
+	rc = n;
+
+out:
+	free(events);
+	state_free(initial);
+	state_free(state);
+	return rc;
+}
+
+int evemu_add_checkpoints(FILE *in, FILE *out, long interval)
+{
+	struct evemu_device *dev;
+	struct evemu_state *state = NULL;
+	char *line = NULL;
+	size_t sz = 0;
+	long header, next;
+	int rc = -EINVAL;
+
+	if (interval <= 0)
+		return -EINVAL;
+
+	dev = evemu_new(NULL);
+	if (!dev)
+		return -ENOMEM;
+
+	if (evemu_read(dev, in) <= 0)
+		goto out;
+
+	/* copy the description and everything up to the first event */
+	header = ftell(in);
+	if (header < 0 || fseek(in, 0, SEEK_SET) != 0) {
+		rc = -errno;
+		goto out;
+	}
+	while (ftell(in) < header && getline(&line, &sz, in) >= 0)
+		if (!is_checkpoint_line(line))
+			fputs(line, out);
+
+	rc = -ENOMEM;
+	state = checkpoint_state_new(dev);
+	if (!state)
+		goto out;
+
+	/* the state the recording starts with */
+	if ((rc = write_checkpoint(out, state, 0)) < 0)
+		goto out;
+	next = interval;
+
+	while (getline(&line, &sz, in) >= 0) {
+		struct input_event ev;
+		unsigned long sec;
+		unsigned int usec, type, code;
+		int value;
+		long time;
+
+		/* existing checkpoints are replaced */
+		if (is_checkpoint_line(line))
+			continue;
+
+		if (strncmp(line, "E:", 2) != 0) {
+			fputs(line, out);
+			continue;
+		}
+
+		if (sscanf(line, "E: %lu.%06u %04x %04x %d\n",
+			   &sec, &usec, &type, &code, &value) != 5) {
+			error(FATAL, "Invalid event format: %s\n", line);
+			rc = -EINVAL;
+			goto out;
+		}
+
+		fputs(line, out);
+
+		time = sec * 1000000L + usec;
+
+		evemu_create_event(&ev, type, code, value);
+		update_state(state, &ev);
+		if (type == EV_SYN && code == SYN_REPORT && time >= next) {
+			if ((rc = write_checkpoint(out, state, time)) < 0)
+				goto out;
+			next = time + interval;
+		}
+	}
+
+	rc = ferror(in) || ferror(out) ? -EIO : 0;
+
+out:
+	free(line);
+	state_free(state);
+	evemu_delete(dev);
+	return rc;
+}
+
+enum trace_kind {
+	/* spans */
+	TRACE_PARSE,
+	TRACE_SLEEP,
+	TRACE_WRITE,
+	TRACE_READ,
+	TRACE_FRAME,
+	/* counters */
+	TRACE_LATENESS,
+	TRACE_LATENCY,
+};
+
+static const char *trace_names[] = {
+	[TRACE_PARSE] = "parse",
+	[TRACE_SLEEP] = "sleep",
+	[TRACE_WRITE] = "write",
+	[TRACE_READ] = "read",
+	[TRACE_FRAME] = "frame",
+	[TRACE_LATENESS] = "lateness_us",
+	[TRACE_LATENCY] = "latency_us",
+};
+
+/* a span from start to end, or a counter with value at start; times in
+ * ns since tracing was enabled */
+struct trace_record {
+	uint64_t start;
+	uint64_t end;
+	long value;
+	enum trace_kind kind;
+};
+
+struct evemu_trace {
+	struct trace_record *records;
+	size_t len;
+	size_t size;
+	size_t max;
+	unsigned long dropped;
+	uint64_t epoch;
+	/* start and number of events of the current frame */
+	uint64_t frame_start;
+	long frame_events;
+};
+
+/* All state of one event stream. Nothing in here is shared between
+ * contexts, so different contexts may be used from different threads */
+struct evemu_context {
+	struct evemu_filter *filter;
+	struct evemu_stats *stats;
+	/* time of the last SYN_REPORT written, for the +Nms comments */
+	unsigned long last_ms;
+	/* number of incompatible events played */
+	int warned;
+	/* evemu_context_record() returns after this many bytes or µs,
+	 * 0 if unbounded */
+	size_t record_bytes;
+	long record_us;
+	/* the recorded state, if checkpoints are enabled */
+	struct evemu_state *checkpoint;
+	long checkpoint_us;
+	/* delivery latency of recorded frames, if enabled */
+	struct evemu_latency *latency;
+	unsigned long stall_us;
+	int annotate_latency;
+	/* the next slot of latency->stall, a ring of the last stalls */
+	unsigned int stall_next;
+	/* timeline of play and record, if tracing is enabled */
+	struct evemu_trace *trace;
+};
+
+static inline uint64_t timespec_to_ns(const struct timespec *ts)
+{
+	return ts->tv_sec * 1000000000ULL + ts->tv_nsec;
+}
+
+static inline uint64_t now_ns(void)
+{
+	struct timespec ts;
+
+	clock_gettime(CLOCK_MONOTONIC, &ts);
+	return timespec_to_ns(&ts);
+}
+
+static void trace_add(struct evemu_trace *trace, enum trace_kind kind,
+		      uint64_t start, uint64_t end, long value)
+{
+	struct trace_record *r;
+
+	if (trace->len == trace->size) {
+		size_t size = trace->size ? trace->size * 2 : 4096;
+
+		if (size > trace->max)
+			size = trace->max;
+		r = trace->len < size ?
+			realloc(trace->records, size * sizeof(*r)) : NULL;
+		if (!r) {
+			trace->dropped++;
+			return;
+		}
+		trace->records = r;
+		trace->size = size;
+	}
+
+	r = &trace->records[trace->len++];
+	r->start = start - trace->epoch;
+	r->end = end - trace->epoch;
+	r->value = value;
+	r->kind = kind;
+}
+
+static inline void trace_counter(struct evemu_trace *trace,
+				 enum trace_kind kind, uint64_t time,
+				 long value)
+{
+	trace_add(trace, kind, time, time, value);
+}
+
+/* A frame starts with parsing or reading its first event */
+static inline void trace_frame_event(struct evemu_trace *trace,
+				     uint64_t start)
+{
+	if (trace->frame_events++ == 0)
+		trace->frame_start = start;
+}
+
+/* and ends once its SYN_REPORT is written */
+static void trace_frame_done(struct evemu_trace *trace,
+			     const struct input_event *ev, uint64_t end)
+{
+	if (trace->frame_events == 0 ||
+	    ev->type != EV_SYN || ev->code != SYN_REPORT)
+		return;
+
+	trace_add(trace, TRACE_FRAME, trace->frame_start, end,
+		  trace->frame_events);
+	trace->frame_events = 0;
+}
+
+/* bucket 0 for 0, bucket n for [2^(n-1), 2^n), the last bucket for all
+ * larger values */
+static inline unsigned int log2_bucket(unsigned long value,
+				       unsigned int nbuckets)
+{
+	unsigned int bucket = 0;
+
+	while (value >> bucket && bucket < nbuckets - 1)
+		bucket++;
+
+	return bucket;
+}
+
+/* requested and elapsed in µs */
+static void account_sleep(struct evemu_stats *stats,
+			  unsigned long requested, unsigned long elapsed)
+{
+	unsigned long overshoot = elapsed > requested ? elapsed - requested : 0;
+	unsigned int bucket = log2_bucket(overshoot,
+					  EVEMU_STATS_OVERSHOOT_BUCKETS);
+
+	stats->sleeps++;
+	stats->sleep_overshoot[bucket]++;
+	if (overshoot > stats->max_overshoot_us)
+		stats->max_overshoot_us = overshoot;
+}
+
+static void account_event(struct evemu_stats *stats,
+			  const struct input_event *ev)
+{
+	stats->events_read++;
+	if (ev->type == EV_SYN && ev->code == SYN_DROPPED)
+		stats->syn_dropped++;
+}
+
+struct evemu_context *evemu_context_new(void)
+{
+	return calloc(1, sizeof(struct evemu_context));
+}
+
+void evemu_context_delete(struct evemu_context *ctx)
+{
+	if (ctx == NULL)
+		return;
+
+	state_free(ctx->checkpoint);
+	if (ctx->trace)
+		free(ctx->trace->records);
+	free(ctx->trace);
+	free(ctx->latency);
+	free(ctx->stats);
+	free(ctx);
+}
+
+void evemu_context_set_filter(struct evemu_context *ctx,
+			      struct evemu_filter *filter)
+{
+	ctx->filter = filter;
+}
+
+void evemu_context_set_record_limits(struct evemu_context *ctx,
+				     size_t bytes, long us)
+{
+	ctx->record_bytes = bytes;
+	ctx->record_us = us;
+}
+
+int evemu_context_enable_trace(struct evemu_context *ctx, size_t max_records)
+{
+	if (max_records == 0) {
+		if (ctx->trace)
+			free(ctx->trace->records);
+		free(ctx->trace);
+		ctx->trace = NULL;
+		return 0;
+	}
+
+	if (!ctx->trace) {
+		ctx->trace = calloc(1, sizeof(struct evemu_trace));
+		if (!ctx->trace)
+			return -ENOMEM;
+	}
+
+	free(ctx->trace->records);
+	memset(ctx->trace, 0, sizeof(struct evemu_trace));
+	ctx->trace->max = max_records;
+	ctx->trace->epoch = now_ns();
+
+	return 0;
+}
+
+/* µs with ns precision, independent of the locale */
+static void write_trace_time(FILE *fp, const char *key, uint64_t ns)
+{
+	fprintf(fp, "\"%s\":%llu.%03u", key, (unsigned long long)(ns / 1000),
+		(unsigned int)(ns % 1000));
+}
+
+int evemu_context_write_trace(const struct evemu_context *ctx, FILE *fp)
+{
+	const struct evemu_trace *trace = ctx->trace;
+	int pid = getpid();
+	size_t i;
+
+	if (!trace)
+		return -EINVAL;
+
+	fprintf(fp, "{\"traceEvents\":[\n");
+	fprintf(fp, "{\"name\":\"process_name\",\"ph\":\"M\",\"pid\":%d,"
+		    "\"tid\":%d,\"args\":{\"name\":\"evemu\"}}", pid, pid);
+
+	for (i = 0; i < trace->len; i++) {
+		const struct trace_record *r = &trace->records[i];
+		const char *name = trace_names[r->kind];
+
+		fprintf(fp, ",\n{\"name\":\"%s\",\"cat\":\"evemu\",", name);
+		if (r->kind < TRACE_LATENESS) {
+			fprintf(fp, "\"ph\":\"X\",");
+			write_trace_time(fp, "ts", r->start);
+			fprintf(fp, ",");
+			write_trace_time(fp, "dur", r->end - r->start);
+			fprintf(fp, ",\"pid\":%d,\"tid\":%d", pid, pid);
+			if (r->kind == TRACE_FRAME)
+				fprintf(fp, ",\"args\":{\"events\":%ld}",
+					r->value);
+		} else {
+			fprintf(fp, "\"ph\":\"C\",");
+			write_trace_time(fp, "ts", r->start);
+			fprintf(fp, ",\"pid\":%d,\"args\":{\"%s\":%ld}",
+				pid, name, r->value);
+		}
+		fprintf(fp, "}");
+	}
+
+	fprintf(fp, "\n],\n\"displayTimeUnit\":\"ms\",");
+	fprintf(fp, "\"otherData\":{\"dropped_records\":%lu}}\n",
+		trace->dropped);
+	fflush(fp);
+
+	return ferror(fp) ? -EIO : 0;
+}
+
+int evemu_context_enable_checkpoints(struct evemu_context *ctx,
+				     const struct evemu_device *dev,
+				     long interval)
+{
+	struct evemu_state *state;
+
+	if (interval < 0)
+		return -EINVAL;
+
+	if (interval == 0) {
+		state_free(ctx->checkpoint);
+		ctx->checkpoint = NULL;
+		return 0;
+	}
+
+	state = checkpoint_state_new(dev);
+	if (!state)
+		return -ENOMEM;
+
+	state_free(ctx->checkpoint);
+	ctx->checkpoint = state;
+	ctx->checkpoint_us = interval;
+
+	return 0;
+}
+
+int evemu_context_enable_stats(struct evemu_context *ctx)
+{
+	if (!ctx->stats) {
+		ctx->stats = malloc(sizeof(struct evemu_stats));
+		if (!ctx->stats)
+			return -ENOMEM;
+	}
+
+	memset(ctx->stats, 0, sizeof(struct evemu_stats));
+
+	return 0;
+}
+
+int evemu_context_get_stats(const struct evemu_context *ctx,
+			    struct evemu_stats *stats)
+{
+	if (!ctx->stats)
+		return -EINVAL;
+
+	*stats = *ctx->stats;
+
+	return 0;
+}
+
+int evemu_context_enable_latency(struct evemu_context *ctx, long stall_us,
+				 int annotate)
+{
+	if (stall_us < 0)
+		return -EINVAL;
+
+	if (!ctx->latency) {
+		ctx->latency = malloc(sizeof(struct evemu_latency));
+		if (!ctx->latency)
+			return -ENOMEM;
+	}
+
+	memset(ctx->latency, 0, sizeof(struct evemu_latency));
+	ctx->stall_us = stall_us;
+	ctx->annotate_latency = annotate;
+	ctx->stall_next = 0;
+
+	return 0;
+}
+
+int evemu_context_get_latency(const struct evemu_context *ctx,
+			      struct evemu_latency *latency)
+{
+	const struct evemu_latency *l = ctx->latency;
+	unsigned int i, n;
+
+	if (!l)
+		return -EINVAL;
+
+	*latency = *l;
+
+	/* the stalls oldest first */
+	n = l->stalls < EVEMU_LATENCY_STALLS ? l->stalls : EVEMU_LATENCY_STALLS;
+	for (i = 0; i < n; i++)
+		latency->stall[i] = l->stall[(ctx->stall_next + EVEMU_LATENCY_STALLS -
+					      n + i) % EVEMU_LATENCY_STALLS];
+
+	return 0;
+}
+
+/* Accounts the delivery latency of the frame ending with a SYN_REPORT
+ * with the kernel timestamp ev_us, read at read_us (both µs,
+ * CLOCK_MONOTONIC) and recorded at time. Returns the latency or -1 if the
+ * timestamp is not comparable to the read time. */
+static long account_latency(struct evemu_context *ctx, long ev_us,
+			    long read_us, long time)
+{
+	struct evemu_latency *l = ctx->latency;
+	unsigned long us;
+
+	if (read_us < ev_us) {
+		l->skewed++;
+		return -1;
+	}
+
+	us = read_us - ev_us;
+	l->frames++;
+	l->histogram[log2_bucket(us, EVEMU_LATENCY_BUCKETS)]++;
+	l->total_us += us;
+	if (us > l->max_us)
+		l->max_us = us;
+
+	if (ctx->stall_us && us >= ctx->stall_us) {
+		struct evemu_latency_stall *stall = &l->stall[ctx->stall_next];
+
+		stall->time = time;
+		stall->latency_us = us;
+		ctx->stall_next = (ctx->stall_next + 1) % EVEMU_LATENCY_STALLS;
+		l->stalls++;
+	}
+
+	return us;
+}
+
+static int write_latency(FILE *fp, long us, unsigned long stall_us)
+{
+	return fprintf(fp, "# L: %ld%s\n", us,
+		       stall_us && (unsigned long)us >= stall_us ? " stall" : "");
+}
+
+static inline unsigned long s2us(unsigned long s)
+{
+	return s * 1000000L;
+}
+
+static inline unsigned long us2s(unsigned long us)
+{
+	return us / 1000000L;
+}
+
+static void wait_for_event(struct evemu_context *ctx,
+			   const struct input_event *ev,
+			   struct timeval *evtime)
+{
+	struct evemu_stats *stats = ctx->stats;
+	unsigned long usec;
+	const unsigned long ERROR_MARGIN = 150; /* µs */
+
+	if (evtime->tv_sec == 0 && evtime->tv_usec == 0)
+		*evtime = ev->time;
+	usec = time_to_long(&ev->time) - time_to_long(evtime);
+	if (usec > ERROR_MARGIN * 2) {
+		uint64_t start = 0;
+
+		if (usec > s2us(10))
+			error(INFO, "Sleeping for %lds.\n", us2s(usec));
+		if (stats || ctx->trace)
+			start = now_ns();
+		usleep(usec - ERROR_MARGIN);
+		if (stats || ctx->trace) {
+			uint64_t end = now_ns();
+
+			if (ctx->trace)
+				trace_add(ctx->trace, TRACE_SLEEP, start, end, 0);
+			if (stats) {
+				stats->sleep_ns += end - start;
+				account_sleep(stats, usec - ERROR_MARGIN,
+					      (end - start) / 1000);
+			}
+		}
+		*evtime = ev->time;
+	}
+}
+
+int evemu_context_read_event(struct evemu_context *ctx, FILE *fp,
+			     struct input_event *ev)
+{
+	struct evemu_stats *stats = ctx->stats;
+	uint64_t start, end;
+	int ret;
+
+	if (!stats && !ctx->trace)
+		return evemu_read_event(fp, ev);
+
+	start = now_ns();
+	ret = evemu_read_event(fp, ev);
+	end = now_ns();
+
+	if (ctx->trace && ret > 0) {
+		trace_frame_event(ctx->trace, start);
+		trace_add(ctx->trace, TRACE_PARSE, start, end, 0);
+	}
+
+	if (!stats)
+		return ret;
+
+	stats->parse_ns += end - start;
+	if (ret > 0)
+		account_event(stats, ev);
+	else if (ret < 0)
+		stats->parse_failures++;
+
+	return ret;
+}
+
+int evemu_context_read_event_realtime(struct evemu_context *ctx, FILE *fp,
+				      struct input_event *ev,
+				      struct timeval *evtime)
+{
+	int ret;
+
+	ret = evemu_context_read_event(ctx, fp, ev);
+	if (ret <= 0)
+		return ret;
+
+	if (evtime)
+		wait_for_event(ctx, ev, evtime);
+
+	return ret;
+}
+
+int evemu_read_event_realtime(FILE *fp, struct input_event *ev,
+			      struct timeval *evtime)
+{
+	struct evemu_context ctx = { .filter = NULL };
+
+	return evemu_context_read_event_realtime(&ctx, fp, ev, evtime);
+}
+
+static int play_one(struct evemu_stats *stats, int fd,
+		    const struct input_event *ev)
+{
+	uint64_t start = 0;
+	int ret, err;
+
+	if (stats)
+		start = now_ns();
+
+	SYSCALL(ret = write(fd, ev, sizeof(*ev)));
+	err = ret == -1 ? errno : 0;
+
+	if (stats) {
+		stats->write_ns += now_ns() - start;
+		stats->write_calls++;
+		if (ret == -1)
+			stats->write_errors++;
+		else if ((size_t)ret < sizeof(*ev))
+			stats->short_writes++;
+		else
+			stats->events_written++;
+	}
+
+	/* callers report the errno of a failed write */
+	errno = err;
+	return (ret == -1 || (size_t)ret < sizeof(*ev)) ? -1 : 0;
+}
+
+int evemu_context_write_event(struct evemu_context *ctx, FILE *fp,
+			      const struct input_event *ev)
+{
+	return write_event(fp, ev, &ctx->last_ms);
+}
+
+int evemu_context_play_one(struct evemu_context *ctx, int fd,
+			   const struct input_event *ev)
+{
+	return play_one(ctx->stats, fd, ev);
+}
+
+int evemu_play_one(int fd, const struct input_event *ev)
+{
+	return play_one(NULL, fd, ev);
+}
+
+/* Like play_one(), tracing the write. After each frame, its lateness
+ * is measured against the timeline that started when the event at
+ * *first_us was played at *first_ns */
+static void play_one_traced(struct evemu_context *ctx, int fd,
+			     const struct input_event *ev,
+			     long *first_us, uint64_t *first_ns)
+{
+	struct evemu_trace *trace = ctx->trace;
+	uint64_t start = now_ns(), end;
+
+	play_one(ctx->stats, fd, ev);
+	end = now_ns();
+	trace_add(trace, TRACE_WRITE, start, end, 0);
+
+	if (*first_ns == 0) {
+		*first_ns = end;
+		*first_us = time_to_long(&ev->time);
+	}
+
+	if (ev->type == EV_SYN && ev->code == SYN_REPORT) {
+		long lateness = (long)((end - *first_ns) / 1000) -
+				(time_to_long(&ev->time) - *first_us);
+
+		trace_frame_done(trace, ev, end);
+		trace_counter(trace, TRACE_LATENESS, end, lateness);
+	}
+}
+
+static void evemu_warn_about_incompatible_event(struct evemu_context *ctx,
+						struct input_event *ev)
+{
+	const int max_warnings = 3;
+
+	if (++ctx->warned <= max_warnings) {
+		if (ctx->warned == 1)
+			error(WARNING, "You are trying to play events incompatbile with this device. "
+					"Is this the right device/recordings file?\n");
+		error(WARNING, "%s %s is not supported by this device.\n",
+				libevdev_event_type_get_name(ev->type),
+				libevdev_event_code_get_name(ev->type, ev->code));
+	} else if (ctx->warned == max_warnings + 1) {
+		error(INFO, "warned about incompatible events %d times. Will be quiet now.\n",
+				ctx->warned - 1);
+	}
+}
+
+static int context_play(struct evemu_context *ctx, FILE *fp, int fd,
+			long start)
+{
+	struct input_event ev;
+	struct timeval evtime;
+	struct evemu_device *dev;
+	uint64_t first_ns = 0;
+	long first_us = 0;
+
+	dev = evemu_new(NULL);
+	if (dev) {
+		if (evemu_extract(dev, fd) != 0) {
+			evemu_delete(dev);
+			dev = NULL;
+		}
+	}
+
+	if (start >= 0) {
+		struct input_event *frame;
+		int i, n;
+
+		n = dev ? evemu_seek(dev, fp, start, &frame) : -ENODEV;
+		if (n < 0) {
+			evemu_delete(dev);
+			return n;
+		}
+		for (i = 0; i < n; i++)
+			play_one(ctx->stats, fd, &frame[i]);
+		free(frame);
+	}
+
+	memset(&evtime, 0, sizeof(evtime));
+	while (evemu_context_read_event(ctx, fp, &ev) > 0) {
+		if (ctx->filter && !evemu_filter_event(ctx->filter, &ev))
+			continue;
+		wait_for_event(ctx, &ev, &evtime);
+		if (dev &&
+		    (ev.type != EV_SYN || ev.code != SYN_MT_REPORT) &&
+		    !evemu_has_event(dev, ev.type, ev.code))
+			evemu_warn_about_incompatible_event(ctx, &ev);
+		if (ctx->trace)
+			play_one_traced(ctx, fd, &ev, &first_us, &first_ns);
+		else
+			play_one(ctx->stats, fd, &ev);
+	}
+
+	if (dev)
+		evemu_delete(dev);
+	return 0;
+}
+
+int evemu_context_play(struct evemu_context *ctx, FILE *fp, int fd)
+{
+	return context_play(ctx, fp, fd, -1);
+}
+
+int evemu_context_play_from(struct evemu_context *ctx, FILE *fp, int fd,
+			    long time)
+{
+	return context_play(ctx, fp, fd, time < 0 ? 0 : time);
+}
+
+int evemu_play_filtered(FILE *fp, int fd, struct evemu_filter *filter)
+{
+	struct evemu_context ctx = { .filter = filter };
+
+	return evemu_context_play(&ctx, fp, fd);
+}
+
+int evemu_play(FILE *fp, int fd)
+{
+	return evemu_play_filtered(fp, fd, NULL);
+}
+
+int evemu_context_record(struct evemu_context *ctx, FILE *fp, int fd, int ms)
+{
+	struct pollfd fds = { fd, POLLIN, 0 };
+	struct evemu_stats *stats = ctx->stats;
+	struct evemu_trace *trace = ctx->trace;
+	struct input_event ev;
+	int ret;
+	long offset = 0;
+	long next_checkpoint = 0;
+	size_t bytes = 0;
+
+#ifdef EVIOCSCLOCKID
+	/* latencies compare the event timestamps to CLOCK_MONOTONIC, fails
+	 * harmlessly on anything but an event node */
+	if (ctx->latency) {
+		int clockid = CLOCK_MONOTONIC;
+
+		ioctl(fd, EVIOCSCLOCKID, &clockid);
+	}
+#endif
+
+	while (poll(&fds, 1, ms) > 0) {
+		uint64_t start = 0;
+
+		if (trace)
+			start = now_ns();
+		SYSCALL(ret = read(fd, &ev, sizeof(ev)));
+		if (stats)
+			stats->read_calls++;
+		if (ret < 0)
+			return ret;
+		if (ret == sizeof(ev)) {
+			long time, latency = -1;
+
+			if (trace) {
+				trace_frame_event(trace, start);
+				trace_add(trace, TRACE_READ, start, now_ns(), 0);
+			}
+
+			/* one clock_gettime(2) per frame, taken before the
+			 * frame is formatted */
+			if (ctx->latency && ev.type == EV_SYN &&
+			    ev.code == SYN_REPORT)
+				latency = now_ns() / 1000;
+
+			if (stats)
+				account_event(stats, &ev);
+
+			if (offset == 0) {
+				offset = time_to_long(&ev.time) - 1;
+
+				/* each recording starts with the state it
+				 * continues from */
+				if (ctx->checkpoint &&
+				    (ret = write_checkpoint(fp, ctx->checkpoint, 0)) > 0)
+					bytes += ret;
+				next_checkpoint = ctx->checkpoint_us;
+			}
+
+			time = time_to_long(&ev.time);
+			ev.time = long_to_time(time - offset);
+			if (latency >= 0) {
+				latency = account_latency(ctx, time, latency,
+							  time - offset);
+				if (trace && latency >= 0)
+					trace_counter(trace, TRACE_LATENCY,
+						      now_ns(), latency);
+			}
+			if (ctx->filter && !evemu_filter_event(ctx->filter, &ev)) {
+				/* the time window has ended, no later frame
+				 * passes the filter */
+				if (ev.type == EV_SYN && ev.code == SYN_REPORT &&
+				    ctx->filter->end != -1 &&
+				    time - offset > ctx->filter->end)
+					return 0;
+				continue;
+			}
+
+			if (stats || trace)
+				start = now_ns();
+			ret = write_event(fp, &ev, &ctx->last_ms);
+			if (ret > 0)
+				bytes += ret;
+
+			if (ctx->annotate_latency && latency >= 0 &&
+			    ev.type == EV_SYN && ev.code == SYN_REPORT) {
+				ret = write_latency(fp, latency, ctx->stall_us);
+				if (ret > 0)
+					bytes += ret;
+			}
+
+			if (ctx->checkpoint) {
+				update_state(ctx->checkpoint, &ev);
+				if (ev.type == EV_SYN && ev.code == SYN_REPORT &&
+				    time - offset >= next_checkpoint) {
+					ret = write_checkpoint(fp, ctx->checkpoint,
+							       time - offset);
+					if (ret > 0)
+						bytes += ret;
+					next_checkpoint = time - offset +
+							  ctx->checkpoint_us;
+				}
+			}
+
+			fflush(fp);
+			if (stats || trace) {
+				uint64_t end = now_ns();
+
+				if (trace) {
+					trace_add(trace, TRACE_WRITE, start, end, 0);
+					trace_frame_done(trace, &ev, end);
+				}
+				if (stats) {
+					stats->write_ns += end - start;
+					stats->events_written++;
+				}
+			}
+
+			/* limits only end a recording between frames */
+			if (ev.type == EV_SYN && ev.code == SYN_REPORT &&
+			    ((ctx->record_bytes && bytes >= ctx->record_bytes) ||
+			     (ctx->record_us && time - offset >= ctx->record_us)))
+				return 1;
+		}
+	}
+
+	return 0;
+}
+
+int evemu_record_filtered(FILE *fp, int fd, int ms,
+			  struct evemu_filter *filter)
+{
+	struct evemu_context ctx = { .filter = filter };
+
+	return evemu_context_record(&ctx, fp, fd, ms);
+}
+
+int evemu_record(FILE *fp, int fd, int ms)
+{
+	return evemu_record_filtered(fp, fd, ms, NULL);
+}
+
+struct evemu_recording {
+	struct input_event *events;
+	size_t nevents;
+	/* index of the first event of each frame, plus nevents as sentinel */
+	size_t *frames;
+	size_t nframes;
+};
+
+struct evemu_player_stream {
+	const struct evemu_recording *rec;
+	int fd;
+	long offset; /* µs */
+	size_t frame; /* the next frame to play */
+};
+
+struct evemu_player {
+	struct evemu_player_stream *streams;
+	size_t nstreams;
+};
+
+static int recording_append(struct evemu_recording *rec,
+			    const struct input_event *ev, size_t *sz)
+{
+	if (rec->nevents == *sz) {
+		size_t newsz = *sz ? *sz * 2 : 1024;
+		struct input_event *events;
+
+		events = realloc(rec->events, newsz * sizeof(*events));
+		if (!events)
+			return -ENOMEM;
+		rec->events = events;
+		*sz = newsz;
+	}
+
+	rec->events[rec->nevents++] = *ev;
+
+	return 0;
+}
+
+static int recording_index_frames(struct evemu_recording *rec)
+{
+	size_t i;
+
+	rec->frames = malloc((rec->nevents + 1) * sizeof(*rec->frames));
+	if (!rec->frames)
+		return -ENOMEM;
+
+	for (i = 0; i < rec->nevents; i++) {
+		if (i == 0 || (rec->events[i - 1].type == EV_SYN &&
+			       rec->events[i - 1].code == SYN_REPORT))
+			rec->frames[rec->nframes++] = i;
+	}
+	rec->frames[rec->nframes] = rec->nevents;
+
+	return 0;
+}
+
+struct evemu_recording *evemu_recording_new(FILE *fp,
+					    struct evemu_filter *filter)
+{
+	struct evemu_recording *rec;
+	struct input_event ev;
+	size_t sz = 0;
+	int ret;
+
+	rec = calloc(1, sizeof(struct evemu_recording));
+	if (!rec)
+		return NULL;
+
+	while ((ret = evemu_read_event(fp, &ev)) > 0) {
+		if (filter && !evemu_filter_event(filter, &ev))
+			continue;
+		if (recording_append(rec, &ev, &sz) != 0)
+			goto error;
+	}
+
+	if (ret < 0 || recording_index_frames(rec) != 0)
+		goto error;
+
+	return rec;
+
+error:
+	evemu_recording_delete(rec);
+	return NULL;
+}
+
+void evemu_recording_delete(struct evemu_recording *rec)
+{
+	if (rec == NULL)
+		return;
+
+	free(rec->frames);
+	free(rec->events);
+	free(rec);
+}
+
+size_t evemu_recording_get_frame_count(const struct evemu_recording *rec)
+{
+	return rec->nframes;
+}
+
+long evemu_recording_get_duration(const struct evemu_recording *rec)
+{
+	if (rec->nevents == 0)
+		return 0;
+
+	return time_to_long(&rec->events[rec->nevents - 1].time) -
+	       time_to_long(&rec->events[0].time);
+}
+
+struct evemu_player *evemu_player_new(void)
+{
+	return calloc(1, sizeof(struct evemu_player));
+}
+
+void evemu_player_delete(struct evemu_player *player)
+{
+	if (player == NULL)
+		return;
+
+	free(player->streams);
+	free(player);
+}
+
+int evemu_player_add(struct evemu_player *player,
+		     const struct evemu_recording *rec, int fd, long offset)
+{
+	struct evemu_player_stream *streams;
+
+	streams = realloc(player->streams,
+			  (player->nstreams + 1) * sizeof(*streams));
+	if (!streams)
+		return -ENOMEM;
+
+	player->streams = streams;
+	streams[player->nstreams].rec = rec;
+	streams[player->nstreams].fd = fd;
+	streams[player->nstreams].offset = offset;
+	streams[player->nstreams].frame = 0;
+	player->nstreams++;
+
+	return 0;
+}
+
+/* µs since the start of the replay the stream's next frame is due */
+static inline long stream_due(const struct evemu_player_stream *s)
+{
+	const struct input_event *events = s->rec->events;
+
+	return time_to_long(&events[s->rec->frames[s->frame]].time) -
+	       time_to_long(&events[0].time) + s->offset;
+}
+
+/* A binary min-heap of streams ordered by the time their next frame is
+ * due. Streams with the same due time stay in the order they were
+ * added, so frames of the same time are dispatched in a stable order. */
+static inline int stream_before(const struct evemu_player_stream *a,
+				const struct evemu_player_stream *b)
+{
+	long da = stream_due(a), db = stream_due(b);
+
+	return da < db || (da == db && a < b);
+}
+
+static void heap_sift_down(struct evemu_player_stream **heap, size_t n,
+			   size_t i)
+{
+	while (1) {
+		size_t min = i, l = 2 * i + 1, r = 2 * i + 2;
+		struct evemu_player_stream *tmp;
+
+		if (l < n && stream_before(heap[l], heap[min]))
+			min = l;
+		if (r < n && stream_before(heap[r], heap[min]))
+			min = r;
+		if (min == i)
+			return;
+
+		tmp = heap[i];
+		heap[i] = heap[min];
+		heap[min] = tmp;
+		i = min;
+	}
+}
+
+static int write_frame(int fd, const struct input_event *events, size_t n)
+{
+	const char *data = (const char*)events;
+	size_t len = n * sizeof(*events);
+
+	while (len > 0) {
+		ssize_t ret;
+
+		SYSCALL(ret = write(fd, data, len));
+		if (ret < 0)
+			return -errno;
+		if (ret == 0)
+			return -EIO;
+		data += ret;
+		len -= ret;
+	}
+
+	return 0;
+}
+
+int evemu_player_run(struct evemu_player *player)
+{
+	struct evemu_player_stream **heap;
+	struct timespec start;
+	long elapsed = 0; /* µs since start, as of the last clock check */
+	size_t i, n = 0;
+	int rc = 0;
+
+	heap = malloc((player->nstreams + 1) * sizeof(*heap));
+	if (!heap)
+		return -ENOMEM;
+
+	for (i = 0; i < player->nstreams; i++) {
+		player->streams[i].frame = 0;
+		if (player->streams[i].rec->nframes > 0)
+			heap[n++] = &player->streams[i];
+	}
+	for (i = n / 2; i-- > 0; )
+		heap_sift_down(heap, n, i);
+
+	clock_gettime(CLOCK_MONOTONIC, &start);
+
+	while (n > 0) {
+		struct evemu_player_stream *s = heap[0];
+		const struct evemu_recording *rec = s->rec;
+		long due = stream_due(s);
+		int ret;
+
+		/* Frames that are already due are written back-to-back
+		 * without looking at the clock again, so many devices with
+		 * the same timeline cost one clock_gettime() per frame
+		 * time, not one per device. All frames are timed against
+		 * the same start, so the streams do not drift apart however
+		 * long the replay. */
+		if (due > elapsed) {
+			elapsed = (now_ns() - timespec_to_ns(&start)) / 1000;
+			if (due > elapsed) {
+				struct timespec deadline = start;
+
+				deadline.tv_sec += due / 1000000;
+				deadline.tv_nsec += (due % 1000000) * 1000;
+				if (deadline.tv_nsec >= 1000000000) {
+					deadline.tv_sec++;
+					deadline.tv_nsec -= 1000000000;
+				}
+				while (clock_nanosleep(CLOCK_MONOTONIC,
+						       TIMER_ABSTIME,
+						       &deadline, NULL) == EINTR)
+					;
+				elapsed = due;
+			}
+		}
+
+		ret = write_frame(s->fd, &rec->events[rec->frames[s->frame]],
+				  rec->frames[s->frame + 1] - rec->frames[s->frame]);
+		if (ret < 0) {
+			error(WARNING, "Failed to write to fd %d: %s\n",
+			      s->fd, strerror(-ret));
+			if (rc == 0)
+				rc = ret;
+		}
+
+		if (ret == 0 && ++s->frame < rec->nframes)
+			heap_sift_down(heap, n, 0);
+		else {
+			heap[0] = heap[--n];
+			heap_sift_down(heap, n, 0);
+		}
+	}
+
+	free(heap);
+
+	return rc;
+}
+
+struct evemu_ring_trigger {
+	int type;
+	int code; /* -1 for any code of the type */
+	int value;
+	int any_value;
+};
+
+struct evemu_ring {
+	struct input_event *events;
+	size_t size;
+	size_t head; /* where the next event goes */
+	size_t count;
+	int partial; /* the oldest event is not the start of a frame */
+	long duration; /* µs, 0 if unbounded */
+
+	/* a bit is set for each type/code that has a trigger, so the
+	 * common case costs one bit test per event */
+	unsigned char trigger_mask[EV_CNT][NBYTES(KEY_CNT)];
+	struct evemu_ring_trigger *triggers;
+	size_t ntriggers;
+	int pending; /* a trigger matched, waiting for the SYN_REPORT */
+};
+
+struct evemu_ring *evemu_ring_new(size_t size, long duration)
+{
+	struct evemu_ring *ring;
+
+	if (size < sizeof(struct input_event) || duration < 0)
+		return NULL;
+
+	ring = calloc(1, sizeof(*ring));
+	if (!ring)
+		return NULL;
+
+	ring->size = size / sizeof(struct input_event);
+	ring->events = malloc(ring->size * sizeof(struct input_event));
+	if (!ring->events) {
+		free(ring);
+		return NULL;
+	}
+	ring->duration = duration;
+
+	return ring;
+}
+
+void evemu_ring_delete(struct evemu_ring *ring)
+{
+	if (ring == NULL)
+		return;
+
+	free(ring->triggers);
+	free(ring->events);
+	free(ring);
+}
+
+int evemu_ring_add_trigger(struct evemu_ring *ring, const char *spec)
+{
+	char buf[64];
+	const char *eq = strchr(spec, '=');
+	struct evemu_ring_trigger trigger, *triggers;
+	size_t len = eq ? (size_t)(eq - spec) : strlen(spec);
+
+	if (len >= sizeof(buf))
+		return -EINVAL;
+	memcpy(buf, spec, len);
+	buf[len] = '\0';
+
+	if (parse_event(buf, &trigger.type, &trigger.code))
+		return -EINVAL;
+
+	trigger.any_value = eq == NULL;
+	trigger.value = 0;
+	if (eq) {
+		char *endp;
+		long v = strtol(eq + 1, &endp, 0);
+
+		if (eq[1] == '\0' || *endp != '\0' || v < INT_MIN || v > INT_MAX)
+			return -EINVAL;
+		trigger.value = v;
+	}
+
+	triggers = realloc(ring->triggers,
+			   (ring->ntriggers + 1) * sizeof(*triggers));
+	if (!triggers)
+		return -ENOMEM;
+
+	triggers[ring->ntriggers++] = trigger;
+	ring->triggers = triggers;
+	set_event_bits(ring->trigger_mask, trigger.type, trigger.code);
+
+	return 0;
+}
+
+static inline size_t ring_index(const struct evemu_ring *ring, size_t i)
+{
+	/* the i'th oldest event */
+	return (ring->head + ring->size - ring->count + i) % ring->size;
+}
+
+static inline int is_syn_report(const struct input_event *ev)
+{
+	return ev->type == EV_SYN && ev->code == SYN_REPORT;
+}
+
+static int ring_triggered(const struct evemu_ring *ring,
+			  const struct input_event *ev)
+{
+	size_t i;
+
+	if (ev->type >= EV_CNT || ev->code >= KEY_CNT ||
+	    !bit_is_set(ring->trigger_mask[ev->type], ev->code))
+		return 0;
+
+	for (i = 0; i < ring->ntriggers; i++) {
+		const struct evemu_ring_trigger *t = &ring->triggers[i];
+
+		if (t->type == ev->type &&
+		    (t->code == -1 || t->code == ev->code) &&
+		    (t->any_value || t->value == ev->value))
+			return 1;
+	}
+
+	return 0;
+}
+
+int evemu_ring_add_event(struct evemu_ring *ring,
+			 const struct input_event *ev)
+{
+	if (ring->count == ring->size)
+		ring->partial = !is_syn_report(&ring->events[ring->head]);
+	else
+		ring->count++;
+	ring->events[ring->head] = *ev;
+	ring->head = (ring->head + 1) % ring->size;
+
+	if (ring->duration) {
+		long newest = time_to_long(&ev->time);
+
+		while (ring->count > 1) {
+			const struct input_event *oldest =
+				&ring->events[ring_index(ring, 0)];
+
+			if (newest - time_to_long(&oldest->time) <= ring->duration)
+				break;
+			ring->partial = !is_syn_report(oldest);
+			ring->count--;
+		}
+	}
+
+	if (ring_triggered(ring, ev))
+		ring->pending = 1;
+
+	if (ring->pending && is_syn_report(ev)) {
+		ring->pending = 0;
+		return 1;
+	}
+
+	return 0;
+}
+
+size_t evemu_ring_get_event_count(const struct evemu_ring *ring)
+{
+	return ring->count;
+}
+
+void evemu_ring_clear(struct evemu_ring *ring)
+{
+	ring->count = 0;
+	ring->partial = 0;
+	ring->pending = 0;
+}
+
+int evemu_context_record_ring(struct evemu_context *ctx,
+			      struct evemu_ring *ring, int fd, int ms)
+{
+	struct pollfd fds = { fd, POLLIN, 0 };
+	struct evemu_stats *stats = ctx->stats;
+	struct input_event buf[64];
+	int triggered = 0;
+
+	while (!triggered) {
+		size_t i, n;
+		ssize_t ret;
+
+		ret = poll(&fds, 1, ms);
+		if (ret == 0)
+			return 0;
+		if (ret < 0)
+			return -errno;
+
+		ret = read(fd, buf, sizeof(buf));
+		if (stats)
+			stats->read_calls++;
+		if (ret < 0) {
+			if (errno == EAGAIN)
+				continue;
+			return -errno;
+		}
+		if (ret == 0)
+			return -ENODEV;
+
+		n = ret / sizeof(buf[0]);
+		for (i = 0; i < n; i++) {
+			if (stats)
+				account_event(stats, &buf[i]);
+			if (evemu_ring_add_event(ring, &buf[i]))
+				triggered = 1;
+		}
+	}
+
+	return 1;
+}
+
+int evemu_context_write_ring(struct evemu_context *ctx,
+			     const struct evemu_ring *ring, FILE *fp)
+{
+	struct evemu_stats *stats = ctx->stats;
+	size_t i = 0, last;
+	long offset;
+	int written = 0;
+
+	/* only write whole frames */
+	last = ring->count;
+	while (last > 0) {
+		if (is_syn_report(&ring->events[ring_index(ring, last - 1)]))
+			break;
+		last--;
+	}
+
+	if (ring->partial) {
+		while (i < last &&
+		       !is_syn_report(&ring->events[ring_index(ring, i++)]))
+			;
+	}
+
+	if (i >= last)
+		return 0;
+
+	offset = time_to_long(&ring->events[ring_index(ring, i)].time) - 1;
+	for (; i < last; i++) {
+		struct input_event ev = ring->events[ring_index(ring, i)];
+
+		ev.time = long_to_time(time_to_long(&ev.time) - offset);
+		if (ctx->filter && !evemu_filter_event(ctx->filter, &ev))
+			continue;
+		if (write_event(fp, &ev, &ctx->last_ms) < 0)
+			return -errno;
+		written++;
+	}
+
+	if (stats)
+		stats->events_written += written;
+
+	return written;
+}
+
+/*
+ * Shared memory fan-out: one publisher writes raw events into a ring in a
+ * POSIX shared memory segment, any number of subscribers map it read-only
+ * and read the events in place.
+ *
+ * The publisher is the only writer. It bumps 'reserved' before it
+ * overwrites slots and 'head' once the events are in place, both count
+ * the events published since the segment was created. Subscribers keep
+ * their own position and never write to the segment, so a slow or dead
+ * subscriber cannot hold up the publisher; instead, it is overrun. Events
+ * read in place stay valid until 'reserved' has moved more than the
+ * capacity past them. 'seq' is bumped after each batch and doubles as
+ * futex word for subscribers waiting for events.
+ */
+#define SHM_MAGIC "EVEMUSHM"
+#define SHM_VERSION 1
+
+struct shm_header {
+	char magic[8];
+	uint32_t version;
+	uint32_t event_size;
+	uint64_t capacity; /* events, a power of two */
+	uint64_t data_offset;
+	/* written by the publisher, on their own cache line */
+	uint64_t reserved __attribute__((aligned(64)));
+	uint64_t head;
+	uint32_t seq;
+	uint32_t closed;
+};
+
+#define SHM_DATA_OFFSET 128
+
+struct evemu_shm {
+	struct shm_header *header;
+	struct input_event *events;
+	size_t map_size;
+	char *name; /* the publisher unlinks the segment */
+	int publisher;
+
+	uint64_t tail; /* the next event to read */
+	uint64_t last; /* the first event returned by the last read */
+	unsigned long lost;
+};
+
+static int futex(uint32_t *uaddr, int op, uint32_t val,
+		 const struct timespec *timeout)
+{
+	return syscall(SYS_futex, uaddr, op, val, timeout, NULL, 0);
+}
+
+struct evemu_shm *evemu_shm_new(const char *name, size_t size)
+{
+	struct evemu_shm *shm;
+	uint64_t capacity = 1;
+	int fd;
+
+	if (size / sizeof(struct input_event) < 2) {
+		errno = EINVAL;
+		return NULL;
+	}
+	while (capacity * 2 <= size / sizeof(struct input_event))
+		capacity *= 2;
+
+	shm = calloc(1, sizeof(*shm));
+	if (!shm)
+		return NULL;
+	shm->publisher = 1;
+	shm->name = strdup(name);
+	if (!shm->name)
+		goto error;
+	shm->map_size = SHM_DATA_OFFSET +
+			capacity * sizeof(struct input_event);
+
+	/* a stale segment left by a publisher that died is replaced,
+	 * subscribers that still map it are not affected */
+	shm_unlink(name);
+	fd = shm_open(name, O_RDWR | O_CREAT | O_EXCL | O_CLOEXEC, 0644);
+	if (fd < 0)
+		goto error;
+	if (ftruncate(fd, shm->map_size) < 0) {
+		int err = errno;
+
+		close(fd);
+		shm_unlink(name);
+		errno = err;
+		goto error;
+	}
+	shm->header = mmap(NULL, shm->map_size, PROT_READ | PROT_WRITE,
+			   MAP_SHARED, fd, 0);
+	close(fd);
+	if (shm->header == MAP_FAILED) {
+		int err = errno;
+
+		shm->header = NULL;
+		shm_unlink(name);
+		errno = err;
+		goto error;
+	}
+
+	shm->header->version = SHM_VERSION;
+	shm->header->event_size = sizeof(struct input_event);
+	shm->header->capacity = capacity;
+	shm->header->data_offset = SHM_DATA_OFFSET;
+	shm->events = (struct input_event *)((char *)shm->header +
+					     SHM_DATA_OFFSET);
+	/* subscribers check the magic last */
+	__atomic_thread_fence(__ATOMIC_RELEASE);
+	memcpy(shm->header->magic, SHM_MAGIC, sizeof(shm->header->magic));
+
+	return shm;
+
+error:
+	free(shm->name);
+	free(shm);
+	return NULL;
+}
+
+struct evemu_shm *evemu_shm_open(const char *name)
+{
+	struct evemu_shm *shm;
+	struct shm_header header;
+	struct stat st;
+	int fd;
+
+	fd = shm_open(name, O_RDONLY | O_CLOEXEC, 0);
+	if (fd < 0)
+		return NULL;
+
+	if (fstat(fd, &st) < 0 || (size_t)st.st_size < sizeof(header) ||
+	    pread(fd, &header, sizeof(header), 0) != sizeof(header) ||
+	    memcmp(header.magic, SHM_MAGIC, sizeof(header.magic)) != 0 ||
+	    header.version != SHM_VERSION ||
+	    header.event_size != sizeof(struct input_event) ||
+	    header.data_offset != SHM_DATA_OFFSET ||
+	    header.capacity == 0 ||
+	    (header.capacity & (header.capacity - 1)) ||
+	    (uint64_t)st.st_size < SHM_DATA_OFFSET +
+				   header.capacity * header.event_size) {
+		close(fd);
+		errno = EPROTO;
+		return NULL;
+	}
+
+	shm = calloc(1, sizeof(*shm));
+	if (!shm) {
+		close(fd);
+		return NULL;
+	}
+	shm->map_size = SHM_DATA_OFFSET +
+			header.capacity * sizeof(struct input_event);
+	shm->header = mmap(NULL, shm->map_size, PROT_READ, MAP_SHARED, fd, 0);
+	close(fd);
+	if (shm->header == MAP_FAILED) {
+		free(shm);
+		return NULL;
+	}
+	shm->events = (struct input_event *)((char *)shm->header +
+					     SHM_DATA_OFFSET);
+
+	/* only events published from now on */
+	shm->tail = __atomic_load_n(&shm->header->head, __ATOMIC_ACQUIRE);
+	shm->last = shm->tail;
+
+	return shm;
+}
+
+void evemu_shm_delete(struct evemu_shm *shm)
+{
+	if (shm == NULL)
+		return;
+
+	if (shm->publisher) {
+		__atomic_store_n(&shm->header->closed, 1, __ATOMIC_RELEASE);
+		__atomic_add_fetch(&shm->header->seq, 1, __ATOMIC_RELEASE);
+		futex(&shm->header->seq, FUTEX_WAKE, INT_MAX, NULL);
+		shm_unlink(shm->name);
+	}
+
+	munmap(shm->header, shm->map_size);
+	free(shm->name);
+	free(shm);
+}
+
+size_t evemu_shm_get_capacity(const struct evemu_shm *shm)
+{
+	return shm->header->capacity;
+}
+
+int evemu_shm_publish(struct evemu_shm *shm, const struct input_event *ev,
+		      size_t n)
+{
+	struct shm_header *header = shm->header;
+	uint64_t mask = header->capacity - 1;
+	uint64_t head = header->head;
+	size_t i, count = n;
+
+	if (!shm->publisher)
+		return -EBADF;
+	if (n == 0)
+		return 0;
+
+	/* only the newest events of a batch larger than the ring survive */
+	if (n > header->capacity) {
+		ev += n - header->capacity;
+		head += n - header->capacity;
+		n = header->capacity;
+	}
+
+	/* a subscriber reading the slots we are about to overwrite sees the
+	 * new 'reserved' after reading them */
+	__atomic_store_n(&header->reserved, head + n, __ATOMIC_RELAXED);
+	__atomic_thread_fence(__ATOMIC_RELEASE);
+
+	for (i = 0; i < n; i++)
+		shm->events[(head + i) & mask] = ev[i];
+
+	__atomic_store_n(&header->head, head + n, __ATOMIC_RELEASE);
+	__atomic_add_fetch(&header->seq, 1, __ATOMIC_RELEASE);
+	/* subscribers map the segment read-only and cannot announce that
+	 * they wait, so wake unconditionally; this is one syscall per batch,
+	 * not per event */
+	futex(&header->seq, FUTEX_WAKE, INT_MAX, NULL);
+
+	return count;
+}
+
+static int shm_wait(struct evemu_shm *shm, int ms)
+{
+	struct shm_header *header = shm->header;
+	struct timespec deadline, now, timeout;
+
+	if (ms >= 0) {
+		clock_gettime(CLOCK_MONOTONIC, &deadline);
+		deadline.tv_sec += ms / 1000;
+		deadline.tv_nsec += (ms % 1000) * 1000000L;
+		if (deadline.tv_nsec >= 1000000000L) {
+			deadline.tv_sec++;
+			deadline.tv_nsec -= 1000000000L;
+		}
+	}
+
+	while (1) {
+		/* load seq before head: if the publisher adds events after
+		 * we checked head, seq has moved and the wait returns */
+		uint32_t seq = __atomic_load_n(&header->seq, __ATOMIC_ACQUIRE);
+
+		if (__atomic_load_n(&header->head, __ATOMIC_ACQUIRE) != shm->tail)
+			return 1;
+		if (__atomic_load_n(&header->closed, __ATOMIC_ACQUIRE))
+			return -EPIPE;
+
+		if (ms >= 0) {
+			clock_gettime(CLOCK_MONOTONIC, &now);
+			timeout.tv_sec = deadline.tv_sec - now.tv_sec;
+			timeout.tv_nsec = deadline.tv_nsec - now.tv_nsec;
+			if (timeout.tv_nsec < 0) {
+				timeout.tv_sec--;
+				timeout.tv_nsec += 1000000000L;
+			}
+			if (timeout.tv_sec < 0)
+				return 0;
+		}
+
+		if (futex(&header->seq, FUTEX_WAIT, seq,
+			  ms >= 0 ? &timeout : NULL) < 0 &&
+		    errno != EAGAIN && errno != EINTR && errno != ETIMEDOUT)
+			return -errno;
+	}
+}
+
+int evemu_shm_read(struct evemu_shm *shm, const struct input_event **events,
+		   int ms)
+{
+	struct shm_header *header = shm->header;
+	uint64_t capacity = header->capacity;
+	uint64_t head, reserved;
+	int rc;
+
+	if (shm->publisher)
+		return -EBADF;
+
+	do {
+		rc = shm_wait(shm, ms);
+		if (rc <= 0)
+			return rc;
+
+		/* load 'reserved' before 'head': a 'head' loaded first is
+		 * stale once the publisher completed more batches since */
+		reserved = __atomic_load_n(&header->reserved,
+					   __ATOMIC_ACQUIRE);
+		head = __atomic_load_n(&header->head, __ATOMIC_ACQUIRE);
+
+		/* overrun: skip to the oldest event that is not being
+		 * overwritten, which may be one that is not published yet;
+		 * never past 'head' */
+		if (reserved - shm->tail > capacity) {
+			uint64_t oldest = reserved - capacity;
+
+			if (oldest > head)
+				oldest = head;
+			shm->lost += oldest - shm->tail;
+			shm->tail = oldest;
+		}
+	} while (shm->tail == head);
+
+	/* the events up to the end of the ring, the rest is returned by the
+	 * next call */
+	rc = head - shm->tail;
+	if ((shm->tail & (capacity - 1)) + rc > capacity)
+		rc = capacity - (shm->tail & (capacity - 1));
+
+	*events = &shm->events[shm->tail & (capacity - 1)];
+	shm->last = shm->tail;
+	shm->tail += rc;
+
+	return rc;
+}
+
+int evemu_shm_valid(const struct evemu_shm *shm)
+{
+	uint64_t reserved;
+
+	/* the reads of the events happen before we look at 'reserved' */
+	__atomic_thread_fence(__ATOMIC_ACQUIRE);
+	reserved = __atomic_load_n(&shm->header->reserved, __ATOMIC_RELAXED);
+
+	return reserved - shm->last <= shm->header->capacity;
+}
+
+unsigned long evemu_shm_get_lost(const struct evemu_shm *shm)
+{
+	return shm->lost;
+}
+
+int evemu_context_record_shm(struct evemu_context *ctx, struct evemu_shm *shm,
+			     int fd, int ms)
+{
+	struct pollfd fds = { fd, POLLIN, 0 };
+	struct evemu_stats *stats = ctx->stats;
+	struct input_event buf[64];
+	size_t i, n;
+	ssize_t ret;
+
+	ret = poll(&fds, 1, ms);
+	if (ret == 0)
+		return 0;
+	if (ret < 0)
+		return -errno;
+
+	ret = read(fd, buf, sizeof(buf));
+	if (stats)
+		stats->read_calls++;
+	if (ret < 0)
+		return errno == EAGAIN ? 0 : -errno;
+	if (ret == 0)
+		return -ENODEV;
+
+	/* filter in place, the batch is published at once */
+	for (i = 0, n = 0; i < (size_t)ret / sizeof(buf[0]); i++) {
+		if (stats)
+			account_event(stats, &buf[i]);
+		if (ctx->filter && !evemu_filter_event(ctx->filter, &buf[i]))
+			continue;
+		buf[n++] = buf[i];
+	}
+
+	ret = evemu_shm_publish(shm, buf, n);
+	if (ret > 0 && stats)
+		stats->events_written += ret;
+
+	return ret;
+}
+
+/* Segments of a split recording are named <output>.<date>-<time>[.<n>],
+ * see make_filename() in evemu-record */
+#define SEGMENT_TIME "dddd-dd-dd-dd:dd:dd"
+
+struct evemu_tail {
+	/* the file read, -1 while waiting for the first segment */
+	int fd;
+	char *filename;
+	/* the basename of filename if it is a segment, NULL otherwise */
+	char *segment;
+	/* where the segments are and the basename of <output> */
+	char *dir;
+	char *base;
+	int inotify_fd;
+	int dir_wd;
+	int file_wd;
+	/* a segment was created since the directory was last scanned */
+	int pending;
+	/* data read but not parsed yet, from start to len */
+	char *buf;
+	size_t start;
+	size_t len;
+	size_t size;
+};
+
+/* Returns the <n> of a segment of base, 0 if it has none, or -1 if name
+ * is no segment of base */
+static long segment_number(const char *name, const char *base)
+{
+	size_t blen = strlen(base);
+	const char *p;
+	char *end;
+	long n;
+
+	if (strncmp(name, base, blen) != 0 || name[blen] != '.')
+		return -1;
+
+	name += blen + 1;
+	for (p = SEGMENT_TIME; *p; p++, name++) {
+		if (*p == 'd' ? !isdigit((unsigned char)*name) : *name != *p)
+			return -1;
+	}
+
+	if (*name == '\0')
+		return 0;
+	if (*name != '.' || !isdigit((unsigned char)name[1]))
+		return -1;
+	n = strtol(name + 1, &end, 10);
+
+	return *end == '\0' ? n : -1;
+}
+
+/* Orders two segments of base by time and <n> */
+static int segment_cmp(const char *a, const char *b, const char *base)
+{
+	size_t offset = strlen(base) + 1;
+	long na, nb;
+	int cmp;
+
+	cmp = strncmp(a + offset, b + offset, strlen(SEGMENT_TIME));
+	if (cmp)
+		return cmp;
+
+	na = segment_number(a, base);
+	nb = segment_number(b, base);
+
+	return na < nb ? -1 : na > nb;
+}
+
+/* Returns the <output> of a segment name, or NULL */
+static char *segment_base(const char *name)
+{
+	const char *dot;
+
+	for (dot = strrchr(name, '.'); dot; ) {
+		char *base = strndup(name, dot - name);
+
+		if (base && segment_number(name, base) >= 0)
+			return base;
+		free(base);
+
+		while (--dot > name && *dot != '.')
+			;
+		if (dot == name)
+			break;
+	}
+
+	return NULL;
+}
+
+/* Returns the name of the oldest segment newer than after, of the oldest
+ * segment if after is NULL, or of the newest segment if newest is set */
+static char *find_segment(const struct evemu_tail *tail, const char *after,
+			  int newest)
+{
+	struct dirent *dirent;
+	char *found = NULL;
+	DIR *dir;
+
+	dir = opendir(tail->dir);
+	if (!dir)
+		return NULL;
+
+	while ((dirent = readdir(dir))) {
+		const char *name = dirent->d_name;
+
+		if (segment_number(name, tail->base) < 0 ||
+		    (after && segment_cmp(name, after, tail->base) <= 0))
+			continue;
+		if (found &&
+		    (segment_cmp(name, found, tail->base) < 0) == newest)
+			continue;
+
+		free(found);
+		found = strdup(name);
+		if (!found)
+			break;
+	}
+	closedir(dir);
+
+	return found;
+}
+
+/* Starts reading the segment name of the tail's directory */
+static int tail_open_segment(struct evemu_tail *tail, char *name)
+{
+	char *filename;
+	int fd;
+
+	if (asprintf(&filename, "%s/%s", tail->dir, name) < 0) {
+		free(name);
+		return -ENOMEM;
+	}
+
+	fd = open(filename, O_RDONLY | O_CLOEXEC);
+	if (fd < 0) {
+		int err = errno;
+
+		free(filename);
+		free(name);
+		return -err;
+	}
+
+	if (tail->fd >= 0)
+		close(tail->fd);
+	if (tail->file_wd >= 0)
+		inotify_rm_watch(tail->inotify_fd, tail->file_wd);
+	free(tail->filename);
+	free(tail->segment);
+
+	tail->fd = fd;
+	tail->filename = filename;
+	tail->segment = name;
+	tail->file_wd = inotify_add_watch(tail->inotify_fd, filename,
+					  IN_MODIFY);
+	/* a segment cut off in the middle of a line ends there */
+	tail->start = 0;
+	tail->len = 0;
+
+	return 0;
+}
+
+struct evemu_tail *evemu_tail_new(const char *path, int fd)
+{
+	struct evemu_tail *tail;
+	const char *slash = strrchr(path, '/');
+	const char *name = slash ? slash + 1 : path;
+	int err = ENOMEM;
+
+	tail = calloc(1, sizeof(struct evemu_tail));
+	if (!tail)
+		return NULL;
+	tail->fd = -1;
+	tail->file_wd = -1;
+	tail->inotify_fd = -1;
+
+	if (slash == path)
+		tail->dir = strdup("/");
+	else if (slash)
+		tail->dir = strndup(path, slash - path);
+	else
+		tail->dir = strdup(".");
+	tail->base = segment_base(name);
+	if (tail->base) {
+		tail->segment = strdup(name);
+		if (!tail->segment)
+			goto error;
+	} else {
+		tail->base = strdup(name);
+	}
+	if (!tail->dir || !tail->base)
+		goto error;
+
+	tail->inotify_fd = inotify_init1(IN_NONBLOCK | IN_CLOEXEC);
+	if (tail->inotify_fd < 0)
+		goto errno_error;
+	tail->dir_wd = inotify_add_watch(tail->inotify_fd, tail->dir,
+					 IN_CREATE | IN_MOVED_TO);
+	if (tail->dir_wd < 0)
+		goto errno_error;
+
+	if (fd >= 0)
+		tail->fd = fcntl(fd, F_DUPFD_CLOEXEC, 0);
+	else
+		tail->fd = open(path, O_RDONLY | O_CLOEXEC);
+
+	if (tail->fd >= 0) {
+		tail->filename = strdup(path);
+		if (!tail->filename)
+			goto error;
+		if (fd >= 0) {
+			/* watch the open file, whatever @path refers to */
+			char proc[64];
+
+			snprintf(proc, sizeof(proc), "/proc/self/fd/%d",
+				 tail->fd);
+			tail->file_wd = inotify_add_watch(tail->inotify_fd,
+							  proc, IN_MODIFY);
+		}
+		if (tail->file_wd < 0)
+			tail->file_wd = inotify_add_watch(tail->inotify_fd,
+							  path, IN_MODIFY);
+	} else if (fd >= 0 || errno != ENOENT || tail->segment) {
+		goto errno_error;
+	} else {
+		/* <output> of a split recording, start with its newest
+		 * segment or wait for the first one */
+		char *segment = find_segment(tail, NULL, 1);
+
+		if (segment) {
+			int ret = tail_open_segment(tail, segment);
+
+			if (ret < 0) {
+				err = -ret;
+				goto error;
+			}
+		}
+	}
+
+	return tail;
+
+errno_error:
+	err = errno;
+error:
+	evemu_tail_delete(tail);
+	errno = err;
+	return NULL;
+}
+
+void evemu_tail_delete(struct evemu_tail *tail)
+{
+	if (tail == NULL)
+		return;
+
+	if (tail->fd >= 0)
+		close(tail->fd);
+	if (tail->inotify_fd >= 0)
+		close(tail->inotify_fd);
+	free(tail->filename);
+	free(tail->segment);
+	free(tail->dir);
+	free(tail->base);
+	free(tail->buf);
+	free(tail);
+}
+
+const char *evemu_tail_get_filename(const struct evemu_tail *tail)
+{
+	return tail->filename;
+}
+
+/* Reads what was appended. Returns the number of bytes read, zero at the
+ * end of the file, negative error otherwise */
+static int tail_fill(struct evemu_tail *tail)
+{
+	ssize_t ret;
+
+	if (tail->start > 0) {
+		memmove(tail->buf, tail->buf + tail->start,
+			tail->len - tail->start);
+		tail->len -= tail->start;
+		tail->start = 0;
+	}
+
+	if (tail->len == tail->size) {
+		size_t size = tail->size ? tail->size * 2 : 4096;
+		char *buf = realloc(tail->buf, size);
+
+		if (!buf)
+			return -ENOMEM;
+		tail->buf = buf;
+		tail->size = size;
+	}
+
+	SYSCALL(ret = read(tail->fd, tail->buf + tail->len,
+			   tail->size - tail->len));
+	if (ret < 0)
+		return -errno;
+	tail->len += ret;
+
+	return ret;
+}
+
+/* Returns 1 if an event was parsed, zero if all complete lines were read,
+ * negative error otherwise */
+static int tail_next_event(struct evemu_tail *tail, struct input_event *ev)
+{
+	char *line, *nl;
+	int ret;
+
+	if (tail->fd < 0)
+		return 0;
+
+	while (1) {
+		nl = memchr(tail->buf + tail->start, '\n',
+			    tail->len - tail->start);
+		if (!nl) {
+			ret = tail_fill(tail);
+			if (ret <= 0)
+				return ret;
+			continue;
+		}
+
+		*nl = '\0';
+		line = tail->buf + tail->start;
+		tail->start = nl - tail->buf + 1;
+
+		if (strncmp(line, "E:", 2) == 0)
+			return parse_event_line(line, ev) ? 1 : -EINVAL;
+	}
+}
+
+static void tail_dispatch(struct evemu_tail *tail)
+{
+	char buf[4096] __attribute__((aligned(__alignof__(struct inotify_event))));
+	const struct inotify_event *event;
+	ssize_t len;
+	char *p;
+
+	while ((len = read(tail->inotify_fd, buf, sizeof(buf))) > 0) {
+		for (p = buf; p < buf + len; p += sizeof(*event) + event->len) {
+			event = (const struct inotify_event *)p;
+			if (event->mask & IN_Q_OVERFLOW)
+				tail->pending = 1;
+			else if (event->wd == tail->dir_wd && event->len &&
+				 segment_number(event->name, tail->base) >= 0)
+				tail->pending = 1;
+		}
+	}
+}
+
+int evemu_tail_read_event(struct evemu_tail *tail, struct input_event *ev,
+			  int ms)
+{
+	struct pollfd pfd = { tail->inotify_fd, POLLIN, 0 };
+	uint64_t deadline = ms > 0 ? now_ns() + ms * 1000000ULL : 0;
+	int ret;
+
+	while (1) {
+		ret = tail_next_event(tail, ev);
+		if (ret != 0)
+			return ret;
+
+		/* all events of the current file were read after the next
+		 * segment was created, so the current one is complete */
+		if (tail->pending) {
+			char *segment = find_segment(tail, tail->segment, 0);
+
+			tail->pending = 0;
+			if (segment) {
+				ret = tail_open_segment(tail, segment);
+				if (ret < 0)
+					return ret;
+				/* there may be more segments */
+				tail->pending = 1;
+				continue;
+			}
+		}
+
+		if (ms > 0) {
+			uint64_t now = now_ns();
+
+			if (now >= deadline)
+				return 0;
+			ret = poll(&pfd, 1, (deadline - now + 999999) / 1000000);
+		} else {
+			ret = poll(&pfd, 1, ms);
+		}
+		if (ret < 0)
+			return -errno;
+		if (ret == 0)
+			return 0;
+		tail_dispatch(tail);
+	}
+}
+
+#define DEV_INPUT "/dev/input"
+#define MAX_SCAN_THREADS 8
+
+struct evemu_device_entry {
+	char *devnode;
+	struct evemu_device *dev;
+};
+
+struct evemu_device_list {
+	char *path;
+	int inotify_fd;
+	struct evemu_device_entry *entries;
+	size_t nentries;
+};
+
+static int is_event_node(const char *name)
+{
+	return strncmp(name, "event", 5) == 0;
+}
+
+static int select_event_node(const struct dirent *dir)
+{
+	return is_event_node(dir->d_name);
+}
+
+static struct evemu_device *probe_device(const char *devnode)
+{
+	struct evemu_device *dev;
+	int fd;
+
+	fd = open(devnode, O_RDONLY | O_NONBLOCK | O_CLOEXEC);
+	if (fd < 0)
+		return NULL;
+
+	dev = evemu_new(NULL);
+	if (dev && evemu_extract(dev, fd) != 0) {
+		evemu_delete(dev);
+		dev = NULL;
+	}
+	close(fd);
+
+	return dev;
+}
+
+struct scan_job {
+	struct evemu_device_entry *entries;
+	size_t nentries;
+	size_t next; /* shared between the scan threads */
+};
+
+static void *scan_thread(void *data)
+{
+	struct scan_job *job = data;
+	size_t i;
+
+	while ((i = __sync_fetch_and_add(&job->next, 1)) < job->nentries)
+		job->entries[i].dev = probe_device(job->entries[i].devnode);
+
+	return NULL;
+}
+
+/* Opening a device node may take a while, e.g. for devices behind a slow
+ * bus, so the nodes are probed from several threads */
+static int scan_devices(struct evemu_device_list *list)
+{
+	struct dirent **namelist;
+	struct evemu_device_entry *entries;
+	struct scan_job job = { NULL, 0, 0 };
+	pthread_t threads[MAX_SCAN_THREADS];
+	size_t nthreads = 0, i, n = 0;
+	int ndev;
+
+	ndev = scandir(list->path, &namelist, select_event_node, versionsort);
+	if (ndev < 0)
+		ndev = 0;
+
+	entries = calloc(ndev ? ndev : 1, sizeof(*entries));
+	for (i = 0; entries && i < (size_t)ndev; i++) {
+		if (asprintf(&entries[i].devnode, "%s/%s", list->path,
+			     namelist[i]->d_name) < 0)
+			entries[i].devnode = NULL;
+	}
+	for (i = 0; i < (size_t)ndev; i++)
+		free(namelist[i]);
+	if (ndev > 0)
+		free(namelist);
+	if (!entries)
+		return -ENOMEM;
+
+	job.entries = entries;
+	job.nentries = ndev;
+	while (nthreads < MAX_SCAN_THREADS && nthreads + 1 < (size_t)ndev &&
+	       pthread_create(&threads[nthreads], NULL, scan_thread, &job) == 0)
+		nthreads++;
+	scan_thread(&job);
+	for (i = 0; i < nthreads; i++)
+		pthread_join(threads[i], NULL);
+
+	/* drop the nodes we cannot read */
+	for (i = 0; i < (size_t)ndev; i++) {
+		if (entries[i].dev)
+			entries[n++] = entries[i];
+		else
+			free(entries[i].devnode);
+	}
+
+	for (i = 0; i < list->nentries; i++) {
+		free(list->entries[i].devnode);
+		evemu_delete(list->entries[i].dev);
+	}
+	free(list->entries);
+	list->entries = entries;
+	list->nentries = n;
+
+	return 0;
+}
+
+struct evemu_device_list *evemu_device_list_new(const char *path)
+{
+	struct evemu_device_list *list = calloc(1, sizeof(*list));
+
+	if (!list)
+		return NULL;
+
+	list->path = strdup(path ? path : DEV_INPUT);
+	if (!list->path) {
+		free(list);
+		return NULL;
+	}
+
+	/* the watch is added before the scan, so no device is missed */
+	list->inotify_fd = inotify_init1(IN_NONBLOCK | IN_CLOEXEC);
+	if (list->inotify_fd >= 0 &&
+	    inotify_add_watch(list->inotify_fd, list->path,
+			      IN_CREATE | IN_DELETE | IN_ATTRIB |
+			      IN_MOVED_FROM | IN_MOVED_TO) < 0) {
+		close(list->inotify_fd);
+		list->inotify_fd = -1;
+	}
+
+	if (scan_devices(list) != 0) {
+		evemu_device_list_delete(list);
+		return NULL;
+	}
+
+	return list;
+}
+
+void evemu_device_list_delete(struct evemu_device_list *list)
+{
+	size_t i;
+
+	if (list == NULL)
+		return;
+
+	for (i = 0; i < list->nentries; i++) {
+		free(list->entries[i].devnode);
+		evemu_delete(list->entries[i].dev);
+	}
+	free(list->entries);
+	if (list->inotify_fd >= 0)
+		close(list->inotify_fd);
+	free(list->path);
+	free(list);
+}
+
+/* rescans a single node, returns 1 if the list changed */
+static int update_device(struct evemu_device_list *list, const char *name)
+{
+	struct evemu_device_entry entry, *entries;
+	size_t i, pos;
+	int changed = 0;
+
+	if (asprintf(&entry.devnode, "%s/%s", list->path, name) < 0)
+		return -ENOMEM;
+
+	for (pos = 0; pos < list->nentries; pos++) {
+		int cmp = strverscmp(list->entries[pos].devnode, entry.devnode);
+
+		if (cmp == 0) {
+			free(list->entries[pos].devnode);
+			evemu_delete(list->entries[pos].dev);
+			list->nentries--;
+			memmove(&list->entries[pos], &list->entries[pos + 1],
+				(list->nentries - pos) * sizeof(*entries));
+			changed = 1;
+			break;
+		}
+		if (cmp > 0)
+			break;
+	}
+
+	entry.dev = probe_device(entry.devnode);
+	if (!entry.dev) {
+		free(entry.devnode);
+		return changed;
+	}
+
+	entries = realloc(list->entries,
+			  (list->nentries + 1) * sizeof(*entries));
+	if (!entries) {
+		free(entry.devnode);
+		evemu_delete(entry.dev);
+		return -ENOMEM;
+	}
+	list->entries = entries;
+	for (i = list->nentries; i > pos; i--)
+		entries[i] = entries[i - 1];
+	entries[pos] = entry;
+	list->nentries++;
+
+	return 1;
+}
+
+int evemu_device_list_update(struct evemu_device_list *list)
+{
+	char buf[4096] __attribute__((aligned(__alignof__(struct inotify_event))));
+	int changed = 0;
+	ssize_t len;
+
+	if (list->inotify_fd < 0) {
+		size_t before = list->nentries;
+		int rc = scan_devices(list);
+
+		if (rc < 0)
+			return rc;
+		/* without inotify we cannot tell, assume something changed
+		 * if the number of devices did */
+		return before != list->nentries;
+	}
+
+	while ((len = read(list->inotify_fd, buf, sizeof(buf))) > 0) {
+		const struct inotify_event *e;
+		char *p;
+
+		for (p = buf; p < buf + len; p += sizeof(*e) + e->len) {
+			int rc;
+
+			e = (const struct inotify_event *)p;
+			if (e->mask & IN_Q_OVERFLOW) {
+				rc = scan_devices(list);
+				if (rc < 0)
+					return rc;
+				changed++;
+				continue;
+			}
+			if (!e->len || !is_event_node(e->name))
+				continue;
+
+			rc = update_device(list, e->name);
+			if (rc < 0)
+				return rc;
+			changed += rc;
+		}
+	}
+
+	if (len < 0 && errno != EAGAIN)
+		return -errno;
+
+	return changed;
+}
+
+int evemu_device_list_get_fd(const struct evemu_device_list *list)
+{
+	return list->inotify_fd;
+}
+
+size_t evemu_device_list_get_count(const struct evemu_device_list *list)
+{
+	return list->nentries;
+}
+
+const char *evemu_device_list_get_devnode(const struct evemu_device_list *list,
+					  size_t index)
+{
+	if (index >= list->nentries)
+		return NULL;
+
+	return list->entries[index].devnode;
+}
+
+const struct evemu_device *
+evemu_device_list_get_device(const struct evemu_device_list *list,
+			     size_t index)
+{
+	if (index >= list->nentries)
+		return NULL;
+
+	return list->entries[index].dev;
+}
+
+struct evemu_node {
+	char *devnode;
+	int flags;
+	int ready;
+};
+
+struct evemu_node_watch {
+	int inotify_fd;
+	struct evemu_node *nodes;
+	size_t nnodes;
+};
+
+struct evemu_node_watch *evemu_node_watch_new(void)
+{
+	struct evemu_node_watch *watch = calloc(1, sizeof(*watch));
+
+	if (!watch)
+		return NULL;
+
+	watch->inotify_fd = inotify_init1(IN_NONBLOCK | IN_CLOEXEC);
+	if (watch->inotify_fd < 0) {
+		free(watch);
+		return NULL;
+	}
+
+	return watch;
+}
+
+void evemu_node_watch_delete(struct evemu_node_watch *watch)
+{
+	size_t i;
+
+	if (watch == NULL)
+		return;
+
+	for (i = 0; i < watch->nnodes; i++)
+		free(watch->nodes[i].devnode);
+	free(watch->nodes);
+	close(watch->inotify_fd);
+	free(watch);
+}
+
+/* Watches the directory of the node, or the closest parent that exists
+ * if the directory itself is yet to be created (e.g. /dev/input for the
+ * first input device). Adding the same watch twice is harmless. */
+static void watch_node_dir(int fd, const char *devnode)
+{
+	char dir[PATH_MAX];
+	char *slash;
+
+	snprintf(dir, sizeof(dir), "%s", devnode);
+	while ((slash = strrchr(dir, '/')) && slash != dir) {
+		*slash = '\0';
+		if (inotify_add_watch(fd, dir, IN_CREATE | IN_ATTRIB |
+				      IN_MOVED_TO) >= 0 || errno != ENOENT)
+			return;
+	}
+}
+
+static int node_ready(const struct evemu_node *node)
+{
+	int fd = open(node->devnode, node->flags | O_NONBLOCK | O_CLOEXEC);
+
+	if (fd < 0)
+		return 0;
+	close(fd);
+	return 1;
+}
+
+int evemu_node_watch_add(struct evemu_node_watch *watch, const char *devnode,
+			 int flags)
+{
+	struct evemu_node *nodes;
+
+	nodes = realloc(watch->nodes, (watch->nnodes + 1) * sizeof(*nodes));
+	if (!nodes)
+		return -ENOMEM;
+	watch->nodes = nodes;
+
+	nodes[watch->nnodes].devnode = strdup(devnode);
+	if (!nodes[watch->nnodes].devnode)
+		return -ENOMEM;
+	nodes[watch->nnodes].flags = flags & O_ACCMODE;
+	nodes[watch->nnodes].ready = 0;
+	watch->nnodes++;
+
+	/* the watch goes first, so a node created in between is not missed */
+	watch_node_dir(watch->inotify_fd, devnode);
+
+	return 0;
+}
+
+int evemu_node_watch_get_fd(const struct evemu_node_watch *watch)
+{
+	return watch->inotify_fd;
+}
+
+int evemu_node_watch_dispatch(struct evemu_node_watch *watch)
+{
+	char buf[4096] __attribute__((aligned(__alignof__(struct inotify_event))));
+	size_t i;
+	int pending = 0;
+
+	/* the events only tell us when to look again */
+	while (read(watch->inotify_fd, buf, sizeof(buf)) > 0)
+		;
+	if (errno != EAGAIN)
+		return -errno;
+
+	for (i = 0; i < watch->nnodes; i++) {
+		struct evemu_node *node = &watch->nodes[i];
+
+		if (node->ready)
+			continue;
+
+		node->ready = node_ready(node);
+		if (!node->ready) {
+			/* a parent directory may have appeared */
+			watch_node_dir(watch->inotify_fd, node->devnode);
+			node->ready = node_ready(node);
+		}
+		if (!node->ready)
+			pending++;
+	}
+
+	return pending;
+}
+
+int evemu_node_watch_wait(struct evemu_node_watch *watch, int ms)
+{
+	struct pollfd fds = { watch->inotify_fd, POLLIN, 0 };
+	uint64_t deadline = now_ns() + (uint64_t)ms * 1000000;
+
+	for (;;) {
+		int64_t left;
+		int rc = evemu_node_watch_dispatch(watch);
+
+		if (rc <= 0)
+			return rc;
+
+		if (ms < 0) {
+			left = -1;
+		} else {
+			left = ((int64_t)deadline - (int64_t)now_ns()) / 1000000;
+			if (left < 0)
+				return -ETIMEDOUT;
+		}
+
+		rc = poll(&fds, 1, left > INT_MAX ? INT_MAX : (int)left);
+		if (rc < 0 && errno != EINTR)
+			return -errno;
+	}
+}
+
+int evemu_wait_devnode(struct evemu_device *dev, int flags, int ms)
+{
+	struct evemu_node_watch *watch;
+	const char *devnode = evemu_get_devnode(dev);
+	int rc;
+
+	if (!devnode)
+		return -ENODEV;
+
+	watch = evemu_node_watch_new();
+	if (!watch)
+		return -errno;
+
+	rc = evemu_node_watch_add(watch, devnode, flags);
+	if (rc == 0)
+		rc = evemu_node_watch_wait(watch, ms);
+
+	evemu_node_watch_delete(watch);
+	return rc;
+}
+
 int evemu_create(struct evemu_device *dev, int fd)
 {
 	return libevdev_uinput_create_from_device(dev->evdev, fd, &dev->uidev);
@@ -329,7 +329,9 @@ int evemu_read(struct evemu_device *dev, FILE *fp);
  * @fp: file pointer to write the event to
  * @ev: pointer to the kernel event to write
  *
- * Writes the kernel event to the file.
+ * Writes the kernel event to the file. The time since the previous
+ * SYN_REPORT written by the calling thread is added as comment, use
+ * evemu_context_write_event() to keep separate streams apart.
  *
  * Returns a positive number if successful, zero or negative error
  * otherwise.
@@ -411,6 +413,1015 @@ int evemu_play_one(int fd, const struct input_event *ev);
  */
 int evemu_play(FILE *fp, int fd);
 
+/**
+ * evemu_filter_new() - allocate a new event filter
+ *
+ * Allocates a filter that passes all events. Rules are added with
+ * evemu_filter_add().
+ *
+ * Returns NULL in case of memory failure.
+ */
+struct evemu_filter *evemu_filter_new(void);
+
+/**
+ * evemu_filter_delete() - free an event filter
+ * @filter: the filter to free
+ *
+ * The filter pointer is invalidated by this call.
+ */
+void evemu_filter_delete(struct evemu_filter *filter);
+
+/**
+ * evemu_filter_add() - add rules to an event filter
+ * @filter: the filter in use
+ * @spec: a comma-separated list of rules
+ *
+ * Each rule is one of
+ *   select=<event>	only pass the given events (EV_SYN always passes)
+ *   drop=<event>	drop the given events
+ *   time=<start>-<end>	only pass events within the time window, in
+ *			seconds. Either bound may be omitted.
+ *   remap=<event>=<event>	replace the type and code of an event
+ *
+ * An event is an event type, a type and code separated by a colon or an
+ * event code on its own, e.g. "EV_MSC", "EV_ABS:ABS_X" or "ABS_X".
+ * Numerical values may be used instead of names. The type/code rules are
+ * compiled into a bitmask, so the cost of filtering an event does not
+ * depend on the number of rules.
+ *
+ * Returns zero if successful, negative error otherwise.
+ */
+int evemu_filter_add(struct evemu_filter *filter, const char *spec);
+
+/**
+ * evemu_filter_event() - run an event through a filter
+ * @filter: the filter in use
+ * @ev: pointer to the kernel event, modified if a remap rule applies
+ *
+ * A SYN_REPORT is dropped if the filter dropped all events of its frame.
+ * The filter keeps state across calls, use one filter per event stream.
+ *
+ * If reduction is enabled, rules are applied first, then events the
+ * kernel would discard are dropped, see evemu_filter_enable_reduction().
+ *
+ * Returns 1 if the event passes the filter, zero if it should be dropped.
+ */
+int evemu_filter_event(struct evemu_filter *filter, struct input_event *ev);
+
+/**
+ * evemu_filter_enable_reduction() - drop events the kernel would discard
+ * @filter: the filter in use
+ * @dev: the device the events are written to
+ *
+ * The kernel's input core discards key, switch and LED events that do not
+ * change the state, EV_REL events with a zero value, absolute events
+ * within the fuzz of the previous value (per slot for multitouch axes),
+ * events the device does not support and frames without events. With
+ * reduction enabled, the filter tracks the device state the same way and
+ * drops these events before they are written. Clients see the same event
+ * stream, but each dropped event saves a write(2).
+ *
+ * The initial state is taken from @dev. A device described by a file
+ * starts with all slots unused. Enabling reduction again resets the state
+ * and the reduced count.
+ *
+ * Returns zero if successful, negative error otherwise.
+ */
+int evemu_filter_enable_reduction(struct evemu_filter *filter,
+				  const struct evemu_device *dev);
+
+/**
+ * evemu_filter_get_reduced_count() - get the number of reduced events
+ * @filter: the filter in use
+ *
+ * Returns the number of events, including SYN_REPORTs, dropped because
+ * the kernel would have discarded them.
+ */
+unsigned long evemu_filter_get_reduced_count(const struct evemu_filter *filter);
+
+/**
+ * evemu_record_filtered() - read and filter events from a kernel device
+ * @fp: file pointer to write the events to
+ * @fd: file descriptor of kernel device to read from
+ * @ms: maximum time to wait for an event to appear before reading (ms)
+ * @filter: the filter to apply, or NULL
+ *
+ * Like evemu_record(), but events dropped by the filter are not written.
+ * Time windows apply to the timestamps as written to the file. Once the
+ * end of the time window has passed, the function returns after the
+ * first frame past it instead of waiting for the timeout.
+ *
+ * Returns zero if successful, negative error otherwise.
+ */
+int evemu_record_filtered(FILE *fp, int fd, int ms,
+			  struct evemu_filter *filter);
+
+/**
+ * evemu_play_filtered() - replay filtered events from file in realtime
+ * @fp: file pointer to read the events from
+ * @fd: file descriptor of kernel device to write to
+ * @filter: the filter to apply, or NULL
+ *
+ * Like evemu_play(), but events dropped by the filter are not written
+ * and do not contribute to the replay timing.
+ *
+ * Returns zero if successful, negative error otherwise.
+ */
+int evemu_play_filtered(FILE *fp, int fd, struct evemu_filter *filter);
+
+#define EVEMU_STATS_OVERSHOOT_BUCKETS 16
+
+/**
+ * struct evemu_stats - counters collected by a context
+ * @events_read: events parsed from a file or read from a device
+ * @events_written: events written to a device or a file
+ * @parse_failures: lines that could not be parsed as event
+ * @read_calls: read(2) calls on the device
+ * @write_calls: write(2) calls on the device
+ * @write_errors: write(2) calls that failed
+ * @short_writes: write(2) calls that wrote less than one event
+ * @syn_dropped: SYN_DROPPED events seen
+ * @sleeps: sleeps to honor the timestamps of the events
+ * @sleep_overshoot: histogram of the time slept beyond the requested
+ *	time. Bucket 0 counts overshoots below 1µs, bucket n overshoots of
+ *	[2^(n-1), 2^n)µs, the last bucket counts all longer overshoots.
+ * @max_overshoot_us: the longest overshoot in µs
+ * @parse_ns: time spent parsing events, in ns
+ * @sleep_ns: time spent sleeping, in ns
+ * @write_ns: time spent writing events, in ns
+ */
+struct evemu_stats {
+	unsigned long events_read;
+	unsigned long events_written;
+	unsigned long parse_failures;
+	unsigned long read_calls;
+	unsigned long write_calls;
+	unsigned long write_errors;
+	unsigned long short_writes;
+	unsigned long syn_dropped;
+	unsigned long sleeps;
+	unsigned long sleep_overshoot[EVEMU_STATS_OVERSHOOT_BUCKETS];
+	unsigned long max_overshoot_us;
+	unsigned long long parse_ns;
+	unsigned long long sleep_ns;
+	unsigned long long write_ns;
+};
+
+#define EVEMU_LATENCY_BUCKETS 20
+#define EVEMU_LATENCY_STALLS 16
+
+/**
+ * struct evemu_latency_stall - a frame delivered late
+ * @time: the time of the frame in the recording, in µs
+ * @latency_us: the delivery latency of the frame in µs
+ */
+struct evemu_latency_stall {
+	long time;
+	unsigned long latency_us;
+};
+
+/**
+ * struct evemu_latency - delivery latency of recorded frames
+ * @frames: frames measured
+ * @histogram: histogram of the delivery latency. Bucket 0 counts
+ *	latencies below 1µs, bucket n latencies of [2^(n-1), 2^n)µs, the
+ *	last bucket counts all longer latencies.
+ * @max_us: the longest latency in µs
+ * @total_us: the sum of all latencies in µs
+ * @skewed: frames with a timestamp later than the time they were read,
+ *	not measured. The device does not timestamp with CLOCK_MONOTONIC.
+ * @stalls: frames with a latency of at least the stall threshold
+ * @stall: the most recent stalls, oldest first, up to
+ *	EVEMU_LATENCY_STALLS or @stalls
+ *
+ * The delivery latency of a frame is the time from the kernel timestamp
+ * of its SYN_REPORT until evemu read the SYN_REPORT. It grows when the
+ * recording process is not scheduled in time.
+ */
+struct evemu_latency {
+	unsigned long frames;
+	unsigned long histogram[EVEMU_LATENCY_BUCKETS];
+	unsigned long max_us;
+	unsigned long long total_us;
+	unsigned long skewed;
+	unsigned long stalls;
+	struct evemu_latency_stall stall[EVEMU_LATENCY_STALLS];
+};
+
+/**
+ * evemu_context_new() - create a new record/replay context
+ *
+ * A context holds the state of one event stream. The evemu_context_*
+ * functions behave like their counterparts without context but apply the
+ * context's filter and collect statistics if enabled.
+ *
+ * Contexts share no state, so separate contexts may be used concurrently
+ * from separate threads. A single context, including its filter, must
+ * only be used by one thread at a time. evemu_play(), evemu_record() and
+ * their _filtered variants use a private context for each call and are
+ * thus reentrant.
+ *
+ * Returns NULL in case of memory failure.
+ */
+struct evemu_context *evemu_context_new(void);
+
+/**
+ * evemu_context_delete() - free a context
+ * @ctx: the context to free
+ *
+ * The filter set on the context is not freed.
+ */
+void evemu_context_delete(struct evemu_context *ctx);
+
+/**
+ * evemu_context_set_filter() - set the filter applied by a context
+ * @ctx: the context in use
+ * @filter: the filter to apply, or NULL
+ *
+ * The caller keeps ownership of the filter, it must stay valid while the
+ * context uses it.
+ */
+void evemu_context_set_filter(struct evemu_context *ctx,
+			      struct evemu_filter *filter);
+
+/**
+ * evemu_context_set_record_limits() - limit the length of a recording
+ * @ctx: the context in use
+ * @bytes: the number of bytes after which to stop, or 0
+ * @us: the recording time in µs after which to stop, or 0
+ *
+ * evemu_context_record() returns at the end of the first frame that
+ * exceeds either limit, so each recording holds whole frames. The time
+ * is measured from the first event recorded. This allows splitting a
+ * continuous stream of events into several files. Both limits are 0
+ * by default.
+ */
+void evemu_context_set_record_limits(struct evemu_context *ctx,
+				     size_t bytes, long us);
+
+/**
+ * evemu_context_enable_checkpoints() - write state checkpoints while recording
+ * @ctx: the context in use
+ * @dev: the device recorded from
+ * @interval: the minimum time between two checkpoints in µs, or 0
+ *
+ * A replay from the middle of a recording depends on the state built up
+ * by the events before it: pressed keys, switch and LED states and the
+ * contacts in each slot. With checkpoints enabled, evemu_context_record()
+ * tracks the state of the recorded events and writes it as a checkpoint
+ * at the start of each recording and after the first frame at least
+ * @interval after the previous checkpoint. Checkpoints are comment lines,
+ * readers that do not know them skip them. See evemu_seek().
+ *
+ * The initial state is taken from @dev, which should be extracted from
+ * the recorded device. The state is kept across calls, so each file of a
+ * rotated recording starts with the state it continues from. Enabling
+ * checkpoints again resets the state, an @interval of 0 disables them.
+ *
+ * Returns zero if successful, negative error otherwise.
+ */
+int evemu_context_enable_checkpoints(struct evemu_context *ctx,
+				     const struct evemu_device *dev,
+				     long interval);
+
+/**
+ * evemu_context_enable_stats() - enable statistics collection
+ * @ctx: the context in use
+ *
+ * Statistics are off by default, collecting them costs a few
+ * clock_gettime(2) calls per event. If already enabled, the statistics
+ * are reset.
+ *
+ * Returns zero if successful, negative error otherwise.
+ */
+int evemu_context_enable_stats(struct evemu_context *ctx);
+
+/**
+ * evemu_context_get_stats() - get the statistics of a context
+ * @ctx: the context in use
+ * @stats: the struct to copy the statistics into
+ *
+ * Returns zero if successful or -EINVAL if statistics are not enabled.
+ */
+int evemu_context_get_stats(const struct evemu_context *ctx,
+			    struct evemu_stats *stats);
+
+/**
+ * evemu_context_enable_latency() - measure the delivery latency of frames
+ * @ctx: the context in use
+ * @stall_us: the latency in µs from which a frame counts as stall, or 0
+ * @annotate: non-zero to write the latency of each frame
+ *
+ * With latency profiling enabled, evemu_context_record() compares the
+ * kernel timestamp of each SYN_REPORT with the CLOCK_MONOTONIC time it
+ * was read at, see struct evemu_latency. The device is switched to
+ * CLOCK_MONOTONIC timestamps with EVIOCSCLOCKID, which the recording
+ * does not show as its timestamps are relative to the first event. This
+ * costs one clock_gettime(2) per frame.
+ *
+ * With @annotate, a comment line "# L: <µs>" follows each SYN_REPORT
+ * written, with " stall" appended for stalls. Readers skip it.
+ *
+ * If already enabled, the latencies are reset.
+ *
+ * Returns zero if successful, negative error otherwise.
+ */
+int evemu_context_enable_latency(struct evemu_context *ctx, long stall_us,
+				 int annotate);
+
+/**
+ * evemu_context_get_latency() - get the delivery latency of recorded frames
+ * @ctx: the context in use
+ * @latency: the struct to copy the latencies into
+ *
+ * Returns zero if successful or -EINVAL if latency profiling is not
+ * enabled.
+ */
+int evemu_context_get_latency(const struct evemu_context *ctx,
+			      struct evemu_latency *latency);
+
+/**
+ * evemu_context_enable_trace() - trace record and replay on a timeline
+ * @ctx: the context in use
+ * @max_records: the most trace records kept in memory, or 0
+ *
+ * With tracing enabled, evemu_context_play() records a span for parsing,
+ * sleeping for and writing each event and one span per frame, from
+ * parsing its first event to writing its SYN_REPORT. After each frame,
+ * the lateness of the frame against the timeline of the recording is
+ * recorded as counter.
+ * evemu_context_record() records a span for reading and writing each
+ * event, one span per frame and, if enabled, the delivery latency of
+ * each frame as counter.
+ *
+ * Records are kept in memory and written by evemu_context_write_trace(),
+ * so the replay and recording only pay for a clock_gettime(2) call or
+ * two per event. Records beyond @max_records are dropped. If already
+ * enabled, the records are cleared, a @max_records of 0 disables
+ * tracing.
+ *
+ * Returns zero if successful, negative error otherwise.
+ */
+int evemu_context_enable_trace(struct evemu_context *ctx, size_t max_records);
+
+/**
+ * evemu_context_write_trace() - write the trace records of a context
+ * @ctx: the context in use
+ * @fp: file pointer to write the trace to
+ *
+ * Writes the records collected since evemu_context_enable_trace() in the
+ * JSON trace event format read by chrome://tracing and Perfetto. Times
+ * are in µs since tracing was enabled.
+ *
+ * Returns zero if successful, -EINVAL if tracing is not enabled or
+ * negative error otherwise.
+ */
+int evemu_context_write_trace(const struct evemu_context *ctx, FILE *fp);
+
+/**
+ * evemu_context_read_event() - read kernel event from file
+ * @ctx: the context in use
+ * @fp: file pointer to read the event from
+ * @ev: pointer to the kernel event to be filled
+ *
+ * Like evemu_read_event(). The context's filter is not applied.
+ *
+ * Returns the number of events read, negative error otherwise.
+ */
+int evemu_context_read_event(struct evemu_context *ctx, FILE *fp,
+			     struct input_event *ev);
+
+/**
+ * evemu_context_read_event_realtime() - read event from file in realtime
+ * @ctx: the context in use
+ * @fp: file pointer to read the event from
+ * @ev: pointer to the kernel event to be filled
+ * @evtime: pointer to a timeval struct
+ *
+ * Like evemu_read_event_realtime(). The context's filter is not applied.
+ *
+ * Returns the number of events read, negative error otherwise.
+ */
+int evemu_context_read_event_realtime(struct evemu_context *ctx, FILE *fp,
+				      struct input_event *ev,
+				      struct timeval *evtime);
+
+/**
+ * evemu_context_write_event() - write kernel event to file
+ * @ctx: the context in use
+ * @fp: file pointer to write the event to
+ * @ev: pointer to the kernel event to write
+ *
+ * Like evemu_write_event(), with the time since the previous SYN_REPORT
+ * written through this context as comment. The context's filter is not
+ * applied.
+ *
+ * Returns a positive number if successful, zero or negative error
+ * otherwise.
+ */
+int evemu_context_write_event(struct evemu_context *ctx, FILE *fp,
+			      const struct input_event *ev);
+
+/**
+ * evemu_context_play_one() - play one event to kernel device
+ * @ctx: the context in use
+ * @fd: file descriptor of kernel device to write to
+ * @ev: pointer to the kernel event to be played
+ *
+ * Like evemu_play_one(). The context's filter is not applied.
+ *
+ * Returns zero if successful, negative error otherwise.
+ */
+int evemu_context_play_one(struct evemu_context *ctx, int fd,
+			   const struct input_event *ev);
+
+/**
+ * evemu_context_play() - replay events from file to kernel device
+ * @ctx: the context in use
+ * @fp: file pointer to read the events from
+ * @fd: file descriptor of kernel device to write to
+ *
+ * Like evemu_play_filtered() with the context's filter.
+ *
+ * Returns zero if successful, negative error otherwise.
+ */
+int evemu_context_play(struct evemu_context *ctx, FILE *fp, int fd);
+
+/**
+ * evemu_context_play_from() - replay events from a point in time
+ * @ctx: the context in use
+ * @fp: file pointer to read the events from, must be seekable
+ * @fd: file descriptor of kernel device to write to
+ * @time: the time in µs to start replaying at
+ *
+ * Like evemu_context_play(), but first restores the device state at
+ * @time with a single frame and then replays the events from the first
+ * frame at or after @time, see evemu_seek(). With checkpoints in the
+ * recording, this takes about as long as replaying from the start of the
+ * recording to the first checkpoint.
+ *
+ * Returns zero if successful, negative error otherwise.
+ */
+int evemu_context_play_from(struct evemu_context *ctx, FILE *fp, int fd,
+			    long time);
+
+/**
+ * evemu_context_record() - read events from kernel device
+ * @ctx: the context in use
+ * @fp: file pointer to write the events to
+ * @fd: file descriptor of kernel device to read from
+ * @ms: maximum time to wait for an event to appear before reading (ms)
+ *
+ * Like evemu_record_filtered() with the context's filter.
+ *
+ * Returns zero if successful, 1 if a limit set with
+ * evemu_context_set_record_limits() was reached, negative error
+ * otherwise.
+ */
+int evemu_context_record(struct evemu_context *ctx, FILE *fp, int fd, int ms);
+
+/**
+ * evemu_seek() - position a recording at a point in time
+ * @dev: the device the events are written to
+ * @fp: file pointer to read the events from, positioned before the
+ * first event and seekable
+ * @time: the time in µs to seek to
+ * @frame: set to the frame restoring the state at @time, or NULL
+ *
+ * Finds the last checkpoint before @time by bisecting the file,
+ * then reads the events following it up to the first frame at or after
+ * @time. On return, @fp is positioned at that frame. Without a checkpoint
+ * before @time, the state is tracked from the current state of @dev and
+ * the current position of @fp.
+ *
+ * @frame holds the events that take @dev from its current state to the
+ * state at @time, terminated by a SYN_REPORT and timestamped with the
+ * time of the next event. Only the keys, switches, LEDs, axes and slots
+ * that differ are included. The caller must free() it.
+ *
+ * Returns the number of events in @frame, zero if the state does not
+ * differ, negative error otherwise.
+ */
+int evemu_seek(const struct evemu_device *dev, FILE *fp, long time,
+	       struct input_event **frame);
+
+/**
+ * evemu_add_checkpoints() - add state checkpoints to a recording
+ * @in: file pointer to read the recording from, must be seekable
+ * @out: file pointer to write the recording to
+ * @interval: the minimum time between two checkpoints in µs
+ *
+ * Copies a recording, including its description, and writes a checkpoint
+ * at its start and after the first frame at least @interval after the
+ * previous checkpoint, see evemu_context_enable_checkpoints(). Existing
+ * checkpoints are replaced, all other lines are copied as they are.
+ *
+ * Returns zero if successful, negative error otherwise.
+ */
+int evemu_add_checkpoints(FILE *in, FILE *out, long interval);
+
+/**
+ * evemu_recording_new() - read a recording into memory
+ * @fp: file pointer to read the events from
+ * @filter: the filter to apply while reading, or NULL
+ *
+ * Reads all events from the file and splits them into frames, each
+ * terminated by a SYN_REPORT. A recording is read-only once created and
+ * may be played to any number of devices, see evemu_player_add().
+ *
+ * Returns NULL in case of memory failure or if the file contains
+ * invalid events.
+ */
+struct evemu_recording *evemu_recording_new(FILE *fp,
+					    struct evemu_filter *filter);
+
+/**
+ * evemu_recording_delete() - free a recording
+ * @rec: the recording to free
+ */
+void evemu_recording_delete(struct evemu_recording *rec);
+
+/**
+ * evemu_recording_get_frame_count() - get the number of frames
+ * @rec: the recording in use
+ *
+ * Returns the number of frames in the recording.
+ */
+size_t evemu_recording_get_frame_count(const struct evemu_recording *rec);
+
+/**
+ * evemu_recording_get_duration() - get the duration of a recording
+ * @rec: the recording in use
+ *
+ * Returns the time between the first and the last event in µs.
+ */
+long evemu_recording_get_duration(const struct evemu_recording *rec);
+
+/**
+ * evemu_player_new() - create a new multi-device player
+ *
+ * A player replays several recordings to several devices on one
+ * timeline. Each frame is written to its device with a single write(2)
+ * when it is due, frames of different devices are dispatched in the
+ * order of their timestamps.
+ *
+ * Returns NULL in case of memory failure.
+ */
+struct evemu_player *evemu_player_new(void);
+
+/**
+ * evemu_player_delete() - free a player
+ * @player: the player to free
+ *
+ * The recordings added to the player are not freed.
+ */
+void evemu_player_delete(struct evemu_player *player);
+
+/**
+ * evemu_player_add() - add a device to a player
+ * @player: the player in use
+ * @rec: the recording to play to the device
+ * @fd: file descriptor of kernel device to write to
+ * @offset: time in µs to delay the recording by
+ *
+ * The first event of each recording is played at the start of the
+ * replay plus @offset, the timing within each recording is preserved.
+ * The same recording may be added for several devices. The caller keeps
+ * ownership of the recording, it must stay valid while the player uses
+ * it.
+ *
+ * Returns zero if successful, negative error otherwise.
+ */
+int evemu_player_add(struct evemu_player *player,
+		     const struct evemu_recording *rec, int fd, long offset);
+
+/**
+ * evemu_player_run() - replay all recordings in realtime
+ * @player: the player in use
+ *
+ * All frames are scheduled against the same CLOCK_MONOTONIC start
+ * time, so the devices do not drift apart. A device that fails a write
+ * is skipped for the remainder of the replay. The function terminates
+ * when all recordings have been played and may be called again to
+ * replay them again.
+ *
+ * Returns zero if successful, or the first negative error of a write.
+ */
+int evemu_player_run(struct evemu_player *player);
+
+/**
+ * evemu_ring_new() - create an in-memory flight recorder
+ * @size: the memory to use for events, in bytes
+ * @duration: the time window to keep in µs, or 0 for no time limit
+ *
+ * A ring keeps the most recent events read from a device in a
+ * fixed-size buffer. Once the buffer is full or the events exceed the
+ * time window, the oldest events are overwritten. Events are stored
+ * raw, nothing is formatted or filtered until the ring is written out
+ * with evemu_context_write_ring().
+ *
+ * Returns NULL in case of memory failure or if @size cannot hold a
+ * single event.
+ */
+struct evemu_ring *evemu_ring_new(size_t size, long duration);
+
+/**
+ * evemu_ring_delete() - free a ring
+ * @ring: the ring to free
+ */
+void evemu_ring_delete(struct evemu_ring *ring);
+
+/**
+ * evemu_ring_add_trigger() - add an event pattern that triggers a dump
+ * @ring: the ring in use
+ * @spec: the event pattern
+ *
+ * The pattern is an event as accepted by evemu_filter_add(), e.g.
+ * "EV_KEY:KEY_F12" or "BTN_TOUCH", optionally followed by "=<value>"
+ * to only match that value. A ring may have several triggers.
+ *
+ * Returns zero if successful, negative error otherwise.
+ */
+int evemu_ring_add_trigger(struct evemu_ring *ring, const char *spec);
+
+/**
+ * evemu_ring_add_event() - add an event to a ring
+ * @ring: the ring in use
+ * @ev: the event to add
+ *
+ * Returns 1 if @ev is the SYN_REPORT completing a frame that matched a
+ * trigger, zero otherwise.
+ */
+int evemu_ring_add_event(struct evemu_ring *ring,
+			 const struct input_event *ev);
+
+/**
+ * evemu_ring_get_event_count() - get the number of events in a ring
+ * @ring: the ring in use
+ */
+size_t evemu_ring_get_event_count(const struct evemu_ring *ring);
+
+/**
+ * evemu_ring_clear() - discard all events in a ring
+ * @ring: the ring in use
+ */
+void evemu_ring_clear(struct evemu_ring *ring);
+
+/**
+ * evemu_context_record_ring() - read events from a device into a ring
+ * @ctx: the context in use
+ * @ring: the ring to add the events to
+ * @fd: file descriptor of kernel device to read from
+ * @ms: maximum time to wait for an event (ms), or -1 to wait forever
+ *
+ * Reads events in batches until @ms elapse without an event, a trigger
+ * of the ring matches or a signal interrupts the wait. The context's
+ * filter is not applied here, see evemu_context_write_ring().
+ *
+ * Returns 1 if a trigger matched, zero on timeout, negative error
+ * otherwise, -EINTR if interrupted by a signal.
+ */
+int evemu_context_record_ring(struct evemu_context *ctx,
+			      struct evemu_ring *ring, int fd, int ms);
+
+/**
+ * evemu_context_write_ring() - write the events of a ring
+ * @ctx: the context in use
+ * @ring: the ring to write
+ * @fp: file pointer to write the events to
+ *
+ * Writes the complete frames in the ring in the format of
+ * evemu_record(), with timestamps relative to the first frame written.
+ * Events that do not pass the context's filter are skipped. The ring is
+ * not modified, see evemu_ring_clear().
+ *
+ * Returns the number of events written, negative error otherwise.
+ */
+int evemu_context_write_ring(struct evemu_context *ctx,
+			     const struct evemu_ring *ring, FILE *fp);
+
+/**
+ * evemu_shm_new() - publish events in shared memory
+ * @name: the name of the POSIX shared memory segment, e.g. "/touchpad"
+ * @size: the memory to use for events, in bytes
+ *
+ * Creates a shared memory segment holding a ring of raw struct
+ * input_event, see evemu_shm_publish(). Any number of processes can
+ * subscribe to the events with evemu_shm_open(), each reads them in
+ * place. The ring holds the largest power of two of events that fits
+ * into @size. An existing segment with the same name is replaced.
+ *
+ * Returns NULL with errno set in case of failure.
+ */
+struct evemu_shm *evemu_shm_new(const char *name, size_t size);
+
+/**
+ * evemu_shm_open() - subscribe to the events of a shared memory segment
+ * @name: the name the publisher passed to evemu_shm_new()
+ *
+ * The segment is mapped read-only, subscribers never slow down the
+ * publisher or each other. Only events published after this call are
+ * read, see evemu_shm_read().
+ *
+ * Returns NULL with errno set in case of failure, EPROTO if @name is not
+ * a segment created by evemu_shm_new() of the same architecture.
+ */
+struct evemu_shm *evemu_shm_open(const char *name);
+
+/**
+ * evemu_shm_delete() - close a shared memory segment
+ * @shm: the publisher or subscriber to close
+ *
+ * If @shm is the publisher, the segment is unlinked and its subscribers
+ * see the end of the events once they have read the remaining ones.
+ */
+void evemu_shm_delete(struct evemu_shm *shm);
+
+/**
+ * evemu_shm_get_capacity() - get the number of events a segment holds
+ * @shm: the publisher or subscriber in use
+ */
+size_t evemu_shm_get_capacity(const struct evemu_shm *shm);
+
+/**
+ * evemu_shm_publish() - publish events in shared memory
+ * @shm: the publisher in use
+ * @ev: the events to publish
+ * @n: the number of events
+ *
+ * Copies the events into the ring, overwriting the oldest ones, and
+ * wakes all subscribers waiting in evemu_shm_read(). The events become
+ * visible to subscribers at once, publish whole frames for subscribers
+ * that expect them.
+ *
+ * Returns the number of events published, negative error otherwise.
+ */
+int evemu_shm_publish(struct evemu_shm *shm, const struct input_event *ev,
+		      size_t n);
+
+/**
+ * evemu_shm_read() - read the next events from shared memory
+ * @shm: the subscriber in use
+ * @events: set to the first event read
+ * @ms: maximum time to wait for events (ms), or -1 to wait forever
+ *
+ * Waits for events not read yet and points @events to them in the
+ * shared memory, no events are copied. Where the ring wraps around,
+ * the remaining events are returned by the next call.
+ *
+ * The events stay in place until the publisher overwrites them, a
+ * subscriber that copies or processes them in place checks with
+ * evemu_shm_valid() afterwards. A subscriber that falls behind by more
+ * than the capacity of the ring skips the overwritten events, see
+ * evemu_shm_get_lost().
+ *
+ * Returns the number of events, zero on timeout, -EPIPE once the
+ * publisher closed the segment and all events have been read, negative
+ * error otherwise.
+ */
+int evemu_shm_read(struct evemu_shm *shm, const struct input_event **events,
+		   int ms);
+
+/**
+ * evemu_shm_valid() - check the events of the last read
+ * @shm: the subscriber in use
+ *
+ * Returns 1 if none of the events returned by the last evemu_shm_read()
+ * has been overwritten by the publisher since, zero otherwise.
+ */
+int evemu_shm_valid(const struct evemu_shm *shm);
+
+/**
+ * evemu_shm_get_lost() - get the number of events lost to overruns
+ * @shm: the subscriber in use
+ *
+ * Returns the number of events evemu_shm_read() skipped because the
+ * publisher had overwritten them before they were read.
+ */
+unsigned long evemu_shm_get_lost(const struct evemu_shm *shm);
+
+/**
+ * evemu_context_record_shm() - publish events of a device in shared memory
+ * @ctx: the context in use
+ * @shm: the publisher to publish the events with
+ * @fd: file descriptor of kernel device to read from
+ * @ms: maximum time to wait for events (ms), or -1 to wait forever
+ *
+ * Reads one batch of events and publishes the ones that pass the
+ * context's filter with evemu_shm_publish(). The events keep their
+ * kernel timestamps. Call this in a loop for a live stream.
+ *
+ * Returns the number of events published, zero if none were published,
+ * e.g. on timeout, negative error otherwise, -EINTR if interrupted by a
+ * signal.
+ */
+int evemu_context_record_shm(struct evemu_context *ctx, struct evemu_shm *shm,
+			     int fd, int ms);
+
+/**
+ * evemu_tail_new() - follow a recording that is still being written
+ * @path: the recording, or the output file given to evemu-record
+ * @fd: an open file descriptor of the recording, or -1
+ *
+ * A tail reads the events of a recording as evemu-record appends them,
+ * waiting with inotify rather than polling the file, see
+ * evemu_tail_read_event(). Lines are only parsed once complete.
+ *
+ * evemu-record with --autorestart or --rotate-* writes a new file named
+ * <output>.<date>-<time>[.<n>] for each segment. A tail moves on to the
+ * next segment in the same directory once it read all events of the
+ * current one. @path may be such a segment or <output>: if no file
+ * <output> exists, the tail starts with the newest segment, or with the
+ * first one created if none exists yet.
+ *
+ * If @fd is not negative, the tail reads a duplicate of @fd from its
+ * current offset instead of opening @path.
+ *
+ * Returns NULL on error, with errno set.
+ */
+struct evemu_tail *evemu_tail_new(const char *path, int fd);
+
+/**
+ * evemu_tail_delete() - stop following a recording
+ * @tail: the tail to free
+ */
+void evemu_tail_delete(struct evemu_tail *tail);
+
+/**
+ * evemu_tail_read_event() - read the next event of a followed recording
+ * @tail: the tail in use
+ * @ev: the event read
+ * @ms: maximum time to wait for an event (ms), or -1 to wait forever
+ *
+ * Reads the next event, waiting for evemu-record to append one if all
+ * events were read. Comments and the device description are skipped.
+ *
+ * Returns 1 if an event was read, zero on timeout, negative error
+ * otherwise, -EINVAL for a line that is not a valid event.
+ */
+int evemu_tail_read_event(struct evemu_tail *tail, struct input_event *ev,
+			  int ms);
+
+/**
+ * evemu_tail_get_filename() - get the file a tail reads
+ * @tail: the tail in use
+ *
+ * Returns the path of the file read, which changes when a new segment
+ * starts, or NULL while waiting for the first segment. The pointer is
+ * owned by the tail and valid until the next evemu_tail_read_event().
+ */
+const char *evemu_tail_get_filename(const struct evemu_tail *tail);
+
+/**
+ * evemu_device_list_new() - list the input devices of the system
+ * @path: the directory to scan, or NULL for /dev/input
+ *
+ * Opens all event nodes in @path and reads their description, using
+ * several threads. Nodes that cannot be opened, e.g. for lack of
+ * permissions, are not listed. The list is kept current with inotify,
+ * see evemu_device_list_update().
+ *
+ * Returns NULL in case of memory failure.
+ */
+struct evemu_device_list *evemu_device_list_new(const char *path);
+
+/**
+ * evemu_device_list_delete() - free a device list
+ * @list: the list to free
+ *
+ * The devices of the list are freed too.
+ */
+void evemu_device_list_delete(struct evemu_device_list *list);
+
+/**
+ * evemu_device_list_update() - process hotplug events
+ * @list: the list in use
+ *
+ * Rescans the nodes that were added, removed or changed since the last
+ * update. This does not block and costs a single read(2) if nothing
+ * changed. If inotify is not available, the whole directory is rescanned.
+ * Indices and devices previously returned by the list are invalid
+ * afterwards.
+ *
+ * Returns the number of nodes that changed, negative error otherwise.
+ */
+int evemu_device_list_update(struct evemu_device_list *list);
+
+/**
+ * evemu_device_list_get_fd() - get the file descriptor for hotplug events
+ * @list: the list in use
+ *
+ * The file descriptor becomes readable when evemu_device_list_update()
+ * has something to do, so it may be added to a poll(2) loop.
+ *
+ * Returns the file descriptor, or -1 if inotify is not available.
+ */
+int evemu_device_list_get_fd(const struct evemu_device_list *list);
+
+/**
+ * evemu_device_list_get_count() - get the number of devices in a list
+ * @list: the list in use
+ */
+size_t evemu_device_list_get_count(const struct evemu_device_list *list);
+
+/**
+ * evemu_device_list_get_devnode() - get the device node of a device
+ * @list: the list in use
+ * @index: the index of the device, sorted by event node number
+ *
+ * Returns the device node, or NULL if @index is out of range. The string
+ * is owned by the list.
+ */
+const char *evemu_device_list_get_devnode(const struct evemu_device_list *list,
+					  size_t index);
+
+/**
+ * evemu_device_list_get_device() - get the description of a device
+ * @list: the list in use
+ * @index: the index of the device, sorted by event node number
+ *
+ * The device may be queried with the evemu_get_*() and evemu_has_*()
+ * functions. It is owned by the list.
+ *
+ * Returns the device, or NULL if @index is out of range.
+ */
+const struct evemu_device *
+evemu_device_list_get_device(const struct evemu_device_list *list,
+			     size_t index);
+
+/**
+ * evemu_node_watch_new() - wait for device nodes to become usable
+ *
+ * After a uinput device is created, udev creates its device node and sets
+ * its permissions asynchronously. A node watch uses inotify to wait until
+ * any number of nodes can be opened, without polling the file system.
+ *
+ * Returns NULL in case of memory failure or if inotify is not available.
+ */
+struct evemu_node_watch *evemu_node_watch_new(void);
+
+/**
+ * evemu_node_watch_delete() - free a node watch
+ * @watch: the watch to free
+ */
+void evemu_node_watch_delete(struct evemu_node_watch *watch);
+
+/**
+ * evemu_node_watch_add() - add a device node to wait for
+ * @watch: the watch in use
+ * @devnode: the device node, e.g. as returned by evemu_get_devnode()
+ * @flags: the access mode the node must be opened with, O_RDONLY or
+ * O_RDWR
+ *
+ * Returns zero if successful, negative error otherwise.
+ */
+int evemu_node_watch_add(struct evemu_node_watch *watch, const char *devnode,
+			 int flags);
+
+/**
+ * evemu_node_watch_get_fd() - get the file descriptor of a node watch
+ * @watch: the watch in use
+ *
+ * The file descriptor becomes readable when evemu_node_watch_dispatch()
+ * should be called again, so it may be added to an event loop.
+ */
+int evemu_node_watch_get_fd(const struct evemu_node_watch *watch);
+
+/**
+ * evemu_node_watch_dispatch() - check the nodes of a watch
+ * @watch: the watch in use
+ *
+ * Does not block.
+ *
+ * Returns the number of nodes that cannot be opened yet, negative error
+ * otherwise.
+ */
+int evemu_node_watch_dispatch(struct evemu_node_watch *watch);
+
+/**
+ * evemu_node_watch_wait() - wait until all nodes of a watch can be opened
+ * @watch: the watch in use
+ * @ms: the maximum time to wait (ms), or -1 to wait forever
+ *
+ * Returns zero if all nodes can be opened, -ETIMEDOUT if @ms elapsed
+ * first, negative error otherwise.
+ */
+int evemu_node_watch_wait(struct evemu_node_watch *watch, int ms);
+
+/**
+ * evemu_wait_devnode() - wait until a created device can be opened
+ * @dev: the device in use
+ * @flags: the access mode the node must be opened with, O_RDONLY or
+ * O_RDWR
+ * @ms: the maximum time to wait (ms), or -1 to wait forever
+ *
+ * To be called after evemu_create_managed(), see evemu_node_watch_new().
+ *
+ * Returns zero if the node can be opened, -ETIMEDOUT if @ms elapsed
+ * first, negative error otherwise.
+ */
+int evemu_wait_devnode(struct evemu_device *dev, int flags, int ms);
+
 /**
  * evemu_create() - create a kernel device from the evemu configuration
  * @dev: the device in use
@@ -0,0 +1,366 @@
+/*
+ * Test state checkpoints and seeking in recordings.
+ */
+
+#define _GNU_SOURCE
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <unistd.h>
+#include <assert.h>
+#include "evemu.h"
+#include <linux/input.h>
+
+#define UNUSED __attribute__((unused))
+
+/* BTN_LEFT, LED_CAPSL, ABS_X and two slots with position and tracking
+ * id, the LED is on when recording starts */
+static const char *desc =
+	"# EVEMU 1.2\n"
+	"N: checkpoint test\n"
+	"I: 0003 0001 0001 0001\n"
+	"B: 00 0b 00 02 00 00 00 00 00\n"
+	"B: 01 00 00 00 00 00 00 00 00\n"
+	"B: 01 00 00 00 00 00 00 00 00\n"
+	"B: 01 00 00 00 00 00 00 00 00\n"
+	"B: 01 00 00 00 00 00 00 00 00\n"
+	"B: 01 00 00 01 00 00 00 00 00\n"
+	"B: 03 01 00 00 00 00 80 20 02\n"
+	"B: 11 02 00 00 00 00 00 00 00\n"
+	"A: 00 0 1000 0 0 0\n"
+	"A: 2f 0 1 0 0 0\n"
+	"A: 35 0 1000 0 0 0\n"
+	"A: 39 0 65535 0 0 0\n"
+	"L: 01 1\n";
+
+static const char *events =
+	"E: 0.500000 0003 0000 0010\n"
+	"E: 0.500000 0000 0000 0000\n"
+	/* first finger down */
+	"E: 1.000000 0003 0039 0001\n"
+	"E: 1.000000 0003 0035 0100\n"
+	"E: 1.000000 0001 0110 0001\n"
+	"E: 1.000000 0000 0000 0000\n"
+	/* second finger down */
+	"E: 2.000000 0003 002f 0001\n"
+	"E: 2.000000 0003 0039 0002\n"
+	"E: 2.000000 0003 0035 0200\n"
+	"E: 2.000000 0000 0000 0000\n"
+	"E: 2.500000 0003 0035 0250\n"
+	"E: 2.500000 0000 0000 0000\n"
+	/* first finger up */
+	"E: 3.000000 0003 002f 0000\n"
+	"E: 3.000000 0003 0039 -001\n"
+	"E: 3.000000 0001 0110 0000\n"
+	"E: 3.000000 0000 0000 0000\n"
+	"E: 4.000000 0011 0001 0000\n"
+	"E: 4.000000 0003 0000 0020\n"
+	"E: 4.000000 0000 0000 0000\n"
+	/* second finger up */
+	"E: 5.000000 0003 002f 0001\n"
+	"E: 5.000000 0003 0039 -001\n"
+	"E: 5.000000 0000 0000 0000\n"
+	"E: 6.000000 0003 0000 0030\n"
+	"E: 6.000000 0000 0000 0000\n";
+
+static FILE *open_recording(char **buf)
+{
+	FILE *fp;
+
+	assert(asprintf(buf, "%s%s", desc, events) > 0);
+	fp = fmemopen(*buf, strlen(*buf), "r");
+	assert(fp);
+
+	return fp;
+}
+
+static struct evemu_device *read_device(FILE *fp)
+{
+	struct evemu_device *dev = evemu_new(NULL);
+
+	assert(dev);
+	assert(evemu_read(dev, fp) > 0);
+
+	return dev;
+}
+
+static int count_checkpoints(FILE *fp)
+{
+	char *line = NULL;
+	size_t sz = 0;
+	int n = 0;
+
+	rewind(fp);
+	while (getline(&line, &sz, fp) >= 0)
+		if (strncmp(line, "# C:", 4) == 0)
+			n++;
+	free(line);
+	rewind(fp);
+
+	return n;
+}
+
+static int frame_has(const struct input_event *frame, int n,
+		     int type, int code, int value)
+{
+	int i;
+
+	for (i = 0; i < n; i++)
+		if (frame[i].type == type && frame[i].code == code &&
+		    frame[i].value == value)
+			return 1;
+	return 0;
+}
+
+static FILE *add_checkpoints(long interval)
+{
+	char *buf;
+	FILE *in = open_recording(&buf);
+	FILE *out = tmpfile();
+
+	assert(out);
+	assert(evemu_add_checkpoints(in, out, interval) == 0);
+	fclose(in);
+	free(buf);
+	rewind(out);
+
+	return out;
+}
+
+static void check_add_checkpoints(void)
+{
+	FILE *fp = add_checkpoints(2000000);
+	struct evemu_device *dev;
+	struct input_event ev;
+	int n = 0;
+
+	/* at the start, after 2s, 4s and 6s */
+	assert(count_checkpoints(fp) == 4);
+
+	/* readers skip the checkpoints */
+	dev = read_device(fp);
+	while (evemu_read_event(fp, &ev) > 0)
+		n++;
+	assert(n == 24);
+
+	/* adding checkpoints again replaces them */
+	rewind(fp);
+	{
+		FILE *out = tmpfile();
+
+		assert(out);
+		assert(evemu_add_checkpoints(fp, out, 1000000) == 0);
+		assert(count_checkpoints(out) == 7);
+		fclose(out);
+	}
+
+	assert(evemu_add_checkpoints(fp, fp, 0) == -EINVAL);
+
+	evemu_delete(dev);
+	fclose(fp);
+}
+
+static void check_seek_frame(void)
+{
+	FILE *fp = add_checkpoints(2000000);
+	struct evemu_device *dev = read_device(fp);
+	long begin = ftell(fp);
+	struct input_event *frame, ev;
+	int n;
+
+	/* both fingers down, LED still on */
+	n = evemu_seek(dev, fp, 2200000, &frame);
+	assert(n == 8);
+	assert(frame_has(frame, n, EV_KEY, BTN_LEFT, 1));
+	assert(frame_has(frame, n, EV_ABS, ABS_X, 10));
+	assert(frame_has(frame, n, EV_ABS, ABS_MT_TRACKING_ID, 1));
+	assert(frame_has(frame, n, EV_ABS, ABS_MT_POSITION_X, 100));
+	assert(frame_has(frame, n, EV_ABS, ABS_MT_TRACKING_ID, 2));
+	assert(frame_has(frame, n, EV_ABS, ABS_MT_POSITION_X, 200));
+	assert(!frame_has(frame, n, EV_LED, LED_CAPSL, 1));
+	assert(frame[n - 1].type == EV_SYN && frame[n - 1].code == SYN_REPORT);
+	/* the last event left slot 1 staged */
+	assert(frame[n - 2].code == ABS_MT_TRACKING_ID &&
+	       frame[n - 2].value == 2);
+	assert(frame[0].time.tv_sec == 2 && frame[0].time.tv_usec == 500000);
+	free(frame);
+
+	/* the next event is the first one of the frame at 2.5s */
+	assert(evemu_read_event(fp, &ev) > 0);
+	assert(ev.time.tv_sec == 2 && ev.time.tv_usec == 500000);
+	assert(ev.code == ABS_MT_POSITION_X && ev.value == 250);
+
+	/* one finger left in slot 1, LED off */
+	fseek(fp, begin, SEEK_SET);
+	n = evemu_seek(dev, fp, 4500000, &frame);
+	assert(n == 7);
+	assert(frame_has(frame, n, EV_LED, LED_CAPSL, 0));
+	assert(frame_has(frame, n, EV_ABS, ABS_MT_SLOT, 1));
+	assert(frame_has(frame, n, EV_ABS, ABS_MT_TRACKING_ID, 2));
+	assert(!frame_has(frame, n, EV_KEY, BTN_LEFT, 1));
+	free(frame);
+
+	/* nothing differs at the start */
+	fseek(fp, begin, SEEK_SET);
+	assert(evemu_seek(dev, fp, 0, &frame) == 0);
+	assert(frame == NULL);
+	assert(ftell(fp) <= begin + 64);
+
+	/* past the end */
+	fseek(fp, begin, SEEK_SET);
+	n = evemu_seek(dev, fp, 100000000, &frame);
+	assert(n == 4);
+	assert(evemu_read_event(fp, &ev) == 0);
+	free(frame);
+
+	evemu_delete(dev);
+	fclose(fp);
+}
+
+/* Checkpoints past 2^31 µs, e.g. with absolute timestamps */
+static void check_seek_late(void)
+{
+	const char *late =
+		"E: 3000.000000 0003 0000 0010\n"
+		"E: 3000.000000 0000 0000 0000\n"
+		"E: 3001.000000 0003 0000 0020\n"
+		"E: 3001.000000 0000 0000 0000\n"
+		"E: 3002.000000 0003 0000 0030\n"
+		"E: 3002.000000 0000 0000 0000\n";
+	struct evemu_device *dev;
+	struct input_event *frame, ev;
+	FILE *in, *fp = tmpfile();
+	char *buf;
+	int n;
+
+	assert(asprintf(&buf, "%s%s", desc, late) > 0);
+	in = fmemopen(buf, strlen(buf), "r");
+	assert(in && fp);
+	assert(evemu_add_checkpoints(in, fp, 500000) == 0);
+	assert(count_checkpoints(fp) > 1);
+	dev = read_device(fp);
+
+	n = evemu_seek(dev, fp, 3001500000L, &frame);
+	assert(n == 2);
+	assert(frame_has(frame, n, EV_ABS, ABS_X, 20));
+	assert(frame[0].time.tv_sec == 3002);
+	free(frame);
+	assert(evemu_read_event(fp, &ev) > 0);
+	assert(ev.time.tv_sec == 3002 && ev.value == 30);
+
+	evemu_delete(dev);
+	fclose(in);
+	fclose(fp);
+	free(buf);
+}
+
+/* Seeking with checkpoints gives the same result as seeking through all
+ * events */
+static void check_seek_matches_linear(void)
+{
+	FILE *fp = add_checkpoints(1000000);
+	char *buf;
+	FILE *plain = open_recording(&buf);
+	struct evemu_device *dev = read_device(fp);
+	struct evemu_device *plain_dev = read_device(plain);
+	long begin = ftell(fp), plain_begin = ftell(plain);
+	long t;
+
+	for (t = 0; t <= 7000000; t += 250000) {
+		struct input_event *a, *b, ea, eb;
+		int na, nb, ra, rb;
+
+		fseek(fp, begin, SEEK_SET);
+		fseek(plain, plain_begin, SEEK_SET);
+		na = evemu_seek(dev, fp, t, &a);
+		nb = evemu_seek(plain_dev, plain, t, &b);
+		assert(na >= 0);
+		assert(na == nb);
+		assert(na == 0 ||
+		       memcmp(a, b, na * sizeof(struct input_event)) == 0);
+		free(a);
+		free(b);
+
+		ra = evemu_read_event(fp, &ea);
+		rb = evemu_read_event(plain, &eb);
+		assert(ra == rb);
+		assert(ra == 0 || memcmp(&ea, &eb, sizeof(ea)) == 0);
+	}
+
+	evemu_delete(plain_dev);
+	evemu_delete(dev);
+	fclose(plain);
+	fclose(fp);
+	free(buf);
+}
+
+static void check_record(void)
+{
+	struct evemu_context *ctx = evemu_context_new();
+	struct evemu_device *dev;
+	struct input_event ev[6];
+	/* press at 10s, release at 10.5s, press at 11.5s */
+	const long usec[] = { 0, 0, 500000, 500000, 1500000, 1500000 };
+	char *buf, *line = NULL;
+	size_t sz = 0;
+	FILE *in = open_recording(&buf);
+	FILE *out = tmpfile();
+	int fds[2];
+	int i;
+
+	assert(ctx);
+	assert(out);
+	dev = read_device(in);
+
+	assert(evemu_context_enable_checkpoints(ctx, dev, -1) == -EINVAL);
+	assert(evemu_context_enable_checkpoints(ctx, dev, 1000000) == 0);
+
+	for (i = 0; i < 6; i++) {
+		if (i % 2)
+			evemu_create_event(&ev[i], EV_SYN, SYN_REPORT, 0);
+		else
+			evemu_create_event(&ev[i], EV_KEY, BTN_LEFT, i != 2);
+		ev[i].time.tv_sec = 10 + usec[i] / 1000000;
+		ev[i].time.tv_usec = usec[i] % 1000000;
+	}
+	assert(pipe(fds) == 0);
+	assert(write(fds[1], ev, sizeof(ev)) == sizeof(ev));
+	/* the recording ends after 100ms without events */
+	assert(evemu_context_record(ctx, out, fds[0], 100) == 0);
+	close(fds[0]);
+	close(fds[1]);
+
+	/* at the start and after the frame at 1.5s, with the key down */
+	assert(count_checkpoints(out) == 2);
+	while (getline(&line, &sz, out) >= 0)
+		if (strncmp(line, "# C:", 4) == 0)
+			break;
+	assert(strcmp(line, "# C: 0.000000 1\n") == 0);
+	assert(getline(&line, &sz, out) >= 0);
+	assert(strcmp(line, "# R: 0011 0001 1\n") == 0);
+	while (getline(&line, &sz, out) >= 0)
+		if (strncmp(line, "# C:", 4) == 0)
+			break;
+	assert(strcmp(line, "# C: 1.500001 2\n") == 0);
+	assert(getline(&line, &sz, out) >= 0);
+	assert(strcmp(line, "# R: 0001 0110 1\n") == 0);
+
+	/* disabled checkpoints do not need a device */
+	assert(evemu_context_enable_checkpoints(ctx, NULL, 0) == 0);
+
+	free(line);
+	evemu_delete(dev);
+	evemu_context_delete(ctx);
+	fclose(out);
+	fclose(in);
+	free(buf);
+}
+
+int main(int argc UNUSED, char **argv UNUSED) {
+	check_add_checkpoints();
+	check_seek_frame();
+	check_seek_late();
+	check_seek_matches_linear();
+	check_record();
+	return 0;
+}
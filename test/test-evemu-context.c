@@ -0,0 +1,406 @@
+/*
+ * Test the statistics and state kept by a context.
+ */
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <unistd.h>
+#include <assert.h>
+#include <errno.h>
+#include <time.h>
+#include "evemu.h"
+#include <linux/input.h>
+
+#define UNUSED __attribute__((unused))
+
+static const char *events =
+	"E: 0.000001 0002 0000 0001\n"
+	"E: 0.000001 0000 0000 0000\n"
+	"E: 0.002001 0002 0000 0001\n"
+	"E: 0.002001 0000 0000 0000\n"
+	"E: 0.004001 0000 0003 0000\n"
+	"E: 0.004001 0000 0000 0000\n";
+
+static void play(struct evemu_context *ctx, const char *str, int *nevents)
+{
+	FILE *fp = fmemopen((void*)str, strlen(str), "r");
+	struct input_event ev;
+	int fds[2];
+	int n = 0;
+
+	assert(fp);
+	assert(pipe(fds) == 0);
+	assert(evemu_context_play(ctx, fp, fds[1]) == 0);
+	close(fds[1]);
+	while (read(fds[0], &ev, sizeof(ev)) == sizeof(ev))
+		n++;
+	close(fds[0]);
+	fclose(fp);
+
+	if (nevents)
+		*nevents = n;
+}
+
+static void check_disabled(void)
+{
+	struct evemu_context *ctx = evemu_context_new();
+	struct evemu_stats stats;
+	int n;
+
+	assert(ctx);
+	assert(evemu_context_get_stats(ctx, &stats) == -EINVAL);
+	play(ctx, events, &n);
+	assert(n == 6);
+	evemu_context_delete(ctx);
+}
+
+static void check_play_stats(void)
+{
+	struct evemu_context *ctx = evemu_context_new();
+	struct evemu_stats stats;
+	unsigned long sleeps = 0;
+	int i;
+
+	assert(ctx);
+	assert(evemu_context_enable_stats(ctx) == 0);
+	play(ctx, events, NULL);
+
+	assert(evemu_context_get_stats(ctx, &stats) == 0);
+	assert(stats.events_read == 6);
+	assert(stats.events_written == 6);
+	assert(stats.write_calls == 6);
+	assert(stats.write_errors == 0);
+	assert(stats.short_writes == 0);
+	assert(stats.parse_failures == 0);
+	assert(stats.read_calls == 0);
+	assert(stats.syn_dropped == 1);
+	assert(stats.sleeps == 2);
+	assert(stats.sleep_ns >= 2 * 1850 * 1000);
+	assert(stats.parse_ns > 0);
+	assert(stats.write_ns > 0);
+
+	for (i = 0; i < EVEMU_STATS_OVERSHOOT_BUCKETS; i++)
+		sleeps += stats.sleep_overshoot[i];
+	assert(sleeps == stats.sleeps);
+
+	/* enabling again resets */
+	assert(evemu_context_enable_stats(ctx) == 0);
+	assert(evemu_context_get_stats(ctx, &stats) == 0);
+	assert(stats.events_read == 0);
+
+	evemu_context_delete(ctx);
+}
+
+static void check_parse_failure(void)
+{
+	struct evemu_context *ctx = evemu_context_new();
+	struct evemu_stats stats;
+
+	assert(ctx);
+	assert(evemu_context_enable_stats(ctx) == 0);
+	play(ctx, "E: 0.000001 0002 0000 0001\nE: foo\n", NULL);
+
+	assert(evemu_context_get_stats(ctx, &stats) == 0);
+	assert(stats.events_read == 1);
+	assert(stats.parse_failures == 1);
+
+	evemu_context_delete(ctx);
+}
+
+static void check_filter(void)
+{
+	struct evemu_context *ctx = evemu_context_new();
+	struct evemu_filter *filter = evemu_filter_new();
+	struct evemu_stats stats;
+	int n;
+
+	assert(ctx);
+	assert(filter);
+	assert(evemu_filter_add(filter, "drop=EV_REL") == 0);
+	evemu_context_set_filter(ctx, filter);
+	assert(evemu_context_enable_stats(ctx) == 0);
+	play(ctx, events, &n);
+	assert(n == 2);
+
+	assert(evemu_context_get_stats(ctx, &stats) == 0);
+	assert(stats.events_read == 6);
+	assert(stats.events_written == 2);
+
+	evemu_context_delete(ctx);
+	evemu_filter_delete(filter);
+}
+
+static void write_syn(struct evemu_context *ctx, FILE *fp, long ms)
+{
+	struct input_event ev;
+
+	evemu_create_event(&ev, EV_SYN, SYN_REPORT, 0);
+	ev.time.tv_sec = ms / 1000;
+	ev.time.tv_usec = (ms % 1000) * 1000;
+	assert(evemu_context_write_event(ctx, fp, &ev) > 0);
+}
+
+static void check_write_event(void)
+{
+	struct evemu_context *a = evemu_context_new();
+	struct evemu_context *b = evemu_context_new();
+	char *buf_a = NULL, *buf_b = NULL;
+	size_t sz_a, sz_b;
+	FILE *fp_a = open_memstream(&buf_a, &sz_a);
+	FILE *fp_b = open_memstream(&buf_b, &sz_b);
+
+	assert(a && b && fp_a && fp_b);
+
+	/* interleaved streams keep their own time base */
+	write_syn(a, fp_a, 1000);
+	write_syn(b, fp_b, 5000);
+	write_syn(a, fp_a, 1010);
+	write_syn(b, fp_b, 5020);
+	fclose(fp_a);
+	fclose(fp_b);
+
+	assert(strstr(buf_a, "+10ms"));
+	assert(strstr(buf_b, "+20ms"));
+	assert(!strstr(buf_a, "-3990ms"));
+
+	free(buf_a);
+	free(buf_b);
+	evemu_context_delete(a);
+	evemu_context_delete(b);
+}
+
+/* records frames of REL_X from a pipe, returns the number of SYN_REPORTs
+ * written before evemu_context_record() returned */
+static int record_frames(struct evemu_context *ctx, int nframes, int *ret)
+{
+	struct input_event ev;
+	char *buf = NULL;
+	size_t sz;
+	FILE *fp = open_memstream(&buf, &sz);
+	const char *p;
+	int fds[2];
+	int i, n = 0;
+
+	assert(fp);
+	assert(pipe(fds) == 0);
+	for (i = 0; i < nframes; i++) {
+		evemu_create_event(&ev, EV_REL, REL_X, 1);
+		ev.time.tv_sec = 10;
+		ev.time.tv_usec = i * 1000;
+		assert(write(fds[1], &ev, sizeof(ev)) == sizeof(ev));
+		evemu_create_event(&ev, EV_SYN, SYN_REPORT, 0);
+		ev.time.tv_sec = 10;
+		ev.time.tv_usec = i * 1000;
+		assert(write(fds[1], &ev, sizeof(ev)) == sizeof(ev));
+	}
+
+	*ret = evemu_context_record(ctx, fp, fds[0], 10);
+	fclose(fp);
+	for (p = buf; (p = strstr(p, "SYN_REPORT")); p++)
+		n++;
+
+	free(buf);
+	close(fds[0]);
+	close(fds[1]);
+
+	return n;
+}
+
+static void check_record_limits(void)
+{
+	struct evemu_context *ctx = evemu_context_new();
+	int ret;
+
+	assert(ctx);
+	assert(record_frames(ctx, 5, &ret) == 5);
+	assert(ret == 0);
+
+	/* the frame reaching the limit is completed */
+	evemu_context_set_record_limits(ctx, 0, 2000);
+	assert(record_frames(ctx, 5, &ret) == 3);
+	assert(ret == 1);
+
+	evemu_context_set_record_limits(ctx, 1, 0);
+	assert(record_frames(ctx, 5, &ret) == 1);
+	assert(ret == 1);
+
+	evemu_context_delete(ctx);
+}
+
+static long monotonic_us(void)
+{
+	struct timespec ts;
+
+	clock_gettime(CLOCK_MONOTONIC, &ts);
+	return ts.tv_sec * 1000000L + ts.tv_nsec / 1000;
+}
+
+static void check_latency(void)
+{
+	struct evemu_context *ctx = evemu_context_new();
+	struct evemu_latency latency;
+	struct input_event ev;
+	/* frames of the past, the last one from the future */
+	const long ago[] = { 60000, 10000, 1000, -10000000 };
+	long now = monotonic_us();
+	char *buf = NULL;
+	const char *p;
+	size_t sz;
+	unsigned long sum = 0;
+	int annotations = 0, stalls = 0;
+	FILE *fp = open_memstream(&buf, &sz);
+	int fds[2];
+	int i;
+
+	assert(ctx && fp);
+	assert(evemu_context_get_latency(ctx, &latency) == -EINVAL);
+	assert(evemu_context_enable_latency(ctx, -1, 0) == -EINVAL);
+	assert(evemu_context_enable_latency(ctx, 30000, 1) == 0);
+
+	assert(pipe(fds) == 0);
+	for (i = 0; i < 4; i++) {
+		evemu_create_event(&ev, EV_REL, REL_X, 1);
+		ev.time.tv_sec = (now - ago[i]) / 1000000;
+		ev.time.tv_usec = (now - ago[i]) % 1000000;
+		assert(write(fds[1], &ev, sizeof(ev)) == sizeof(ev));
+		evemu_create_event(&ev, EV_SYN, SYN_REPORT, 0);
+		ev.time.tv_sec = (now - ago[i]) / 1000000;
+		ev.time.tv_usec = (now - ago[i]) % 1000000;
+		assert(write(fds[1], &ev, sizeof(ev)) == sizeof(ev));
+	}
+	assert(evemu_context_record(ctx, fp, fds[0], 10) == 0);
+	close(fds[0]);
+	close(fds[1]);
+
+	assert(evemu_context_get_latency(ctx, &latency) == 0);
+	assert(latency.frames == 3);
+	assert(latency.skewed == 1);
+	for (i = 0; i < EVEMU_LATENCY_BUCKETS; i++)
+		sum += latency.histogram[i];
+	assert(sum == 3);
+	assert(latency.max_us >= 60000);
+	assert(latency.total_us >= 71000);
+	assert(latency.stalls >= 1);
+	/* the first frame is recorded at 1µs */
+	assert(latency.stall[0].time == 1);
+	assert(latency.stall[0].latency_us >= 60000);
+
+	/* the skewed frame is not annotated */
+	fclose(fp);
+	for (p = buf; (p = strstr(p, "# L: ")); p++) {
+		const char *stall = strstr(p, " stall");
+
+		annotations++;
+		if (stall && stall < strchr(p, '\n'))
+			stalls++;
+	}
+	assert(annotations == 3);
+	assert(stalls == (int)latency.stalls);
+
+	/* enabling again resets */
+	assert(evemu_context_enable_latency(ctx, 0, 0) == 0);
+	assert(evemu_context_get_latency(ctx, &latency) == 0);
+	assert(latency.frames == 0);
+
+	free(buf);
+	evemu_context_delete(ctx);
+}
+
+static int count(const char *str, const char *needle)
+{
+	int n = 0;
+
+	while ((str = strstr(str, needle))) {
+		str += strlen(needle);
+		n++;
+	}
+
+	return n;
+}
+
+static char *write_trace(struct evemu_context *ctx)
+{
+	char *buf = NULL;
+	size_t sz = 0;
+	FILE *fp = open_memstream(&buf, &sz);
+
+	assert(fp);
+	assert(evemu_context_write_trace(ctx, fp) == 0);
+	fclose(fp);
+
+	return buf;
+}
+
+static void check_trace(void)
+{
+	struct evemu_context *ctx = evemu_context_new();
+	struct input_event ev[4];
+	char *buf;
+	FILE *out;
+	int fds[2];
+	int i;
+
+	assert(ctx);
+	assert(evemu_context_write_trace(ctx, stdout) == -EINVAL);
+
+	/* three frames, two sleeps */
+	assert(evemu_context_enable_trace(ctx, 1000) == 0);
+	play(ctx, events, NULL);
+	buf = write_trace(ctx);
+	assert(strncmp(buf, "{\"traceEvents\":[", 15) == 0);
+	assert(count(buf, "\"name\":\"parse\"") == 6);
+	assert(count(buf, "\"name\":\"write\"") == 6);
+	assert(count(buf, "\"name\":\"sleep\"") == 2);
+	assert(count(buf, "\"name\":\"frame\"") == 3);
+	assert(count(buf, "\"events\":2") == 3);
+	assert(count(buf, "\"name\":\"lateness_us\"") == 3);
+	assert(count(buf, "\"ph\":\"C\"") == 3);
+	assert(strstr(buf, "\"dropped_records\":0}"));
+	free(buf);
+
+	/* records beyond the limit are dropped */
+	assert(evemu_context_enable_trace(ctx, 4) == 0);
+	play(ctx, events, NULL);
+	buf = write_trace(ctx);
+	assert(count(buf, "\"cat\":\"evemu\"") == 4);
+	assert(strstr(buf, "\"dropped_records\":0}") == NULL);
+	free(buf);
+
+	/* recording */
+	assert(evemu_context_enable_trace(ctx, 1000) == 0);
+	for (i = 0; i < 4; i++)
+		evemu_create_event(&ev[i], i % 2 ? EV_SYN : EV_REL, 0, i);
+	assert(pipe(fds) == 0);
+	assert(write(fds[1], ev, sizeof(ev)) == sizeof(ev));
+	out = tmpfile();
+	assert(out);
+	assert(evemu_context_record(ctx, out, fds[0], 100) == 0);
+	close(fds[0]);
+	close(fds[1]);
+	fclose(out);
+	buf = write_trace(ctx);
+	assert(count(buf, "\"name\":\"read\"") == 4);
+	assert(count(buf, "\"name\":\"write\"") == 4);
+	assert(count(buf, "\"name\":\"frame\"") == 2);
+	assert(count(buf, "\"name\":\"parse\"") == 0);
+	free(buf);
+
+	/* disabled again */
+	assert(evemu_context_enable_trace(ctx, 0) == 0);
+	assert(evemu_context_write_trace(ctx, stdout) == -EINVAL);
+
+	evemu_context_delete(ctx);
+}
+
+int main(int argc UNUSED, char **argv UNUSED) {
+	check_disabled();
+	check_play_stats();
+	check_parse_failure();
+	check_filter();
+	check_write_event();
+	check_record_limits();
+	check_latency();
+	check_trace();
+	return 0;
+}
@@ -0,0 +1,82 @@
+/*
+ * Test the device list. There are no real event nodes here, so this only
+ * checks that nodes which are not evdev devices are skipped.
+ */
+
+#define _GNU_SOURCE
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <unistd.h>
+#include <assert.h>
+#include <fcntl.h>
+#include "evemu.h"
+
+#define UNUSED __attribute__((unused))
+
+static void touch(const char *dir, const char *name)
+{
+	char path[256];
+	int fd;
+
+	snprintf(path, sizeof(path), "%s/%s", dir, name);
+	fd = open(path, O_CREAT | O_WRONLY, 0644);
+	assert(fd >= 0);
+	close(fd);
+}
+
+static void remove_node(const char *dir, const char *name)
+{
+	char path[256];
+
+	snprintf(path, sizeof(path), "%s/%s", dir, name);
+	assert(unlink(path) == 0);
+}
+
+static void check_not_evdev(void)
+{
+	char dir[] = "/tmp/evemu-test-XXXXXX";
+	struct evemu_device_list *list;
+
+	assert(mkdtemp(dir));
+	touch(dir, "event0");
+
+	list = evemu_device_list_new(dir);
+	assert(list);
+	assert(evemu_device_list_get_count(list) == 0);
+	assert(evemu_device_list_get_devnode(list, 0) == NULL);
+	assert(evemu_device_list_get_device(list, 0) == NULL);
+	assert(evemu_device_list_get_fd(list) >= 0);
+	assert(evemu_device_list_update(list) == 0);
+
+	touch(dir, "event1");
+	touch(dir, "mouse0");
+	assert(evemu_device_list_update(list) == 0);
+	assert(evemu_device_list_get_count(list) == 0);
+
+	remove_node(dir, "event0");
+	remove_node(dir, "event1");
+	remove_node(dir, "mouse0");
+	assert(evemu_device_list_update(list) == 0);
+
+	evemu_device_list_delete(list);
+	assert(rmdir(dir) == 0);
+}
+
+static void check_missing_directory(void)
+{
+	struct evemu_device_list *list;
+
+	list = evemu_device_list_new("/tmp/evemu-test-does-not-exist");
+	assert(list);
+	assert(evemu_device_list_get_count(list) == 0);
+	assert(evemu_device_list_get_fd(list) == -1);
+	assert(evemu_device_list_update(list) == 0);
+	evemu_device_list_delete(list);
+}
+
+int main(int argc UNUSED, char **argv UNUSED) {
+	check_not_evdev();
+	check_missing_directory();
+	return 0;
+}
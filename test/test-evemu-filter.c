@@ -0,0 +1,255 @@
+/*
+ * Test the event filter rules.
+ */
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <unistd.h>
+#include <assert.h>
+#include "evemu.h"
+#include <linux/input.h>
+
+#define UNUSED __attribute__((unused))
+
+static int filter(struct evemu_filter *f, long usec, int type, int code,
+		  int value, struct input_event *out)
+{
+	struct input_event ev;
+
+	evemu_create_event(&ev, type, code, value);
+	ev.time.tv_sec = usec / 1000000;
+	ev.time.tv_usec = usec % 1000000;
+
+	if (out)
+		*out = ev;
+
+	return evemu_filter_event(f, out ? out : &ev);
+}
+
+static void check_invalid_rules(void)
+{
+	struct evemu_filter *f = evemu_filter_new();
+
+	assert(f);
+	assert(evemu_filter_add(f, "foo") < 0);
+	assert(evemu_filter_add(f, "drop=EV_FOO") < 0);
+	assert(evemu_filter_add(f, "drop=EV_ABS:KEY_A") < 0);
+	assert(evemu_filter_add(f, "time=3-1") < 0);
+	assert(evemu_filter_add(f, "remap=ABS_X") < 0);
+	assert(evemu_filter_add(f, "remap=EV_ABS=ABS_Y") < 0);
+	evemu_filter_delete(f);
+}
+
+static void check_drop(void)
+{
+	struct evemu_filter *f = evemu_filter_new();
+
+	assert(f);
+	assert(evemu_filter_add(f, "drop=EV_MSC,drop=EV_ABS:ABS_Y") == 0);
+
+	assert(filter(f, 0, EV_ABS, ABS_X, 1, NULL));
+	assert(!filter(f, 0, EV_ABS, ABS_Y, 1, NULL));
+	assert(!filter(f, 0, EV_MSC, MSC_TIMESTAMP, 1, NULL));
+	assert(filter(f, 0, EV_SYN, SYN_REPORT, 0, NULL));
+
+	/* a frame with only dropped events loses its SYN_REPORT */
+	assert(!filter(f, 0, EV_MSC, MSC_TIMESTAMP, 1, NULL));
+	assert(!filter(f, 0, EV_SYN, SYN_REPORT, 0, NULL));
+
+	/* an empty frame in the source is left alone */
+	assert(filter(f, 0, EV_SYN, SYN_REPORT, 0, NULL));
+
+	evemu_filter_delete(f);
+}
+
+static void check_select(void)
+{
+	struct evemu_filter *f = evemu_filter_new();
+
+	assert(f);
+	assert(evemu_filter_add(f, "select=EV_KEY") == 0);
+	assert(evemu_filter_add(f, "select=ABS_X") == 0);
+
+	assert(filter(f, 0, EV_KEY, BTN_LEFT, 1, NULL));
+	assert(filter(f, 0, EV_ABS, ABS_X, 1, NULL));
+	assert(!filter(f, 0, EV_ABS, ABS_Y, 1, NULL));
+	assert(!filter(f, 0, EV_REL, REL_X, 1, NULL));
+	assert(filter(f, 0, EV_SYN, SYN_REPORT, 0, NULL));
+
+	/* drop rules apply on top of the selection */
+	assert(evemu_filter_add(f, "drop=BTN_LEFT") == 0);
+	assert(!filter(f, 0, EV_KEY, BTN_LEFT, 1, NULL));
+	assert(filter(f, 0, EV_KEY, BTN_RIGHT, 1, NULL));
+
+	evemu_filter_delete(f);
+}
+
+static void check_time(void)
+{
+	struct evemu_filter *f = evemu_filter_new();
+
+	assert(f);
+	assert(evemu_filter_add(f, "time=1.5-3") == 0);
+
+	assert(!filter(f, 1000000, EV_REL, REL_X, 1, NULL));
+	assert(!filter(f, 1000000, EV_SYN, SYN_REPORT, 0, NULL));
+	assert(filter(f, 1500000, EV_REL, REL_X, 1, NULL));
+	assert(filter(f, 1500000, EV_SYN, SYN_REPORT, 0, NULL));
+	assert(filter(f, 3000000, EV_REL, REL_X, 1, NULL));
+	assert(!filter(f, 3000001, EV_REL, REL_X, 1, NULL));
+
+	assert(evemu_filter_add(f, "time=2-") == 0);
+	assert(!filter(f, 1500000, EV_REL, REL_X, 1, NULL));
+	assert(filter(f, 500000000, EV_REL, REL_X, 1, NULL));
+
+	evemu_filter_delete(f);
+}
+
+/* recording stops once the time window has ended */
+static void check_record_time(void)
+{
+	struct evemu_filter *f = evemu_filter_new();
+	struct input_event ev[8];
+	char *buf = NULL;
+	size_t sz = 0;
+	FILE *fp;
+	int fds[2];
+	int i, n = 0;
+
+	assert(f);
+	assert(evemu_filter_add(f, "time=0-1.5") == 0);
+	for (i = 0; i < 4; i++) {
+		evemu_create_event(&ev[2 * i], EV_REL, REL_X, i + 1);
+		evemu_create_event(&ev[2 * i + 1], EV_SYN, SYN_REPORT, 0);
+		ev[2 * i].time.tv_sec = ev[2 * i + 1].time.tv_sec = 10 + i;
+	}
+	assert(pipe(fds) == 0);
+	assert(write(fds[1], ev, sizeof(ev)) == sizeof(ev));
+
+	fp = open_memstream(&buf, &sz);
+	assert(fp);
+	/* would wait 10s for more events without the window */
+	assert(evemu_record_filtered(fp, fds[0], 10000, f) == 0);
+	fclose(fp);
+	for (i = 0; buf[i]; i++)
+		if (buf[i] == 'E' && (i == 0 || buf[i - 1] == '\n'))
+			n++;
+	assert(n == 4);
+
+	/* the frame after the first one past the window is not read */
+	assert(read(fds[0], ev, sizeof(ev)) == 2 * sizeof(ev[0]));
+	assert(ev[0].value == 4);
+
+	close(fds[0]);
+	close(fds[1]);
+	free(buf);
+	evemu_filter_delete(f);
+}
+
+static void check_remap(void)
+{
+	struct evemu_filter *f = evemu_filter_new();
+	struct input_event ev;
+
+	assert(f);
+	assert(evemu_filter_add(f, "remap=BTN_LEFT=BTN_RIGHT") == 0);
+	assert(evemu_filter_add(f, "remap=EV_REL:REL_WHEEL=EV_REL:REL_HWHEEL") == 0);
+
+	assert(filter(f, 0, EV_KEY, BTN_LEFT, 1, &ev));
+	assert(ev.type == EV_KEY && ev.code == BTN_RIGHT && ev.value == 1);
+	assert(filter(f, 0, EV_REL, REL_WHEEL, -1, &ev));
+	assert(ev.type == EV_REL && ev.code == REL_HWHEEL && ev.value == -1);
+	assert(filter(f, 0, EV_KEY, BTN_MIDDLE, 1, &ev));
+	assert(ev.type == EV_KEY && ev.code == BTN_MIDDLE);
+
+	evemu_filter_delete(f);
+}
+
+static struct evemu_device *create_device(void)
+{
+	/* BTN_LEFT, REL_X, ABS_X with fuzz 8 and two slots */
+	const char *desc =
+		"# EVEMU 1.2\n"
+		"N: reduce test\n"
+		"I: 0003 0001 0001 0001\n"
+		"B: 00 0f 00 00 00 00 00 00 00\n"
+		"B: 01 00 00 00 00 00 00 00 00\n"
+		"B: 01 00 00 00 00 00 00 00 00\n"
+		"B: 01 00 00 00 00 00 00 00 00\n"
+		"B: 01 00 00 00 00 00 00 00 00\n"
+		"B: 01 00 00 01 00 00 00 00 00\n"
+		"B: 02 01 00 00 00 00 00 00 00\n"
+		"B: 03 01 00 00 00 00 80 20 02\n"
+		"A: 00 0 1000 8 0 0\n"
+		"A: 2f 0 1 0 0 0\n"
+		"A: 35 0 1000 0 0 0\n"
+		"A: 39 0 65535 0 0 0\n";
+	struct evemu_device *dev = evemu_new(NULL);
+	FILE *fp = fmemopen((void*)desc, strlen(desc), "r");
+
+	assert(dev);
+	assert(fp);
+	assert(evemu_read(dev, fp) > 0);
+	fclose(fp);
+
+	return dev;
+}
+
+static void check_reduce(void)
+{
+	struct evemu_filter *f = evemu_filter_new();
+	struct evemu_device *dev = create_device();
+
+	assert(f);
+	assert(evemu_filter_enable_reduction(f, dev) == 0);
+	assert(evemu_filter_get_reduced_count(f) == 0);
+
+	/* key state changes only */
+	assert(filter(f, 0, EV_KEY, BTN_LEFT, 1, NULL));
+	assert(!filter(f, 0, EV_KEY, BTN_LEFT, 1, NULL));
+	assert(filter(f, 0, EV_SYN, SYN_REPORT, 0, NULL));
+	assert(!filter(f, 0, EV_KEY, BTN_LEFT, 1, NULL));
+	assert(!filter(f, 0, EV_SYN, SYN_REPORT, 0, NULL));
+	assert(filter(f, 0, EV_KEY, BTN_LEFT, 0, NULL));
+	assert(filter(f, 0, EV_SYN, SYN_REPORT, 0, NULL));
+
+	/* unsupported codes and zero relative motion */
+	assert(!filter(f, 0, EV_KEY, BTN_RIGHT, 1, NULL));
+	assert(!filter(f, 0, EV_REL, REL_X, 0, NULL));
+	assert(filter(f, 0, EV_REL, REL_X, 1, NULL));
+	assert(filter(f, 0, EV_SYN, SYN_REPORT, 0, NULL));
+
+	/* fuzz */
+	assert(filter(f, 0, EV_ABS, ABS_X, 100, NULL));
+	assert(!filter(f, 0, EV_ABS, ABS_X, 103, NULL));
+	assert(filter(f, 0, EV_ABS, ABS_X, 120, NULL));
+
+	/* per-slot values */
+	assert(!filter(f, 0, EV_ABS, ABS_MT_SLOT, 0, NULL));
+	assert(filter(f, 0, EV_ABS, ABS_MT_POSITION_X, 50, NULL));
+	assert(filter(f, 0, EV_ABS, ABS_MT_SLOT, 1, NULL));
+	assert(filter(f, 0, EV_ABS, ABS_MT_POSITION_X, 50, NULL));
+	assert(filter(f, 0, EV_ABS, ABS_MT_SLOT, 0, NULL));
+	assert(!filter(f, 0, EV_ABS, ABS_MT_POSITION_X, 50, NULL));
+	assert(filter(f, 0, EV_SYN, SYN_REPORT, 0, NULL));
+
+	/* empty frames */
+	assert(!filter(f, 0, EV_SYN, SYN_REPORT, 0, NULL));
+
+	assert(evemu_filter_get_reduced_count(f) == 9);
+
+	evemu_delete(dev);
+	evemu_filter_delete(f);
+}
+
+int main(int argc UNUSED, char **argv UNUSED) {
+	check_invalid_rules();
+	check_drop();
+	check_select();
+	check_time();
+	check_record_time();
+	check_remap();
+	check_reduce();
+	return 0;
+}
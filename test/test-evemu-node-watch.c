@@ -0,0 +1,89 @@
+/*
+ * Test waiting for device nodes, with regular files standing in for the
+ * nodes.
+ */
+
+#define _GNU_SOURCE
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <unistd.h>
+#include <assert.h>
+#include <errno.h>
+#include <fcntl.h>
+#include <pthread.h>
+#include <sys/stat.h>
+#include "evemu.h"
+
+#define UNUSED __attribute__((unused))
+
+static char dir[] = "/tmp/evemu-test-XXXXXX";
+
+static void *create_nodes(void *data UNUSED)
+{
+	char path[256];
+	int fd;
+
+	usleep(50000);
+
+	/* the directory does not exist when the wait starts */
+	snprintf(path, sizeof(path), "%s/input", dir);
+	assert(mkdir(path, 0755) == 0);
+
+	snprintf(path, sizeof(path), "%s/input/event0", dir);
+	fd = open(path, O_CREAT | O_WRONLY, 0644);
+	assert(fd >= 0);
+	close(fd);
+
+	snprintf(path, sizeof(path), "%s/input/event1", dir);
+	fd = open(path, O_CREAT | O_WRONLY, 0644);
+	assert(fd >= 0);
+	close(fd);
+
+	return NULL;
+}
+
+static void cleanup(void)
+{
+	char path[256];
+
+	snprintf(path, sizeof(path), "%s/input/event0", dir);
+	unlink(path);
+	snprintf(path, sizeof(path), "%s/input/event1", dir);
+	unlink(path);
+	snprintf(path, sizeof(path), "%s/input", dir);
+	rmdir(path);
+	rmdir(dir);
+}
+
+static void check_wait(void)
+{
+	struct evemu_node_watch *watch = evemu_node_watch_new();
+	char path[256];
+	pthread_t thread;
+
+	assert(watch);
+	assert(evemu_node_watch_get_fd(watch) >= 0);
+
+	snprintf(path, sizeof(path), "%s/input/event0", dir);
+	assert(evemu_node_watch_add(watch, path, O_RDWR) == 0);
+	snprintf(path, sizeof(path), "%s/input/event1", dir);
+	assert(evemu_node_watch_add(watch, path, O_RDONLY) == 0);
+
+	assert(evemu_node_watch_dispatch(watch) == 2);
+	assert(evemu_node_watch_wait(watch, 10) == -ETIMEDOUT);
+
+	assert(pthread_create(&thread, NULL, create_nodes, NULL) == 0);
+	assert(evemu_node_watch_wait(watch, 5000) == 0);
+	assert(evemu_node_watch_dispatch(watch) == 0);
+	pthread_join(thread, NULL);
+
+	evemu_node_watch_delete(watch);
+}
+
+int main(int argc UNUSED, char **argv UNUSED) {
+	assert(mkdtemp(dir));
+	check_wait();
+	cleanup();
+	return 0;
+}
@@ -0,0 +1,142 @@
+/*
+ * Test in-memory recordings and the multi-device player.
+ */
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <unistd.h>
+#include <assert.h>
+#include "evemu.h"
+#include <linux/input.h>
+
+#define UNUSED __attribute__((unused))
+
+static const char *rel_x =
+	"# EVEMU 1.2\n"
+	"N: test\n"
+	"E: 10.000000 0002 0000 0001\n"
+	"E: 10.000000 0000 0000 0000\n"
+	"E: 10.002000 0002 0000 0001\n"
+	"E: 10.002000 0000 0000 0000\n"
+	"E: 10.004000 0002 0000 0001\n"
+	"E: 10.004000 0002 0001 0001\n"
+	"E: 10.004000 0000 0000 0000\n";
+
+static const char *rel_wheel =
+	"E: 0.001000 0002 0008 0001\n"
+	"E: 0.001000 0000 0000 0000\n"
+	"E: 0.003000 0002 0008 0001\n"
+	"E: 0.003000 0000 0000 0000\n";
+
+static struct evemu_recording *read_recording(const char *str,
+					      struct evemu_filter *filter)
+{
+	FILE *fp = fmemopen((void*)str, strlen(str), "r");
+	struct evemu_recording *rec;
+
+	assert(fp);
+	rec = evemu_recording_new(fp, filter);
+	fclose(fp);
+
+	return rec;
+}
+
+/* Plays the player into a pipe and returns the codes of the events
+ * that are not EV_SYN as string, e.g. "0008" */
+static void run(struct evemu_player *player, int fds[2], char *codes,
+		size_t sz)
+{
+	struct input_event ev;
+	size_t len = 0;
+
+	assert(evemu_player_run(player) == 0);
+	close(fds[1]);
+	while (read(fds[0], &ev, sizeof(ev)) == sizeof(ev)) {
+		if (ev.type == EV_SYN)
+			continue;
+		assert(len + 2 < sz);
+		codes[len++] = '0' + ev.code;
+	}
+	codes[len] = '\0';
+	close(fds[0]);
+}
+
+static void check_recording(void)
+{
+	struct evemu_recording *rec;
+	struct evemu_filter *filter = evemu_filter_new();
+
+	rec = read_recording(rel_x, NULL);
+	assert(rec);
+	assert(evemu_recording_get_frame_count(rec) == 3);
+	assert(evemu_recording_get_duration(rec) == 4000);
+	evemu_recording_delete(rec);
+
+	assert(filter);
+	assert(evemu_filter_add(filter, "drop=REL_Y,time=10.001-") == 0);
+	rec = read_recording(rel_x, filter);
+	assert(rec);
+	assert(evemu_recording_get_frame_count(rec) == 2);
+	evemu_recording_delete(rec);
+	evemu_filter_delete(filter);
+
+	assert(read_recording("E: foo\n", NULL) == NULL);
+
+	rec = read_recording("", NULL);
+	assert(rec);
+	assert(evemu_recording_get_frame_count(rec) == 0);
+	evemu_recording_delete(rec);
+}
+
+static void check_merge(void)
+{
+	struct evemu_recording *a = read_recording(rel_x, NULL);
+	struct evemu_recording *b = read_recording(rel_wheel, NULL);
+	struct evemu_player *player = evemu_player_new();
+	char codes[32];
+	int fds[2];
+
+	assert(a && b && player);
+
+	/* both streams into one pipe to see the global order */
+	assert(pipe(fds) == 0);
+	assert(evemu_player_add(player, a, fds[1], 0) == 0);
+	assert(evemu_player_add(player, b, fds[1], 0) == 0);
+	run(player, fds, codes, sizeof(codes));
+	assert(strcmp(codes, "080801") == 0);
+
+	evemu_player_delete(player);
+
+	/* delaying the second stream moves its frames to the end */
+	player = evemu_player_new();
+	assert(pipe(fds) == 0);
+	assert(evemu_player_add(player, a, fds[1], 0) == 0);
+	assert(evemu_player_add(player, b, fds[1], 5000) == 0);
+	run(player, fds, codes, sizeof(codes));
+	assert(strcmp(codes, "000188") == 0);
+
+	evemu_player_delete(player);
+	evemu_recording_delete(a);
+	evemu_recording_delete(b);
+}
+
+static void check_write_error(void)
+{
+	struct evemu_recording *rec = read_recording(rel_x, NULL);
+	struct evemu_player *player = evemu_player_new();
+
+	assert(rec && player);
+	assert(evemu_player_add(player, rec, -1, 0) == 0);
+	assert(evemu_player_run(player) == -EBADF);
+
+	evemu_player_delete(player);
+	evemu_recording_delete(rec);
+}
+
+int main(int argc UNUSED, char **argv UNUSED) {
+	check_recording();
+	check_merge();
+	check_write_error();
+	return 0;
+}
@@ -0,0 +1,203 @@
+/*
+ * Test the in-memory flight recorder.
+ */
+
+#define _GNU_SOURCE
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <unistd.h>
+#include <assert.h>
+#include <errno.h>
+#include "evemu.h"
+#include <linux/input.h>
+
+#define UNUSED __attribute__((unused))
+
+static struct input_event event(long usec, int type, int code, int value)
+{
+	struct input_event ev;
+
+	evemu_create_event(&ev, type, code, value);
+	ev.time.tv_sec = usec / 1000000;
+	ev.time.tv_usec = usec % 1000000;
+	return ev;
+}
+
+/* adds a frame of REL_X with the given value, returns the trigger */
+static int add_frame(struct evemu_ring *ring, long usec, int value)
+{
+	struct input_event ev;
+
+	ev = event(usec, EV_REL, REL_X, value);
+	assert(evemu_ring_add_event(ring, &ev) == 0);
+	ev = event(usec, EV_SYN, SYN_REPORT, 0);
+	return evemu_ring_add_event(ring, &ev);
+}
+
+/* writes the ring and reads it back, returns the number of events */
+static int dump(struct evemu_ring *ring, struct input_event *events,
+		int max)
+{
+	struct evemu_context *ctx = evemu_context_new();
+	char *buf = NULL;
+	size_t len = 0;
+	FILE *fp = open_memstream(&buf, &len);
+	int n = 0, written;
+
+	assert(ctx);
+	assert(fp);
+	written = evemu_context_write_ring(ctx, ring, fp);
+	assert(written >= 0);
+	fclose(fp);
+
+	fp = fmemopen(buf, len ? len : 1, "r");
+	assert(fp);
+	while (n < max && len && evemu_read_event(fp, &events[n]) > 0)
+		n++;
+	assert(n == written);
+
+	fclose(fp);
+	free(buf);
+	evemu_context_delete(ctx);
+
+	return n;
+}
+
+static void check_invalid(void)
+{
+	struct evemu_ring *ring;
+
+	assert(evemu_ring_new(1, 0) == NULL);
+	assert(evemu_ring_new(sizeof(struct input_event), -1) == NULL);
+
+	ring = evemu_ring_new(sizeof(struct input_event), 0);
+	assert(ring);
+	assert(evemu_ring_add_trigger(ring, "foo") < 0);
+	assert(evemu_ring_add_trigger(ring, "KEY_A=") < 0);
+	assert(evemu_ring_add_trigger(ring, "KEY_A=x") < 0);
+	assert(evemu_ring_add_trigger(ring, "KEY_A=1") == 0);
+	evemu_ring_delete(ring);
+}
+
+static void check_size(void)
+{
+	struct evemu_ring *ring = evemu_ring_new(5 * sizeof(struct input_event), 0);
+	struct input_event events[8];
+	int i;
+
+	assert(ring);
+	for (i = 1; i <= 3; i++)
+		assert(add_frame(ring, i * 1000, i) == 0);
+	assert(evemu_ring_get_event_count(ring) == 5);
+
+	/* the first frame was partly overwritten and is not written */
+	assert(dump(ring, events, 8) == 4);
+	assert(events[0].type == EV_REL && events[0].value == 2);
+	assert(events[2].type == EV_REL && events[2].value == 3);
+
+	/* timestamps are relative to the first frame written */
+	assert(events[0].time.tv_sec == 0 && events[0].time.tv_usec == 1);
+	assert(events[2].time.tv_usec == 1001);
+
+	evemu_ring_clear(ring);
+	assert(evemu_ring_get_event_count(ring) == 0);
+	assert(dump(ring, events, 8) == 0);
+
+	evemu_ring_delete(ring);
+}
+
+static void check_duration(void)
+{
+	struct evemu_ring *ring = evemu_ring_new(4096, 2500);
+	struct input_event events[16];
+	struct input_event ev;
+	int i;
+
+	assert(ring);
+	for (i = 0; i < 5; i++)
+		assert(add_frame(ring, i * 1000, i) == 0);
+
+	/* frames 2, 3 and 4 are within 2.5ms of the newest one */
+	assert(evemu_ring_get_event_count(ring) == 6);
+	assert(dump(ring, events, 16) == 6);
+	assert(events[0].value == 2);
+
+	/* an incomplete frame is not written */
+	ev = event(5000, EV_REL, REL_X, 5);
+	assert(evemu_ring_add_event(ring, &ev) == 0);
+	assert(dump(ring, events, 16) == 4);
+	assert(events[0].value == 3);
+
+	evemu_ring_delete(ring);
+}
+
+static void check_trigger(void)
+{
+	struct evemu_ring *ring = evemu_ring_new(4096, 0);
+	struct input_event ev;
+
+	assert(ring);
+	assert(evemu_ring_add_trigger(ring, "EV_KEY:KEY_A=1") == 0);
+	assert(evemu_ring_add_trigger(ring, "EV_SW") == 0);
+
+	assert(add_frame(ring, 0, 1) == 0);
+
+	/* the trigger fires on the SYN_REPORT of the matching frame */
+	ev = event(0, EV_KEY, KEY_A, 0);
+	assert(evemu_ring_add_event(ring, &ev) == 0);
+	assert(add_frame(ring, 0, 1) == 0);
+	ev = event(0, EV_KEY, KEY_A, 1);
+	assert(evemu_ring_add_event(ring, &ev) == 0);
+	assert(add_frame(ring, 0, 1) == 1);
+	assert(add_frame(ring, 0, 1) == 0);
+
+	ev = event(0, EV_SW, SW_LID, 1);
+	assert(evemu_ring_add_event(ring, &ev) == 0);
+	ev = event(0, EV_SYN, SYN_REPORT, 0);
+	assert(evemu_ring_add_event(ring, &ev) == 1);
+
+	evemu_ring_delete(ring);
+}
+
+static void check_record(void)
+{
+	struct evemu_context *ctx = evemu_context_new();
+	struct evemu_ring *ring = evemu_ring_new(4096, 0);
+	struct input_event ev[4];
+	int fds[2];
+
+	assert(ctx);
+	assert(ring);
+	assert(evemu_ring_add_trigger(ring, "BTN_LEFT=1") == 0);
+	assert(pipe(fds) == 0);
+
+	ev[0] = event(1000, EV_REL, REL_X, 1);
+	ev[1] = event(1000, EV_SYN, SYN_REPORT, 0);
+	ev[2] = event(2000, EV_KEY, BTN_LEFT, 1);
+	ev[3] = event(2000, EV_SYN, SYN_REPORT, 0);
+
+	assert(write(fds[1], ev, 2 * sizeof(ev[0])) == 2 * sizeof(ev[0]));
+	assert(evemu_context_record_ring(ctx, ring, fds[0], 10) == 0);
+	assert(evemu_ring_get_event_count(ring) == 2);
+
+	assert(write(fds[1], ev, sizeof(ev)) == sizeof(ev));
+	assert(evemu_context_record_ring(ctx, ring, fds[0], 10) == 1);
+	assert(evemu_ring_get_event_count(ring) == 6);
+
+	close(fds[1]);
+	assert(evemu_context_record_ring(ctx, ring, fds[0], 10) == -ENODEV);
+
+	close(fds[0]);
+	evemu_ring_delete(ring);
+	evemu_context_delete(ctx);
+}
+
+int main(int argc UNUSED, char **argv UNUSED) {
+	check_invalid();
+	check_size();
+	check_duration();
+	check_trigger();
+	check_record();
+	return 0;
+}
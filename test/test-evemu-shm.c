@@ -0,0 +1,243 @@
+/*
+ * Test the shared memory fan-out of events.
+ */
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <unistd.h>
+#include <errno.h>
+#include <assert.h>
+#include <fcntl.h>
+#include <stdint.h>
+#include <sys/mman.h>
+#include <sys/wait.h>
+#include "evemu.h"
+#include <linux/input.h>
+
+#define UNUSED __attribute__((unused))
+#define CAPACITY 16
+/* offsets of 'reserved' and 'head' in struct shm_header, see evemu.c */
+#define SHM_RESERVED 64
+#define SHM_HEAD 72
+
+static char name[64];
+
+static void fill(struct input_event *ev, int n, int first)
+{
+	int i;
+
+	memset(ev, 0, n * sizeof(*ev));
+	for (i = 0; i < n; i++) {
+		ev[i].type = EV_ABS;
+		ev[i].code = ABS_X;
+		ev[i].value = first + i;
+	}
+}
+
+static void publish(struct evemu_shm *pub, int n, int first)
+{
+	struct input_event ev[64];
+
+	assert(n <= 64);
+	fill(ev, n, first);
+	assert(evemu_shm_publish(pub, ev, n) == n);
+}
+
+static void check_read(struct evemu_shm *sub, int n, int first)
+{
+	const struct input_event *ev;
+	int i;
+
+	assert(evemu_shm_read(sub, &ev, 0) == n);
+	for (i = 0; i < n; i++)
+		assert(ev[i].value == first + i);
+	assert(evemu_shm_valid(sub));
+}
+
+static void check_ring(void)
+{
+	struct evemu_shm *pub, *sub;
+	const struct input_event *ev;
+
+	errno = 0;
+	assert(evemu_shm_new(name, sizeof(struct input_event)) == NULL);
+	assert(errno == EINVAL);
+
+	/* rounded down to a power of two */
+	pub = evemu_shm_new(name, (CAPACITY + 3) * sizeof(struct input_event));
+	assert(pub);
+	assert(evemu_shm_get_capacity(pub) == CAPACITY);
+
+	/* events published before subscribing are not seen */
+	publish(pub, 3, 100);
+	sub = evemu_shm_open(name);
+	assert(sub);
+	assert(evemu_shm_get_capacity(sub) == CAPACITY);
+	assert(evemu_shm_read(sub, &ev, 0) == 0);
+
+	/* the subscriber is at 3, the ring wraps after 13 events */
+	publish(pub, 5, 0);
+	check_read(sub, 5, 0);
+	publish(pub, 14, 5);
+	check_read(sub, 8, 5);
+	check_read(sub, 6, 13);
+	assert(evemu_shm_get_lost(sub) == 0);
+
+	/* the subscriber falls behind by 40 - 16 events */
+	publish(pub, 40, 19);
+	assert(evemu_shm_read(sub, &ev, 0) > 0);
+	assert(evemu_shm_get_lost(sub) == 24);
+	assert(ev[0].value == 19 + 24);
+	while (evemu_shm_read(sub, &ev, 0) > 0)
+		;
+
+	/* events overwritten while in use are detected */
+	publish(pub, 2, 59);
+	assert(evemu_shm_read(sub, &ev, 0) == 2);
+	assert(evemu_shm_valid(sub));
+	publish(pub, CAPACITY - 2, 61);
+	assert(evemu_shm_valid(sub));
+	publish(pub, 1, 75);
+	assert(!evemu_shm_valid(sub));
+
+	/* only the publisher publishes */
+	assert(evemu_shm_publish(sub, ev, 1) == -EBADF);
+	assert(evemu_shm_read(pub, &ev, 0) == -EBADF);
+
+	/* the remaining events are read after the publisher is gone */
+	evemu_shm_delete(pub);
+	check_read(sub, CAPACITY - 1, 61);
+	assert(evemu_shm_read(sub, &ev, -1) == -EPIPE);
+	evemu_shm_delete(sub);
+
+	assert(evemu_shm_open(name) == NULL);
+	assert(errno == ENOENT);
+}
+
+/* a subscriber sees 'reserved' more than the capacity past a 'head' that
+ * is stale, as if the publisher completed batches in between */
+static void check_stale_head(void)
+{
+	struct evemu_shm *pub = evemu_shm_new(name,
+					      CAPACITY * sizeof(struct input_event));
+	struct evemu_shm *sub = evemu_shm_open(name);
+	const struct input_event *ev;
+	char *header;
+	int fd;
+
+	assert(pub && sub);
+	fd = shm_open(name, O_RDWR, 0);
+	assert(fd >= 0);
+	header = mmap(NULL, 128, PROT_READ | PROT_WRITE, MAP_SHARED, fd, 0);
+	assert(header != MAP_FAILED);
+	close(fd);
+
+	publish(pub, 2, 0);
+	*(uint64_t *)(header + SHM_RESERVED) = 2 + CAPACITY + 4;
+
+	/* the subscriber does not move past the published events */
+	assert(evemu_shm_read(sub, &ev, 0) == 0);
+	assert(evemu_shm_get_lost(sub) == 2);
+
+	/* once published, the oldest events not overwritten are read */
+	*(uint64_t *)(header + SHM_HEAD) = 2 + CAPACITY + 4;
+	assert(evemu_shm_read(sub, &ev, 0) == CAPACITY - 6);
+	assert(evemu_shm_get_lost(sub) == 6);
+	assert(evemu_shm_read(sub, &ev, 0) == 6);
+	assert(evemu_shm_read(sub, &ev, 0) == 0);
+
+	munmap(header, 128);
+	evemu_shm_delete(sub);
+	evemu_shm_delete(pub);
+}
+
+/* a subscriber in another process sleeps until events arrive */
+static void check_wakeup(void)
+{
+	struct evemu_shm *pub = evemu_shm_new(name, 4096);
+	int sync[2];
+	pid_t pid;
+	int status;
+	char c;
+
+	assert(pub);
+	assert(pipe(sync) == 0);
+
+	pid = fork();
+	assert(pid >= 0);
+	if (pid == 0) {
+		struct evemu_shm *sub = evemu_shm_open(name);
+		const struct input_event *ev;
+		int sum = 0, n, i;
+
+		if (!sub || write(sync[1], "x", 1) != 1)
+			_exit(1);
+		while ((n = evemu_shm_read(sub, &ev, 5000)) > 0)
+			for (i = 0; i < n; i++)
+				sum += ev[i].value;
+		evemu_shm_delete(sub);
+		_exit(n == -EPIPE && sum == 10 ? 0 : 2);
+	}
+
+	assert(read(sync[0], &c, 1) == 1);
+	usleep(20000);
+	publish(pub, 4, 1);
+	usleep(20000);
+	evemu_shm_delete(pub);
+
+	assert(waitpid(pid, &status, 0) == pid);
+	assert(WIFEXITED(status) && WEXITSTATUS(status) == 0);
+	close(sync[0]);
+	close(sync[1]);
+}
+
+static void check_record(void)
+{
+	struct evemu_context *ctx = evemu_context_new();
+	struct evemu_filter *filter = evemu_filter_new();
+	struct evemu_shm *pub = evemu_shm_new(name, 4096);
+	struct evemu_shm *sub = evemu_shm_open(name);
+	const struct input_event *ev;
+	struct input_event events[4];
+	int fds[2];
+
+	assert(ctx && filter && pub && sub);
+	assert(evemu_filter_add(filter, "drop=EV_MSC") == 0);
+	evemu_context_set_filter(ctx, filter);
+
+	fill(events, 4, 1);
+	events[1].type = EV_MSC;
+	events[1].code = MSC_SCAN;
+	events[3].type = EV_SYN;
+	events[3].code = SYN_REPORT;
+	events[3].time.tv_sec = 7;
+	assert(pipe(fds) == 0);
+	assert(write(fds[1], events, sizeof(events)) == sizeof(events));
+
+	assert(evemu_context_record_shm(ctx, pub, fds[0], 100) == 3);
+	assert(evemu_context_record_shm(ctx, pub, fds[0], 10) == 0);
+	close(fds[1]);
+	assert(evemu_context_record_shm(ctx, pub, fds[0], 10) == -ENODEV);
+	close(fds[0]);
+
+	/* one batch, kernel timestamps */
+	assert(evemu_shm_read(sub, &ev, 0) == 3);
+	assert(ev[0].value == 1 && ev[1].value == 3);
+	assert(ev[2].type == EV_SYN && ev[2].time.tv_sec == 7);
+
+	evemu_shm_delete(sub);
+	evemu_shm_delete(pub);
+	evemu_filter_delete(filter);
+	evemu_context_delete(ctx);
+}
+
+int main(int argc UNUSED, char **argv UNUSED) {
+	snprintf(name, sizeof(name), "/evemu-test-shm-%d", (int)getpid());
+
+	check_ring();
+	check_stale_head();
+	check_wakeup();
+	check_record();
+	return 0;
+}
@@ -0,0 +1,204 @@
+/*
+ * Test following recordings that are still being written.
+ */
+
+#define _GNU_SOURCE
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <unistd.h>
+#include <assert.h>
+#include <errno.h>
+#include <fcntl.h>
+#include <pthread.h>
+#include "evemu.h"
+#include <linux/input.h>
+
+#define UNUSED __attribute__((unused))
+
+static char dir[] = "/tmp/evemu-test-XXXXXX";
+
+static const char *desc =
+	"# EVEMU 1.3\n"
+	"N: tail test\n"
+	"I: 0003 0001 0001 0001\n"
+	"################################\n"
+	"#      Waiting for events      #\n"
+	"################################\n";
+
+static char *path(const char *name)
+{
+	static char buf[256];
+
+	snprintf(buf, sizeof(buf), "%s/%s", dir, name);
+	return buf;
+}
+
+static void append(const char *name, const char *str)
+{
+	int fd = open(path(name), O_WRONLY | O_CREAT | O_APPEND, 0644);
+
+	assert(fd >= 0);
+	assert(write(fd, str, strlen(str)) == (ssize_t)strlen(str));
+	close(fd);
+}
+
+static void check_read(struct evemu_tail *tail, int ms, int value)
+{
+	struct input_event ev;
+
+	assert(evemu_tail_read_event(tail, &ev, ms) == 1);
+	assert(ev.type == EV_REL && ev.code == REL_X);
+	assert(ev.value == value);
+}
+
+static void *append_later(void *data)
+{
+	usleep(50000);
+	append(data, "E: 0.200000 0002 0000 0004\n");
+
+	return NULL;
+}
+
+static void check_follow(void)
+{
+	struct evemu_tail *tail;
+	struct input_event ev;
+	pthread_t thread;
+
+	append("rec", desc);
+	append("rec", "E: 0.000001 0002 0000 0001\n"
+		      "# a comment\n"
+		      "E: 0.100000 0002 0000 0002\n"
+		      "E: 0.150000 0002");
+
+	tail = evemu_tail_new(path("rec"), -1);
+	assert(tail);
+	assert(strcmp(evemu_tail_get_filename(tail), path("rec")) == 0);
+
+	check_read(tail, 0, 1);
+	check_read(tail, 0, 2);
+	/* the last line is not complete yet */
+	assert(evemu_tail_read_event(tail, &ev, 0) == 0);
+	assert(evemu_tail_read_event(tail, &ev, 20) == 0);
+	append("rec", " 0000 0003\n");
+	check_read(tail, 0, 3);
+
+	/* waits for appends */
+	assert(pthread_create(&thread, NULL, append_later, "rec") == 0);
+	check_read(tail, -1, 4);
+	pthread_join(thread, NULL);
+
+	append("rec", "E: foo\n");
+	assert(evemu_tail_read_event(tail, &ev, 0) == -EINVAL);
+
+	evemu_tail_delete(tail);
+	unlink(path("rec"));
+
+	errno = 0;
+	assert(evemu_tail_new(path("rec.2026-01-01-00:00:00"), -1) == NULL);
+	assert(errno == ENOENT);
+}
+
+static void check_offset(void)
+{
+	struct evemu_tail *tail;
+	int fd;
+
+	append("rec", desc);
+	append("rec", "E: 0.000001 0002 0000 0001\n"
+		      "E: 0.100000 0002 0000 0002\n");
+	fd = open(path("rec"), O_RDONLY);
+	assert(fd >= 0);
+	assert(lseek(fd, strlen(desc) + 27, SEEK_SET) > 0);
+
+	tail = evemu_tail_new(path("rec"), fd);
+	assert(tail);
+	close(fd);
+	check_read(tail, 0, 2);
+
+	evemu_tail_delete(tail);
+	unlink(path("rec"));
+}
+
+static void check_segments(void)
+{
+	const char *first = "seg.2026-01-01-00:00:00";
+	const char *second = "seg.2026-01-01-00:00:00.1";
+	const char *third = "seg.2026-01-01-00:00:05";
+	struct evemu_tail *tail;
+	struct input_event ev;
+	pthread_t thread;
+
+	/* no segment yet */
+	tail = evemu_tail_new(path("seg"), -1);
+	assert(tail);
+	assert(evemu_tail_get_filename(tail) == NULL);
+	assert(evemu_tail_read_event(tail, &ev, 0) == 0);
+
+	append(first, desc);
+	append(first, "E: 0.000001 0002 0000 0001\n");
+	check_read(tail, 100, 1);
+	assert(strcmp(evemu_tail_get_filename(tail), path(first)) == 0);
+
+	/* other files are ignored */
+	append("seg.2026-01-01-00:00:00.xz", "E: 0.000001 0002 0000 0009\n");
+	append("seg.old", "E: 0.000001 0002 0000 0009\n");
+	append("other.2026-01-01-00:00:01", "E: 0.000001 0002 0000 0009\n");
+	assert(evemu_tail_read_event(tail, &ev, 20) == 0);
+
+	/* the rest of a segment is read before the next ones, in order */
+	append(first, "E: 0.100000 0002 0000 0002\n");
+	append(third, desc);
+	append(third, "E: 0.000001 0002 0000 0004\n");
+	append(second, desc);
+	append(second, "E: 0.000001 0002 0000 0003\n");
+	check_read(tail, 100, 2);
+	check_read(tail, 100, 3);
+	assert(strcmp(evemu_tail_get_filename(tail), path(second)) == 0);
+	check_read(tail, 100, 4);
+	assert(strcmp(evemu_tail_get_filename(tail), path(third)) == 0);
+
+	/* and the newest segment is followed */
+	assert(pthread_create(&thread, NULL, append_later, (void*)third) == 0);
+	check_read(tail, 1000, 4);
+	pthread_join(thread, NULL);
+	evemu_tail_delete(tail);
+
+	/* following <output> starts with its newest segment */
+	tail = evemu_tail_new(path("seg"), -1);
+	assert(tail);
+	assert(strcmp(evemu_tail_get_filename(tail), path(third)) == 0);
+	evemu_tail_delete(tail);
+
+	/* following a segment continues with the next ones */
+	tail = evemu_tail_new(path(second), -1);
+	assert(tail);
+	check_read(tail, 0, 3);
+	/* a pending check finds the newer segment once the directory
+	 * changes */
+	append("seg.2026-01-01-00:00:10", "E: 0.000001 0002 0000 0005\n");
+	check_read(tail, 100, 4);
+	check_read(tail, 100, 4);
+	check_read(tail, 100, 5);
+	evemu_tail_delete(tail);
+
+	unlink(path(first));
+	unlink(path(second));
+	unlink(path(third));
+	unlink(path("seg.2026-01-01-00:00:10"));
+	unlink(path("seg.2026-01-01-00:00:00.xz"));
+	unlink(path("seg.old"));
+	unlink(path("other.2026-01-01-00:00:01"));
+}
+
+int main(int argc UNUSED, char **argv UNUSED) {
+	assert(mkdtemp(dir));
+
+	check_follow();
+	check_offset();
+	check_segments();
+
+	rmdir(dir);
+	return 0;
+}
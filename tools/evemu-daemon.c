@@ -0,0 +1,593 @@
+/*****************************************************************************
+ *
+ * evemu - Kernel device emulation
+ *
+ * Copyright (C) 2010-2012 Canonical Ltd.
+ *
+ * This program is free software: you can redistribute it and/or modify it
+ * under the terms of the GNU General Public License version 3 as published
+ * by the Free Software Foundation.
+ *
+ * This program is distributed in the hope that it will be useful, but
+ * WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ * General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License along
+ * with this program.  If not, see <http://www.gnu.org/licenses/>.
+ *
+ ****************************************************************************/
+
+/*
+ * evemu-daemon keeps virtual devices alive across clients. Clients connect
+ * to a Unix socket and send line-based commands:
+ *
+ *   CREATE <n>           followed by n lines of device description
+ *                        -> OK <id> <devnode>
+ *   PLAY <id> <path>     replay the recording at path in realtime -> OK
+ *   SEND <id> <n>        followed by n lines of "<type> <code> <value>" or
+ *                        "E: ..." events, written in one batch -> OK <n>
+ *   DESTROY <id>         -> OK
+ *   LIST                 -> OK <n>, followed by n lines
+ *                        "<id> <devnode> <name>"
+ *
+ * Failed commands are answered with "ERR <errno> <message>".
+ */
+
+#define _GNU_SOURCE
+#include "evemu.h"
+#include <errno.h>
+#include <getopt.h>
+#include <limits.h>
+#include <pthread.h>
+#include <signal.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <fcntl.h>
+#include <sys/socket.h>
+#include <sys/stat.h>
+#include <sys/types.h>
+#include <sys/un.h>
+#include <unistd.h>
+#include <linux/input.h>
+#include <libevdev/libevdev.h>
+
+#define MAX_LINES 65536
+
+struct daemon_device {
+	struct daemon_device *next;
+	int id;
+	int fd;
+	int busy;
+	struct evemu_device *dev;
+};
+
+static pthread_mutex_t devices_lock = PTHREAD_MUTEX_INITIALIZER;
+static struct daemon_device *devices;
+static int next_id = 1;
+static volatile sig_atomic_t stop;
+
+static void handler(int sig __attribute__((unused)))
+{
+	stop = 1;
+}
+
+static void reply_error(int fd, int err, const char *msg)
+{
+	dprintf(fd, "ERR %d %s\n", err, msg ? msg : strerror(err));
+}
+
+/* Returns the device with the given id and marks it busy, or NULL */
+static struct daemon_device *get_device(const char *arg)
+{
+	struct daemon_device *d;
+	char *end;
+	long id = strtol(arg, &end, 10);
+
+	if (*arg == '\0' || *end != '\0')
+		return NULL;
+
+	pthread_mutex_lock(&devices_lock);
+	for (d = devices; d; d = d->next)
+		if (d->id == id)
+			break;
+	if (d)
+		d->busy++;
+	pthread_mutex_unlock(&devices_lock);
+
+	return d;
+}
+
+static void put_device(struct daemon_device *d)
+{
+	pthread_mutex_lock(&devices_lock);
+	d->busy--;
+	pthread_mutex_unlock(&devices_lock);
+}
+
+static void free_device(struct daemon_device *d)
+{
+	if (d->fd >= 0)
+		close(d->fd);
+	evemu_delete(d->dev);
+	free(d);
+}
+
+static int parse_count(const char *arg, long *count)
+{
+	char *end;
+
+	*count = strtol(arg, &end, 10);
+	return *arg != '\0' && *end == '\0' && *count >= 0 &&
+	       *count <= MAX_LINES;
+}
+
+/* Reads n lines from fp into one buffer, returns its length or -1 */
+static ssize_t read_lines(FILE *fp, long n, char **buf)
+{
+	char *line = NULL;
+	size_t size = 0, len = 0;
+	FILE *out = open_memstream(buf, &len);
+	ssize_t rc = 0;
+
+	if (!out)
+		return -1;
+
+	while (n-- > 0) {
+		if (getline(&line, &size, fp) < 0) {
+			rc = -1;
+			break;
+		}
+		fputs(line, out);
+	}
+
+	free(line);
+	fclose(out);
+	if (rc < 0) {
+		free(*buf);
+		*buf = NULL;
+		return -1;
+	}
+	return len;
+}
+
+static void cmd_create(int fd, FILE *fp, const char *arg)
+{
+	struct daemon_device *d;
+	struct evemu_device *dev;
+	const char *devnode;
+	char *desc = NULL;
+	ssize_t len;
+	FILE *desc_fp;
+	long n;
+	int rc;
+
+	if (!arg || !parse_count(arg, &n)) {
+		reply_error(fd, EINVAL, "usage: CREATE <lines>");
+		return;
+	}
+
+	len = read_lines(fp, n, &desc);
+	if (len < 0)
+		return;
+
+	dev = evemu_new(NULL);
+	desc_fp = len > 0 ? fmemopen(desc, len, "r") : NULL;
+	rc = dev && desc_fp ? evemu_read(dev, desc_fp) : -1;
+	if (desc_fp)
+		fclose(desc_fp);
+	free(desc);
+	if (rc <= 0) {
+		reply_error(fd, EINVAL, "invalid device description");
+		goto error;
+	}
+
+	if (strlen(evemu_get_name(dev)) == 0) {
+		char name[64];
+		sprintf(name, "evemu-%d", getpid());
+		evemu_set_name(dev, name);
+	}
+
+	rc = evemu_create_managed(dev);
+	if (rc < 0) {
+		reply_error(fd, -rc, NULL);
+		goto error;
+	}
+
+	devnode = evemu_get_devnode(dev);
+	if (!devnode) {
+		reply_error(fd, ENODEV, "cannot determine the device node");
+		goto error;
+	}
+
+	d = calloc(1, sizeof(*d));
+	if (!d) {
+		reply_error(fd, ENOMEM, NULL);
+		goto error;
+	}
+	d->dev = dev;
+
+	/* udev may not have created the node yet */
+	evemu_wait_devnode(dev, O_WRONLY, 5000);
+	d->fd = open(devnode, O_WRONLY | O_CLOEXEC);
+	if (d->fd < 0) {
+		reply_error(fd, errno, NULL);
+		free_device(d);
+		return;
+	}
+
+	pthread_mutex_lock(&devices_lock);
+	d->id = next_id++;
+	d->next = devices;
+	devices = d;
+	pthread_mutex_unlock(&devices_lock);
+
+	dprintf(fd, "OK %d %s\n", d->id, devnode);
+	return;
+
+error:
+	evemu_delete(dev);
+}
+
+static void cmd_play(int fd, const char *arg)
+{
+	struct daemon_device *d;
+	struct evemu_context *ctx;
+	char *id = arg ? strdupa(arg) : NULL;
+	char *path = id ? strchr(id, ' ') : NULL;
+	FILE *fp;
+	int rc;
+
+	if (!path) {
+		reply_error(fd, EINVAL, "usage: PLAY <id> <path>");
+		return;
+	}
+	*path++ = '\0';
+
+	d = get_device(id);
+	if (!d) {
+		reply_error(fd, ENODEV, "no such device");
+		return;
+	}
+
+	fp = fopen(path, "r");
+	if (!fp) {
+		reply_error(fd, errno, NULL);
+		put_device(d);
+		return;
+	}
+
+	ctx = evemu_context_new();
+	rc = ctx ? evemu_context_play(ctx, fp, d->fd) : -ENOMEM;
+	evemu_context_delete(ctx);
+	fclose(fp);
+	put_device(d);
+
+	if (rc < 0)
+		reply_error(fd, -rc, NULL);
+	else
+		dprintf(fd, "OK\n");
+}
+
+static int parse_value(const char *arg, long *value)
+{
+	char *end;
+
+	*value = strtol(arg, &end, 0);
+	return *arg != '\0' && *end == '\0';
+}
+
+/* Parses a line of SEND. E: lines are read by libevemu as in a
+ * recording, the other lines are <type> <code> <value> */
+static int parse_event_line(const char *line, struct input_event *ev)
+{
+	char type[64], code[64];
+	long t, c;
+	int value;
+
+	if (strncmp(line, "E:", 2) == 0) {
+		FILE *fp = fmemopen((void *)line, strlen(line), "r");
+		int rc;
+
+		if (!fp)
+			return -1;
+		rc = evemu_read_event(fp, ev);
+		fclose(fp);
+		return rc > 0 ? 0 : -1;
+	}
+
+	if (sscanf(line, "%63s %63s %d", type, code, &value) != 3)
+		return -1;
+
+	t = libevdev_event_type_from_name(type);
+	if (t == -1 && !parse_value(type, &t))
+		return -1;
+	c = libevdev_event_code_from_name(t, code);
+	if (c == -1 && !parse_value(code, &c))
+		return -1;
+
+	return evemu_create_event(ev, t, c, value);
+}
+
+static void cmd_send(int fd, FILE *fp, const char *arg)
+{
+	struct daemon_device *d;
+	struct input_event *evs;
+	char *id = arg ? strdupa(arg) : NULL;
+	char *count = id ? strchr(id, ' ') : NULL;
+	char *line = NULL;
+	size_t size = 0;
+	long i, n;
+	int invalid = 0;
+	ssize_t rc;
+
+	if (!count || (*count++ = '\0', !parse_count(count, &n))) {
+		reply_error(fd, EINVAL, "usage: SEND <id> <lines>");
+		return;
+	}
+
+	evs = calloc(n ? n : 1, sizeof(*evs));
+	if (!evs) {
+		reply_error(fd, ENOMEM, NULL);
+		return;
+	}
+
+	/* always consume the payload so the stream stays in sync */
+	for (i = 0; i < n; i++) {
+		if (getline(&line, &size, fp) < 0) {
+			free(line);
+			free(evs);
+			return;
+		}
+		if (parse_event_line(line, &evs[i]))
+			invalid = 1;
+	}
+	free(line);
+
+	if (invalid) {
+		reply_error(fd, EINVAL, "invalid event");
+		goto out;
+	}
+
+	d = get_device(id);
+	if (!d) {
+		reply_error(fd, ENODEV, "no such device");
+		goto out;
+	}
+
+	rc = n ? write(d->fd, evs, n * sizeof(*evs)) : 0;
+	put_device(d);
+	if (rc < 0)
+		reply_error(fd, errno, NULL);
+	else
+		dprintf(fd, "OK %ld\n", (long)(rc / sizeof(*evs)));
+out:
+	free(evs);
+}
+
+static void cmd_destroy(int fd, const char *arg)
+{
+	struct daemon_device **p, *d = NULL;
+	char *end;
+	long id = arg ? strtol(arg, &end, 10) : 0;
+	int busy = 0;
+
+	if (!arg || *arg == '\0' || *end != '\0') {
+		reply_error(fd, EINVAL, "usage: DESTROY <id>");
+		return;
+	}
+
+	pthread_mutex_lock(&devices_lock);
+	for (p = &devices; *p; p = &(*p)->next) {
+		if ((*p)->id == id) {
+			busy = (*p)->busy;
+			if (!busy) {
+				d = *p;
+				*p = d->next;
+			}
+			break;
+		}
+	}
+	pthread_mutex_unlock(&devices_lock);
+
+	if (busy)
+		reply_error(fd, EBUSY, NULL);
+	else if (!d)
+		reply_error(fd, ENODEV, "no such device");
+	else {
+		free_device(d);
+		dprintf(fd, "OK\n");
+	}
+}
+
+static void cmd_list(int fd)
+{
+	struct daemon_device *d;
+	int n = 0;
+
+	pthread_mutex_lock(&devices_lock);
+	for (d = devices; d; d = d->next)
+		n++;
+	dprintf(fd, "OK %d\n", n);
+	for (d = devices; d; d = d->next)
+		dprintf(fd, "%d %s %s\n", d->id, evemu_get_devnode(d->dev),
+			evemu_get_name(d->dev));
+	pthread_mutex_unlock(&devices_lock);
+}
+
+static void *serve_client(void *data)
+{
+	int fd = (int)(long)data;
+	FILE *fp = fdopen(dup(fd), "r");
+	char *line = NULL;
+	size_t size = 0;
+	ssize_t len;
+
+	while (fp && (len = getline(&line, &size, fp)) > 0) {
+		char *arg;
+
+		if (line[len - 1] == '\n')
+			line[len - 1] = '\0';
+		arg = strchr(line, ' ');
+		if (arg)
+			*arg++ = '\0';
+
+		if (strcmp(line, "CREATE") == 0)
+			cmd_create(fd, fp, arg);
+		else if (strcmp(line, "PLAY") == 0)
+			cmd_play(fd, arg);
+		else if (strcmp(line, "SEND") == 0)
+			cmd_send(fd, fp, arg);
+		else if (strcmp(line, "DESTROY") == 0)
+			cmd_destroy(fd, arg);
+		else if (strcmp(line, "LIST") == 0)
+			cmd_list(fd);
+		else
+			reply_error(fd, EINVAL, "unknown command");
+	}
+
+	free(line);
+	if (fp)
+		fclose(fp);
+	close(fd);
+	return NULL;
+}
+
+static int open_socket(const char *path)
+{
+	struct sockaddr_un addr;
+	int fd;
+
+	if (strlen(path) >= sizeof(addr.sun_path)) {
+		fprintf(stderr, "error: socket path too long\n");
+		return -1;
+	}
+
+	memset(&addr, 0, sizeof(addr));
+	addr.sun_family = AF_UNIX;
+	strcpy(addr.sun_path, path);
+
+	fd = socket(AF_UNIX, SOCK_STREAM | SOCK_CLOEXEC, 0);
+	if (fd < 0)
+		goto error;
+
+	/* replace a stale socket, but not a running daemon */
+	if (connect(fd, (struct sockaddr *)&addr, sizeof(addr)) == 0) {
+		fprintf(stderr, "error: %s is in use\n", path);
+		close(fd);
+		return -1;
+	}
+	unlink(path);
+
+	if (bind(fd, (struct sockaddr *)&addr, sizeof(addr)) < 0 ||
+	    listen(fd, 16) < 0)
+		goto error;
+
+	return fd;
+error:
+	fprintf(stderr, "error: cannot listen on %s (%m)\n", path);
+	if (fd >= 0)
+		close(fd);
+	return -1;
+}
+
+static void usage(void)
+{
+	fprintf(stderr, "Usage: %s [--socket=<path>]\n",
+		program_invocation_short_name);
+	fprintf(stderr, "\n");
+	fprintf(stderr, "The default socket is $XDG_RUNTIME_DIR/evemu.socket "
+		"or /run/evemu.socket\n");
+}
+
+int main(int argc, char *argv[])
+{
+	const struct option opts[] = {
+		{ "socket", required_argument, NULL, 's' },
+		{ "help", no_argument, NULL, 'h' },
+		{ NULL, 0, NULL, 0 },
+	};
+	struct sigaction act;
+	const char *runtime_dir = getenv("XDG_RUNTIME_DIR");
+	char *path = NULL;
+	pthread_attr_t attr;
+	int fd;
+
+	while (1) {
+		int c = getopt_long(argc, argv, "", opts, NULL);
+		if (c == -1)
+			break;
+
+		switch (c) {
+		case 's':
+			free(path);
+			path = strdup(optarg);
+			break;
+		default:
+			usage();
+			return c == 'h' ? 0 : 1;
+		}
+	}
+
+	if (optind < argc) {
+		usage();
+		return 1;
+	}
+
+	if (!path && (!runtime_dir ||
+		      asprintf(&path, "%s/evemu.socket", runtime_dir) < 0))
+		path = strdup("/run/evemu.socket");
+
+	fd = open_socket(path);
+	if (fd < 0) {
+		free(path);
+		return 1;
+	}
+
+	memset(&act, 0, sizeof(act));
+	act.sa_handler = handler;
+	sigaction(SIGINT, &act, NULL);
+	sigaction(SIGTERM, &act, NULL);
+	signal(SIGPIPE, SIG_IGN);
+
+	pthread_attr_init(&attr);
+	pthread_attr_setdetachstate(&attr, PTHREAD_CREATE_DETACHED);
+
+	fprintf(stdout, "listening on %s\n", path);
+	fflush(stdout);
+
+	while (!stop) {
+		pthread_t thread;
+		int cfd = accept4(fd, NULL, NULL, SOCK_CLOEXEC);
+
+		if (cfd < 0) {
+			if (errno != EINTR && errno != ECONNABORTED)
+				fprintf(stderr, "error: accept failed (%m)\n");
+			continue;
+		}
+
+		if (pthread_create(&thread, &attr, serve_client,
+				   (void *)(long)cfd) != 0) {
+			reply_error(cfd, EAGAIN, NULL);
+			close(cfd);
+		}
+	}
+
+	close(fd);
+	unlink(path);
+	free(path);
+
+	/* devices still in use by a client thread are not freed under it,
+	 * the kernel destroys them when their uinput fd is closed on exit */
+	pthread_mutex_lock(&devices_lock);
+	while (devices) {
+		struct daemon_device *d = devices;
+		devices = d->next;
+		if (!d->busy)
+			free_device(d);
+	}
+	pthread_mutex_unlock(&devices_lock);
+
+	return 0;
+}
@@ -21,22 +21,46 @@
 #define _GNU_SOURCE
 
 #include "evemu.h"
+#include <errno.h>
 #include <getopt.h>
 #include <limits.h>
+#include <poll.h>
 #include <stdio.h>
 #include <fcntl.h>
 #include <string.h>
+#include <time.h>
 #include <unistd.h>
 #include <stdlib.h>
 #include <linux/input.h>
 #include <libevdev/libevdev.h>
 
+#define BATCH_SIZE 64
+#define LINE_MAX_LEN 4096
+
 static struct option opts[] = {
 	{ "type", required_argument, 0, 't'},
 	{ "code", required_argument, 0, 'c'},
 	{ "value", required_argument, 0, 'v'},
 	{ "sync", no_argument, 0, 's'},
-	{ "device", required_argument, 0, 'd'}
+	{ "device", required_argument, 0, 'd'},
+	{ "stdin", no_argument, 0, 'i'},
+	{ "timed", no_argument, 0, 'T'},
+	{ "delay", required_argument, 0, 'D'},
+	{ 0, 0, 0, 0 }
+};
+
+/* events queued for a single write() */
+struct batch {
+	int fd;
+	size_t count;
+	struct input_event evs[BATCH_SIZE];
+};
+
+struct line_reader {
+	int fd;
+	int eof;
+	size_t start, end;
+	char buf[LINE_MAX_LEN + 1];
 };
 
 static int parse_arg(const char *arg, long int *value)
@@ -67,9 +91,206 @@ static int parse_code(long int type, const char *arg, long int *value)
 	return parse_arg(arg, value);
 }
 
+static int flush_batch(struct batch *b)
+{
+	size_t len = b->count * sizeof(b->evs[0]);
+	ssize_t rc;
+
+	if (b->count == 0)
+		return 0;
+
+	do {
+		rc = write(b->fd, b->evs, len);
+	} while (rc < 0 && errno == EINTR);
+	b->count = 0;
+
+	return (rc < 0 || (size_t)rc < len) ? -1 : 0;
+}
+
+static int queue_event(struct batch *b, long type, long code, long value)
+{
+	if (evemu_create_event(&b->evs[b->count], type, code, value))
+		return -1;
+	if (++b->count == BATCH_SIZE)
+		return flush_batch(b);
+	return 0;
+}
+
+/*
+ * Returns the next line without its newline, NULL at the end of the input
+ * or on error. The pending events are flushed before blocking on the
+ * input, so interactive input is not held back by the batching.
+ */
+static char *read_line(struct line_reader *r, struct batch *b)
+{
+	while (1) {
+		char *nl = memchr(r->buf + r->start, '\n', r->end - r->start);
+		struct pollfd pfd = { r->fd, POLLIN, 0 };
+		ssize_t rc;
+
+		if (nl) {
+			char *line = r->buf + r->start;
+			*nl = '\0';
+			r->start = nl - r->buf + 1;
+			return line;
+		}
+
+		if (r->eof) {
+			char *line = r->buf + r->start;
+
+			if (r->start == r->end)
+				return NULL;
+			/* last line without a newline */
+			r->buf[r->end] = '\0';
+			r->start = r->end;
+			return line;
+		}
+
+		memmove(r->buf, r->buf + r->start, r->end - r->start);
+		r->end -= r->start;
+		r->start = 0;
+		if (r->end == LINE_MAX_LEN) {
+			fprintf(stderr, "error: line too long\n");
+			return NULL;
+		}
+
+		if (poll(&pfd, 1, 0) == 0 && flush_batch(b))
+			return NULL;
+
+		do {
+			rc = read(r->fd, r->buf + r->end, LINE_MAX_LEN - r->end);
+		} while (rc < 0 && errno == EINTR);
+		if (rc < 0)
+			return NULL;
+		if (rc == 0)
+			r->eof = 1;
+		r->end += rc;
+	}
+}
+
+static void sleep_until(const struct timespec *ts)
+{
+	while (clock_nanosleep(CLOCK_MONOTONIC, TIMER_ABSTIME, ts, NULL) == EINTR)
+		;
+}
+
+static void add_us(struct timespec *ts, long us)
+{
+	ts->tv_sec += us / 1000000;
+	ts->tv_nsec += (us % 1000000) * 1000;
+	if (ts->tv_nsec >= 1000000000) {
+		ts->tv_sec++;
+		ts->tv_nsec -= 1000000000;
+	}
+}
+
+/*
+ * Parses "<type> <code> <value>" or an "E:" line. Returns 1 for an event,
+ * 0 for a blank or comment line and -1 for an invalid line. usec is set
+ * to the timestamp of an E: line, or -1.
+ */
+static int parse_line(const char *line, long *type, long *code, long *value,
+		      long *usec)
+{
+	char t[64], c[64], v[64], rest;
+	unsigned long sec, us;
+	unsigned int ut, uc;
+	int val;
+
+	*usec = -1;
+	line += strspn(line, " \t");
+	if (*line == '\0' || *line == '#')
+		return 0;
+
+	if (strncmp(line, "E:", 2) == 0) {
+		if (sscanf(line, "E: %lu.%lu %x %x %d", &sec, &us, &ut, &uc,
+			   &val) != 5)
+			return -1;
+		*usec = sec * 1000000 + us;
+		*type = ut;
+		*code = uc;
+		*value = val;
+		return 1;
+	}
+
+	if (sscanf(line, "%63s %63s %63s %c", t, c, v, &rest) != 3)
+		return -1;
+	if (parse_type(t, type) || parse_code(*type, c, code) ||
+	    parse_arg(v, value) || *value < INT_MIN || *value > INT_MAX)
+		return -1;
+	return 1;
+}
+
+static int play_from_stdin(int fd, int sync, int timed, long delay_us)
+{
+	struct batch b = { .fd = fd, .count = 0 };
+	struct line_reader r = { .fd = STDIN_FILENO };
+	struct timespec start, next;
+	long first_usec = -1;
+	int lineno = 0;
+	char *line;
+
+	clock_gettime(CLOCK_MONOTONIC, &start);
+	next = start;
+
+	while ((line = read_line(&r, &b))) {
+		long type, code, value, usec;
+		int rc;
+
+		lineno++;
+		rc = parse_line(line, &type, &code, &value, &usec);
+		if (rc == 0)
+			continue;
+		if (rc < 0) {
+			fprintf(stderr, "error: line %d: invalid event '%s'\n",
+				lineno, line);
+			flush_batch(&b);
+			return -1;
+		}
+
+		if (timed && usec >= 0) {
+			struct timespec due = start;
+
+			if (first_usec < 0)
+				first_usec = usec;
+			add_us(&due, usec - first_usec);
+			if (flush_batch(&b))
+				goto error;
+			sleep_until(&due);
+		}
+
+		if (queue_event(&b, type, code, value))
+			goto error;
+		if (sync && type != EV_SYN &&
+		    queue_event(&b, EV_SYN, SYN_REPORT, 0))
+			goto error;
+
+		if (delay_us > 0 &&
+		    (sync || (type == EV_SYN && code == SYN_REPORT))) {
+			if (flush_batch(&b))
+				goto error;
+			add_us(&next, delay_us);
+			sleep_until(&next);
+		}
+	}
+
+	if (!r.eof) {
+		fprintf(stderr, "error: failed to read input\n");
+		flush_batch(&b);
+		return -1;
+	}
+
+	if (flush_batch(&b) == 0)
+		return 0;
+error:
+	fprintf(stderr, "error: could not play events (%m)\n");
+	return -1;
+}
+
 static void usage(void)
 {
 	fprintf(stderr, "Usage: %s [--sync] <device> --type <type> --code <code> --value <value>\n", program_invocation_short_name);
+	fprintf(stderr, "       %s [--sync] [--timed] [--delay=<ms>] --stdin <device>\n", program_invocation_short_name);
 }
 
 int main(int argc, char *argv[])
@@ -79,10 +300,12 @@ int main(int argc, char *argv[])
 	long int type, code, value = LONG_MAX;
 	struct input_event ev;
 	int sync = 0;
+	int from_stdin = 0, timed = 0;
+	long delay = 0;
 	const char *path = NULL;
 	const char *code_arg = NULL, *type_arg = NULL;
 
-	if (argc < 5) {
+	if (argc < 3) {
 		usage();
 		goto out;
 	}
@@ -114,23 +337,44 @@ int main(int argc, char *argv[])
 			case 's': /* sync */
 				sync = 1;
 				break;
+			case 'i': /* stdin */
+				from_stdin = 1;
+				break;
+			case 'T': /* timed */
+				timed = 1;
+				break;
+			case 'D': /* delay */
+				if (parse_arg(optarg, &delay) || delay < 0 ||
+				    delay > INT_MAX / 1000) {
+					fprintf(stderr, "error: invalid delay '%s'\n", optarg);
+					goto out;
+				}
+				break;
 			default:
 				usage();
 				goto out;
 		}
 	}
 
-	if (!type_arg || !code_arg || value == LONG_MAX) {
+	if (from_stdin) {
+		if (type_arg || code_arg || value != LONG_MAX) {
+			usage();
+			goto out;
+		}
+	} else if (!type_arg || !code_arg || value == LONG_MAX) {
 		usage();
 		goto out;
+	} else if (timed || delay) {
+		fprintf(stderr, "error: --timed and --delay require --stdin\n");
+		goto out;
 	}
 
-	if (parse_type(type_arg, &type)) {
+	if (!from_stdin && parse_type(type_arg, &type)) {
 		fprintf(stderr, "error: invalid type argument '%s'\n", type_arg);
 		goto out;
 	}
 
-	if (parse_code(type, code_arg, &code)) {
+	if (!from_stdin && parse_code(type, code_arg, &code)) {
 		fprintf(stderr, "error: invalid code argument '%s'\n", code_arg);
 		goto out;
 	}
@@ -156,6 +400,11 @@ int main(int argc, char *argv[])
 		goto out;
 	}
 
+	if (from_stdin) {
+		rc = play_from_stdin(fd, sync, timed, delay * 1000) ? -1 : 0;
+		goto out;
+	}
+
 	if (evemu_create_event(&ev, type, code, value)) {
 		fprintf(stderr, "error: failed to create event\n");
 		goto out;
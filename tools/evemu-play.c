@@ -42,13 +42,19 @@
 #define _GNU_SOURCE
 #include "evemu.h"
 #include <errno.h>
+#include <getopt.h>
+#include <limits.h>
 #include <stdio.h>
+#include <stdlib.h>
 #include <fcntl.h>
 #include <string.h>
 #include <sys/types.h>
 #include <sys/stat.h>
 #include <unistd.h>
 
+/* trace records kept in memory by --trace, 32 bytes each */
+#define TRACE_RECORDS (1024 * 1024)
+
 static int open_evemu_device(struct evemu_device *dev)
 {
 	int fd;
@@ -59,6 +65,9 @@ static int open_evemu_device(struct evemu_device *dev)
 		return -1;
 	}
 
+	/* udev may not have created the node yet */
+	evemu_wait_devnode(dev, O_RDWR, 5000);
+
 	fd = open(device_node, O_RDWR);
 	if (fd < 0) {
 		fprintf(stderr, "error %d opening %s: %s\n",
@@ -156,19 +165,110 @@ static int device(int argc, char *argv[])
 	return 0;
 }
 
-static int play_from_stdin(int fd)
+static int enable_reduction(struct evemu_filter *filter,
+			    const struct evemu_device *dev)
+{
+	int ret = evemu_filter_enable_reduction(filter, dev);
+
+	if (ret != 0)
+		fprintf(stderr, "error: could not enable reduction: %s\n",
+			strerror(-ret));
+
+	return ret;
+}
+
+static void print_reduced(const struct evemu_filter *filter, int reduce)
+{
+	if (reduce)
+		fprintf(stderr, "%lu writes saved\n",
+			evemu_filter_get_reduced_count(filter));
+}
+
+static int write_trace(const struct evemu_context *ctx, const char *path)
+{
+	FILE *fp = fopen(path, "w");
+	int ret;
+
+	if (!fp) {
+		fprintf(stderr, "error: could not open %s (%m)\n", path);
+		return -errno;
+	}
+
+	ret = evemu_context_write_trace(ctx, fp);
+	if (fclose(fp) != 0 && ret == 0)
+		ret = -errno;
+	if (ret != 0)
+		fprintf(stderr, "error: could not write %s (%s)\n", path,
+			strerror(-ret));
+
+	return ret;
+}
+
+/* Replays from start µs into the recording, or from its beginning if
+ * start is negative */
+static int replay(FILE *fp, int fd, struct evemu_filter *filter, long start,
+		  const char *trace)
+{
+	struct evemu_context *ctx;
+	int ret;
+
+	if (start < 0 && !trace)
+		return evemu_play_filtered(fp, fd, filter);
+
+	ctx = evemu_context_new();
+	if (!ctx)
+		return -ENOMEM;
+
+	evemu_context_set_filter(ctx, filter);
+	if (trace) {
+		ret = evemu_context_enable_trace(ctx, TRACE_RECORDS);
+		if (ret != 0)
+			goto out;
+	}
+
+	if (start < 0)
+		ret = evemu_context_play(ctx, fp, fd);
+	else
+		ret = evemu_context_play_from(ctx, fp, fd, start);
+	if (trace)
+		write_trace(ctx, trace);
+out:
+	evemu_context_delete(ctx);
+
+	return ret;
+}
+
+static int play_from_stdin(int fd, struct evemu_filter *filter, int reduce,
+			   long start, const char *trace)
 {
+	struct evemu_device *dev = NULL;
 	int ret;
 
-	ret = evemu_play(stdin, fd);
+	if (reduce) {
+		dev = evemu_new(NULL);
+		if (!dev || evemu_extract(dev, fd) != 0) {
+			fprintf(stderr, "error: could not describe device\n");
+			evemu_delete(dev);
+			return -1;
+		}
+		ret = enable_reduction(filter, dev);
+		evemu_delete(dev);
+		if (ret != 0)
+			return ret;
+	}
+
+	ret = replay(stdin, fd, filter, start, trace);
 
 	if (ret != 0)
 		fprintf(stderr, "error: could not replay device\n");
 
+	print_reduced(filter, reduce);
+
 	return ret;
 }
 
-static int play_from_file(int recording_fd)
+static int play_from_file(int recording_fd, struct evemu_filter *filter,
+			  int reduce, long start, const char *trace)
 {
 	FILE *fp;
 	struct evemu_device *dev = NULL;
@@ -191,6 +291,10 @@ static int play_from_file(int recording_fd)
 	if (fd < 0)
 		goto out;
 
+	/* the device keeps its state between replays, so does the filter */
+	if (reduce && enable_reduction(filter, dev) != 0)
+		goto out;
+
 	while (1) {
 		int ret;
 		char line[32];
@@ -200,11 +304,12 @@ static int play_from_file(int recording_fd)
 		fgets(line, sizeof(line), stdin);
 
 		fseek(fp, 0, SEEK_SET);
-		ret = evemu_play(fp, fd);
+		ret = replay(fp, fd, filter, start, trace);
 		if (ret != 0) {
 			fprintf(stderr, "error: could not replay device\n");
 			break;
 		}
+		print_reduced(filter, reduce);
 	}
 
 out:
@@ -214,41 +319,461 @@ out:
 	return 0;
 }
 
+/* Creates the device from the description of the file the tail reads */
+static struct evemu_device *create_followed_device(struct evemu_tail *tail)
+{
+	struct evemu_device *dev;
+	FILE *fp;
+
+	fp = fopen(evemu_tail_get_filename(tail), "r");
+	if (!fp) {
+		fprintf(stderr, "error: could not open file (%m)\n");
+		return NULL;
+	}
+
+	dev = create_device(fp);
+	if (!dev)
+		fprintf(stderr, "error: could not create device: %m\n");
+	fclose(fp);
+
+	return dev;
+}
+
+/* Replays the events appended to a recording as they land, until
+ * interrupted */
+static int play_follow(const char *path, struct evemu_filter *filter,
+		       int reduce)
+{
+	struct evemu_tail *tail;
+	struct evemu_device *dev = NULL;
+	struct input_event ev;
+	int fd = -1;
+	int ret;
+
+	tail = evemu_tail_new(path, -1);
+	if (!tail) {
+		fprintf(stderr, "error: could not follow %s (%m)\n", path);
+		return -1;
+	}
+
+	/* like tail -f, only events appended from now on are replayed */
+	while ((ret = evemu_tail_read_event(tail, &ev, 0)) > 0)
+		;
+
+	/* without a segment yet, the device is created once the first one
+	 * has an event */
+	if (ret == 0 && !evemu_tail_get_filename(tail))
+		ret = evemu_tail_read_event(tail, &ev, -1);
+	if (ret < 0)
+		goto error;
+
+	dev = create_followed_device(tail);
+	if (!dev)
+		goto out;
+	fd = open_evemu_device(dev);
+	if (fd < 0)
+		goto out;
+	if (reduce && enable_reduction(filter, dev) != 0)
+		goto out;
+
+	if (ret == 0)
+		ret = evemu_tail_read_event(tail, &ev, -1);
+	while (ret > 0) {
+		if (!filter || evemu_filter_event(filter, &ev)) {
+			if (evemu_play_one(fd, &ev) < 0) {
+				fprintf(stderr, "error: could not replay device (%m)\n");
+				goto out;
+			}
+		}
+		ret = evemu_tail_read_event(tail, &ev, -1);
+	}
+
+error:
+	if (ret == -EINVAL)
+		fprintf(stderr, "error: invalid event in %s\n",
+			evemu_tail_get_filename(tail));
+	else if (ret < 0)
+		fprintf(stderr, "error: could not follow %s (%s)\n", path,
+			strerror(-ret));
+out:
+	if (fd >= 0)
+		close(fd);
+	evemu_delete(dev);
+	evemu_tail_delete(tail);
+	return -1;
+}
+
+struct replay_recording {
+	FILE *desc, *events;
+	struct evemu_recording *rec;
+};
+
+struct replay_device {
+	struct evemu_device *dev;
+	int fd;
+};
+
+/* Opens a recording, or a description and an event file given as
+ * <description>:<events> */
+static int open_recording(const char *path, struct replay_recording *r)
+{
+	char *desc = strdup(path);
+	char *events = NULL;
+	int rc = -1;
+
+	if (!desc)
+		return -1;
+
+	if (access(desc, F_OK) != 0 && (events = strrchr(desc, ':'))) {
+		*events++ = '\0';
+		r->events = fopen(events, "r");
+		if (!r->events) {
+			fprintf(stderr, "error: could not open %s (%m)\n", events);
+			goto out;
+		}
+	}
+
+	r->desc = fopen(desc, "r");
+	if (!r->desc) {
+		fprintf(stderr, "error: could not open %s (%m)\n", desc);
+		goto out;
+	}
+
+	rc = 0;
+out:
+	free(desc);
+	return rc;
+}
+
+/* Plays each recording to ncopies devices, the n-th device is delayed
+ * by offsets[n] + n * stagger */
+static int play_recordings(char **paths, int npaths, int ncopies,
+			   const long *offsets, int noffsets, long stagger,
+			   struct evemu_filter *filter)
+{
+	struct replay_recording *recordings;
+	struct replay_device *devices;
+	struct evemu_player *player;
+	int ndevices = npaths * ncopies;
+	int i, n = 0;
+	int rc = -1;
+
+	recordings = calloc(npaths, sizeof(*recordings));
+	devices = calloc(ndevices, sizeof(*devices));
+	player = evemu_player_new();
+	if (!recordings || !devices || !player) {
+		fprintf(stderr, "error: could not allocate player\n");
+		goto out;
+	}
+
+	for (i = 0; i < ndevices; i++)
+		devices[i].fd = -1;
+
+	/* create all devices before the first event is played, each
+	 * recording is only parsed once */
+	for (i = 0; i < npaths; i++) {
+		struct replay_recording *r = &recordings[i];
+		int copy;
+
+		if (open_recording(paths[i], r) != 0)
+			goto out;
+
+		for (copy = 0; copy < ncopies; copy++, n++) {
+			struct replay_device *d = &devices[n];
+
+			fseek(r->desc, 0, SEEK_SET);
+			d->dev = create_device(r->desc);
+			if (!d->dev) {
+				fprintf(stderr, "error: could not create device: %m\n");
+				goto out;
+			}
+
+			d->fd = open_evemu_device(d->dev);
+			if (d->fd < 0)
+				goto out;
+		}
+
+		r->rec = evemu_recording_new(r->events ? r->events : r->desc,
+					     filter);
+		if (!r->rec) {
+			fprintf(stderr, "error: could not read events of %s\n",
+				paths[i]);
+			goto out;
+		}
+
+		for (copy = n - ncopies; copy < n; copy++) {
+			long offset = copy * stagger;
+
+			if (copy < noffsets)
+				offset += offsets[copy];
+
+			if (evemu_player_add(player, r->rec, devices[copy].fd,
+					     offset) != 0) {
+				fprintf(stderr, "error: could not add device to player\n");
+				goto out;
+			}
+		}
+	}
+
+	while (1) {
+		char line[32];
+
+		printf("Hit enter to start replaying");
+		fflush(stdout);
+		fgets(line, sizeof(line), stdin);
+
+		if (evemu_player_run(player) != 0) {
+			fprintf(stderr, "error: could not replay devices\n");
+			break;
+		}
+	}
+
+	rc = 0;
+out:
+	for (i = 0; devices && i < ndevices; i++) {
+		if (devices[i].fd >= 0)
+			close(devices[i].fd);
+		evemu_delete(devices[i].dev);
+	}
+	for (i = 0; recordings && i < npaths; i++) {
+		struct replay_recording *r = &recordings[i];
+
+		evemu_recording_delete(r->rec);
+		if (r->desc)
+			fclose(r->desc);
+		if (r->events)
+			fclose(r->events);
+	}
+	free(devices);
+	free(recordings);
+	evemu_player_delete(player);
+	return rc;
+}
+
+static void play_usage(const char *prgm_name)
+{
+	fprintf(stderr, "Usage: %s [--filter=<rules>] [--reduce] [--start=<ms>]\n"
+			"            [--trace=<file>] <device>|<recording>\n", prgm_name);
+	fprintf(stderr, "       %s [--filter=<rules>] [--reduce] --follow <recording>\n",
+			prgm_name);
+	fprintf(stderr, "       %s [--filter=<rules>] [--offset=<ms>] [--fanout=<n>] [--stagger=<ms>]\n"
+			"            <recording> [<recording> ...]\n", prgm_name);
+	fprintf(stderr, "\n");
+	fprintf(stderr, "If the argument is an input event node,\n"
+			"event data is read from standard input.\n");
+	fprintf(stderr, "If the argument is an evemu recording,\n"
+			"the device is created and the event data is"
+			"read from the same device.\n");
+	fprintf(stderr, "If several recordings are given, all devices are\n"
+			"created first and the events are replayed on one\n"
+			"timeline. A recording may also be given as\n"
+			"<description>:<events>.\n");
+	fprintf(stderr, "\n");
+	fprintf(stderr, "Options:\n");
+	fprintf(stderr, "    --filter=<rules>\n");
+	fprintf(stderr, "	Filter events before replaying them. May be given\n"
+			"	multiple times. See evemu-play(1) for the rule syntax.\n");
+	fprintf(stderr, "    --reduce\n");
+	fprintf(stderr, "	Do not write events the kernel would discard, e.g.\n"
+			"	repeated key states or values within the axis fuzz.\n");
+	fprintf(stderr, "    --start=<ms>\n");
+	fprintf(stderr, "	Start replaying <ms> milliseconds into the recording,\n"
+			"	after restoring the device state at that time.\n");
+	fprintf(stderr, "    --trace=<file>\n");
+	fprintf(stderr, "	Write a timeline of parsing, sleeping for and writing\n"
+			"	each event to <file> in the Chrome trace event format\n"
+			"	after each replay.\n");
+	fprintf(stderr, "    --follow\n");
+	fprintf(stderr, "	Replay the events appended to <recording> while\n"
+			"	evemu-record writes it, including the segments\n"
+			"	of --autorestart.\n");
+	fprintf(stderr, "    --offset=<ms>\n");
+	fprintf(stderr, "	Delay a device by <ms> milliseconds. The n-th\n"
+			"	offset applies to the n-th device.\n");
+	fprintf(stderr, "    --fanout=<n>\n");
+	fprintf(stderr, "	Create <n> devices for each recording and replay\n"
+			"	the recording into all of them.\n");
+	fprintf(stderr, "    --stagger=<ms>\n");
+	fprintf(stderr, "	Delay the n-th device by n * <ms> milliseconds.\n");
+}
+
+/* Parses a non-negative number of milliseconds into µs */
+static int parse_ms(const char *str, long *us)
+{
+	char *end;
+	long ms;
+
+	errno = 0;
+	ms = strtol(str, &end, 10);
+	if (*str == '\0' || *end != '\0' || ms < 0 || errno != 0 ||
+	    ms > LONG_MAX / 1000)
+		return 0;
+
+	*us = ms * 1000;
+	return 1;
+}
+
 static int play(int argc, char *argv[])
 {
 	int fd;
 	struct stat st;
-
-	if (argc != 2) {
-		fprintf(stderr, "Usage: %s <device>|<recording>\n", argv[0]);
-		fprintf(stderr, "\n");
-		fprintf(stderr, "If the argument is an input event node,\n"
-				"event data is read from standard input.\n");
-		fprintf(stderr, "If the argument is an evemu recording,\n"
-				"the device is created and the event data is"
-				"read from the same device.\n");
+	struct evemu_filter *filter = NULL;
+	struct option opts[] = {
+		{ "filter", required_argument, 0, 'f' },
+		{ "reduce", no_argument, 0, 'r' },
+		{ "offset", required_argument, 0, 'o' },
+		{ "fanout", required_argument, 0, 'n' },
+		{ "stagger", required_argument, 0, 's' },
+		{ "start", required_argument, 0, 'S' },
+		{ "trace", required_argument, 0, 'T' },
+		{ "follow", no_argument, 0, 'F' },
+		{ 0, 0, 0, 0 },
+	};
+	int reduce = 0;
+	int ncopies = 1;
+	long stagger = 0;
+	long start = -1;
+	const char *trace = NULL;
+	int follow = 0;
+	long *offsets;
+	int noffsets = 0;
+	int rc = -1;
+
+	/* there cannot be more offsets than arguments */
+	offsets = calloc(argc, sizeof(*offsets));
+	if (!offsets) {
+		fprintf(stderr, "error: could not allocate offsets\n");
 		return -1;
 	}
 
-	fd = open(argv[1], O_RDWR);
+	while (1) {
+		int c;
+		int option_index = 0;
+
+		c = getopt_long(argc, argv, "", opts, &option_index);
+		if (c == -1)
+			break;
+
+		switch (c) {
+			case 'f':
+				if (!filter && !(filter = evemu_filter_new())) {
+					fprintf(stderr, "error: could not allocate filter\n");
+					goto out;
+				}
+				if (evemu_filter_add(filter, optarg) != 0) {
+					play_usage(argv[0]);
+					goto out;
+				}
+				break;
+			case 'r':
+				reduce = 1;
+				break;
+			case 'o':
+				if (!parse_ms(optarg, &offsets[noffsets++])) {
+					play_usage(argv[0]);
+					goto out;
+				}
+				break;
+			case 's':
+				if (!parse_ms(optarg, &stagger)) {
+					play_usage(argv[0]);
+					goto out;
+				}
+				break;
+			case 'S':
+				if (!parse_ms(optarg, &start)) {
+					play_usage(argv[0]);
+					goto out;
+				}
+				break;
+			case 'T':
+				trace = optarg;
+				break;
+			case 'F':
+				follow = 1;
+				break;
+			case 'n': {
+				char *end;
+				long n;
+
+				errno = 0;
+				n = strtol(optarg, &end, 10);
+				if (*optarg == '\0' || *end != '\0' ||
+				    errno != 0 || n < 1 || n > INT_MAX / argc) {
+					play_usage(argv[0]);
+					goto out;
+				}
+				ncopies = n;
+				break;
+			}
+			default:
+				play_usage(argv[0]);
+				goto out;
+		}
+	}
+
+	if (argc - optind <= 1 && ncopies == 1 && (noffsets || stagger)) {
+		fprintf(stderr, "error: --offset and --stagger need several devices\n");
+		goto out;
+	}
+
+	if (follow) {
+		if (argc - optind != 1 || ncopies > 1 || start >= 0 || trace) {
+			fprintf(stderr, "error: --follow needs a single recording and no --start or --trace\n");
+			goto out;
+		}
+		if (reduce && !filter && !(filter = evemu_filter_new())) {
+			fprintf(stderr, "error: could not allocate filter\n");
+			goto out;
+		}
+		rc = play_follow(argv[optind], filter, reduce);
+		goto out;
+	}
+
+	if (argc - optind > 1 || ncopies > 1) {
+		if (reduce || start >= 0 || trace) {
+			fprintf(stderr, "error: --reduce, --start and --trace need a single device\n");
+			goto out;
+		}
+		rc = play_recordings(&argv[optind], argc - optind, ncopies,
+				     offsets, noffsets, stagger, filter);
+		goto out;
+	}
+
+	if (argc - optind != 1) {
+		play_usage(argv[0]);
+		goto out;
+	}
+
+	if (reduce && !filter && !(filter = evemu_filter_new())) {
+		fprintf(stderr, "error: could not allocate filter\n");
+		goto out;
+	}
+
+	fd = open(argv[optind], O_RDWR);
 	if (fd < 0) {
 		fprintf(stderr, "error: could not open file or device (%m)\n");
-		return -1;
+		goto out;
 	}
 
 	if (fstat(fd, &st) == -1) {
 		fprintf(stderr, "error: failed to look at file (%m)\n");
-		return -1;
+		close(fd);
+		goto out;
 	}
 
 	if (S_ISCHR(st.st_mode))
-		play_from_stdin(fd);
+		play_from_stdin(fd, filter, reduce, start, trace);
 	else
-		play_from_file(fd);
+		play_from_file(fd, filter, reduce, start, trace);
 
 
 	close(fd);
-	return 0;
+	rc = 0;
+out:
+	free(offsets);
+	evemu_filter_delete(filter);
+	return rc;
 }
 
 int main(int argc, char *argv[])
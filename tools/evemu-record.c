@@ -47,18 +47,32 @@
 #include <stdbool.h>
 #include <stdio.h>
 #include <stdlib.h>
+#include <errno.h>
 #include <fcntl.h>
 #include <string.h>
 #include <unistd.h>
+#include <pthread.h>
 #include <signal.h>
+#include <spawn.h>
 #include <time.h>
+#include <sys/wait.h>
 
 #include "find_event_devices.h"
 
 #define INFINITE -1
+#define FLIGHT_RECORDER_SIZE 16 /* MB */
+#define PUBLISH_SIZE 1 /* MB */
+#define STALL_MS 20
+/* trace records kept in memory by --trace, 32 bytes each */
+#define TRACE_RECORDS (1024 * 1024)
 
 static FILE *output;
 static bool autorestart = false;
+static bool rotate = false;
+static struct evemu_filter *filter = NULL;
+
+static volatile sig_atomic_t dump_requested = 0;
+static volatile sig_atomic_t stop_requested = 0;
 
 static int describe_device(FILE *output, int fd)
 {
@@ -79,6 +93,25 @@ out:
 	return ret;
 }
 
+static int enable_checkpoints(struct evemu_context *ctx, int fd,
+			      long interval)
+{
+	struct evemu_device *dev;
+	int ret = -ENOMEM;
+
+	dev = evemu_new(NULL);
+	if (!dev)
+		goto out;
+	ret = evemu_extract(dev, fd);
+	if (ret)
+		goto out;
+
+	ret = evemu_context_enable_checkpoints(ctx, dev, interval);
+out:
+	evemu_delete(dev);
+	return ret;
+}
+
 static void handler (int sig __attribute__((unused)))
 {
 	fflush(output);
@@ -87,6 +120,15 @@ static void handler (int sig __attribute__((unused)))
 		output = stdout;
 	}
 	autorestart = false;
+	rotate = false;
+}
+
+static void flight_recorder_handler(int sig)
+{
+	if (sig == SIGUSR1)
+		dump_requested = 1;
+	else
+		stop_requested = 1;
 }
 
 static inline bool safe_atoi(const char *str, int *val)
@@ -109,7 +151,16 @@ static inline bool safe_atoi(const char *str, int *val)
 
 static inline void usage()
 {
-	fprintf(stderr, "Usage: %s [--autorestart=s] <device> [output file]\n",
+	fprintf(stderr, "Usage: %s [--autorestart=s] [--rotate-size=MB] [--rotate-time=s]\n"
+			"		[--compress[=program]] [--filter=rules] [--checkpoint=s]\n"
+			"		[--latency[=ms]] [--latency-annotate] [--trace=file]\n"
+			"		<device> [output file]\n",
+		program_invocation_short_name);
+	fprintf(stderr, "       %s --flight-recorder=s [--flight-recorder-size=MB]\n"
+			"		[--trigger=event] [--filter=rules] <device> <output file>\n",
+		program_invocation_short_name);
+	fprintf(stderr, "       %s --publish=name [--publish-size=MB] [--filter=rules]\n"
+			"		<device>\n",
 		program_invocation_short_name);
 	fprintf(stderr, "Options:\n");
 	fprintf(stderr, "    --autorestart=s\n");
@@ -119,6 +170,52 @@ static inline void usage()
 			"	the recording's start.\n"
 			"	The timeout must be greater than 0.\n"
 			"	This option is only valid for evemu-record.\n");
+	fprintf(stderr, "    --rotate-size=MB\n");
+	fprintf(stderr, "	Start a new recording once the current one exceeds\n"
+			"	<MB> megabytes. Like --autorestart, this option requires\n"
+			"	an output file and suffixes it with the date and time.\n");
+	fprintf(stderr, "    --rotate-time=s\n");
+	fprintf(stderr, "	Start a new recording once the current one spans more\n"
+			"	than <s> seconds.\n");
+	fprintf(stderr, "    --compress[=program]\n");
+	fprintf(stderr, "	Compress each finished recording in the background with\n"
+			"	<program> (default: gzip), invoked as 'program file'.\n");
+	fprintf(stderr, "    --filter=rules\n");
+	fprintf(stderr, "	Only record events that pass the filter rules. May be\n"
+			"	given multiple times. See evemu-record(1) for the rule\n"
+			"	syntax. This option is only valid for evemu-record.\n");
+	fprintf(stderr, "    --checkpoint=s\n");
+	fprintf(stderr, "	Write the device state every <s> seconds, so a replay\n"
+			"	can start in the middle of the recording. This option is\n"
+			"	only valid for evemu-record.\n");
+	fprintf(stderr, "    --latency[=ms]\n");
+	fprintf(stderr, "	Measure the delivery latency of each frame and print a\n"
+			"	histogram and the frames delivered after <ms> or later\n"
+			"	(default: %d) at the end.\n", STALL_MS);
+	fprintf(stderr, "    --latency-annotate\n");
+	fprintf(stderr, "	Like --latency, and write the latency of each frame\n"
+			"	into the recording.\n");
+	fprintf(stderr, "    --trace=file\n");
+	fprintf(stderr, "	Write a timeline of reading and writing each event to\n"
+			"	<file> in the Chrome trace event format at the end.\n");
+	fprintf(stderr, "    --flight-recorder=s\n");
+	fprintf(stderr, "	Keep the last <s> seconds of events in memory and only\n"
+			"	write them when triggered by SIGUSR1 or a --trigger event.\n"
+			"	Each dump is written to the output file suffixed with the\n"
+			"	date and time. 0 keeps as many events as fit into memory.\n");
+	fprintf(stderr, "    --flight-recorder-size=MB\n");
+	fprintf(stderr, "	The memory used by the flight recorder (default: %d).\n",
+		FLIGHT_RECORDER_SIZE);
+	fprintf(stderr, "    --trigger=event[=value]\n");
+	fprintf(stderr, "	Dump the flight recorder after a frame with the given\n"
+			"	event, e.g. KEY_F12=1. May be given multiple times.\n");
+	fprintf(stderr, "    --publish=name\n");
+	fprintf(stderr, "	Publish the raw events in the shared memory segment\n"
+			"	<name>, e.g. /touchpad, instead of writing them. Other\n"
+			"	processes read the live events from there.\n");
+	fprintf(stderr, "    --publish-size=MB\n");
+	fprintf(stderr, "	The memory used for published events (default: %d).\n",
+		PUBLISH_SIZE);
 }
 
 static inline char* make_filename(const char *prefix)
@@ -142,29 +239,297 @@ static inline char* make_filename(const char *prefix)
 	return filename;
 }
 
-static bool record_device(int fd, unsigned int timeout, const char *prefix)
+static FILE *open_unique_file(const char *prefix, char **filename)
+{
+	char *base = make_filename(prefix);
+	FILE *fp;
+	int i;
+
+	if (!base)
+		return NULL;
+
+	/* several files may be started within the same second */
+	*filename = strdup(base);
+	for (i = 1; *filename && access(*filename, F_OK) == 0; i++) {
+		free(*filename);
+		if (asprintf(filename, "%s.%d", base, i) < 0)
+			*filename = NULL;
+	}
+	free(base);
+
+	if (!*filename)
+		return NULL;
+
+	fp = fopen(*filename, "w");
+	if (!fp) {
+		free(*filename);
+		*filename = NULL;
+	}
+	return fp;
+}
+
+/* Closed recordings are handed to a worker thread that syncs them to
+ * disk and compresses them, the recording itself never waits for it */
+struct segment_worker {
+	pthread_t thread;
+	pthread_mutex_t lock;
+	pthread_cond_t cond;
+	char **files;
+	size_t nfiles;
+	bool done;
+	const char *compress;
+};
+
+static struct segment_worker *worker = NULL;
+
+extern char **environ;
+
+static void compress_segment(const char *filename, const char *compress)
+{
+	posix_spawnattr_t attr;
+	sigset_t mask;
+	char *cmd = NULL;
+	char *argv[] = { "sh", "-c", NULL, "sh", (char*)filename, NULL };
+	pid_t pid;
+	int status;
+
+	if (asprintf(&cmd, "%s \"$1\"", compress) < 0)
+		return;
+	argv[2] = cmd;
+
+	/* the compressor runs in its own process group so a ^C on
+	 * evemu-record does not kill it halfway through a segment */
+	sigemptyset(&mask);
+	posix_spawnattr_init(&attr);
+	posix_spawnattr_setflags(&attr, POSIX_SPAWN_SETPGROUP |
+					POSIX_SPAWN_SETSIGMASK);
+	posix_spawnattr_setpgroup(&attr, 0);
+	posix_spawnattr_setsigmask(&attr, &mask);
+
+	if (posix_spawn(&pid, "/bin/sh", NULL, &attr, argv, environ) != 0)
+		fprintf(stderr, "error: could not run '%s'\n", compress);
+	else if (waitpid(pid, &status, 0) < 0 ||
+		 !WIFEXITED(status) || WEXITSTATUS(status) != 0)
+		fprintf(stderr, "error: '%s' failed on %s\n", compress, filename);
+
+	posix_spawnattr_destroy(&attr);
+	free(cmd);
+}
+
+static void *segment_worker_run(void *data)
+{
+	struct segment_worker *w = data;
+
+	pthread_mutex_lock(&w->lock);
+	while (w->nfiles > 0 || !w->done) {
+		char *filename;
+		int fd;
+
+		if (w->nfiles == 0) {
+			pthread_cond_wait(&w->cond, &w->lock);
+			continue;
+		}
+
+		filename = w->files[0];
+		memmove(w->files, w->files + 1,
+			--w->nfiles * sizeof(*w->files));
+		pthread_mutex_unlock(&w->lock);
+
+		fd = open(filename, O_RDONLY);
+		if (fd >= 0) {
+			fsync(fd);
+			close(fd);
+		}
+		if (w->compress)
+			compress_segment(filename, w->compress);
+		free(filename);
+
+		pthread_mutex_lock(&w->lock);
+	}
+	pthread_mutex_unlock(&w->lock);
+
+	return NULL;
+}
+
+static bool start_segment_worker(const char *compress)
+{
+	sigset_t mask, old;
+	int rc;
+
+	worker = calloc(1, sizeof(*worker));
+	if (!worker)
+		return false;
+
+	pthread_mutex_init(&worker->lock, NULL);
+	pthread_cond_init(&worker->cond, NULL);
+	worker->compress = compress;
+
+	/* signals must interrupt the recording, not the worker */
+	sigemptyset(&mask);
+	sigaddset(&mask, SIGINT);
+	sigaddset(&mask, SIGTERM);
+	sigaddset(&mask, SIGUSR1);
+	pthread_sigmask(SIG_BLOCK, &mask, &old);
+	rc = pthread_create(&worker->thread, NULL, segment_worker_run, worker);
+	pthread_sigmask(SIG_SETMASK, &old, NULL);
+
+	if (rc != 0) {
+		free(worker);
+		worker = NULL;
+		return false;
+	}
+
+	return true;
+}
+
+/* takes ownership of filename */
+static void queue_segment(char *filename)
+{
+	char **files;
+
+	if (!worker) {
+		free(filename);
+		return;
+	}
+
+	pthread_mutex_lock(&worker->lock);
+	files = realloc(worker->files,
+			(worker->nfiles + 1) * sizeof(*files));
+	if (files) {
+		worker->files = files;
+		worker->files[worker->nfiles++] = filename;
+		pthread_cond_signal(&worker->cond);
+	} else {
+		fprintf(stderr, "error: could not queue %s\n", filename);
+		free(filename);
+	}
+	pthread_mutex_unlock(&worker->lock);
+}
+
+/* waits for all queued segments to be finished */
+static void stop_segment_worker(void)
+{
+	if (!worker)
+		return;
+
+	pthread_mutex_lock(&worker->lock);
+	worker->done = true;
+	pthread_cond_signal(&worker->cond);
+	pthread_mutex_unlock(&worker->lock);
+	pthread_join(worker->thread, NULL);
+
+	pthread_cond_destroy(&worker->cond);
+	pthread_mutex_destroy(&worker->lock);
+	free(worker->files);
+	free(worker);
+	worker = NULL;
+}
+
+static void print_latency(const struct evemu_context *ctx)
+{
+	struct evemu_latency l;
+	unsigned long i, n;
+
+	if (evemu_context_get_latency(ctx, &l) != 0)
+		return;
+
+	fprintf(stderr, "Delivery latency of %lu frames", l.frames);
+	if (l.frames)
+		fprintf(stderr, ", mean %.3fms, max %.3fms",
+			l.total_us / 1000.0 / l.frames, l.max_us / 1000.0);
+	fprintf(stderr, "\n");
+	if (l.skewed)
+		fprintf(stderr, "  %lu frames not measured, the device clock is not CLOCK_MONOTONIC\n",
+			l.skewed);
+
+	for (i = 0; i < EVEMU_LATENCY_BUCKETS; i++) {
+		if (!l.histogram[i])
+			continue;
+		if (i == 0)
+			fprintf(stderr, "  %16s", "< 1us");
+		else if (i == EVEMU_LATENCY_BUCKETS - 1)
+			fprintf(stderr, "  >= %11luus", 1UL << (i - 1));
+		else
+			fprintf(stderr, "  %7lu-%6luus", 1UL << (i - 1), 1UL << i);
+		fprintf(stderr, ": %lu\n", l.histogram[i]);
+	}
+
+	if (!l.stalls)
+		return;
+	fprintf(stderr, "%lu stalls", l.stalls);
+	n = l.stalls < EVEMU_LATENCY_STALLS ? l.stalls : EVEMU_LATENCY_STALLS;
+	if (n < l.stalls)
+		fprintf(stderr, ", the last %lu", n);
+	fprintf(stderr, ":\n");
+	for (i = 0; i < n; i++)
+		fprintf(stderr, "  at %ld.%06lds: %.3fms\n",
+			l.stall[i].time / 1000000, l.stall[i].time % 1000000,
+			l.stall[i].latency_us / 1000.0);
+}
+
+static void write_trace(const struct evemu_context *ctx, const char *path)
 {
+	FILE *fp = fopen(path, "w");
+	int ret;
+
+	if (!fp) {
+		fprintf(stderr, "error: could not open %s (%m)\n", path);
+		return;
+	}
+
+	ret = evemu_context_write_trace(ctx, fp);
+	if (fclose(fp) != 0 && ret == 0)
+		ret = -errno;
+	if (ret != 0)
+		fprintf(stderr, "error: could not write %s (%s)\n", path,
+			strerror(-ret));
+}
+
+static bool record_device(int fd, unsigned int timeout, const char *prefix,
+			  size_t rotate_bytes, long rotate_us, long checkpoint_us,
+			  int stall_ms, bool annotate, const char *trace)
+{
+	struct evemu_context *ctx;
 	char *filename = NULL;
 	bool rc = false;
+	bool split = autorestart || rotate;
 	long ftell_start = 0 , ftell_end = 1;
 
-	assert(!autorestart || prefix != NULL);
+	assert(!split || prefix != NULL);
+
+	ctx = evemu_context_new();
+	if (!ctx) {
+		fprintf(stderr, "error: could not allocate context\n");
+		return false;
+	}
+	evemu_context_set_filter(ctx, filter);
+	evemu_context_set_record_limits(ctx, rotate_bytes, rotate_us);
+	if (checkpoint_us && enable_checkpoints(ctx, fd, checkpoint_us) != 0) {
+		fprintf(stderr, "error: could not enable checkpoints\n");
+		goto out;
+	}
+	if (stall_ms &&
+	    evemu_context_enable_latency(ctx, stall_ms * 1000L, annotate) != 0) {
+		fprintf(stderr, "error: could not enable latency profiling\n");
+		goto out;
+	}
+	if (trace && evemu_context_enable_trace(ctx, TRACE_RECORDS) != 0) {
+		fprintf(stderr, "error: could not enable tracing\n");
+		goto out;
+	}
 
 	do {
-		free(filename);
+		int ret;
 
 		if (prefix == NULL) {
 			output = stdout;
 		} else {
-			if (autorestart)
-				filename = make_filename(prefix);
-			else
+			if (split) {
+				output = open_unique_file(prefix, &filename);
+			} else {
 				filename = strdup(prefix);
-			if (filename == NULL) {
-				fprintf(stderr, "error: failed to init the filename\n");
-				goto out;
+				output = filename ? fopen(filename, "w") : NULL;
 			}
-			output = fopen(filename, "w");
 			if (!output) {
 				fprintf(stderr, "error: could not open output file (%m)");
 				goto out;
@@ -179,13 +544,16 @@ static bool record_device(int fd, unsigned int timeout, const char *prefix)
 		fprintf(output,  "################################\n");
 		fprintf(output,  "#      Waiting for events      #\n");
 		fprintf(output,  "################################\n");
-		if (autorestart) {
+		if (autorestart)
 			fprintf(output, "# Autorestart timeout: %d\n", timeout);
+		if (split)
 			ftell_start = ftell(output);
-		}
 
-		if (evemu_record(output, fd, timeout)) {
+		ret = evemu_context_record(ctx, output, fd, timeout);
+		if (ret < 0) {
 			fprintf(stderr, "error: could not record device\n");
+		} else if (ret > 0) {
+			fprintf(output, "# Closing after reaching the rotation limit\n");
 		} else if (autorestart) {
 			ftell_end = ftell(output);
 			fprintf(output, "# Closing after %ds inactivity\n",
@@ -197,15 +565,154 @@ static bool record_device(int fd, unsigned int timeout, const char *prefix)
 			fclose(output);
 			output = stdout;
 
-			if (autorestart && ftell_start == ftell_end)
+			if (autorestart && ftell_start == ftell_end) {
 				unlink(filename);
+				free(filename);
+				filename = NULL;
+			}
 		}
-	} while (autorestart);
 
+		/* the signal handler may have closed the file already */
+		if (filename) {
+			queue_segment(filename);
+			filename = NULL;
+		}
+	} while (autorestart || rotate);
+
+	print_latency(ctx);
+	if (trace)
+		write_trace(ctx, trace);
 	rc = true;
 
 out:
+	if (output && output != stdout) {
+		fclose(output);
+		output = stdout;
+	}
 	free(filename);
+	evemu_context_delete(ctx);
+	return rc;
+}
+
+static bool dump_flight_recorder(int fd, struct evemu_context *ctx,
+				 struct evemu_ring *ring, const char *prefix,
+				 const char *reason)
+{
+	char *filename = NULL;
+	FILE *fp;
+	int n;
+
+	fp = open_unique_file(prefix, &filename);
+	if (!fp) {
+		fprintf(stderr, "error: could not open output file (%m)\n");
+		return false;
+	}
+
+	if (describe_device(fp, fd)) {
+		fprintf(stderr, "error: could not describe device\n");
+		fclose(fp);
+		free(filename);
+		return false;
+	}
+
+	fprintf(fp, "################################\n");
+	fprintf(fp, "#   Flight recorder: %-9s #\n", reason);
+	fprintf(fp, "################################\n");
+	n = evemu_context_write_ring(ctx, ring, fp);
+	fclose(fp);
+
+	if (n < 0)
+		fprintf(stderr, "error: could not write %s (%s)\n",
+			filename, strerror(-n));
+	else
+		fprintf(stderr, "%s: %d events\n", filename, n);
+
+	queue_segment(filename);
+	return n >= 0;
+}
+
+static bool record_flight_recorder(int fd, int duration, int size,
+				   const char **triggers, int ntriggers,
+				   const char *prefix)
+{
+	struct evemu_context *ctx = NULL;
+	struct evemu_ring *ring = NULL;
+	bool rc = false;
+	int i;
+
+	ctx = evemu_context_new();
+	ring = evemu_ring_new((size_t)size * 1024 * 1024, duration * 1000000L);
+	if (!ctx || !ring) {
+		fprintf(stderr, "error: could not allocate flight recorder\n");
+		goto out;
+	}
+	evemu_context_set_filter(ctx, filter);
+
+	for (i = 0; i < ntriggers; i++) {
+		if (evemu_ring_add_trigger(ring, triggers[i])) {
+			fprintf(stderr, "error: invalid trigger '%s'\n",
+				triggers[i]);
+			goto out;
+		}
+	}
+
+	while (!stop_requested) {
+		/* wake up regularly, a signal may arrive just before we
+		 * start waiting */
+		int ret = evemu_context_record_ring(ctx, ring, fd, 1000);
+
+		if (ret == 1)
+			dump_flight_recorder(fd, ctx, ring, prefix, "trigger");
+		else if (ret < 0 && ret != -EINTR) {
+			fprintf(stderr, "error: could not record device (%s)\n",
+				strerror(-ret));
+			goto out;
+		}
+
+		if (dump_requested) {
+			dump_requested = 0;
+			dump_flight_recorder(fd, ctx, ring, prefix, "signal");
+		}
+	}
+
+	rc = true;
+out:
+	evemu_ring_delete(ring);
+	evemu_context_delete(ctx);
+	return rc;
+}
+
+static bool record_shm(int fd, const char *name, int size)
+{
+	struct evemu_context *ctx = NULL;
+	struct evemu_shm *shm = NULL;
+	bool rc = false;
+
+	ctx = evemu_context_new();
+	shm = evemu_shm_new(name, (size_t)size * 1024 * 1024);
+	if (!ctx || !shm) {
+		fprintf(stderr, "error: could not create %s (%m)\n", name);
+		goto out;
+	}
+	evemu_context_set_filter(ctx, filter);
+	fprintf(stderr, "%s: %zu events\n", name, evemu_shm_get_capacity(shm));
+
+	while (!stop_requested) {
+		/* wake up regularly, a signal may arrive just before we
+		 * start waiting */
+		int ret = evemu_context_record_shm(ctx, shm, fd, 1000);
+
+		if (ret < 0 && ret != -EINTR) {
+			fprintf(stderr, "error: could not record device (%s)\n",
+				strerror(-ret));
+			goto out;
+		}
+	}
+
+	rc = true;
+out:
+	evemu_shm_delete(shm);
+	evemu_context_delete(ctx);
 	return rc;
 }
 
@@ -229,6 +736,19 @@ enum mode {
 
 enum options {
 	OPT_AUTORESTART,
+	OPT_FILTER,
+	OPT_FLIGHT_RECORDER,
+	OPT_FLIGHT_RECORDER_SIZE,
+	OPT_TRIGGER,
+	OPT_ROTATE_SIZE,
+	OPT_ROTATE_TIME,
+	OPT_COMPRESS,
+	OPT_CHECKPOINT,
+	OPT_PUBLISH,
+	OPT_PUBLISH_SIZE,
+	OPT_LATENCY,
+	OPT_LATENCY_ANNOTATE,
+	OPT_TRACE,
 };
 
 int main(int argc, char *argv[])
@@ -241,9 +761,35 @@ int main(int argc, char *argv[])
 	int timeout = INFINITE;
 	struct option opts[] = {
 		{ "autorestart", required_argument, 0, OPT_AUTORESTART },
+		{ "filter", required_argument, 0, OPT_FILTER },
+		{ "flight-recorder", required_argument, 0, OPT_FLIGHT_RECORDER },
+		{ "flight-recorder-size", required_argument, 0, OPT_FLIGHT_RECORDER_SIZE },
+		{ "trigger", required_argument, 0, OPT_TRIGGER },
+		{ "rotate-size", required_argument, 0, OPT_ROTATE_SIZE },
+		{ "rotate-time", required_argument, 0, OPT_ROTATE_TIME },
+		{ "compress", optional_argument, 0, OPT_COMPRESS },
+		{ "checkpoint", required_argument, 0, OPT_CHECKPOINT },
+		{ "publish", required_argument, 0, OPT_PUBLISH },
+		{ "publish-size", required_argument, 0, OPT_PUBLISH_SIZE },
+		{ "latency", optional_argument, 0, OPT_LATENCY },
+		{ "latency-annotate", no_argument, 0, OPT_LATENCY_ANNOTATE },
+		{ "trace", required_argument, 0, OPT_TRACE },
 		{ 0, 0, 0, 0},
 	};
 	const char *prefix = NULL;
+	int flight_recorder = -1; /* seconds */
+	int flight_recorder_size = FLIGHT_RECORDER_SIZE;
+	const char **triggers = NULL;
+	int ntriggers = 0;
+	int rotate_size = 0; /* MB */
+	int rotate_time = 0; /* s */
+	const char *compress = NULL;
+	int checkpoint = 0; /* s */
+	const char *publish = NULL;
+	int publish_size = PUBLISH_SIZE;
+	int stall_ms = 0; /* 0 if latency profiling is off */
+	bool annotate = false;
+	const char *trace = NULL;
 	int rc = 1;
 
 	output = stdout;
@@ -271,12 +817,119 @@ int main(int argc, char *argv[])
 				timeout *= 1000; /* sec to ms */
 				autorestart = true;
 				break;
+			case OPT_FILTER:
+				if (!filter && !(filter = evemu_filter_new())) {
+					fprintf(stderr, "error: could not allocate filter\n");
+					goto out;
+				}
+				if (evemu_filter_add(filter, optarg) != 0) {
+					usage();
+					goto out;
+				}
+				break;
+			case OPT_FLIGHT_RECORDER:
+				if (!safe_atoi(optarg, &flight_recorder) ||
+				    flight_recorder < 0) {
+					usage();
+					goto out;
+				}
+				break;
+			case OPT_FLIGHT_RECORDER_SIZE:
+				if (!safe_atoi(optarg, &flight_recorder_size) ||
+				    flight_recorder_size <= 0) {
+					usage();
+					goto out;
+				}
+				break;
+			case OPT_TRIGGER:
+				if (!triggers &&
+				    !(triggers = calloc(argc, sizeof(*triggers)))) {
+					fprintf(stderr, "error: could not allocate triggers\n");
+					goto out;
+				}
+				triggers[ntriggers++] = optarg;
+				break;
+			case OPT_ROTATE_SIZE:
+				if (!safe_atoi(optarg, &rotate_size) ||
+				    rotate_size <= 0) {
+					usage();
+					goto out;
+				}
+				rotate = true;
+				break;
+			case OPT_ROTATE_TIME:
+				if (!safe_atoi(optarg, &rotate_time) ||
+				    rotate_time <= 0) {
+					usage();
+					goto out;
+				}
+				rotate = true;
+				break;
+			case OPT_COMPRESS:
+				compress = optarg ? optarg : "gzip";
+				break;
+			case OPT_CHECKPOINT:
+				if (!safe_atoi(optarg, &checkpoint) ||
+				    checkpoint <= 0) {
+					usage();
+					goto out;
+				}
+				break;
+			case OPT_PUBLISH:
+				publish = optarg;
+				break;
+			case OPT_PUBLISH_SIZE:
+				if (!safe_atoi(optarg, &publish_size) ||
+				    publish_size <= 0) {
+					usage();
+					goto out;
+				}
+				break;
+			case OPT_LATENCY:
+				if (!optarg)
+					stall_ms = stall_ms ? stall_ms : STALL_MS;
+				else if (!safe_atoi(optarg, &stall_ms) ||
+					 stall_ms <= 0) {
+					usage();
+					goto out;
+				}
+				break;
+			case OPT_LATENCY_ANNOTATE:
+				annotate = true;
+				if (!stall_ms)
+					stall_ms = STALL_MS;
+				break;
+			case OPT_TRACE:
+				trace = optarg;
+				break;
 			default:
 				usage();
 				goto out;
 		}
 	}
 
+	if (flight_recorder == -1 && ntriggers > 0) {
+		fprintf(stderr, "Option --trigger requires --flight-recorder\n");
+		goto out;
+	}
+	if (flight_recorder != -1 && (autorestart || rotate)) {
+		fprintf(stderr, "Option --flight-recorder cannot be combined with --autorestart or --rotate-*\n");
+		goto out;
+	}
+	if (flight_recorder != -1 && checkpoint) {
+		fprintf(stderr, "Option --flight-recorder cannot be combined with --checkpoint\n");
+		goto out;
+	}
+	if (publish && (flight_recorder != -1 || autorestart || rotate ||
+			compress || checkpoint)) {
+		fprintf(stderr, "Option --publish cannot be combined with other recording modes\n");
+		goto out;
+	}
+	if ((stall_ms || trace) && (publish || flight_recorder != -1)) {
+		fprintf(stderr, "Options --latency and --trace cannot be combined with --publish or --flight-recorder\n");
+		goto out;
+	}
+
 	device = (optind >= argc) ? find_event_devices() : strdup(argv[optind++]);
 
 	if (device == NULL) {
@@ -306,7 +959,19 @@ int main(int argc, char *argv[])
 			fprintf(stderr, "Option --autoresume requires an output file\n");
 			goto out;
 		}
+		if (flight_recorder != -1) {
+			fprintf(stderr, "Option --flight-recorder requires an output file\n");
+			goto out;
+		}
+		if (rotate || compress) {
+			fprintf(stderr, "Options --rotate-* and --compress require an output file\n");
+			goto out;
+		}
 	} else {
+		if (publish) {
+			fprintf(stderr, "Option --publish does not take an output file\n");
+			goto out;
+		}
 		prefix = argv[optind++];
 	}
 
@@ -318,7 +983,41 @@ int main(int argc, char *argv[])
 		if (!test_grab_device(fd))
 			goto out;
 
-		record_device(fd, timeout,  prefix);
+		if ((compress || rotate || autorestart) &&
+		    !start_segment_worker(compress)) {
+			fprintf(stderr, "error: could not start the compression thread\n");
+			goto out;
+		}
+
+		if (publish) {
+			act.sa_handler = &flight_recorder_handler;
+			if (sigaction(SIGTERM, &act, NULL) < 0 ||
+			    sigaction(SIGINT, &act, NULL) < 0) {
+				fprintf(stderr, "Could not attach signal handlers (%m)\n");
+				goto out;
+			}
+			if (!record_shm(fd, publish, publish_size))
+				goto out;
+		} else if (flight_recorder != -1) {
+			act.sa_handler = &flight_recorder_handler;
+			if (sigaction(SIGTERM, &act, NULL) < 0 ||
+			    sigaction(SIGINT, &act, NULL) < 0 ||
+			    sigaction(SIGUSR1, &act, NULL) < 0) {
+				fprintf(stderr, "Could not attach signal handlers (%m)\n");
+				goto out;
+			}
+			if (!record_flight_recorder(fd, flight_recorder,
+						    flight_recorder_size,
+						    triggers, ntriggers,
+						    prefix))
+				goto out;
+		} else {
+			record_device(fd, timeout,  prefix,
+				      (size_t)rotate_size * 1024 * 1024,
+				      rotate_time * 1000000L,
+				      checkpoint * 1000000L,
+				      stall_ms, annotate, trace);
+		}
 
 	} else if (mode == EVEMU_DESCRIBE) {
 		if (prefix) {
@@ -337,6 +1036,9 @@ int main(int argc, char *argv[])
 
 	rc = 0;
 out:
+	stop_segment_worker();
+	evemu_filter_delete(filter);
+	free(triggers);
 	free(device);
 	close(fd);
 	if (output && output != stdout) {
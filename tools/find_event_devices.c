@@ -23,61 +23,52 @@
  ****************************************************************************/
 
 #define _GNU_SOURCE
-#include <linux/input.h>
-#include <dirent.h>
 #include <string.h>
 #include <stdio.h>
 #include <stdlib.h>
-#include <sys/types.h>
-#include <sys/stat.h>
-#include <fcntl.h>
-#include <unistd.h>
 
+#include "evemu.h"
 
 #define DEV_INPUT_EVENT "/dev/input"
 #define EVENT_DEV_NAME "event"
 
-static int is_event_device(const struct dirent *dir) {
-	return strncmp(EVENT_DEV_NAME, dir->d_name, 5) == 0;
-}
-
 char* find_event_devices(void)
 {
-	struct dirent **namelist;
-	int i, ndev, devnum;
+	struct evemu_device_list *list;
+	size_t i, ndev;
 	char *filename;
+	int devnum;
 	int max_device = 0;
 	int rc;
 
-	ndev = scandir(DEV_INPUT_EVENT, &namelist, is_event_device, versionsort);
-	if (ndev <= 0)
+	list = evemu_device_list_new(NULL);
+	if (!list)
+		return NULL;
+
+	ndev = evemu_device_list_get_count(list);
+	if (ndev == 0) {
+		evemu_device_list_delete(list);
 		return NULL;
+	}
 
 	fprintf(stderr, "Available devices:\n");
 
 	for (i = 0; i < ndev; i++)
 	{
-		char fname[PATH_MAX];
-		int fd = -1;
-		char name[256] = "???";
-
-		snprintf(fname, sizeof(fname),
-			 "%s/%s", DEV_INPUT_EVENT, namelist[i]->d_name);
-		fd = open(fname, O_RDONLY);
-		if (fd < 0)
-			continue;
-		ioctl(fd, EVIOCGNAME(sizeof(name)), name);
+		const char *fname = evemu_device_list_get_devnode(list, i);
+		const struct evemu_device *dev =
+			evemu_device_list_get_device(list, i);
 
-		fprintf(stderr, "%s:	%s\n", fname, name);
-		close(fd);
+		fprintf(stderr, "%s:	%s\n", fname, evemu_get_name(dev));
 
-		rc = sscanf(namelist[i]->d_name, "event%d", &devnum);
+		rc = sscanf(fname, DEV_INPUT_EVENT "/" EVENT_DEV_NAME "%d",
+			    &devnum);
 		if (rc == 1 && devnum > max_device)
 			max_device = devnum;
-
-		free(namelist[i]);
 	}
 
+	evemu_device_list_delete(list);
+
 	fprintf(stderr, "Select the device event number [0-%d]: ", max_device);
 	rc = scanf("%d", &devnum);
 